@@ -8,11 +8,14 @@
 # granted to it by virtue of its status as Intergovernmental Organization
 # or submit itself to any jurisdiction.
 from storage_api.utils import init_logger
+from storage_api.metrics import timed_phase
 
 from flask_restplus import Api
+from flask_restplus.representations import output_json
 
 from .storage import api as unified_ns
 from .introspect import api as introspection_ns
+from .jobs import api as jobs_ns
 from .common.auth import authorizations
 
 log = init_logger()
@@ -21,6 +24,7 @@ __version__ = '3.3.6'
 __major_version__ = __version__.split(".")[0]
 INTROSPECTION_MOUNTPOINT = "/conf"
 SAPI_MOUNTPOINT = "/v{}".format(__major_version__)
+JOBS_MOUNTPOINT = "{}/jobs".format(SAPI_MOUNTPOINT)
 
 api = Api(
     title='CERN Unified Storage API',
@@ -30,5 +34,13 @@ api = Api(
     validate=True,
 )
 
+
+@api.representation('application/json')
+def timed_output_json(data, code, headers=None):
+    with timed_phase('serialisation'):
+        return output_json(data, code, headers)
+
+
 api.add_namespace(unified_ns, path=SAPI_MOUNTPOINT)
 api.add_namespace(introspection_ns, path=INTROSPECTION_MOUNTPOINT)
+api.add_namespace(jobs_ns, path=JOBS_MOUNTPOINT)
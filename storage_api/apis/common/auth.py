@@ -8,6 +8,7 @@
 # or submit itself to any jurisdiction.
 
 from storage_api import conf, apis
+from storage_api.metrics import timed_phase
 
 from functools import wraps
 from typing import Any # noqa
@@ -169,7 +170,9 @@ def in_role(api, group_name):
                       .format(group_name), model=None)
         @api.doc(security=[{'sso': ['read', 'write']}])
         def group_wrapper(*args, **kwargs):
-            if not is_in_role(group_name):
+            with timed_phase('auth'):
+                authorised = is_in_role(group_name)
+            if not authorised:
                 api.abort(403, ("The current user is not in role {}"
                                 .format(group_name)))
             else:
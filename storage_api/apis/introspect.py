@@ -1,11 +1,11 @@
 from storage_api.utils import init_logger
 
 from flask_restplus import Namespace, Resource
-from flask import current_app
+from flask import current_app, Response
 
-from .common.auth import USER_ROLES
-from .common import auth
-from .storage import exception_is_errorcode
+from .common.auth import USER_ROLES, in_role
+from .common import auth, ADMIN_ROLE
+from .storage import exception_is_errorcode, backend
 
 
 api = Namespace('introspect',
@@ -26,6 +26,77 @@ class Subsystems(Resource):
         return list(current_app.config['SUBSYSTEM'].keys())
 
 
+@api.route('/subsystems/<string:subsystem>/validation')
+@api.param('subsystem', "The subsystem to inspect")
+class SubsystemValidation(Resource):
+
+    @api.doc(description=("Get the validation policy of a subsystem and"
+                          " statistics on how many returned records were"
+                          " validated, skipped, trusted (validated"
+                          " earlier) and failed validation, and the"
+                          " total time spent validating, in seconds."))
+    @in_role(api, ADMIN_ROLE)
+    def get(self, subsystem):
+        return backend(subsystem).validation.stats()
+
+
+@api.route('/subsystems/<string:subsystem>/transport')
+@api.param('subsystem', "The subsystem to inspect")
+class SubsystemTransport(Resource):
+
+    @api.doc(description=("Get the connection pool settings of a subsystem"
+                          " and, for this worker, the number of"
+                          " connections opened and of TLS handshakes"
+                          " made and resumed"))
+    @api.response(404, description=("No such subsystem, or it does not"
+                                    " use a connection pool"))
+    @in_role(api, ADMIN_ROLE)
+    def get(self, subsystem):
+        transport = getattr(backend(subsystem), 'transport', None)
+        if transport is None:
+            api.abort(404, "Subsystem {} does not use a connection pool"
+                      .format(subsystem))
+        return transport.stats()
+
+
+@api.route('/metrics')
+class Metrics(Resource):
+
+    @api.doc(description=("Get latency histograms and error counts of"
+                          " back-end operations per subsystem, and of"
+                          " HTTP requests per route, in the Prometheus"
+                          " text format"))
+    @api.response(404, description="Metrics are not enabled")
+    def get(self):
+        if 'metrics' not in current_app.extensions:
+            api.abort(404, "Metrics are not enabled")
+        return Response(current_app.extensions['metrics'].render(),
+                        mimetype="text/plain; version=0.0.4")
+
+
+@api.route('/retention')
+class Retention(Resource):
+
+    @api.doc(description=("Get the status of the snapshot retention"
+                          " engine: the number of volumes with policies,"
+                          " the number of snapshots due but not started"
+                          " (queue_depth), how long the oldest of them"
+                          " has been due (lag_s), and the numbers of"
+                          " snapshots scheduled, running, completed and"
+                          " failed"))
+    @api.response(404, description=("Retention is not enabled, or has not"
+                                    " run yet"))
+    @in_role(api, ADMIN_ROLE)
+    def get(self):
+        engine = current_app.extensions.get('retention')
+        if engine is None:
+            api.abort(404, "Snapshot retention is not enabled")
+        status = engine.status()
+        if status is None:
+            api.abort(404, "Snapshot retention has not run yet")
+        return status
+
+
 @api.route('/roles')
 class Roles(Resource):
 
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+from storage_api.utils import init_logger
+
+from flask_restplus import Namespace, Resource, fields
+from flask import current_app
+
+from .common.auth import in_role
+from .common import USER_ROLE
+
+api = Namespace('jobs',
+                description='Asynchronous operations')
+
+log = init_logger()
+
+job_model = api.model('Job', {
+    'id': fields.String(),
+    'operation': fields.String(description="The operation run by the job"),
+    'subsystem': fields.String(),
+    'target': fields.String(description="The volume operated on"),
+    'status': fields.String(enum=['queued', 'running', 'succeeded',
+                                  'failed']),
+    'submitted': fields.Float(description="UNIX time"),
+    'started': fields.Float(description="UNIX time"),
+    'finished': fields.Float(description="UNIX time"),
+    'code': fields.Integer(description=("The status code the operation"
+                                        " would have returned if run"
+                                        " synchronously")),
+    'result': fields.Raw(description=("The body the operation would have"
+                                      " returned if run synchronously")),
+})
+
+
+@api.route('/<string:job_id>')
+@api.param('job_id', "The id of the job, as returned when it was submitted")
+class Job(Resource):
+
+    @api.doc(description=("Get the status of a job and, once it has"
+                          " finished, its result"))
+    @api.response(404, description="No such job, or it expired")
+    @api.marshal_with(job_model)
+    @in_role(api, USER_ROLE)
+    def get(self, job_id):
+        jobs = current_app.extensions.get('jobs')
+        try:
+            if jobs is None:
+                raise KeyError(job_id)
+            return jobs.get(job_id)
+        except KeyError:
+            api.abort(404, "No such job: {}".format(job_id))
@@ -9,18 +9,33 @@
 # or submit itself to any jurisdiction.
 
 import storage_api.apis
-from storage_api.apis.common.auth import in_role
+from storage_api.apis.common.auth import in_role, is_in_role
 from storage_api.apis.common import ADMIN_ROLE, UBER_ADMIN_ROLE, USER_ROLE
 from storage_api.utils import dict_without, filter_none
+from storage_api.metrics import timed_phase
+from storage_api.extensions.patch import PartialPatchError
+from storage_api.extensions.storage import TooManySnapshots
+from storage_api.extensions.versions import (PreconditionFailed,
+                                             volume_version)
+from storage_api.jobs import TooManyJobs, error_response
+from .jobs import job_model
 
 from storage_api.utils import init_logger
 import traceback
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from functools import partial
+import itertools
+import json
 import re
+from urllib.parse import urlencode
+from werkzeug.http import quote_etag
 
-from flask_restplus import Namespace, Resource, fields, marshal
-from flask import current_app
+from flask_restplus import Namespace, Resource, fields, marshal, inputs
+from flask_restplus.mask import apply as apply_mask
+from flask import (current_app, request, Response, stream_with_context,
+                   url_for)
 from netapp.api import APIError
 
 api = Namespace('sapi',
@@ -36,6 +51,9 @@ VOLUME_NAME_DESCRIPTION = ("The name of the volume. "
 
 SUBSYSTEM_DESCRIPTION = "The subsystem to run the command on."
 
+ASYNC_DESCRIPTION = ("With `Prefer: respond-async`, the operation was"
+                     " queued as a job, whose status is at `Location`")
+
 DISALLOWED_VOLUME_NAME_RE = re.compile(r'.*[^a-zA-Z0-9:/_\.-].*')
 
 
@@ -60,6 +78,39 @@ keyerror_is_400 = partial(exception_is_errorcode, api=api,
                           exception=KeyError, error_code=400)
 valueerror_is_400 = partial(exception_is_errorcode, api=api,
                             exception=ValueError, error_code=400)
+too_many_snapshots_is_409 = partial(exception_is_errorcode, api=api,
+                                    exception=TooManySnapshots,
+                                    error_code=409)
+
+
+def wants_async():
+    """
+    Return True if the client prefers an asynchronous response, i.e.
+    sent `Prefer: respond-async` (see RFC 7240).
+    """
+    preferences = request.headers.get('Prefer', "").split(",")
+    return any(p.split(";")[0].strip().lower() == "respond-async"
+               for p in preferences)
+
+
+def respond_maybe_async(operation, subsystem, target, run):
+    """
+    Return the (body, status code) returned by run(), or, if the client
+    prefers an asynchronous response, run it in a background job and
+    return 202 with the job, whose status is at its Location.
+
+    run must not use the request, which is gone by the time a job runs.
+    """
+    jobs = current_app.extensions.get('jobs')
+    if jobs is None or not wants_async():
+        return run()
+
+    backend(subsystem)
+    with exception_is_errorcode(api, TooManyJobs, 503):
+        job = jobs.submit(operation, subsystem, target, run)
+    return marshal(job, job_model), 202, {
+        'Location': url_for('jobs_job', job_id=job['id']),
+        'Preference-Applied': "respond-async"}
 
 
 def backend(backend_name):
@@ -163,10 +214,194 @@ snapshot_put_model = api.model('SnapshotPut', {
         description=("If `true`, purge the oldest snapshot iff necessary "
                      " to create a new one"))})
 
+snapshot_group_write_model = api.model('SnapshotGroupWrite', {
+    'volumes': fields.List(fields.String(min_length=1), required=True,
+                           min_items=1,
+                           description=("The volumes to snapshot, see"
+                                        " volume_name"))})
+
+snapshot_timing_model = api.model('SnapshotTiming', {
+    'name': fields.String(description="The name of the volume"),
+    'started': fields.Float(description="UNIX time"),
+    'duration_s': fields.Float(),
+    })
+
+snapshot_group_model = api.model('SnapshotGroup', {
+    'name': fields.String(),
+    'window_s': fields.Float(description=("From the start of the first"
+                                          " snapshot to the end of the"
+                                          " last")),
+    'volumes': fields.List(fields.Nested(snapshot_timing_model)),
+    })
+
 policy_rule_write_model = api.model('PolicyRule',
                                     {'rules': policy_rule_list_field})
 
 
+MAX_PAGE_SIZE = 1000
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+list_parser = api.parser()
+list_parser.add_argument(
+    'stream', type=inputs.boolean, location='args',
+    help=("Stream the listing as newline-delimited JSON, one item per"
+          " line. Equivalent to `Accept: {}`".format(NDJSON_MIMETYPE)))
+
+page_parser = list_parser.copy()
+page_parser.add_argument(
+    'limit', type=inputs.int_range(1, MAX_PAGE_SIZE), location='args',
+    help=("Return at most this many items per page, and the cursor of the"
+          " next page, if any, in the `X-Next-Cursor` and `Link` headers"))
+page_parser.add_argument(
+    'cursor', location='args',
+    help="Return the page starting at this cursor, as returned by a"
+    " previous request with the same parameters")
+
+volume_query_parser = page_parser.copy()
+volume_query_parser.add_argument(
+    'aggregate_name', location='args',
+    help="Only list volumes in this aggregate")
+volume_query_parser.add_argument(
+    'state', location='args',
+    help="Only list volumes in this state, e.g. `online`")
+volume_query_parser.add_argument(
+    'name_prefix', location='args',
+    help="Only list volumes whose names start with this prefix")
+for size_field in ['size_used', 'size_total']:
+    for bound, comparison in [('min', 'at least'), ('max', 'at most')]:
+        volume_query_parser.add_argument(
+            '{}_{}'.format(size_field, bound), type=inputs.natural,
+            location='args',
+            help="Only list volumes with {} {} this many bytes"
+            .format(size_field, comparison))
+volume_query_parser.add_argument(
+    'sort', location='args',
+    help=("Sort on this volume field. Prefix with `-` for descending"
+          " order, e.g. `-size_used`"))
+volume_query_parser.add_argument(
+    'fields', location='args',
+    help=("Only return these comma-separated fields of each volume,"
+          " e.g. `name,size_used`"))
+
+
+def projection(model, field_names):
+    """
+    Return the fields of a model named in the comma-separated string
+    field_names, or all of its fields if field_names is empty.
+
+    Aborts with 400 on unknown field names.
+    """
+    # A plain dict, as marshal() would otherwise re-resolve the model
+    # for every item in a list
+    all_fields = dict(model.resolved)
+    if not field_names:
+        return all_fields
+
+    names = [name.strip() for name in field_names.split(",")
+             if name.strip()]
+    unknown = [name for name in names if name not in all_fields]
+    if unknown:
+        api.abort(400, "Unknown fields: {}. Allowed fields are: {}"
+                  .format(", ".join(unknown), ", ".join(all_fields)))
+
+    return {name: all_fields[name] for name in names}
+
+
+def list_fields(model, field_names=None):
+    """
+    Return the fields to marshal items of a list with: a projection of
+    model, with the mask header applied like api.marshal_with does.
+    """
+    item_fields = projection(model, field_names)
+    mask = request.headers.get(current_app.config['RESTPLUS_MASK_HEADER'])
+    if mask:
+        item_fields = apply_mask(item_fields, mask, skip=True)
+    return item_fields
+
+
+def marshal_list(data, model, field_names=None):
+    """
+    Marshal a list of items with (a projection of) a model.
+    """
+    item_fields = list_fields(model, field_names)
+    with timed_phase('serialisation'):
+        return marshal(data, item_fields)
+
+
+def wants_stream(stream_argument):
+    """
+    True if a listing should be streamed as NDJSON, either because of
+    the stream argument (if set) or because the client prefers NDJSON.
+    """
+    if stream_argument is not None:
+        return stream_argument
+    return (request.accept_mimetypes.best_match(['application/json',
+                                                 NDJSON_MIMETYPE])
+            == NDJSON_MIMETYPE)
+
+
+def stream_list(items, model, field_names=None, headers=None):
+    """
+    Return a Response streaming the items of an iterable marshalled
+    with (a projection of) model, as newline-delimited JSON.
+
+    The first item is fetched before the response starts, so that
+    errors on the initial call to the back-end are still reported with
+    a proper status code.
+    """
+    item_fields = list_fields(model, field_names)
+    items = iter(items)
+    first_items = list(itertools.islice(items, 1))
+
+    def generate():
+        for item in itertools.chain(first_items, items):
+            yield json.dumps(marshal(item, item_fields)) + "\n"
+
+    return Response(stream_with_context(generate()),
+                    mimetype=NDJSON_MIMETYPE,
+                    headers=headers)
+
+
+def respond_with_list(stream, items, model, field_names=None, headers=None):
+    """
+    Respond with the items of an iterable marshalled with (a projection
+    of) model, either streamed as NDJSON if stream is True, or as a
+    JSON list.
+    """
+    headers = headers or {}
+    if stream:
+        return stream_list(items, model, field_names, headers)
+    return marshal_list(list(items), model, field_names), 200, headers
+
+
+def page_of(page_function, **kwargs):
+    """
+    Fetch a page of results using the page_parser arguments limit and
+    cursor (if set) as arguments to page_function.
+
+    Returns a tuple of the items and a dictionary of headers linking to
+    the next page, if any.
+    """
+    limit = kwargs.pop('limit')
+    cursor = kwargs.pop('cursor')
+    if cursor is not None and limit is None:
+        api.abort(400, "A cursor requires a limit")
+
+    with valueerror_is_400():
+        items, next_cursor = page_function(limit=limit, cursor=cursor,
+                                           **kwargs)
+
+    headers = {}
+    if next_cursor is not None:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        headers['X-Next-Cursor'] = next_cursor
+        headers['Link'] = '<{}?{}>; rel="next"'.format(
+            request.base_url, urlencode(args))
+    return items, headers
+
+
 @api.errorhandler(APIError)
 def handle_netapp_exception(error):
     '''Return the error message from the filer and 500 status code'''
@@ -177,6 +412,12 @@ def handle_netapp_exception(error):
     return return_message, 500
 
 
+@api.errorhandler(PartialPatchError)
+def handle_partial_patch(error):
+    '''Return which attributes were updated, which failed and why'''
+    return dict(error.summary(), message=str(error)), 500
+
+
 @api.errorhandler
 def default_error_handler(error):    # pragma: no cover
     log.warning(traceback.format_exc())
@@ -186,12 +427,51 @@ def default_error_handler(error):    # pragma: no cover
 @api.route('/<string:subsystem>/volumes')
 @api.param('subsystem', SUBSYSTEM_DESCRIPTION)
 class AllVolumes(Resource):
-    @api.doc(description="Get a list of all volumes",
+    @api.doc(description=("Get a list of all volumes, optionally filtered,"
+                          " sorted, projected and paginated. Pages may"
+                          " hold fewer than `limit` volumes; only the"
+                          " absence of a next cursor marks the last page."
+                          " Pagination cannot be combined with `sort`."
+                          " Set `stream` or `Accept: application/x-ndjson`"
+                          " to stream the listing as newline-delimited"
+                          " JSON."
+                          " If the back-end"
+                          " serves the listing from a periodically"
+                          " refreshed inventory, the `Age` header gives"
+                          " the age of the data in seconds."),
              id='get_volumes')
-    @api.marshal_with(volume_read_model, as_list=True)
+    @api.expect(volume_query_parser)
+    @api.response(200, "Success", [volume_read_model])
+    @api.response(400, "Invalid query parameters")
     @in_role(api, USER_ROLE)
     def get(self, subsystem):
-        return backend(subsystem).volumes
+        args = volume_query_parser.parse_args()
+        field_names = args.pop('fields')
+        sort_by = args.pop('sort')
+        if sort_by and sort_by.lstrip("-") not in volume_read_model.resolved:
+            api.abort(400, "Cannot sort on unknown field '{}'"
+                      .format(sort_by))
+
+        stream = wants_stream(args.pop('stream'))
+        storage = backend(subsystem)
+        headers = {}
+        if args['limit'] is None and args['cursor'] is None:
+            del args['limit'], args['cursor']
+            with valueerror_is_400():
+                if not stream or sort_by:
+                    volumes = storage.query_volumes(sort_by=sort_by, **args)
+                else:
+                    volumes = storage.iter_volumes(**args)
+        elif sort_by:
+            api.abort(400, "Cannot sort paginated volume listings")
+        else:
+            volumes, headers = page_of(storage.volumes_page, **args)
+
+        age = storage.volumes_age
+        if age is not None:
+            headers['Age'] = str(int(age))
+        return respond_with_list(stream, volumes, volume_read_model,
+                                 field_names, headers)
 
 
 @in_role(api, USER_ROLE)
@@ -202,7 +482,10 @@ class Volume(Resource):
 
     @api.marshal_with(volume_read_model,
                       description="The volume named volume_name")
-    @api.doc(description="Get a specific volume by name")
+    @api.doc(description=("Get a specific volume by name. The `ETag`"
+                          " header holds its version, for conditional"
+                          " updates. It only changes with the fields"
+                          " that can be updated."))
     @api.response(404, description="No such volume exists")
     @api.response(201, description="A new volume was created")
     @in_role(api, USER_ROLE)
@@ -213,7 +496,8 @@ class Volume(Resource):
             api.abort(400, "Invalid volume name")
 
         with keyerror_is_404():
-            return backend(subsystem).get_volume(volume_name)
+            volume = backend(subsystem).get_volume(volume_name)
+        return volume, 200, {'ETag': quote_etag(volume_version(volume))}
 
     @api.doc(body=volume_create_w_snapshot_model,
              description=("Create a new volume with the given details. "
@@ -225,9 +509,10 @@ class Volume(Resource):
                           "clone of `from_volume` named `volume_name`, in the "
                           "state at `from_snapshot`."))
     @api.expect(volume_create_w_snapshot_model, validate=True)
-    @api.marshal_with(volume_read_model,
-                      description=("The newly created volume"
-                                   " (if created), otherwise nothing"))
+    @api.response(201, description=("The newly created volume"
+                                    " (if created), otherwise nothing"),
+                  model=volume_read_model)
+    @api.response(202, description=ASYNC_DESCRIPTION, model=job_model)
     @in_role(api, ADMIN_ROLE)
     def post(self, subsystem, volume_name):
         if DISALLOWED_VOLUME_NAME_RE.match(volume_name):
@@ -236,26 +521,34 @@ class Volume(Resource):
         data = marshal(storage_api.apis.api.payload,
                        volume_create_w_snapshot_model)
 
-        if data['from_volume'] and data['from_snapshot']:
-            with keyerror_is_404(), valueerror_is_400():
-                new_vol = backend(subsystem).clone_volume(
-                    volume_name,
-                    data['from_volume'],
-                    data['from_snapshot'])
-
-        elif data['from_snapshot']:
-            with keyerror_is_404():
-                new_vol = backend(subsystem).rollback_volume(
-                    volume_name,
-                    restore_snapshot_name=data['from_snapshot'])
+        def create():
+            if data['from_volume'] and data['from_snapshot']:
+                with keyerror_is_404(), valueerror_is_400():
+                    new_vol = backend(subsystem).clone_volume(
+                        volume_name,
+                        data['from_volume'],
+                        data['from_snapshot'])
+
+            elif data['from_snapshot']:
+                with keyerror_is_404():
+                    new_vol = backend(subsystem).rollback_volume(
+                        volume_name,
+                        restore_snapshot_name=data['from_snapshot'])
+            else:
+                with valueerror_is_400(), keyerror_is_400():
+                    new_vol = backend(subsystem).create_volume(
+                        volume_name,
+                        **dict_without(dict(data),
+                                       'from_snapshot',
+                                       'from_volume'))
+            return marshal(new_vol, volume_read_model), 201
+
+        if data['from_snapshot']:
+            operation = ('clone_volume' if data['from_volume']
+                         else 'rollback_volume')
         else:
-            with valueerror_is_400(), keyerror_is_400():
-                new_vol = backend(subsystem).create_volume(
-                    volume_name,
-                    **dict_without(dict(data),
-                                   'from_snapshot',
-                                   'from_volume'))
-        return new_vol, 201
+            operation = 'create_volume'
+        return respond_maybe_async(operation, subsystem, volume_name, create)
 
     @api.doc(description=("Restrict the volume named *volume_name*"
                           " but do not actually delete it"))
@@ -269,7 +562,15 @@ class Volume(Resource):
             backend(subsystem).restrict_volume(volume_name)
         return '', 204
 
-    @api.doc(description="Partially update volume_name")
+    @api.doc(description=("Partially update volume_name. If only some of"
+                          " the attributes could be updated, the response"
+                          " lists the attributes that were `applied`,"
+                          " `failed` (and why), and `skipped` because"
+                          " an update they depend on failed. With"
+                          " `If-Match`, only update the volume if its"
+                          " version (its `ETag`) is still the given one."))
+    @api.response(412, description="The volume has changed since")
+    @api.response(202, description=ASYNC_DESCRIPTION, model=job_model)
     @api.expect(volume_write_model, validate=True)
     @in_role(api, UBER_ADMIN_ROLE)
     def patch(self, subsystem, volume_name):
@@ -279,24 +580,50 @@ class Volume(Resource):
         data = filter_none(marshal(storage_api.apis.api.payload,
                                    volume_write_model))
         log.info("PATCH with payload {}".format(str(data)))
-        if data:
-            with keyerror_is_404():
-                backend(subsystem).patch_volume(volume_name, **data)
-        else:
+        expected_versions = None
+        if request.if_match and not request.if_match.star_tag:
+            expected_versions = request.if_match.as_set()
+
+        if not data:
             raise api.abort(400, "No PATCH data provided!")
 
+        def patch():
+            with keyerror_is_404(), exception_is_errorcode(
+                    api, PreconditionFailed, 412):
+                backend(subsystem).patch_volume(
+                    volume_name, expected_versions=expected_versions,
+                    **data)
+            return None, 200
+
+        return respond_maybe_async('patch_volume', subsystem, volume_name,
+                                   patch)
+
 
 @api.route('/<string:subsystem>/volumes/<path:volume_name>/snapshots')
 @api.param('subsystem', SUBSYSTEM_DESCRIPTION)
 @api.param('volume_name', VOLUME_NAME_DESCRIPTION)
 class AllSnapshots(Resource):
-    @api.marshal_with(snapshot_model,
-                      description="All snapshots for the volume",
-                      as_list=True)
+    @api.response(200, "All snapshots for the volume", [snapshot_model])
+    @api.expect(page_parser)
+    @api.doc(description=("Get the snapshots of a volume, optionally"
+                          " paginated or streamed in the same way as"
+                          " volume listings."))
     def get(self, subsystem, volume_name):
         if DISALLOWED_VOLUME_NAME_RE.match(volume_name):
             api.abort(400, "Invalid volume name")
-        return backend(subsystem).get_snapshots(volume_name)
+        args = page_parser.parse_args()
+        stream = wants_stream(args.pop('stream'))
+        storage = backend(subsystem)
+        headers = {}
+        with keyerror_is_404():
+            if args['limit'] is None and args['cursor'] is None:
+                snapshots = storage.iter_snapshots(volume_name)
+            else:
+                snapshots, headers = page_of(storage.snapshots_page,
+                                             volume_name=volume_name,
+                                             **args)
+            return respond_with_list(stream, snapshots, snapshot_model,
+                                     headers=headers)
 
 
 @api.route(('/<string:subsystem>/volumes/'
@@ -318,6 +645,7 @@ class Snapshots(Resource):
                                     " another. Try"
                                     " `purge_old_if_needed=true`."))
     @api.response(201, description="Successfully created a snapshot")
+    @api.response(202, description=ASYNC_DESCRIPTION, model=job_model)
     @api.expect(snapshot_put_model)
     @api.doc(description=("Create a new snapshot of *volume_name*"
                           " under *snapshot_name*"))
@@ -325,11 +653,21 @@ class Snapshots(Resource):
         if DISALLOWED_VOLUME_NAME_RE.match(volume_name):
             api.abort(400, "Invalid volume name")
 
+        payload = storage_api.apis.api.payload or {}
+        purge_old_if_needed = payload.get('purge_old_if_needed') is True
         log.info("Creating snapshot {} for volume {}"
                  .format(snapshot_name, volume_name))
-        with keyerror_is_404(), valueerror_is_400():
-            backend(subsystem).create_snapshot(volume_name, snapshot_name)
-        return '', 201
+
+        def create():
+            with keyerror_is_404(), valueerror_is_400(), \
+                    too_many_snapshots_is_409():
+                backend(subsystem).create_snapshot(
+                    volume_name, snapshot_name,
+                    purge_old_if_needed=purge_old_if_needed)
+            return '', 201
+
+        return respond_maybe_async('create_snapshot', subsystem,
+                                   volume_name, create)
 
     @api.doc(description=("Delete the snapshot"))
     @api.response(204, description="Successfully deleted",
@@ -345,6 +683,44 @@ class Snapshots(Resource):
         return '', 204
 
 
+@api.route('/<string:subsystem>/snapshots/<string:snapshot_name>')
+@api.param('subsystem', SUBSYSTEM_DESCRIPTION)
+@api.param('snapshot_name', 'The snapshot name')
+class SnapshotGroup(Resource):
+
+    @api.doc(description=("Create a snapshot named *snapshot_name* of"
+                          " every volume given, as close in time as"
+                          " possible, e.g. for a database spread over"
+                          " several volumes. Either every snapshot is"
+                          " created, or none is. Reports when each"
+                          " snapshot was taken, and the window between"
+                          " the first and the last."))
+    @api.response(201, description="Successfully created the snapshots",
+                  model=snapshot_group_model)
+    @api.response(202, description=ASYNC_DESCRIPTION, model=job_model)
+    @api.response(404, description="No such volume")
+    @api.expect(snapshot_group_write_model, validate=True)
+    @in_role(api, USER_ROLE)
+    def post(self, subsystem, snapshot_name):
+        volume_names = storage_api.apis.api.payload['volumes']
+        for volume_name in volume_names:
+            if DISALLOWED_VOLUME_NAME_RE.match(volume_name):
+                api.abort(400, "Invalid volume name")
+
+        log.info("Creating snapshot {} of volumes {}"
+                 .format(snapshot_name, ", ".join(volume_names)))
+
+        def create():
+            with keyerror_is_404(), valueerror_is_400(), \
+                    too_many_snapshots_is_409():
+                group = backend(subsystem).create_snapshots(volume_names,
+                                                            snapshot_name)
+            return marshal(group, snapshot_group_model), 201
+
+        return respond_maybe_async('create_snapshots', subsystem,
+                                   ", ".join(volume_names), create)
+
+
 @api.route('/<string:subsystem>/volumes/<path:volume_name>/locks')
 @api.param('subsystem', SUBSYSTEM_DESCRIPTION)
 @api.param('volume_name', VOLUME_NAME_DESCRIPTION)
@@ -393,13 +769,16 @@ class Locks(Resource):
 @api.route('/<string:subsystem>/export')
 @api.param('subsystem', SUBSYSTEM_DESCRIPTION)
 class AllExports(Resource):
-    @api.marshal_with(export_policy_model,
-                      description="The full policy",
-                      as_list=True)
-    @api.doc(description="Get all ACLs present on the back-end")
+    @api.response(200, "The full policy", [export_policy_model])
+    @api.expect(list_parser)
+    @api.doc(description=("Get all ACLs present on the back-end,"
+                          " optionally streamed in the same way as"
+                          " volume listings."))
     @in_role(api, ADMIN_ROLE)
     def get(self, subsystem):
-        return backend(subsystem).policies
+        stream = wants_stream(list_parser.parse_args()['stream'])
+        return respond_with_list(stream, backend(subsystem).iter_policies(),
+                                 export_policy_model)
 
 
 @api.route('/<string:subsystem>/export/<path:policy>')
@@ -462,3 +841,227 @@ class ExportRule(Resource):
     def delete(self, subsystem, policy, rule):
         backend(subsystem).ensure_policy_rule_absent(policy, rule)
         return '', 204
+
+
+# The role needed to run a batch operation (None: anyone), the
+# arguments it requires, and a function running it on a back-end
+BatchOperation = namedtuple('BatchOperation', ['role', 'arguments', 'run'])
+
+
+def _batch_create_snapshot(storage, op):
+    with keyerror_is_404(), valueerror_is_400(), \
+            too_many_snapshots_is_409():
+        storage.create_snapshot(
+            op['volume_name'], op['snapshot_name'],
+            purge_old_if_needed=op.get('purge_old_if_needed') is True)
+    return None, 201
+
+
+def _batch_delete_snapshot(storage, op):
+    with keyerror_is_404():
+        storage.delete_snapshot(op['volume_name'], op['snapshot_name'])
+    return None, 204
+
+
+def _batch_patch_volume(storage, op):
+    data = filter_none(marshal(op.get('data') or {}, volume_write_model))
+    if not data:
+        api.abort(400, "No PATCH data provided!")
+    expected_versions = None
+    if op.get('expected_version'):
+        expected_versions = {op['expected_version'].strip('"')}
+    with keyerror_is_404(), exception_is_errorcode(
+            api, PreconditionFailed, 412):
+        storage.patch_volume(op['volume_name'],
+                             expected_versions=expected_versions, **data)
+    return None, 200
+
+
+def _batch_create_lock(storage, op):
+    with valueerror_is_400(), keyerror_is_404():
+        storage.create_lock(op['volume_name'], op['host'])
+    return None, 201
+
+
+def _batch_remove_lock(storage, op):
+    with keyerror_is_404():
+        storage.remove_lock(op['volume_name'], op['host'])
+    return None, 204
+
+
+def _batch_ensure_policy_rule_present(storage, op):
+    with keyerror_is_404():
+        storage.ensure_policy_rule_present(op['policy'], op['rule'])
+    return None, 201
+
+
+def _batch_ensure_policy_rule_absent(storage, op):
+    with keyerror_is_404():
+        storage.ensure_policy_rule_absent(op['policy'], op['rule'])
+    return None, 204
+
+
+# Used unless set by conf.load_batch_conf
+DEFAULT_MAX_BATCH_SIZE = 1000
+DEFAULT_BATCH_WORKERS = 8
+
+# The same roles as the corresponding endpoints (snapshots as group
+# snapshots)
+BATCH_OPERATIONS = {
+    'create_snapshot': BatchOperation(
+        USER_ROLE, ['volume_name', 'snapshot_name'], _batch_create_snapshot),
+    'delete_snapshot': BatchOperation(
+        ADMIN_ROLE, ['volume_name', 'snapshot_name'],
+        _batch_delete_snapshot),
+    'patch_volume': BatchOperation(
+        UBER_ADMIN_ROLE, ['volume_name'], _batch_patch_volume),
+    'create_lock': BatchOperation(
+        ADMIN_ROLE, ['volume_name', 'host'], _batch_create_lock),
+    'remove_lock': BatchOperation(
+        UBER_ADMIN_ROLE, ['volume_name', 'host'], _batch_remove_lock),
+    'ensure_policy_rule_present': BatchOperation(
+        ADMIN_ROLE, ['policy', 'rule'], _batch_ensure_policy_rule_present),
+    'ensure_policy_rule_absent': BatchOperation(
+        ADMIN_ROLE, ['policy', 'rule'], _batch_ensure_policy_rule_absent),
+}
+
+batch_operation_model = api.model('BatchOperation', {
+    'operation': fields.String(required=True,
+                               enum=sorted(BATCH_OPERATIONS)),
+    'volume_name': fields.String(description=VOLUME_NAME_DESCRIPTION),
+    'snapshot_name': fields.String(),
+    'purge_old_if_needed': fields.Boolean(
+        description=("With create_snapshot, purge the oldest snapshot iff"
+                     " necessary to create a new one")),
+    'host': fields.String(description="The host holding the lock"),
+    'policy': fields.String(),
+    'rule': fields.String(),
+    'data': fields.Nested(volume_write_model,
+                          description="The attributes to patch"),
+    'expected_version': fields.String(
+        description=("Only patch the volume if this is still its version"
+                     " (its ETag)")),
+    })
+
+batch_model = api.model('Batch', {
+    'operations': fields.List(fields.Nested(batch_operation_model),
+                              required=True),
+    })
+
+batch_result_model = api.model('BatchResult', {
+    'operation': fields.String(),
+    'code': fields.Integer(description=("The status code the operation"
+                                        " would have returned on its own")),
+    'result': fields.Raw(description=("The body the operation would have"
+                                      " returned on its own, if any")),
+    })
+
+batch_results_model = api.model('BatchResults', {
+    'results': fields.List(fields.Nested(batch_result_model),
+                           description="In the order of the operations"),
+    })
+
+
+def _batch_target(storage, op):
+    """
+    Return what op operates on: operations on the same target are run
+    in order, others concurrently. Volumes are identified by the name
+    storage resolves them to, so that e.g. `vol1` and `node:/vol1` are
+    the same target.
+    """
+    volume_name = op.get('volume_name')
+    if not volume_name:
+        return 'policy', op.get('policy')
+
+    parse_volume_name = getattr(storage, 'parse_volume_name', None)
+    if parse_volume_name is not None:
+        try:
+            volume_name = parse_volume_name(volume_name)
+        except KeyError:
+            # The operation itself will fail with a 404
+            pass
+    return 'volume', volume_name
+
+
+def _run_batch_operation(storage, op):
+    """
+    Run op on storage, and return its result as served in a batch.
+    """
+    try:
+        operation = BATCH_OPERATIONS[op['operation']]
+        missing = [a for a in operation.arguments if not op.get(a)]
+        if missing:
+            api.abort(400, "Missing arguments to {}: {}".format(
+                op['operation'], ", ".join(missing)))
+        if DISALLOWED_VOLUME_NAME_RE.match(op.get('volume_name') or ""):
+            api.abort(400, "Invalid volume name")
+        result, code = operation.run(storage, op)
+    except Exception as e:
+        log.warning("Batch operation {} failed: {}"
+                    .format(op['operation'], e))
+        code, result = error_response(e)
+    return {'operation': op['operation'], 'code': code, 'result': result}
+
+
+@api.route('/<string:subsystem>/batch')
+@api.param('subsystem', SUBSYSTEM_DESCRIPTION)
+class Batch(Resource):
+
+    @api.doc(description=("Run many operations in one request. Operations"
+                          " on the same volume (or policy) are run in"
+                          " order, others concurrently. Each is authorised"
+                          " as the corresponding endpoint would, and"
+                          " reports the status code and body it would"
+                          " have returned on its own."))
+    @api.response(400, description="Too many operations")
+    @api.expect(batch_model, validate=True)
+    @api.marshal_with(batch_results_model)
+    def post(self, subsystem):
+        operations = storage_api.apis.api.payload['operations']
+        max_size = current_app.config.get('MAX_BATCH_SIZE',
+                                          DEFAULT_MAX_BATCH_SIZE)
+        if len(operations) > max_size:
+            api.abort(400, "At most {} operations are allowed in a batch"
+                      .format(max_size))
+
+        storage = backend(subsystem)
+        with timed_phase('auth'):
+            roles = {role for role in {BATCH_OPERATIONS[op['operation']].role
+                                       for op in operations}
+                     if role is not None and is_in_role(role)}
+        results = [None] * len(operations)
+        allowed = []
+        for i, op in enumerate(operations):
+            role = BATCH_OPERATIONS[op['operation']].role
+            if role is None or role in roles:
+                allowed.append(i)
+            else:
+                results[i] = {'operation': op['operation'], 'code': 403,
+                              'result': {'message': (
+                                  "The current user is not in role {}"
+                                  .format(role))}}
+
+        app = current_app._get_current_object()
+
+        def target(i):
+            with app.app_context():
+                return _batch_target(storage, operations[i])
+
+        def run_sequence(indices):
+            with app.app_context():
+                for i in indices:
+                    results[i] = _run_batch_operation(storage, operations[i])
+
+        workers = min(len(allowed), current_app.config.get(
+            'BATCH_WORKERS', DEFAULT_BATCH_WORKERS))
+        with ThreadPoolExecutor(max(workers, 1),
+                                thread_name_prefix="batch") as executor:
+            # Resolving volume names may take calls to the back-end
+            sequences = OrderedDict()
+            for i, key in zip(allowed, executor.map(target, allowed)):
+                sequences.setdefault(key, []).append(i)
+            list(executor.map(run_sequence, sequences.values()))
+
+        log.info("Ran a batch of {} operations on {} worker(s)"
+                 .format(len(operations), workers))
+        return {'results': results}
@@ -22,7 +22,11 @@ app.secret_key = os.urandom(24)
 api.init_app(app)
 conf.load_basic_auth_conf(app)
 conf.load_oauth_conf(app)
+conf.load_metrics_conf(app)
+conf.load_jobs_conf(app)
+conf.load_batch_conf(app)
 conf.load_backend_conf(app, backends_module=extensions)
+conf.load_retention_conf(app)
 auth.setup_roles_from_env(app)
 auth.setup_basic_auth(app)
 auth.setup_oauth(app,
@@ -0,0 +1,719 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Benchmarks of the storage back-ends and the HTTP API at realistic scale.
+
+Each benchmark fleet is a back-end populated with a number of volumes,
+each with snapshots, exported through a number of policies. Fleets are
+either a `DummyStorage`, or a `NetappStorage` talking to a simulated
+cluster (see `storage_api.simulator`), optionally with latency injected
+into every ZAPI call.
+
+For every fleet, each `StorageBackend` method and each route of the
+storage API (called through the Flask test client) is timed, giving
+throughput and latency percentiles. Results are written as JSON, e.g.:
+
+    python -m storage_api.benchmark --backend dummy --backend netapp \\
+        --volumes 1000 --volumes 10000 --output benchmark.json
+
+Every benchmark is repeated up to --repeat times, but stops early after
+--max-seconds, so full listings of large fleets are only timed a few
+times.
+"""
+from storage_api import extensions
+from storage_api import simulator
+from storage_api.apis import common, SAPI_MOUNTPOINT
+from storage_api.utils import init_logger
+
+from collections import OrderedDict
+from datetime import datetime
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import re
+import sys
+import time
+
+log = init_logger()
+
+BACKEND_KINDS = ['dummy', 'netapp']
+ENDPOINT = 'bench'
+RULES_PER_POLICY = 3
+LOCKED_FRACTION = 10  # one in every LOCKED_FRACTION volumes is locked
+PERCENTILES = [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]
+
+BACKEND_BENCHMARKS = OrderedDict()
+ROUTE_BENCHMARKS = OrderedDict()
+
+
+class RequestFailed(Exception):
+    pass
+
+
+def backend_benchmark(name):
+    """
+    Decorator: register a benchmark of the back-end method name.
+
+    The decorated function is called with the fleet and the iteration
+    number, performs any (untimed) preparation and returns a function
+    of no arguments making the timed call.
+    """
+    def register(func):
+        BACKEND_BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def route_benchmark(name):
+    """
+    Decorator: register a benchmark of an HTTP route, like
+    `backend_benchmark` but called with the fleet, a test client
+    and the iteration number.
+    """
+    def register(func):
+        ROUTE_BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def percentile(sorted_values, fraction):
+    """
+    The nearest-rank percentile of a sorted, non-empty list.
+    """
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarise(durations, errors, elapsed_s):
+    durations = sorted(durations)
+    summary = OrderedDict([('count', len(durations)),
+                           ('errors', errors),
+                           ('elapsed_s', elapsed_s),
+                           ('ops_per_s', (len(durations) / elapsed_s
+                                          if elapsed_s else None))])
+    if durations:
+        latency = OrderedDict([('mean', sum(durations) / len(durations)),
+                               ('min', durations[0])])
+        for name, fraction in PERCENTILES:
+            latency[name] = percentile(durations, fraction)
+        latency['max'] = durations[-1]
+        summary['latency_s'] = latency
+    return summary
+
+
+def run_benchmark(prepare, repeat, max_seconds):
+    """
+    Time up to repeat calls to the functions returned by prepare(i),
+    stopping early once the timed calls have taken max_seconds.
+
+    Calls raising exceptions are counted as errors.
+    """
+    durations = []
+    errors = 0
+    elapsed_s = 0.0
+    for i in range(repeat):
+        try:
+            call = prepare(i)
+        except Exception as e:
+            log.debug("Preparing iteration {} failed: {}".format(i, e))
+            errors += 1
+            continue
+
+        start = time.perf_counter()
+        try:
+            call()
+        except Exception as e:
+            log.debug("Iteration {} failed: {}".format(i, e))
+            errors += 1
+        duration = time.perf_counter() - start
+        durations.append(duration)
+        elapsed_s += duration
+        if elapsed_s >= max_seconds:
+            break
+
+    return summarise(durations, errors, elapsed_s)
+
+
+class Fleet(object):
+    """
+    A back-end populated with volume_count volumes named vol_000000
+    onwards, each with snapshot_count snapshots named snap_0000 onwards,
+    and policy_count export policies named policy_0000 onwards.
+    """
+
+    def __init__(self, kind, volume_count, snapshot_count, policy_count,
+                 latency_s=None, default_latency_s=0.0):
+        self.kind = kind
+        self.volume_count = volume_count
+        self.snapshot_count = snapshot_count
+        self.policy_count = policy_count
+        self.server = None
+        self.cluster = None
+
+        start = time.perf_counter()
+        if kind == 'dummy':
+            self.backend = self._populate_dummy()
+        elif kind == 'netapp':
+            self.backend = self._start_netapp(latency_s, default_latency_s)
+        else:
+            raise ValueError("Unknown back-end kind {}".format(kind))
+        self.populate_s = time.perf_counter() - start
+
+    def _populate_dummy(self):
+        return extensions.DummyStorage(
+            fleet_volumes=self.volume_count,
+            fleet_snapshots=self.snapshot_count,
+            fleet_policies=self.policy_count,
+            fleet_rules=RULES_PER_POLICY,
+            fleet_sizes=100,
+            fleet_locked=1 / LOCKED_FRACTION)
+
+    def _start_netapp(self, latency_s, default_latency_s):
+        self.cluster = simulator.SimulatedCluster.synthetic(
+            volumes=self.volume_count, snapshots=self.snapshot_count,
+            policies=self.policy_count,
+            locks=self.volume_count // LOCKED_FRACTION,
+            latency_s=latency_s, default_latency_s=default_latency_s)
+        self.server = simulator.start_server(self.cluster)
+        host, port = self.server.server_address
+        return extensions.NetappStorage(
+            hostname=host, port=port, transport_type="HTTP",
+            username="benchmark", password="benchmark",
+            vserver=self.cluster.vserver)
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+    @staticmethod
+    def volume_name(number):
+        return "vol_{:06d}".format(number)
+
+    @staticmethod
+    def snapshot_name(number):
+        return "snap_{:04d}".format(number)
+
+    @staticmethod
+    def policy_name(number):
+        return "policy_{:04d}".format(number)
+
+    def volume_id(self, i):
+        """
+        The identifier of an existing volume for iteration i. NetApp
+        back-ends need junction paths for some operations.
+        """
+        name = self.volume_name(i % self.volume_count)
+        return ":/{}".format(name) if self.kind == 'netapp' else name
+
+    def new_volume(self, name):
+        """
+        Create the volume name (outside of any timing) and return its
+        identifier.
+        """
+        self.backend.create_volume(name, junction_path="/{}".format(name),
+                                   size_total=100 * 2**30)
+        return ":/{}".format(name) if self.kind == 'netapp' else name
+
+    def snapshot_of(self, i):
+        return (self.snapshot_name(i % self.snapshot_count)
+                if self.snapshot_count else None)
+
+    def policy_of(self, i):
+        return (self.policy_name(i % self.policy_count)
+                if self.policy_count else None)
+
+    def lock(self, volume_id, host):
+        if self.cluster is not None:
+            self.cluster.add_lock(volume_id.lstrip(':/'), host)
+        else:
+            self.backend.create_lock(volume_id, host)
+
+
+def _consume(iterable):
+    for _ in iterable:
+        pass
+
+
+@backend_benchmark('volumes')
+def bench_volumes(fleet, i):
+    return lambda: fleet.backend.volumes
+
+
+@backend_benchmark('query_volumes')
+def bench_query_volumes(fleet, i):
+    return lambda: fleet.backend.query_volumes(name_prefix="vol_0001")
+
+
+@backend_benchmark('volumes_page')
+def bench_volumes_page(fleet, i):
+    return lambda: fleet.backend.volumes_page(limit=100)
+
+
+@backend_benchmark('iter_volumes')
+def bench_iter_volumes(fleet, i):
+    return lambda: _consume(fleet.backend.iter_volumes())
+
+
+@backend_benchmark('get_volume')
+def bench_get_volume(fleet, i):
+    return lambda: fleet.backend.get_volume(fleet.volume_id(i))
+
+
+@backend_benchmark('get_snapshots')
+def bench_get_snapshots(fleet, i):
+    return lambda: fleet.backend.get_snapshots(fleet.volume_id(i))
+
+
+@backend_benchmark('snapshots_page')
+def bench_snapshots_page(fleet, i):
+    return lambda: fleet.backend.snapshots_page(fleet.volume_id(i),
+                                                limit=100)
+
+
+@backend_benchmark('iter_snapshots')
+def bench_iter_snapshots(fleet, i):
+    return lambda: _consume(fleet.backend.iter_snapshots(fleet.volume_id(i)))
+
+
+@backend_benchmark('get_snapshot')
+def bench_get_snapshot(fleet, i):
+    return lambda: fleet.backend.get_snapshot(fleet.volume_id(i),
+                                              fleet.snapshot_of(i))
+
+
+@backend_benchmark('policies')
+def bench_policies(fleet, i):
+    return lambda: fleet.backend.policies
+
+
+@backend_benchmark('iter_policies')
+def bench_iter_policies(fleet, i):
+    return lambda: _consume(fleet.backend.iter_policies())
+
+
+@backend_benchmark('get_policy')
+def bench_get_policy(fleet, i):
+    return lambda: fleet.backend.get_policy(fleet.policy_of(i))
+
+
+@backend_benchmark('locks')
+def bench_locks(fleet, i):
+    return lambda: fleet.backend.locks(fleet.volume_id(i))
+
+
+@backend_benchmark('create_volume')
+def bench_create_volume(fleet, i):
+    name = "bench_create_{}".format(i)
+    return lambda: fleet.backend.create_volume(
+        name, junction_path="/{}".format(name), size_total=100 * 2**30)
+
+
+@backend_benchmark('patch_volume')
+def bench_patch_volume(fleet, i):
+    return lambda: fleet.backend.patch_volume(
+        fleet.volume_id(i), size_total=(200 + i) * 2**30)
+
+
+@backend_benchmark('restrict_volume')
+def bench_restrict_volume(fleet, i):
+    volume_id = fleet.new_volume("bench_restrict_{}".format(i))
+    return lambda: fleet.backend.restrict_volume(volume_id)
+
+
+@backend_benchmark('clone_volume')
+def bench_clone_volume(fleet, i):
+    volume_id = fleet.volume_id(i)
+    fleet.backend.create_snapshot(volume_id, "bench_clone_{}".format(i))
+    return lambda: fleet.backend.clone_volume(
+        "bench_clone_{}".format(i), from_volume_name=volume_id,
+        from_snapshot_name="bench_clone_{}".format(i))
+
+
+@backend_benchmark('create_snapshot')
+def bench_create_snapshot(fleet, i):
+    return lambda: fleet.backend.create_snapshot(
+        fleet.volume_id(i), "bench_create_{}".format(i))
+
+
+@backend_benchmark('delete_snapshot')
+def bench_delete_snapshot(fleet, i):
+    volume_id = fleet.volume_id(i)
+    fleet.backend.create_snapshot(volume_id, "bench_delete_{}".format(i))
+    return lambda: fleet.backend.delete_snapshot(
+        volume_id, "bench_delete_{}".format(i))
+
+
+@backend_benchmark('rollback_volume')
+def bench_rollback_volume(fleet, i):
+    volume_id = fleet.volume_id(i)
+    fleet.backend.create_snapshot(volume_id, "bench_rollback_{}".format(i))
+    return lambda: fleet.backend.rollback_volume(
+        volume_id, "bench_rollback_{}".format(i))
+
+
+@backend_benchmark('create_policy')
+def bench_create_policy(fleet, i):
+    return lambda: fleet.backend.create_policy(
+        "bench_create_{}".format(i), ["db.cern.ch", "db2.cern.ch"])
+
+
+@backend_benchmark('remove_policy')
+def bench_remove_policy(fleet, i):
+    fleet.backend.create_policy("bench_remove_{}".format(i), ["db.cern.ch"])
+    return lambda: fleet.backend.remove_policy("bench_remove_{}".format(i))
+
+
+@backend_benchmark('set_policy')
+def bench_set_policy(fleet, i):
+    return lambda: fleet.backend.set_policy(fleet.volume_id(i),
+                                            fleet.policy_of(i + 1))
+
+
+@backend_benchmark('ensure_policy_rule_present')
+def bench_ensure_policy_rule_present(fleet, i):
+    return lambda: fleet.backend.ensure_policy_rule_present(
+        fleet.policy_of(i), "bench-{}.cern.ch".format(i))
+
+
+@backend_benchmark('ensure_policy_rule_absent')
+def bench_ensure_policy_rule_absent(fleet, i):
+    return lambda: fleet.backend.ensure_policy_rule_absent(
+        fleet.policy_of(i), "bench-{}.cern.ch".format(i))
+
+
+@backend_benchmark('create_lock')
+def bench_create_lock(fleet, i):
+    volume_id = fleet.new_volume("bench_lock_{}".format(i))
+    return lambda: fleet.backend.create_lock(volume_id, "db.cern.ch")
+
+
+@backend_benchmark('remove_lock')
+def bench_remove_lock(fleet, i):
+    volume_id = fleet.new_volume("bench_unlock_{}".format(i))
+    fleet.lock(volume_id, "db.cern.ch")
+    return lambda: fleet.backend.remove_lock(volume_id, "db.cern.ch")
+
+
+def request(client, method, path, data=None):
+    """
+    Make a function performing an HTTP request for path (relative to
+    the API mount point) through the test client, reading the whole
+    response and raising RequestFailed on errors.
+    """
+    path = SAPI_MOUNTPOINT + path
+
+    def perform():
+        response = client.open(path=path, method=method,
+                               data=json.dumps(data or {}),
+                               headers={'Content-Type': 'application/json',
+                                        'Accept': 'application/json'})
+        response.get_data()
+        if response.status_code >= 400:
+            raise RequestFailed("{} {}: {}".format(method, path,
+                                                   response.status))
+    return perform
+
+
+def volume_path(volume_id):
+    return "/{}/volumes/{}".format(ENDPOINT, volume_id)
+
+
+@route_benchmark('GET /volumes')
+def bench_get_volumes(fleet, client, i):
+    return request(client, 'GET', "/{}/volumes".format(ENDPOINT))
+
+
+@route_benchmark('GET /volumes?stream=true')
+def bench_stream_volumes(fleet, client, i):
+    return request(client, 'GET', "/{}/volumes?stream=true".format(ENDPOINT))
+
+
+@route_benchmark('GET /volumes?limit=100')
+def bench_get_volumes_page(fleet, client, i):
+    return request(client, 'GET', "/{}/volumes?limit=100".format(ENDPOINT))
+
+
+@route_benchmark('GET /volumes?name_prefix=...')
+def bench_query_volumes_route(fleet, client, i):
+    return request(client, 'GET',
+                   "/{}/volumes?name_prefix=vol_0001".format(ENDPOINT))
+
+
+@route_benchmark('GET /volumes/<volume>')
+def bench_get_volume_route(fleet, client, i):
+    return request(client, 'GET', volume_path(fleet.volume_id(i)))
+
+
+@route_benchmark('POST /volumes/<volume>')
+def bench_post_volume_route(fleet, client, i):
+    name = "bench_post_{}".format(i)
+    return request(client, 'POST', volume_path(name),
+                   {'name': name, 'junction_path': "/{}".format(name),
+                    'size_total': 100 * 2**30})
+
+
+@route_benchmark('PATCH /volumes/<volume>')
+def bench_patch_volume_route(fleet, client, i):
+    return request(client, 'PATCH', volume_path(fleet.volume_id(i)),
+                   {'size_total': (300 + i) * 2**30})
+
+
+@route_benchmark('DELETE /volumes/<volume>')
+def bench_delete_volume_route(fleet, client, i):
+    volume_id = fleet.new_volume("bench_delete_{}".format(i))
+    return request(client, 'DELETE', volume_path(volume_id))
+
+
+@route_benchmark('GET /volumes/<volume>/snapshots')
+def bench_get_snapshots_route(fleet, client, i):
+    return request(client, 'GET',
+                   "{}/snapshots".format(volume_path(fleet.volume_id(i))))
+
+
+@route_benchmark('GET /volumes/<volume>/snapshots/<snapshot>')
+def bench_get_snapshot_route(fleet, client, i):
+    return request(client, 'GET', "{}/snapshots/{}".format(
+        volume_path(fleet.volume_id(i)), fleet.snapshot_of(i)))
+
+
+@route_benchmark('POST /volumes/<volume>/snapshots/<snapshot>')
+def bench_post_snapshot_route(fleet, client, i):
+    return request(client, 'POST', "{}/snapshots/bench_post_{}".format(
+        volume_path(fleet.volume_id(i)), i))
+
+
+@route_benchmark('DELETE /volumes/<volume>/snapshots/<snapshot>')
+def bench_delete_snapshot_route(fleet, client, i):
+    volume_id = fleet.volume_id(i)
+    fleet.backend.create_snapshot(volume_id, "bench_delete_{}".format(i))
+    return request(client, 'DELETE', "{}/snapshots/bench_delete_{}".format(
+        volume_path(volume_id), i))
+
+
+@route_benchmark('GET /volumes/<volume>/locks')
+def bench_get_locks_route(fleet, client, i):
+    return request(client, 'GET',
+                   "{}/locks".format(volume_path(fleet.volume_id(i))))
+
+
+@route_benchmark('PUT /volumes/<volume>/locks/<host>')
+def bench_put_lock_route(fleet, client, i):
+    volume_id = fleet.new_volume("bench_put_lock_{}".format(i))
+    return request(client, 'PUT',
+                   "{}/locks/db.cern.ch".format(volume_path(volume_id)))
+
+
+@route_benchmark('DELETE /volumes/<volume>/locks/<host>')
+def bench_delete_lock_route(fleet, client, i):
+    volume_id = fleet.new_volume("bench_delete_lock_{}".format(i))
+    fleet.lock(volume_id, "db.cern.ch")
+    return request(client, 'DELETE',
+                   "{}/locks/db.cern.ch".format(volume_path(volume_id)))
+
+
+@route_benchmark('GET /export')
+def bench_get_exports_route(fleet, client, i):
+    return request(client, 'GET', "/{}/export".format(ENDPOINT))
+
+
+@route_benchmark('GET /export/<policy>')
+def bench_get_export_route(fleet, client, i):
+    return request(client, 'GET',
+                   "/{}/export/{}".format(ENDPOINT, fleet.policy_of(i)))
+
+
+@route_benchmark('POST /export/<policy>')
+def bench_post_export_route(fleet, client, i):
+    return request(client, 'POST',
+                   "/{}/export/bench_post_{}".format(ENDPOINT, i),
+                   {'rules': ["db.cern.ch", "db2.cern.ch"]})
+
+
+@route_benchmark('DELETE /export/<policy>')
+def bench_delete_export_route(fleet, client, i):
+    fleet.backend.create_policy("bench_delete_{}".format(i), ["db.cern.ch"])
+    return request(client, 'DELETE',
+                   "/{}/export/bench_delete_{}".format(ENDPOINT, i))
+
+
+@route_benchmark('PUT /export/<policy>/rule/<rule>')
+def bench_put_rule_route(fleet, client, i):
+    return request(client, 'PUT', "/{}/export/{}/rule/bench-{}.cern.ch"
+                   .format(ENDPOINT, fleet.policy_of(i), i))
+
+
+@route_benchmark('DELETE /export/<policy>/rule/<rule>')
+def bench_delete_rule_route(fleet, client, i):
+    return request(client, 'DELETE', "/{}/export/{}/rule/bench-{}.cern.ch"
+                   .format(ENDPOINT, fleet.policy_of(i), i))
+
+
+def make_app():
+    """
+    Import the app, configured with a placeholder back-end if the
+    environment does not configure any.
+    """
+    os.environ.setdefault('SAPI_BACKENDS',
+                          "{}🌈DummyStorage".format(ENDPOINT))
+    os.environ.setdefault('SAPI_OAUTH_CLIENT_ID', "benchmark")
+    os.environ.setdefault('SAPI_OAUTH_SECRET_KEY', "benchmark")
+    from storage_api.app import app
+    return app
+
+
+def benchmark_fleet(fleet, repeat, max_seconds, name_filter=None):
+    """
+    Run every back-end and route benchmark whose name matches the
+    regular expression name_filter on the fleet, returning a list of
+    results.
+    """
+    def selected(benchmarks):
+        return [(name, prepare) for name, prepare in benchmarks.items()
+                if not name_filter or re.search(name_filter, name)]
+
+    results = []
+
+    def record(kind, name, summary):
+        log.info("{} {} ({} volumes) {}: {} calls, {} errors, {}/s"
+                 .format(fleet.kind, kind, fleet.volume_count, name,
+                         summary['count'], summary['errors'],
+                         "{:.1f}".format(summary['ops_per_s'])
+                         if summary['ops_per_s'] else "-"))
+        results.append(OrderedDict([('backend', fleet.kind),
+                                    ('volumes', fleet.volume_count),
+                                    ('kind', kind),
+                                    ('name', name)] +
+                                   list(summary.items())))
+
+    for name, prepare in selected(BACKEND_BENCHMARKS):
+        record('method', name, run_benchmark(
+            lambda i: prepare(fleet, i), repeat, max_seconds))
+
+    route_benchmarks = selected(ROUTE_BENCHMARKS)
+    if route_benchmarks:
+        app = make_app()
+        fleet.backend.init_app(app, endpoint=ENDPOINT)
+        with app.test_client() as client:
+            with client.session_transaction() as session:
+                session['user'] = {'roles': [common.USER_ROLE,
+                                             common.ADMIN_ROLE,
+                                             common.UBER_ADMIN_ROLE]}
+            for name, prepare in route_benchmarks:
+                record('route', name, run_benchmark(
+                    lambda i: prepare(fleet, client, i), repeat,
+                    max_seconds))
+
+    return results
+
+
+def run(backends, volume_counts, snapshot_count=5, policy_count=100,
+        repeat=100, max_seconds=10.0, name_filter=None, latency_s=None,
+        default_latency_s=0.0):
+    """
+    Benchmark a fresh fleet for every combination of back-end kind and
+    volume count, returning a JSON-serialisable report.
+    """
+    from storage_api.apis import __version__
+
+    report = OrderedDict([
+        ('created', datetime.utcnow().isoformat() + "Z"),
+        ('version', __version__),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('parameters', OrderedDict([
+            ('backends', backends),
+            ('volumes', volume_counts),
+            ('snapshots_per_volume', snapshot_count),
+            ('policies', policy_count),
+            ('repeat', repeat),
+            ('max_seconds', max_seconds),
+            ('filter', name_filter),
+            ('zapi_latency_s', dict(latency_s or {},
+                                    default=default_latency_s))])),
+        ('fleets', []),
+        ('results', [])])
+
+    for kind in backends:
+        for volume_count in volume_counts:
+            log.info("Populating {} with {} volumes"
+                     .format(kind, volume_count))
+            fleet = Fleet(kind, volume_count, snapshot_count, policy_count,
+                          latency_s=latency_s,
+                          default_latency_s=default_latency_s)
+            try:
+                report['fleets'].append(OrderedDict([
+                    ('backend', kind), ('volumes', volume_count),
+                    ('populate_s', fleet.populate_s)]))
+                report['results'].extend(benchmark_fleet(
+                    fleet, repeat, max_seconds, name_filter))
+            finally:
+                fleet.close()
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the storage back-ends and HTTP API")
+    parser.add_argument('--backend', action='append', choices=BACKEND_KINDS,
+                        help="back-end to benchmark (default: all)")
+    parser.add_argument('--volumes', action='append', type=int,
+                        help=("number of volumes in the fleet, may be"
+                              " repeated (default: 1000)"))
+    parser.add_argument('--snapshots', type=int, default=5,
+                        help="snapshots per volume")
+    parser.add_argument('--policies', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=100,
+                        help="maximum number of calls per benchmark")
+    parser.add_argument('--max-seconds', type=float, default=10.0,
+                        help="maximum time spent on each benchmark")
+    parser.add_argument('--filter', default=None, metavar="REGEX",
+                        help="only run benchmarks whose name matches")
+    parser.add_argument('--latency', action='append', default=[],
+                        metavar="API=SECONDS",
+                        help=("ZAPI latency of the simulated cluster, as for"
+                              " storage_api.simulator"))
+    parser.add_argument('--output', default=None,
+                        help="file to write results to (default: stdout)")
+    args = parser.parse_args(argv)
+
+    latency_s, default_latency_s = simulator.parse_latency(args.latency)
+
+    # Logging every call would dominate the timings
+    loggers = [log, logging.getLogger('werkzeug')]
+    levels = [logger.level for logger in loggers]
+    for logger in loggers:
+        logger.setLevel(logging.WARNING)
+    try:
+        report = run(backends=args.backend or BACKEND_KINDS,
+                     volume_counts=args.volumes or [1000],
+                     snapshot_count=args.snapshots,
+                     policy_count=args.policies,
+                     repeat=args.repeat,
+                     max_seconds=args.max_seconds,
+                     name_filter=args.filter,
+                     latency_s=latency_s,
+                     default_latency_s=default_latency_s)
+    finally:
+        for logger, level in zip(loggers, levels):
+            logger.setLevel(level)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,10 @@
 # or submit itself to any jurisdiction.
 
 from storage_api.utils import pairwise
+from storage_api import metrics
+from storage_api import jobs
+from storage_api import retention
+from storage_api.apis import storage as storage_apis
 
 import os
 import csv
@@ -35,6 +39,90 @@ def load_basic_auth_conf(app):
     app.config[env_var_name] = os.getenv(env_var_name)
 
 
+def load_metrics_conf(app):
+    """
+    Initialise metrics collection, sharing metrics between processes
+    through the directory in $SAPI_METRICS_DIR, if set.
+
+    Also set up request timing: a Server-Timing header on every response
+    if $SAPI_SERVER_TIMING is true, and logging of requests slower than
+    $SAPI_SLOW_REQUEST_S seconds, if set.
+
+    Must be called before back-ends are loaded for their calls to be
+    recorded.
+    """
+    directory = os.getenv('SAPI_METRICS_DIR') or None
+    app.logger.info("Collecting metrics{}"
+                    .format(" in {}".format(directory) if directory else ""))
+    metrics.init_app(app, directory=directory)
+
+    server_timing = os.getenv('SAPI_SERVER_TIMING', "").lower() in [
+        "1", "true", "yes"]
+    slow_request_s = os.getenv('SAPI_SLOW_REQUEST_S') or None
+    metrics.init_request_timing(
+        app, server_timing=server_timing,
+        slow_request_s=(float(slow_request_s) if slow_request_s is not None
+                        else None))
+
+
+def load_jobs_conf(app):
+    """
+    Initialise the runner of asynchronous jobs, with $SAPI_JOB_WORKERS
+    threads per process (default: 4), refusing new jobs while
+    $SAPI_MAX_PENDING_JOBS (default: 100) are pending in a process, and
+    sharing jobs between processes through the directory in
+    $SAPI_JOBS_DIR, if set.
+    """
+    directory = os.getenv('SAPI_JOBS_DIR') or None
+    workers = int(os.getenv('SAPI_JOB_WORKERS') or jobs.DEFAULT_WORKERS)
+    max_pending = int(os.getenv('SAPI_MAX_PENDING_JOBS')
+                      or jobs.DEFAULT_MAX_PENDING)
+    app.logger.info("Running jobs on {} worker(s){}".format(
+        workers, " in {}".format(directory) if directory else ""))
+    jobs.init_app(app, directory=directory, workers=workers,
+                  max_pending=max_pending)
+
+
+def load_batch_conf(app):
+    """
+    Configure batches: at most $SAPI_MAX_BATCH_SIZE operations
+    (default: 1000) per batch, run on up to $SAPI_BATCH_WORKERS threads
+    (default: 8) per batch.
+    """
+    app.config['MAX_BATCH_SIZE'] = int(
+        os.getenv('SAPI_MAX_BATCH_SIZE')
+        or storage_apis.DEFAULT_MAX_BATCH_SIZE)
+    app.config['BATCH_WORKERS'] = int(
+        os.getenv('SAPI_BATCH_WORKERS')
+        or storage_apis.DEFAULT_BATCH_WORKERS)
+
+
+def load_retention_conf(app):
+    """
+    Run the snapshot retention engine on the policies in the JSON file
+    $SAPI_RETENTION_POLICIES, if set, checking every
+    $SAPI_RETENTION_INTERVAL_S seconds (default: 30) for snapshots due.
+    Each volume's snapshot is due up to $SAPI_RETENTION_JITTER_S seconds
+    (default: 3000) into its period, and at most $SAPI_RETENTION_PER_FILER
+    (default: 2) are made at a time per subsystem. Worker processes elect
+    a leader to run it in the directory $SAPI_RETENTION_DIR, or by
+    default in one in the system's temporary directory.
+    """
+    policies_path = os.getenv('SAPI_RETENTION_POLICIES')
+    if not policies_path:
+        return
+    directory = os.getenv('SAPI_RETENTION_DIR') or None
+    app.logger.info("Running snapshot retention on {}".format(policies_path))
+    retention.init_app(
+        app, policies_path, directory=directory,
+        interval_s=float(os.getenv('SAPI_RETENTION_INTERVAL_S')
+                         or retention.DEFAULT_INTERVAL_S),
+        jitter_s=float(os.getenv('SAPI_RETENTION_JITTER_S')
+                       or retention.DEFAULT_JITTER_S),
+        per_filer=int(os.getenv('SAPI_RETENTION_PER_FILER')
+                      or retention.DEFAULT_PER_FILER))
+
+
 def load_backend_conf(app, backends_module):
     """
     Initialise back-ends into the app app, using the provided module to
@@ -8,6 +8,7 @@
 # or submit itself to any jurisdiction.
 
 from .storage import DummyStorage, NetappStorage # noqa
+from .sqlite import SqliteDummyStorage # noqa
 
 from storage_api.utils import init_logger
 
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Synthetic fleets of volumes for pre-populating dummy back-ends.
+
+A `FleetSpec` describes the shape of a fleet: how many volumes, spread
+over which aggregates and filers, with which sizes, snapshots, export
+policies and locks. `generate_fleet` turns it into records, always the
+same ones for the same spec and seed, which the dummy back-ends then
+bulk-load (see `DummyStorage.load_fleet`).
+
+Specs can be given as `fleet_*` back-end options in `$SAPI_BACKENDS`,
+e.g. `fleet_volumes🌈100000🌈fleet_snapshots🌈0-20` (see
+`FleetSpec.from_options`).
+"""
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
+import ipaddress
+import random
+
+OPTION_PREFIX = 'fleet_'
+
+# Snapshot times are relative to this, so that fleets are reproducible
+FLEET_EPOCH = datetime(2017, 1, 1)
+
+# A policy, and its rules in order
+Policy = namedtuple('Policy', ['name', 'rules'])
+
+# The fields of a volume, its snapshots as (name, size in kbytes,
+# creation time) tuples in creation order, and the host locking it, if
+# any
+Volume = namedtuple('Volume', ['fields', 'snapshots', 'lock'])
+
+
+def parse_names(value, pattern):
+    """
+    Parse a list of names, given either as comma-separated names, or as
+    a count of names made from pattern, numbered from 1.
+    """
+    value = str(value)
+    if value.isdigit():
+        return [pattern.format(number)
+                for number in range(1, int(value) + 1)]
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def parse_range(value):
+    """
+    Parse a range of integers, given as "N" or "MIN-MAX", into a tuple
+    of (min, max).
+    """
+    try:
+        lower, _, upper = str(value).partition("-")
+        bounds = int(lower), int(upper or lower)
+    except ValueError:
+        raise ValueError("Invalid range: '{}'. Expected N or MIN-MAX"
+                         .format(value))
+    if bounds[0] < 0 or bounds[0] > bounds[1]:
+        raise ValueError("Invalid range: '{}'".format(value))
+    return bounds
+
+
+def parse_sizes(value):
+    """
+    Parse a distribution of volume sizes, given as comma-separated
+    SIZE_GIB:WEIGHT pairs (weights default to 1), into a list of
+    (size in bytes, weight) tuples.
+    """
+    sizes = []
+    for entry in str(value).split(","):
+        size, _, weight = entry.partition(":")
+        try:
+            sizes.append((int(float(size) * 2**30), float(weight or 1)))
+        except ValueError:
+            raise ValueError("Invalid volume size: '{}'. Expected"
+                             " SIZE_GIB:WEIGHT".format(entry))
+        if sizes[-1][0] <= 0 or sizes[-1][1] <= 0:
+            raise ValueError("Invalid volume size: '{}'".format(entry))
+    return sizes
+
+
+class FleetSpec(object):
+    """
+    The shape of a synthetic fleet:
+
+    - volumes: the number of volumes, named vol_000000 onwards
+    - aggregates: the aggregates volumes are spread over, at random
+    - filers: the filers aggregates are spread over, in turn
+    - sizes: (size in bytes, weight) tuples to draw volume sizes from.
+      Volumes are filled to a random fraction of their size.
+    - snapshots: the (min, max) number of snapshots of each volume
+    - policies: the number of export policies, named policy_0000
+      onwards, each volume being exported through one of them
+    - rules: the (min, max) number of CIDR rules of each policy
+    - locked: the fraction of volumes that are locked
+    - seed: the seed of the random generator
+    """
+
+    OPTIONS = ['volumes', 'aggregates', 'filers', 'sizes', 'snapshots',
+               'policies', 'rules', 'locked', 'seed']
+
+    def __init__(self, volumes=0, aggregates=None, filers=None, sizes=None,
+                 snapshots=(0, 0), policies=0, rules=(1, 4), locked=0.0,
+                 seed=0):
+        self.volumes = volumes
+        self.aggregates = aggregates or parse_names(4, "aggr{}_node1")
+        self.filers = filers or ["dummy-filer"]
+        self.sizes = sizes or parse_sizes("10,50,100,500,1000")
+        self.snapshots = snapshots
+        self.policies = policies
+        self.rules = rules
+        self.locked = locked
+        self.seed = seed
+
+        if volumes < 0 or policies < 0:
+            raise ValueError("Fleet sizes must not be negative")
+        if not 0 <= locked <= 1:
+            raise ValueError("The locked fraction of volumes must be"
+                             " between 0 and 1, not {}".format(locked))
+
+    def __repr__(self):
+        return "FleetSpec({})".format(", ".join(
+            "{}={!r}".format(option, getattr(self, option))
+            for option in self.OPTIONS))
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        Make a spec from back-end options prefixed with fleet_, given
+        as strings, or return None if there are no fleet options.
+
+        Raises:
+            ValueError: on unknown or invalid options
+        """
+        if not options:
+            return None
+
+        values = {}
+        for key, value in options.items():
+            option = key[len(OPTION_PREFIX):]
+            if not key.startswith(OPTION_PREFIX) or option not in cls.OPTIONS:
+                raise ValueError("Unknown fleet option: {}. Allowed options"
+                                 " are: {}".format(key, ", ".join(
+                                     OPTION_PREFIX + option
+                                     for option in cls.OPTIONS)))
+            values[option] = value
+
+        parsers = {'volumes': int, 'policies': int, 'seed': int,
+                   'locked': float, 'sizes': parse_sizes,
+                   'snapshots': parse_range, 'rules': parse_range,
+                   'aggregates': lambda v: parse_names(v, "aggr{}_node1"),
+                   'filers': lambda v: parse_names(v, "dummy-filer-{}")}
+        try:
+            return cls(**{option: parsers[option](value)
+                          for option, value in values.items()})
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid fleet options: {}".format(e))
+
+
+def policy_name(number):
+    return "policy_{:04d}".format(number)
+
+
+def snapshot_name(number):
+    return "snap_{:04d}".format(number)
+
+
+def random_rule(rng):
+    prefix_length = rng.choice([16, 22, 24, 26, 28, 32])
+    return str(ipaddress.ip_network((rng.getrandbits(32), prefix_length),
+                                    strict=False))
+
+
+def generate_fleet(spec):
+    """
+    Return the (policies, volumes) of the fleet described by spec, as a
+    list of `Policy` and an iterator of `Volume` in name order.
+    """
+    rng = random.Random(spec.seed)
+
+    policies = []
+    for number in range(spec.policies):
+        rules = [random_rule(rng) for _ in range(rng.randint(*spec.rules))]
+        policies.append(Policy(policy_name(number),
+                               list(OrderedDict.fromkeys(rules))))
+
+    def volumes():
+        width = max(6, len(str(spec.volumes - 1)))
+        sizes = [size for size, _ in spec.sizes]
+        weights = [weight for _, weight in spec.sizes]
+
+        for number in range(spec.volumes):
+            name = "vol_{:0{}d}".format(number, width)
+            # random() is much cheaper than randrange() and randint()
+            aggregate = int(rng.random() * len(spec.aggregates))
+            size_total = rng.choices(sizes, weights)[0]
+            fields = {
+                'name': name,
+                'junction_path': "/{}".format(name),
+                'aggregate_name': spec.aggregates[aggregate],
+                'filer_address': spec.filers[aggregate % len(spec.filers)],
+                'state': 'online',
+                'size_total': size_total,
+                'size_used': int(size_total * rng.random()),
+                'percentage_snapshot_reserve': rng.choice([0, 5, 10, 20])}
+            if policies:
+                fields['active_policy_name'] = rng.choice(policies).name
+
+            created = FLEET_EPOCH + timedelta(minutes=number)
+            max_snapshot_kbytes = size_total // 2**10 // 100
+            snapshots = [(snapshot_name(snapshot),
+                          int(rng.random() * max_snapshot_kbytes),
+                          created + timedelta(hours=snapshot))
+                         for snapshot in range(rng.randint(*spec.snapshots))]
+
+            lock = None
+            if rng.random() < spec.locked:
+                lock = "db-client-{:02d}.cern.ch".format(rng.randrange(100))
+
+            yield Volume(fields, snapshots, lock)
+
+    return policies, volumes()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Snapshots of groups of volumes.
+
+A database spread over several volumes needs a snapshot of all of
+them taken at (nearly) the same time. Back-ends that cannot snapshot
+several volumes atomically take the snapshots concurrently, to keep
+the window between the first and the last as short as possible, and
+delete the snapshots already taken if one of them fails.
+
+Group snapshots report when each snapshot was started and how long it
+took, and the window: the time from the start of the first to the end
+of the last.
+"""
+from storage_api.utils import init_logger
+
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+log = init_logger()
+
+
+def check_group(volume_names):
+    """
+    Raise ValueError unless volume_names is a non-empty list of
+    distinct names.
+    """
+    if not volume_names:
+        raise ValueError("A group snapshot needs at least one volume")
+    if len(set(volume_names)) != len(volume_names):
+        raise ValueError("Volumes appear more than once in {}"
+                         .format(", ".join(volume_names)))
+
+
+def group_snapshot(snapshot_name, timings):
+    """
+    Return the description of the group snapshot snapshot_name, taken
+    with the given per-volume timings.
+    """
+    window_s = (max(t['started'] + t['duration_s'] for t in timings)
+                - min(t['started'] for t in timings))
+    return {'name': snapshot_name, 'window_s': window_s,
+            'volumes': timings}
+
+
+def _timed(create, volume_name, snapshot_name):
+    started = time.time()
+    create(volume_name, snapshot_name)
+    return {'name': volume_name, 'started': started,
+            'duration_s': time.time() - started}
+
+
+def take_group_snapshot(volume_names, snapshot_name, create, delete,
+                        workers=1):
+    """
+    Take the snapshot snapshot_name of every volume in volume_names,
+    calling create(volume_name, snapshot_name) on up to workers threads,
+    and return the group snapshot (see `group_snapshot`).
+
+    If any snapshot fails, the ones that were taken are deleted with
+    delete(volume_name, snapshot_name), and the first exception is
+    raised.
+    """
+    check_group(volume_names)
+    if workers > 1 and len(volume_names) > 1:
+        with ThreadPoolExecutor(min(workers, len(volume_names)),
+                                thread_name_prefix="snapshot") as executor:
+            futures = [executor.submit(_timed, create, name, snapshot_name)
+                       for name in volume_names]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append((future.result(), None))
+            except Exception as e:
+                outcomes.append((None, e))
+    else:
+        outcomes = []
+        for name in volume_names:
+            try:
+                outcomes.append((_timed(create, name, snapshot_name), None))
+            except Exception as e:
+                outcomes.append((None, e))
+                break
+
+    errors = [e for _, e in outcomes if e is not None]
+    timings = [t for t, _ in outcomes if t is not None]
+    if errors:
+        for timing in timings:
+            try:
+                delete(timing['name'], snapshot_name)
+            except Exception as e:
+                log.error("Could not delete snapshot {} of {} after a"
+                          " failed group snapshot: {}".format(
+                              snapshot_name, timing['name'], e))
+        raise errors[0]
+
+    return group_snapshot(snapshot_name, timings)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+In-memory indexes used by back-ends to resolve volume identifiers
+without asking the storage system.
+"""
+from storage_api.utils import init_logger
+
+from collections import namedtuple
+import threading
+import time
+from typing import Dict  # noqa
+
+log = init_logger()
+
+IndexEntry = namedtuple('IndexEntry', 'name, uuid, node, junction_path')
+
+# How long entries are trusted, in seconds
+DEFAULT_TTL_S = 300
+
+
+def entry_from_volume(volume):
+    """
+    Make an IndexEntry from a formatted volume dictionary.
+    """
+    return IndexEntry(name=volume['name'],
+                      uuid=volume.get('uuid', None),
+                      node=volume.get('filer_address', None),
+                      junction_path=volume.get('junction_path', None))
+
+
+class JunctionPathIndex(object):
+    """
+    A bidirectional mapping between `node:/junction/path` identifiers
+    and volume names and UUIDs, with O(1) lookups in both directions.
+
+    Junction paths are unique within a vserver, so the node is not
+    needed to resolve one; it is recorded for the reverse mapping
+    only. This mirrors how NetApp back-ends already ignore the node
+    part of the identifier (which clients may leave empty, or set to
+    an alias of the filer).
+
+    The index is a cache: a miss means "ask the filer", never "no such
+    volume". Entries may go stale if volumes are changed outside the
+    API, so they expire ttl_s seconds after they were added, and
+    back-ends discard those the filer no longer agrees with.
+    """
+
+    def __init__(self, ttl_s=DEFAULT_TTL_S, clock=time.monotonic):
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self._by_path = {}  # type: Dict[str, IndexEntry]
+        self._by_name = {}  # type: Dict[str, IndexEntry]
+        self._added = {}  # type: Dict[str, float]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def __repr__(self):
+        return "JunctionPathIndex({} volumes)".format(len(self))
+
+    def _fresh(self, entry):
+        if entry is None:
+            return None
+        added = self._added.get(entry.name, None)
+        if added is None or self.clock() - added > self.ttl_s:
+            return None
+        return entry
+
+    def lookup(self, node, junction_path):
+        """
+        Return the IndexEntry for the volume mounted at junction_path,
+        or None if it is not indexed or has expired. node is ignored.
+        """
+        return self._fresh(self._by_path.get(junction_path, None))
+
+    def entry_of(self, volume_name):
+        """
+        Return the IndexEntry for the volume named volume_name, or None
+        if it is not indexed or has expired.
+        """
+        return self._fresh(self._by_name.get(volume_name, None))
+
+    def add(self, name, uuid=None, node=None, junction_path=None):
+        """
+        Insert or update the entry for a volume, replacing any previous
+        entry with the same name or junction path.
+        """
+        return self._add(IndexEntry(name=name, uuid=uuid, node=node,
+                                    junction_path=junction_path))
+
+    def add_volume(self, volume):
+        """
+        Insert or update the entry for a formatted volume dictionary.
+        """
+        return self._add(entry_from_volume(volume))
+
+    def _add(self, entry):
+        with self._lock:
+            self._discard(entry.name)
+            if entry.junction_path:
+                displaced = self._by_path.get(entry.junction_path, None)
+                if displaced is not None:
+                    self._by_name.pop(displaced.name, None)
+                    self._added.pop(displaced.name, None)
+                self._by_path[entry.junction_path] = entry
+            self._by_name[entry.name] = entry
+            self._added[entry.name] = self.clock()
+        return entry
+
+    def discard(self, volume_name):
+        """
+        Remove the entry for volume_name, if any.
+        """
+        with self._lock:
+            self._discard(volume_name)
+
+    def discard_path(self, junction_path):
+        """
+        Remove the entry for the volume mounted at junction_path, if
+        any.
+        """
+        with self._lock:
+            entry = self._by_path.get(junction_path, None)
+            if entry is not None:
+                self._discard(entry.name)
+
+    def _discard(self, volume_name):
+        self._added.pop(volume_name, None)
+        entry = self._by_name.pop(volume_name, None)
+        if entry is not None and entry.junction_path:
+            if self._by_path.get(entry.junction_path, None) is entry:
+                self._by_path.pop(entry.junction_path)
+
+    def replace_all(self, volumes):
+        """
+        Rebuild the index from an iterable of formatted volume
+        dictionaries, e.g. a full volume listing.
+        """
+        by_path = {}
+        by_name = {}
+        now = self.clock()
+        for volume in volumes:
+            entry = entry_from_volume(volume)
+            by_name[entry.name] = entry
+            if entry.junction_path:
+                by_path[entry.junction_path] = entry
+
+        with self._lock:
+            self._by_path, self._by_name = by_path, by_name
+            self._added = dict.fromkeys(by_name, now)
+        log.debug("Rebuilt junction path index with {} volumes"
+                  .format(len(by_name)))
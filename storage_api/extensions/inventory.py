@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+An in-memory snapshot of a back-end's volume listing, kept fresh by a
+background thread.
+
+Listing every volume on a big filer can take several seconds, so
+back-ends may serve `volumes` from an inventory instead, trading
+freshness for latency. The staleness bound guarantees that a stuck or
+failing refresher never causes arbitrarily old data to be served: past
+it, the next reader refreshes synchronously.
+"""
+from storage_api.utils import init_logger
+
+import os
+import threading
+import time
+
+log = init_logger()
+
+
+class VolumeInventory(object):
+    """
+    A periodically refreshed snapshot of the result of calling `fetch`.
+
+    The refresher thread is started lazily on first access, and again
+    after a fork (e.g. into a uWSGI worker), as threads do not survive
+    forking.
+
+    Args:
+        fetch (callable): returns an iterable of (formatted) volumes
+        refresh_interval_s (float): seconds between background refreshes
+        max_staleness_s (float): the oldest snapshot that may be
+            served. Defaults to three refresh intervals.
+    """
+
+    def __init__(self, fetch, refresh_interval_s, max_staleness_s=None):
+        self.fetch = fetch
+        self.refresh_interval_s = float(refresh_interval_s)
+        if max_staleness_s is None:
+            self.max_staleness_s = 3 * self.refresh_interval_s
+        else:
+            self.max_staleness_s = float(max_staleness_s)
+
+        if self.refresh_interval_s <= 0:
+            raise ValueError("Inventory refresh interval must be positive")
+        if self.max_staleness_s < self.refresh_interval_s:
+            raise ValueError("Inventory staleness bound must not be shorter"
+                             " than the refresh interval")
+
+        # A (volumes, refreshed_at) tuple, replaced atomically
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.refresh_listeners = []
+
+    def __repr__(self):
+        return ("VolumeInventory(refresh_interval_s={}, max_staleness_s={})"
+                .format(self.refresh_interval_s, self.max_staleness_s))
+
+    @property
+    def age(self):
+        """
+        The age of the current snapshot in seconds, or None if no
+        snapshot has been taken yet.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        return time.monotonic() - snapshot[1]
+
+    def refresh(self, older_than=None):
+        """
+        Synchronously replace the snapshot with fresh data, and notify
+        any refresh listeners with the new list of volumes.
+
+        If older_than is given, only refresh if the current snapshot is
+        at least that many seconds old (e.g. because another thread
+        refreshed it while we were waiting for the lock).
+        """
+        with self._refresh_lock:
+            snapshot = self._snapshot
+            if (older_than is not None and snapshot is not None
+                    and time.monotonic() - snapshot[1] < older_than):
+                return snapshot[0]
+
+            started = time.monotonic()
+            volumes = list(self.fetch())
+            self._snapshot = (volumes, started)
+            log.info("Refreshed volume inventory: {} volumes in {:.2f}s"
+                     .format(len(volumes), time.monotonic() - started))
+
+        for listener in self.refresh_listeners:
+            listener(volumes)
+
+        return volumes
+
+    def volumes(self):
+        """
+        Return the current snapshot, refreshing it first if it is
+        missing or older than the staleness bound.
+
+        The returned list is shared between readers and must not be
+        modified.
+        """
+        if not self._stopped.is_set():
+            self.start()
+
+        snapshot = self._snapshot
+        if snapshot is None or self.age > self.max_staleness_s:
+            log.warning("Volume inventory missing or stale, refreshing"
+                        " synchronously")
+            return self.refresh(older_than=self.max_staleness_s)
+
+        return snapshot[0]
+
+    def start(self):
+        """
+        Start the background refresher, unless it is already running in
+        this process.
+        """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name="volume-inventory",
+                                            daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background refresher. The current snapshot is kept,
+        and will only be refreshed synchronously by readers until
+        start() is called again.
+        """
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.refresh(older_than=self.refresh_interval_s)
+                delay = self.refresh_interval_s - self.age
+            except Exception:
+                log.exception("Failed to refresh volume inventory,"
+                              " keeping the previous snapshot")
+                delay = self.refresh_interval_s
+            self._stopped.wait(max(delay, 0))
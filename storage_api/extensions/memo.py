@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Request-scoped memoisation of read-only back-end calls.
+
+A single API call often resolves the same volume name or lists the same
+snapshots several times (e.g. rollback_volume -> get_snapshot ->
+get_snapshots). Memoising read-only methods for the duration of one
+HTTP request makes sure each piece of storage state is fetched at most
+once per request, while never serving data across requests.
+
+Outside of a request context (e.g. in scripts or background threads),
+the decorators below do nothing.
+
+Hits and misses are counted per request (see `request_memo_stats`) and,
+if metrics are enabled, in the sapi_memo_hits_total and
+sapi_memo_misses_total counters, by method.
+"""
+from storage_api.utils import init_logger
+
+import copy
+import functools
+
+import flask
+
+log = init_logger()
+
+
+def _memo():
+    if not hasattr(flask.g, 'backend_memo'):
+        flask.g.backend_memo = {}
+        flask.g.backend_memo_stats = {'hits': 0, 'misses': 0}
+    return flask.g.backend_memo
+
+
+def request_memo_stats():
+    """
+    Return a dictionary with the number of memoised calls that were
+    served from the memo (hits) and passed through to the back-end
+    (misses) during the current request.
+    """
+    if not flask.has_request_context():
+        return {'hits': 0, 'misses': 0}
+    _memo()
+    return dict(flask.g.backend_memo_stats)
+
+
+def _count(outcome, method_name):
+    flask.g.backend_memo_stats[outcome] += 1
+    metrics = flask.current_app.extensions.get('metrics')
+    if metrics is not None:
+        metrics.increment('sapi_memo_{}_total'.format(outcome),
+                          {'method': method_name})
+
+
+def request_memoized(func):
+    """
+    Decorator: memoise a read-only back-end method for the duration of
+    the current request, keyed on the back-end instance and the call
+    arguments.
+
+    Callers get a (deep) copy of the memoised value, so they are free
+    to modify it. Exceptions are not memoised.
+    """
+
+    @functools.wraps(func)
+    def memo_wrapper(self, *args, **kwargs):
+        if not flask.has_request_context():
+            return func(self, *args, **kwargs)
+
+        memo = _memo()
+        key = (id(self), func.__name__, args,
+               tuple(sorted(kwargs.items())))
+
+        try:
+            hit = key in memo
+        except TypeError:
+            # Unhashable arguments, don't even try
+            return func(self, *args, **kwargs)
+
+        if hit:
+            _count('hits', func.__name__)
+            log.debug("Memo hit for {}{}".format(func.__name__, args))
+        else:
+            _count('misses', func.__name__)
+            memo[key] = func(self, *args, **kwargs)
+
+        return copy.deepcopy(memo[key])
+
+    return memo_wrapper
+
+
+def invalidates_request_memo(func):
+    """
+    Decorator: clear everything memoised for the back-end instance once
+    the (mutating) decorated method returns or fails.
+    """
+
+    @functools.wraps(func)
+    def invalidating_wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            if flask.has_request_context():
+                memo = _memo()
+                for key in [k for k in memo if k[0] == id(self)]:
+                    memo.pop(key)
+
+    return invalidating_wrapper
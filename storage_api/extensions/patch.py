@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Planning and running the back-end calls of a PATCH.
+
+Updating several attributes of a volume takes several calls to the
+filer, most of them independent of each other. A `PatchPlan` groups
+them into sequences of dependent `Change`s, runs the sequences
+concurrently, and reports what was applied, what failed and what was
+skipped because an earlier change of its sequence failed.
+"""
+from storage_api.utils import init_logger
+
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+log = init_logger()
+
+# The attributes a change applies, and a function applying them
+Change = namedtuple('Change', ['attributes', 'apply'])
+
+
+class PartialPatchError(Exception):
+    """
+    An Exception raised when some, but not all, of the changes of a
+    PATCH were applied.
+
+    Attributes:
+        applied: the attributes that were updated
+        failed: a dictionary of the attributes whose update failed, and
+            the exception it failed with
+        skipped: the attributes that were not updated, because an
+            update they depend on failed
+    """
+
+    def __init__(self, applied, failed, skipped):
+        self.applied = applied
+        self.failed = failed
+        self.skipped = skipped
+        super().__init__("Failed to update {}".format(", ".join(
+            "{} ({})".format(attribute, error)
+            for attribute, error in failed.items())))
+
+    def summary(self):
+        return {'applied': self.applied,
+                'failed': {attribute: str(error)
+                           for attribute, error in self.failed.items()},
+                'skipped': self.skipped}
+
+
+class PatchExecutor(object):
+    """
+    A bounded pool of threads running the changes of PATCHes, shared by
+    the requests of a process and re-created after a fork (threads do
+    not survive forking).
+    """
+
+    def __init__(self, max_workers):
+        if max_workers < 1:
+            raise ValueError("PATCH workers must be positive, not {}"
+                             .format(max_workers))
+        self.max_workers = max_workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix="patch")
+                    self._pid = os.getpid()
+        return self._executor.submit(fn, *args, **kwargs)
+
+
+class PatchPlan(object):
+    """
+    The changes of a PATCH, as sequences of changes that must be
+    applied in order. Sequences are independent of each other.
+    """
+
+    def __init__(self):
+        self.sequences = []
+
+    def __len__(self):
+        return sum(len(sequence) for sequence in self.sequences)
+
+    def add(self, *changes):
+        """
+        Add a sequence of changes, applied in order, ignoring changes
+        with no attributes.
+        """
+        sequence = [c for c in changes if c.attributes]
+        if sequence:
+            self.sequences.append(sequence)
+
+    @staticmethod
+    def _run_sequence(sequence):
+        applied, failed, skipped = [], OrderedDict(), []
+        for change in sequence:
+            if failed:
+                skipped.extend(change.attributes)
+                continue
+            try:
+                change.apply()
+            except Exception as e:
+                log.warning("Failed to update {}: {}"
+                            .format(", ".join(change.attributes), e))
+                failed.update((attribute, e)
+                              for attribute in change.attributes)
+            else:
+                applied.extend(change.attributes)
+        return applied, failed, skipped
+
+    def run(self, executor=None):
+        """
+        Apply every change, running the sequences concurrently on
+        executor (a `PatchExecutor`) if there is more than one.
+
+        Raises:
+            PartialPatchError: if some changes were applied, and some
+                failed
+            Exception: the first exception raised by a change, if none
+                was applied
+        """
+        if executor is None or len(self.sequences) < 2:
+            outcomes = [self._run_sequence(s) for s in self.sequences]
+        else:
+            futures = [executor.submit(self._run_sequence, s)
+                       for s in self.sequences]
+            outcomes = [future.result() for future in futures]
+
+        applied, failed, skipped = [], OrderedDict(), []
+        for sequence_applied, sequence_failed, sequence_skipped in outcomes:
+            applied.extend(sequence_applied)
+            failed.update(sequence_failed)
+            skipped.extend(sequence_skipped)
+
+        if failed and not applied:
+            raise next(iter(failed.values()))
+        if failed:
+            raise PartialPatchError(applied, failed, skipped)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Compact in-memory records and indexes used by `DummyStorage` to hold
+fleets of hundreds of thousands of volumes.
+
+Volume and snapshot records use `__slots__` rather than dictionaries,
+but volume records still support dictionary-style access so that they
+can be read (and, in tests, poked at) like the dictionaries they
+replace.
+"""
+from collections import OrderedDict
+import bisect
+
+# Known volume fields, in the order of the volume schema
+VOLUME_FIELDS = ('name', 'uuid', 'active_policy_name', 'junction_path',
+                 'aggregate_name', 'state', 'size_used', 'size_total',
+                 'filer_address', 'creation_time', 'compression_enabled',
+                 'inline_compression', 'percentage_snapshot_reserve',
+                 'percentage_snapshot_reserve_used', 'caching_policy')
+
+_FIELD_SET = frozenset(VOLUME_FIELDS)
+_UNSET = object()
+
+
+class VolumeRecord(object):
+    """
+    The fields of a volume, in slots for the fields of the volume
+    schema and a dictionary for any others.
+
+    Records stored by `DummyStorage` are shared with the clones made
+    of them and read without locking, so they must not be
+    modified once stored: writers replace them by a `copy()` instead.
+
+    `validated_with` records the schema options the record was last
+    validated with (see `normalised_with`), and is cleared whenever the
+    record is modified.
+    """
+    __slots__ = VOLUME_FIELDS + ('extra', 'validated_with')
+
+    def __init__(self, fields=()):
+        self.extra = None
+        self.validated_with = None
+        for key, value in dict(fields).items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        value = self.get(key, _UNSET)
+        if value is _UNSET:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.validated_with = None
+        if key in _FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return self.get(key, _UNSET) is not _UNSET
+
+    def get(self, key, default=None):
+        if key in _FIELD_SET:
+            return getattr(self, key, default)
+        if self.extra is None:
+            return default
+        return self.extra.get(key, default)
+
+    def to_dict(self):
+        fields = {}
+        for key in VOLUME_FIELDS:
+            value = getattr(self, key, _UNSET)
+            if value is not _UNSET:
+                fields[key] = value
+        if self.extra:
+            fields.update(self.extra)
+        return fields
+
+    def items(self):
+        return self.to_dict().items()
+
+    def copy(self, **changes):
+        """
+        Return a copy of the record, with changes applied.
+        """
+        record = VolumeRecord(self.items())
+        for key, value in changes.items():
+            record[key] = value
+        if not changes:
+            record.validated_with = self.validated_with
+        return record
+
+    def __eq__(self, other):
+        if isinstance(other, VolumeRecord):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return "VolumeRecord({})".format(self.to_dict())
+
+
+class SnapshotRecord(object):
+    """
+    A snapshot of a volume.
+    """
+    __slots__ = ('name', 'size_kbytes', 'creation_time', 'validated_with')
+
+    def __init__(self, name, size_kbytes, creation_time):
+        self.name = name
+        self.size_kbytes = size_kbytes
+        self.creation_time = creation_time
+        self.validated_with = None
+
+    def to_dict(self):
+        return {'name': self.name,
+                'size_kbytes': self.size_kbytes,
+                'creation_time': self.creation_time}
+
+
+class SnapshotIndex(object):
+    """
+    The snapshots of a volume by name, in creation order.
+
+    The list of names in sorted order used for paging is only built
+    on the first page requested, and the list of (creation time, name)
+    in sorted order used to find the oldest snapshot when it is first
+    needed. Both are then maintained.
+    """
+    __slots__ = ('by_name', 'sorted_names', 'by_age')
+
+    def __init__(self):
+        self.by_name = {}  # Ordered by creation
+        self.sorted_names = None
+        self.by_age = None
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    def _forget_age(self, snapshot):
+        del self.by_age[bisect.bisect_left(
+            self.by_age, (snapshot.creation_time, snapshot.name))]
+
+    def add(self, snapshot):
+        previous = self.by_name.get(snapshot.name)
+        if self.sorted_names is not None and previous is None:
+            bisect.insort(self.sorted_names, snapshot.name)
+        if self.by_age is not None:
+            if previous is not None:
+                self._forget_age(previous)
+            bisect.insort(self.by_age, (snapshot.creation_time,
+                                        snapshot.name))
+        self.by_name[snapshot.name] = snapshot
+
+    def remove(self, name):
+        """
+        Remove and return the snapshot named name.
+
+        Raises:
+            KeyError: if there is no such snapshot
+        """
+        snapshot = self.by_name.pop(name)
+        if self.sorted_names is not None:
+            self.sorted_names.pop(bisect.bisect_left(self.sorted_names,
+                                                     name))
+        if self.by_age is not None:
+            self._forget_age(snapshot)
+        return snapshot
+
+    def oldest(self):
+        """
+        Return the name of the snapshot with the earliest creation time
+        (the first by name among equals), or None if there are none.
+        """
+        if self.by_age is None:
+            self.by_age = sorted((s.creation_time, s.name)
+                                 for s in self.by_name.values())
+        return self.by_age[0][1] if self.by_age else None
+
+    def values(self):
+        return self.by_name.values()
+
+    def names_after(self, after, limit):
+        """
+        Return at most limit snapshot names in name order, starting
+        after the name after, or from the first one if it is None.
+        """
+        if self.sorted_names is None:
+            self.sorted_names = sorted(self.by_name)
+        start = (0 if after is None
+                 else bisect.bisect_right(self.sorted_names, after))
+        return self.sorted_names[start:start + limit]
+
+
+class RuleSet(object):
+    """
+    The rules of an export policy: an ordered set with O(1) insertion,
+    removal and membership tests.
+    """
+    __slots__ = ('_rules', )
+
+    def __init__(self, rules=()):
+        self._rules = OrderedDict.fromkeys(rules)
+
+    def __contains__(self, rule):
+        return rule in self._rules
+
+    def __iter__(self):
+        return iter(self._rules)
+
+    def __len__(self):
+        return len(self._rules)
+
+    def add(self, rule):
+        self._rules[rule] = None
+
+    def discard(self, rule):
+        self._rules.pop(rule, None)
+
+    def to_list(self):
+        return list(self._rules)
+
+    def __repr__(self):
+        return "RuleSet({})".format(self.to_list())
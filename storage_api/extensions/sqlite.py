@@ -0,0 +1,811 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+A dummy back-end persisted in a local SQLite database.
+
+`DummyStorage` keeps its data in the RAM of each process, so every
+uWSGI worker sees different volumes, and everything is lost on restart.
+`SqliteDummyStorage` follows the same semantics, but keeps its data in
+a database file shared by all processes and threads using it, so that
+a staging deployment behaves like one coherent storage system.
+
+The database runs in WAL mode: readers never block, and never wait for
+writers. Writes are serialised by SQLite, and check-then-act sequences
+(creating a volume, taking a lock...) run in a single write
+transaction, so they are atomic across processes.
+"""
+from storage_api.extensions.storage import (StorageBackend, ValidationError,
+                                            TooManySnapshots,
+                                            DEFAULT_MAX_SNAPSHOTS,
+                                            NormalisedRecord,
+                                            normalised_with,
+                                            vol_404,
+                                            check_volume_query, check_limit,
+                                            sort_volumes, encode_cursor,
+                                            decode_cursor)
+from storage_api.extensions.fleet import FleetSpec, generate_fleet
+from storage_api.extensions.validation import ValidationPolicy
+from storage_api.extensions.versions import check_version
+from storage_api.extensions.groups import check_group, group_snapshot
+from storage_api.utils import init_logger
+
+from contextlib import contextmanager
+from datetime import datetime
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+log = init_logger()
+
+# Number of volumes fetched per query by iter_volumes()
+ITERATION_CHUNK = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS volumes (
+    name TEXT PRIMARY KEY,
+    aggregate_name TEXT,
+    state TEXT,
+    size_used INTEGER,
+    size_total INTEGER,
+    record_id INTEGER NOT NULL,
+    validated_with TEXT
+);
+CREATE INDEX IF NOT EXISTS volumes_by_aggregate
+    ON volumes (aggregate_name, name);
+CREATE INDEX IF NOT EXISTS volumes_by_state ON volumes (state, name);
+CREATE INDEX IF NOT EXISTS volumes_by_record ON volumes (record_id);
+CREATE TABLE IF NOT EXISTS locks (
+    volume TEXT PRIMARY KEY,
+    owner TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS policies (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS rules (
+    policy TEXT NOT NULL,
+    rule TEXT NOT NULL,
+    PRIMARY KEY (policy, rule)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    volume TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size_kbytes INTEGER,
+    creation_time TIMESTAMP,
+    record_id INTEGER NOT NULL,
+    validated_with TEXT,
+    PRIMARY KEY (volume, name)
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_record ON snapshots (record_id);
+CREATE INDEX IF NOT EXISTS snapshots_by_age
+    ON snapshots (volume, creation_time, name);
+"""
+
+# Volume fields with columns of their own, for queries
+VOLUME_COLUMNS = ['aggregate_name', 'state', 'size_used', 'size_total']
+
+# Number of generated volumes inserted per batch by load_fleet()
+LOAD_BATCH = 10000
+
+
+def prefix_upper_bound(prefix):
+    """
+    Return the smallest string greater than all strings starting with
+    prefix, or None if there is no such string.
+    """
+    while prefix:
+        last = ord(prefix[-1])
+        if last < 0x10FFFF:
+            following = last + 1
+            if 0xD800 <= following <= 0xDFFF:
+                following = 0xE000
+            return prefix[:-1] + chr(following)
+        prefix = prefix[:-1]
+    return None
+
+
+def volume_conditions(criteria, after=None):
+    """
+    Return a tuple of (SQL condition, parameters) selecting the volumes
+    matching criteria (see `StorageBackend.query_volumes`), with names
+    after the name after, if given.
+    """
+    conditions = []
+    parameters = []
+    for key in ['aggregate_name', 'state']:
+        if criteria.get(key, None) is not None:
+            conditions.append("{} = ?".format(key))
+            parameters.append(criteria[key])
+
+    for key in ['size_used', 'size_total']:
+        lower = criteria.get('{}_min'.format(key), None)
+        upper = criteria.get('{}_max'.format(key), None)
+        if lower is not None:
+            conditions.append("{} >= ?".format(key))
+            parameters.append(lower)
+        if upper is not None:
+            conditions.append("{} <= ?".format(key))
+            parameters.append(upper)
+
+    name_prefix = criteria.get('name_prefix', None)
+    if name_prefix:
+        conditions.append("name >= ?")
+        parameters.append(name_prefix)
+        upper = prefix_upper_bound(name_prefix)
+        if upper is not None:
+            conditions.append("name < ?")
+            parameters.append(upper)
+
+    if after is not None:
+        conditions.append("name > ?")
+        parameters.append(after)
+
+    return " AND ".join(conditions) or "1", parameters
+
+
+class SqliteDummyStorage(StorageBackend):
+    """
+    A dummy back-end with the semantics of `DummyStorage`, persisted in
+    the SQLite database at path, which is created if needed.
+
+    Every process and thread gets its own connection to the database.
+    Writers wait at most timeout_s seconds for each other before giving
+    up with an `sqlite3.OperationalError`.
+
+    Volume records are immutable rows of the records table, shared
+    between a volume and the snapshots taken of it until the volume is
+    modified. Volumes and snapshots are stored with the validation
+    options they passed unchanged when they were written, if any, so
+    that they are not validated again on every listing.
+
+    Volumes may have at most max_snapshots snapshots each.
+
+    fleet_ options describe a synthetic fleet to load into the database
+    if it is empty (see `load_fleet`).
+    """
+
+    def __init__(self, path, validation='strict', timeout_s=5.0,
+                 max_snapshots=DEFAULT_MAX_SNAPSHOTS, **fleet_options):
+        fleet = FleetSpec.from_options(fleet_options)
+        self.path = path
+        self.validation = ValidationPolicy.parse(validation)
+        self.timeout_s = float(timeout_s)
+        self.max_snapshots = int(max_snapshots)
+        self._local = threading.local()
+
+        # Not kept open: SQLite connections must not be used, nor even
+        # closed, across forks (e.g. into uWSGI workers)
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+        if fleet is not None:
+            self.load_fleet(fleet)
+
+    def __repr__(self):
+        return "SqliteDummyStorage({})".format(self.path)
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path, timeout=self.timeout_s, isolation_level=None,
+            detect_types=sqlite3.PARSE_DECLTYPES)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _connection(self):
+        """
+        Return the connection of this thread, opening a new one in
+        processes forked since it was opened.
+        """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = self._connect()
+            local.pid = os.getpid()
+        return local.connection
+
+    @contextmanager
+    def _transaction(self, write=True):
+        """
+        Run the enclosed statements in a single transaction, holding
+        the write lock of the database from the start if write is True.
+        Otherwise, all statements see the same snapshot of the data.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _query(self, sql, parameters=()):
+        return self._connection().execute(sql, parameters).fetchall()
+
+    @staticmethod
+    def _trusted(row_value, validated_with):
+        """
+        Return a stored value, as a NormalisedRecord if it was trusted
+        when stored.
+        """
+        if validated_with is None:
+            return row_value
+        return NormalisedRecord(tuple(json.loads(validated_with)),
+                                row_value)
+
+    @staticmethod
+    def _trust(normalise, value):
+        """
+        Return the validation options, as JSON, with which value passes
+        through normalise unchanged, or None if it does not.
+        """
+        try:
+            result = normalise([value])[0]
+        except ValidationError:
+            return None
+        validated_with = getattr(result, 'validated_with', None)
+        if validated_with is None or dict(result) != value:
+            return None
+        return json.dumps(validated_with)
+
+    def raise_if_volume_absent(self, connection, volume_name):
+        if not connection.execute("SELECT 1 FROM volumes WHERE name = ?",
+                                  (volume_name, )).fetchone():
+            raise KeyError(vol_404(volume_name))
+
+    def raise_if_snapshot_absent(self, connection, volume_name,
+                                 snapshot_name):
+        self.raise_if_volume_absent(connection, volume_name)
+
+        if not connection.execute(
+                "SELECT 1 FROM snapshots WHERE volume = ? AND name = ?",
+                (volume_name, snapshot_name)).fetchone():
+            raise KeyError("No such snapshot exists for volume '{}': '{}'"
+                           .format(volume_name, snapshot_name))
+
+    def raise_if_policy_absent(self, connection, policy_name):
+        if not connection.execute("SELECT 1 FROM policies WHERE name = ?",
+                                  (policy_name, )).fetchone():
+            raise KeyError(policy_name)
+
+    @staticmethod
+    def _release_records(connection, record_ids):
+        """
+        Delete the records with the given ids that are no longer used
+        by any volume or snapshot.
+        """
+        connection.executemany(
+            "DELETE FROM records WHERE id = ?1"
+            " AND NOT EXISTS (SELECT 1 FROM volumes WHERE record_id = ?1)"
+            " AND NOT EXISTS (SELECT 1 FROM snapshots WHERE record_id = ?1)",
+            [(record_id, ) for record_id in record_ids])
+
+    def _store_volume(self, connection, volume_name, record):
+        """
+        Insert or replace the record of a volume.
+        """
+        previous = connection.execute(
+            "SELECT record_id FROM volumes WHERE name = ?",
+            (volume_name, )).fetchone()
+        record_id = connection.execute(
+            "INSERT INTO records (record) VALUES (?)",
+            (json.dumps(record), )).lastrowid
+        connection.execute(
+            "INSERT INTO volumes (name, {columns}, record_id, validated_with)"
+            " VALUES (?, {placeholders}, ?, ?) ON CONFLICT (name) DO UPDATE"
+            " SET {updates}, record_id = excluded.record_id,"
+            " validated_with = excluded.validated_with"
+            .format(columns=", ".join(VOLUME_COLUMNS),
+                    placeholders=", ".join("?" for _ in VOLUME_COLUMNS),
+                    updates=", ".join("{0} = excluded.{0}".format(column)
+                                      for column in VOLUME_COLUMNS)),
+            [volume_name]
+            + [record.get(column, None) for column in VOLUME_COLUMNS]
+            + [record_id, self._trust(self._normalised_volumes, record)])
+        if previous is not None:
+            self._release_records(connection, [previous[0]])
+
+    def _load_volume(self, connection, volume_name):
+        """
+        Return the record of a volume and its id.
+        """
+        row = connection.execute(
+            "SELECT records.record, records.id FROM volumes"
+            " JOIN records ON records.id = volumes.record_id"
+            " WHERE volumes.name = ?", (volume_name, )).fetchone()
+        if row is None:
+            raise KeyError(vol_404(volume_name))
+        return json.loads(row[0]), row[1]
+
+    @normalised_with('volume', as_list=True)
+    def _normalised_volumes(self, volumes):
+        return volumes
+
+    def _volume_rows(self, criteria, after=None, limit=None):
+        """
+        Return the normalised volumes matching criteria in name order,
+        after the name after, and at most limit of them.
+        """
+        condition, parameters = volume_conditions(criteria, after)
+        sql = ("SELECT records.record, volumes.validated_with FROM volumes"
+               " JOIN records ON records.id = volumes.record_id WHERE {}"
+               " ORDER BY volumes.name".format(condition))
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        return self._normalised_volumes([
+            self._trusted(json.loads(record), validated_with)
+            for record, validated_with in self._query(sql, parameters)])
+
+    @property
+    def volumes(self):
+        return self._volume_rows({})
+
+    def query_volumes(self, sort_by=None, **criteria):
+        """
+        Answer the query in SQL. Results are ordered by name unless
+        sort_by is given.
+        """
+        check_volume_query(criteria)
+        return sort_volumes(self._volume_rows(criteria), sort_by)
+
+    def volumes_page(self, limit, cursor=None, **criteria):
+        check_volume_query(criteria)
+        check_limit(limit)
+        after = None if cursor is None else decode_cursor(cursor, 'name')
+
+        volumes = self._volume_rows(criteria, after, limit + 1)
+        if len(volumes) > limit:
+            volumes = volumes[:limit]
+            return volumes, encode_cursor('name', volumes[-1]['name'])
+        return volumes, None
+
+    def iter_volumes(self, **criteria):
+        """
+        Iterate over the volumes in chunks of `ITERATION_CHUNK`, so that
+        no read is held open for the whole iteration.
+        """
+        check_volume_query(criteria)
+
+        def generate():
+            after = None
+            while True:
+                volumes = self._volume_rows(criteria, after,
+                                            ITERATION_CHUNK)
+                yield from volumes
+                if len(volumes) < ITERATION_CHUNK:
+                    return
+                after = volumes[-1]['name']
+        return generate()
+
+    @normalised_with('volume', allow_unknown=True)
+    def get_volume(self, volume_name):
+        volume_name = str(volume_name)
+        log.info("Trying to get volume {}".format(volume_name))
+        return self._load_volume(self._connection(), volume_name)[0]
+
+    @normalised_with('volume', ignore_none_values=True)
+    def restrict_volume(self, volume_name):
+        volume_name = str(volume_name)
+        log.info("Restricting volume {}".format(volume_name))
+        with self._transaction() as connection:
+            self.raise_if_volume_absent(connection, volume_name)
+            record_ids = [record_id for record_id, in connection.execute(
+                "SELECT record_id FROM volumes WHERE name = ?1 UNION"
+                " SELECT record_id FROM snapshots WHERE volume = ?1",
+                (volume_name, ))]
+            for table, column in [('volumes', 'name'), ('locks', 'volume'),
+                                  ('rules', 'policy'), ('policies', 'name'),
+                                  ('snapshots', 'volume')]:
+                connection.execute("DELETE FROM {} WHERE {} = ?"
+                                   .format(table, column), (volume_name, ))
+            self._release_records(connection, record_ids)
+
+    def patch_volume(self, volume_name, expected_versions=None, **data):
+        volume_name = str(volume_name)
+        log.info("Updating volume {} with data {}"
+                 .format(volume_name, data))
+        with self._transaction() as connection:
+            record, _ = self._load_volume(connection, volume_name)
+            if expected_versions is not None:
+                check_version(self.get_volume(volume_name), expected_versions)
+            record.update(data)
+            self._store_volume(connection, volume_name, record)
+
+    def _add_volume(self, connection, volume_name, record):
+        connection.execute("DELETE FROM locks WHERE volume = ?",
+                           (volume_name, ))
+        self._store_volume(connection, volume_name, record)
+
+    def create_volume(self, volume_name, **kwargs):
+        volume_name = str(volume_name)
+        log.info("Adding new volume '{}': {}"
+                 .format(volume_name, str(kwargs)))
+
+        size_total = kwargs.get('size_total', None)
+        filer_address = kwargs.get('filer_address', None)
+        record = {'name': str(volume_name),
+                  'size_used': 0,
+                  'size_total': 0 if size_total is None else size_total,
+                  'filer_address': ("dummy-filer" if filer_address is None
+                                    else filer_address)}
+
+        with self._transaction() as connection:
+            try:
+                self.raise_if_volume_absent(connection, volume_name)
+            except KeyError:
+                self._add_volume(connection, volume_name, record)
+            else:
+                raise KeyError("Volume {} already exists!"
+                               .format(volume_name))
+        return record
+
+    def locks(self, volume_name):
+        volume_name = str(volume_name)
+        with self._transaction(write=False) as connection:
+            self.raise_if_volume_absent(connection, volume_name)
+            row = connection.execute(
+                "SELECT owner FROM locks WHERE volume = ?",
+                (volume_name, )).fetchone()
+        return None if row is None else row[0]
+
+    def create_lock(self, volume_name, host_owner):
+        volume_name = str(volume_name)
+        log.info("Host_Owner {} is locking {}".format(host_owner, volume_name))
+        with self._transaction() as connection:
+            self.raise_if_volume_absent(connection, volume_name)
+            row = connection.execute(
+                "SELECT owner FROM locks WHERE volume = ?",
+                (volume_name, )).fetchone()
+            if row is not None and row[0] != host_owner:
+                raise ValueError("{} is already locked by {}!"
+                                 .format(volume_name, row[0]))
+
+            connection.execute("INSERT OR REPLACE INTO locks (volume, owner)"
+                               " VALUES (?, ?)", (volume_name, host_owner))
+
+    def remove_lock(self, volume_name, host_owner):
+        volume_name = str(volume_name)
+        with self._transaction() as connection:
+            self.raise_if_volume_absent(connection, volume_name)
+
+            if not connection.execute("SELECT 1 FROM locks WHERE volume = ?",
+                                      (volume_name, )).fetchone():
+                raise KeyError(vol_404(volume_name))
+            connection.execute("DELETE FROM locks WHERE volume = ?"
+                               " AND owner = ?", (volume_name, host_owner))
+
+    @property
+    def policies(self):
+        with self._transaction(write=False) as connection:
+            rules = {}
+            for policy, rule in connection.execute(
+                    "SELECT policy, rule FROM rules ORDER BY rowid"):
+                rules.setdefault(policy, []).append(rule)
+            return [{'name': name, 'rules': rules.get(name, [])}
+                    for name, in connection.execute(
+                        "SELECT name FROM policies ORDER BY rowid")]
+
+    def get_policy(self, policy_name):
+        with self._transaction(write=False) as connection:
+            self.raise_if_policy_absent(connection, policy_name)
+            return [rule for rule, in connection.execute(
+                "SELECT rule FROM rules WHERE policy = ? ORDER BY rowid",
+                (policy_name, ))]
+
+    def set_policy(self, volume_name, policy_name):
+        volume_name = str(volume_name)
+        with self._transaction() as connection:
+            record, _ = self._load_volume(connection, volume_name)
+            try:
+                self.raise_if_policy_absent(connection, policy_name)
+            except KeyError:
+                raise ValueError("No such policy: {}".format(policy_name))
+
+            record['active_policy_name'] = policy_name
+            self._store_volume(connection, volume_name, record)
+
+    def create_policy(self, policy_name, rules):
+        log.info("Adding policy {} with rules {}"
+                 .format(policy_name, rules))
+        with self._transaction() as connection:
+            connection.execute("INSERT OR IGNORE INTO policies (name)"
+                               " VALUES (?)", (policy_name, ))
+            connection.execute("DELETE FROM rules WHERE policy = ?",
+                               (policy_name, ))
+            connection.executemany("INSERT OR IGNORE INTO rules"
+                                   " (policy, rule) VALUES (?, ?)",
+                                   [(policy_name, rule) for rule in rules])
+
+    def remove_policy(self, policy_name):
+        log.info("Removing policy {}"
+                 .format(policy_name))
+        with self._transaction() as connection:
+            self.raise_if_policy_absent(connection, policy_name)
+            connection.execute("DELETE FROM policies WHERE name = ?",
+                               (policy_name, ))
+            connection.execute("DELETE FROM rules WHERE policy = ?",
+                               (policy_name, ))
+
+    def clone_volume(self, clone_volume_name,
+                     from_volume_name, from_snapshot_name):
+        clone_volume_name = str(clone_volume_name)
+        from_volume_name = str(from_volume_name)
+        log.info("Cloning volume {target} from {source}:{snapshot}"
+                 .format(target=clone_volume_name, source=from_volume_name,
+                         snapshot=from_snapshot_name))
+        with self._transaction() as connection:
+            self.raise_if_snapshot_absent(connection, from_volume_name,
+                                          from_snapshot_name)
+            if connection.execute("SELECT 1 FROM volumes WHERE name = ?",
+                                  (clone_volume_name, )).fetchone():
+                raise ValueError("Name already in use!")
+
+            record, _ = self._load_volume(connection, from_volume_name)
+            record['name'] = str(clone_volume_name)
+            self._add_volume(connection, clone_volume_name, record)
+
+    @normalised_with('snapshot', as_list=True)
+    def _normalised_snapshots(self, snapshots):
+        return snapshots
+
+    def _insert_snapshot(self, connection, volume_name, snapshot,
+                         validated_with):
+        _, record_id = self._load_volume(connection, volume_name)
+        previous = connection.execute(
+            "SELECT record_id FROM snapshots WHERE volume = ?"
+            " AND name = ?", (volume_name, snapshot['name'])).fetchone()
+        connection.execute(
+            "INSERT INTO snapshots (volume, name, size_kbytes,"
+            " creation_time, record_id, validated_with)"
+            " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (volume, name)"
+            " DO UPDATE SET size_kbytes = excluded.size_kbytes,"
+            " creation_time = excluded.creation_time,"
+            " record_id = excluded.record_id,"
+            " validated_with = excluded.validated_with",
+            (volume_name, snapshot['name'], snapshot['size_kbytes'],
+             snapshot['creation_time'], record_id, validated_with))
+        if previous is not None:
+            self._release_records(connection, [previous[0]])
+
+    def _make_room_for_snapshot(self, connection, volume_name,
+                                snapshot_name, purge_old_if_needed):
+        """
+        Ensure that a snapshot snapshot_name of volume_name can be made,
+        deleting the oldest snapshots (found through the snapshots_by_age
+        index) if needed and purge_old_if_needed is set.
+        """
+        if connection.execute(
+                "SELECT 1 FROM snapshots WHERE volume = ? AND name = ?",
+                (volume_name, snapshot_name)).fetchone():
+            return
+        count, = connection.execute(
+            "SELECT COUNT(*) FROM snapshots WHERE volume = ?",
+            (volume_name, )).fetchone()
+        if count < self.max_snapshots:
+            return
+        if not purge_old_if_needed:
+            raise TooManySnapshots("Volume {} already has {} snapshots"
+                                   .format(volume_name, count))
+
+        oldest = connection.execute(
+            "SELECT name, record_id FROM snapshots WHERE volume = ?"
+            " ORDER BY creation_time, name LIMIT ?",
+            (volume_name, count - self.max_snapshots + 1)).fetchall()
+        log.info("Purging snapshots {} of {}".format(
+            ", ".join(name for name, _ in oldest), volume_name))
+        connection.executemany(
+            "DELETE FROM snapshots WHERE volume = ? AND name = ?",
+            [(volume_name, name) for name, _ in oldest])
+        self._release_records(connection,
+                              [record_id for _, record_id in oldest])
+
+    def create_snapshot(self, volume_name, snapshot_name,
+                        purge_old_if_needed=False):
+        volume_name = str(volume_name)
+        log.info("Creating snapshot {}:{}".format(volume_name, snapshot_name))
+        snapshot = {'name': snapshot_name, 'size_kbytes': 42,
+                    'creation_time': datetime.now()}
+        validated_with = self._trust(self._normalised_snapshots, snapshot)
+
+        with self._transaction() as connection:
+            self._make_room_for_snapshot(connection, volume_name,
+                                         snapshot_name, purge_old_if_needed)
+            self._insert_snapshot(connection, volume_name, snapshot,
+                                  validated_with)
+
+    def create_snapshots(self, volume_names, snapshot_name):
+        """
+        Make the snapshots atomically, in a single transaction.
+        """
+        volume_names = [str(name) for name in volume_names]
+        log.info("Creating snapshot {} of {}".format(
+            snapshot_name, ", ".join(volume_names)))
+        check_group(volume_names)
+        snapshot = {'name': snapshot_name, 'size_kbytes': 42,
+                    'creation_time': datetime.now()}
+        validated_with = self._trust(self._normalised_snapshots, snapshot)
+
+        with self._transaction() as connection:
+            started = time.time()
+            for volume_name in volume_names:
+                self._make_room_for_snapshot(connection, volume_name,
+                                             snapshot_name,
+                                             purge_old_if_needed=False)
+                self._insert_snapshot(connection, volume_name, snapshot,
+                                      validated_with)
+            duration_s = time.time() - started
+        return group_snapshot(snapshot_name, [
+            {'name': volume_name, 'started': started,
+             'duration_s': duration_s} for volume_name in volume_names])
+
+    def _snapshot_rows(self, connection, volume_name, condition="1",
+                       parameters=(), order="rowid", limit=-1):
+        return [self._trusted({'name': name, 'size_kbytes': size_kbytes,
+                               'creation_time': creation_time},
+                              validated_with)
+                for name, size_kbytes, creation_time, validated_with
+                in connection.execute(
+                    "SELECT name, size_kbytes, creation_time, validated_with"
+                    " FROM snapshots WHERE volume = ? AND {}"
+                    " ORDER BY {} LIMIT ?".format(condition, order),
+                    (volume_name, ) + tuple(parameters) + (limit, ))]
+
+    def get_snapshot(self, volume_name, snapshot_name):
+        volume_name = str(volume_name)
+        log.info("Fetching snapshot {}:{}".format(volume_name, snapshot_name))
+        with self._transaction(write=False) as connection:
+            self.raise_if_snapshot_absent(connection, volume_name,
+                                          snapshot_name)
+            snapshot, = self._snapshot_rows(connection, volume_name,
+                                            "name = ?", (snapshot_name, ))
+        return dict(snapshot)
+
+    def delete_snapshot(self, volume_name, snapshot_name):
+        volume_name = str(volume_name)
+        log.info("Deleting {} on {}".format(snapshot_name, volume_name))
+        with self._transaction() as connection:
+            self.raise_if_snapshot_absent(connection, volume_name,
+                                          snapshot_name)
+            record_id, = connection.execute(
+                "SELECT record_id FROM snapshots WHERE volume = ?"
+                " AND name = ?", (volume_name, snapshot_name)).fetchone()
+            connection.execute("DELETE FROM snapshots WHERE volume = ?"
+                               " AND name = ?", (volume_name, snapshot_name))
+            self._release_records(connection, [record_id])
+
+    def get_snapshots(self, volume_name):
+        volume_name = str(volume_name)
+        log.info("Getting snapshots for {}".format(volume_name))
+        with self._transaction(write=False) as connection:
+            self.raise_if_volume_absent(connection, volume_name)
+            snapshots = self._snapshot_rows(connection, volume_name)
+        return self._normalised_snapshots(snapshots)
+
+    def snapshots_page(self, volume_name, limit, cursor=None):
+        volume_name = str(volume_name)
+        check_limit(limit)
+        after = None if cursor is None else decode_cursor(cursor, 'name')
+
+        with self._transaction(write=False) as connection:
+            self.raise_if_volume_absent(connection, volume_name)
+            if after is None:
+                snapshots = self._snapshot_rows(connection, volume_name,
+                                                order="name", limit=limit + 1)
+            else:
+                snapshots = self._snapshot_rows(connection, volume_name,
+                                                "name > ?", (after, ),
+                                                order="name", limit=limit + 1)
+        next_cursor = None
+        if len(snapshots) > limit:
+            snapshots = snapshots[:limit]
+            next_cursor = encode_cursor('name', snapshots[-1]['name'])
+        return self._normalised_snapshots(snapshots), next_cursor
+
+    def rollback_volume(self, volume_name, restore_snapshot_name):
+        volume_name = str(volume_name)
+        log.info("Restoring '{}' to '{}'"
+                 .format(volume_name, restore_snapshot_name))
+        with self._transaction(write=False) as connection:
+            self.raise_if_snapshot_absent(connection, volume_name,
+                                          restore_snapshot_name)
+
+    def ensure_policy_rule_present(self, policy_name, rule):
+        with self._transaction() as connection:
+            self.raise_if_policy_absent(connection, policy_name)
+            connection.execute("INSERT OR IGNORE INTO rules (policy, rule)"
+                               " VALUES (?, ?)", (policy_name, rule))
+
+    def ensure_policy_rule_absent(self, policy_name, rule):
+        with self._transaction() as connection:
+            self.raise_if_policy_absent(connection, policy_name)
+            connection.execute("DELETE FROM rules WHERE policy = ?"
+                               " AND rule = ?", (policy_name, rule))
+
+    def load_fleet(self, spec):
+        """
+        Bulk-load the synthetic fleet described by spec (see
+        `storage_api.extensions.fleet`), in a single transaction and in
+        batches of `LOAD_BATCH` volumes, unless the database already
+        has volumes. Workers and restarts sharing a database thus only
+        load it once.
+
+        Generated volumes are not validated as they are loaded, but on
+        their first listing.
+
+        Returns:
+            True if the fleet was loaded, False if the database already
+            had volumes.
+        """
+        policies, volumes = generate_fleet(spec)
+
+        with self._transaction() as connection:
+            if connection.execute("SELECT 1 FROM volumes LIMIT 1").fetchone():
+                log.info("Not loading synthetic fleet into non-empty {}"
+                         .format(self.path))
+                return False
+            log.info("Loading synthetic fleet {} into {}"
+                     .format(spec, self.path))
+
+            for policy in policies:
+                connection.execute("INSERT OR IGNORE INTO policies (name)"
+                                   " VALUES (?)", (policy.name, ))
+                connection.execute("DELETE FROM rules WHERE policy = ?",
+                                   (policy.name, ))
+                connection.executemany("INSERT INTO rules (policy, rule)"
+                                       " VALUES (?, ?)",
+                                       [(policy.name, rule)
+                                        for rule in policy.rules])
+
+            next_id, = connection.execute(
+                "SELECT coalesce(max(id), 0) + 1 FROM records").fetchone()
+            while True:
+                batch = list(itertools.islice(volumes, LOAD_BATCH))
+                if not batch:
+                    break
+                record_ids = range(next_id, next_id + len(batch))
+                next_id += len(batch)
+
+                connection.executemany(
+                    "INSERT INTO records (id, record) VALUES (?, ?)",
+                    [(record_id, json.dumps(volume.fields))
+                     for record_id, volume in zip(record_ids, batch)])
+                connection.executemany(
+                    "INSERT INTO volumes (name, {}, record_id)"
+                    " VALUES (?, {}, ?)".format(
+                        ", ".join(VOLUME_COLUMNS),
+                        ", ".join("?" for _ in VOLUME_COLUMNS)),
+                    [[volume.fields['name']]
+                     + [volume.fields.get(column, None)
+                        for column in VOLUME_COLUMNS]
+                     + [record_id]
+                     for record_id, volume in zip(record_ids, batch)])
+                connection.executemany(
+                    "INSERT INTO snapshots (volume, name, size_kbytes,"
+                    " creation_time, record_id) VALUES (?, ?, ?, ?, ?)",
+                    [(volume.fields['name'], name, size_kbytes,
+                      creation_time, record_id)
+                     for record_id, volume in zip(record_ids, batch)
+                     for name, size_kbytes, creation_time
+                     in volume.snapshots])
+                connection.executemany(
+                    "INSERT INTO locks (volume, owner) VALUES (?, ?)",
+                    [(volume.fields['name'], volume.lock)
+                     for volume in batch if volume.lock is not None])
+        return True
@@ -16,19 +16,41 @@ cases, reasonable descriptions of what went wrong should be included,
 and -- if possible -- suggestions on how to fix the situation.
 """
 from storage_api.utils import merge_two_dicts
+from storage_api.extensions.inventory import VolumeInventory
+from storage_api.extensions.index import JunctionPathIndex
+from storage_api.extensions import index as junction_index
+from storage_api.extensions.memo import (request_memoized,
+                                         invalidates_request_memo)
+from storage_api.extensions.records import (VolumeRecord, SnapshotRecord,
+                                            SnapshotIndex, RuleSet)
+from storage_api.extensions.fleet import FleetSpec, generate_fleet
+from storage_api.extensions.transport import PooledSession, parse_flag
+from storage_api.extensions.patch import Change, PatchPlan, PatchExecutor
+from storage_api.extensions.versions import check_version, RecentVolumes
+from storage_api.extensions.groups import (check_group, group_snapshot,
+                                           take_group_snapshot)
+from storage_api.extensions.validation import ValidationPolicy
+from storage_api.metrics import InstrumentedBackend
 
 from abc import ABCMeta, abstractmethod
 from storage_api.utils import init_logger
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
 import functools
-from typing import Dict, Any
+from typing import Dict, Any, List, Set, Tuple  # noqa
 import re
 from datetime import datetime
+import bisect
+import base64
+import copy
+import json
+import threading
+import time
 
-from ordered_set import OrderedSet
 import cerberus
 import flask
 import netapp.api
+import lxml.etree
+import pytz
 
 log = init_logger()
 
@@ -78,6 +100,9 @@ SCHEMAS = [
 
 cerberus.schema_registry.extend(SCHEMAS)
 
+# Characters with a special meaning in ZAPI query values
+ZAPI_QUERY_OPERATORS_RE = re.compile(r'[*|!<>=]|\.\.')
+
 
 class ValidationError(Exception):
     """
@@ -87,16 +112,138 @@ class ValidationError(Exception):
     pass
 
 
+# The maximum number of snapshots of a volume, as on NetApp filers
+DEFAULT_MAX_SNAPSHOTS = 255
+
+
+class TooManySnapshots(Exception):
+    """
+    An Exception raised when creating a snapshot of a volume that
+    already has as many snapshots as it may have.
+    """
+    pass
+
+
 def vol_404(volume_name: str) -> str:
     return "No such volume: {}".format(volume_name)
 
 
-def validate_value(v: cerberus.Validator, value: Dict[str, Any]):
-    validation_result = v.validate(value, normalize=True)
-    if not validation_result:
+class NormalisedRecord(dict):
+    """
+    A dictionary known to be valid and normalised according to a schema
+    with a given set of validation options, as returned by
+    normalised_with.
+
+    Passing a NormalisedRecord through normalised_with again with the
+    same options skips validation. Any modification of the record
+    revokes this trust, as the record may no longer be valid.
+    """
+    __slots__ = ('validated_with',)
+
+    def __init__(self, validated_with, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.validated_with = validated_with
+
+    def __reduce_ex__(self, protocol):
+        return (NormalisedRecord, (self.validated_with, dict(self)))
+
+    def copy(self):
+        return NormalisedRecord(self.validated_with, self)
+
+    def _modifies(method):
+        @functools.wraps(method)
+        def distrusting_method(self, *args, **kwargs):
+            self.validated_with = None
+            return method(self, *args, **kwargs)
+        return distrusting_method
+
+    __setitem__ = _modifies(dict.__setitem__)
+    __delitem__ = _modifies(dict.__delitem__)
+    clear = _modifies(dict.clear)
+    pop = _modifies(dict.pop)
+    popitem = _modifies(dict.popitem)
+    setdefault = _modifies(dict.setdefault)
+    update = _modifies(dict.update)
+    del _modifies
+
+
+_validators = threading.local()
+
+
+def validator_for(schema_name: str,
+                  allow_unknown: bool = False,
+                  ignore_none_values: bool = False) -> cerberus.Validator:
+    """
+    Return a Validator for the registered schema schema_name with the
+    given options.
+
+    Building a Validator validates its schema, which is expensive, so
+    Validators are built once per schema and options and reused.
+    Validators keep the state of the last validation, so each thread
+    gets its own.
+    """
+    schema = cerberus.schema_registry.get(name=schema_name)
+    key = (schema_name, allow_unknown, ignore_none_values)
+    if not hasattr(_validators, 'cache'):
+        _validators.cache = {}
+
+    cached_schema, v = _validators.cache.get(key, (None, None))
+    if cached_schema is not schema:
+        v = cerberus.Validator(schema,
+                               allow_unknown=allow_unknown,
+                               ignore_none_values=ignore_none_values)
+        _validators.cache[key] = (schema, v)
+    return v
+
+
+def validate_value(v: cerberus.Validator, value: Dict[str, Any],
+                   validated_with=None):
+    """
+    Validate and normalise value with v in a single pass, returning the
+    normalised value as a NormalisedRecord marked as validated_with.
+    """
+    if not v.validate(value, normalize=True):
         raise ValidationError(v.errors)  # pragma: no cover
-    else:
-        return v.normalized(value)
+    return NormalisedRecord(validated_with, v.document)
+
+
+def is_trusted(value, validated_with):
+    """
+    True if value is a NormalisedRecord, unmodified since it was
+    validated with the options validated_with.
+    """
+    return (isinstance(value, NormalisedRecord)
+            and value.validated_with == validated_with)
+
+
+# Used for functions that are not methods of a back-end
+DEFAULT_VALIDATION = ValidationPolicy()
+
+
+def trusted_records(normalise, records):
+    """
+    Normalise compact records (with a to_dict() method and a
+    validated_with attribute, see `storage_api.extensions.records`)
+    through normalise, a method decorated with normalised_with(...,
+    as_list=True).
+
+    Records are marked with the options they were validated with, so
+    that they are passed as trusted, and not validated again, until
+    they are modified.
+    """
+    values = [record.to_dict() for record in records]
+    normalised = normalise([
+        NormalisedRecord(record.validated_with, value)
+        if record.validated_with is not None else value
+        for record, value in zip(records, values)])
+
+    for record, value, result in zip(records, values, normalised):
+        validated_with = getattr(result, 'validated_with', None)
+        if (validated_with is not None
+                and record.validated_with != validated_with
+                and dict(result) == value):
+            record.validated_with = validated_with
+    return normalised
 
 
 def normalised_with(schema_name: str,
@@ -110,30 +257,49 @@ def normalised_with(schema_name: str,
     If as_list is True, validate and normalise each entry in the
     returned list.
 
+    Returned values are NormalisedRecords, so records from trusted
+    caches that are passed through a function with the same schema and
+    options again are not re-validated.
+
+    When decorating back-end methods, the `validation` policy of the
+    back-end decides which records are actually validated (see
+    ValidationPolicy).
+
     Raises a ValidationError if the schema was not correctly validated.
     """
+    validated_with = (schema_name, allow_unknown, ignore_none_values)
 
     def validator_decorator(func):
         @functools.wraps(func)
         def inner_wrapper(*args, **kwargs):
-            schema = cerberus.schema_registry.get(name=schema_name)
-            v = cerberus.Validator(schema,
-                                   allow_unknown=allow_unknown,
-                                   ignore_none_values=ignore_none_values)
+            v = validator_for(schema_name,
+                              allow_unknown=allow_unknown,
+                              ignore_none_values=ignore_none_values)
+            policy = (getattr(args[0], 'validation', None)
+                      if args else None) or DEFAULT_VALIDATION
+            validate = functools.partial(validate_value, v,
+                                         validated_with=validated_with)
+
+            def normalise(value):
+                if is_trusted(value, validated_with):
+                    policy.count_trusted()
+                    return value.copy()
+                return policy.check(validate, value)
+
             return_value = func(*args, **kwargs)
 
             if as_list:
                 if isinstance(return_value, str):
                     raise ValidationError("Expected a list!")
                 try:
-                    return [validate_value(v, x) for x in return_value]
+                    return [normalise(x) for x in return_value]
                 except TypeError:  # pragma: no cover
                     raise ValidationError("Expected a list!")
             else:
                 # if function called with decorator returns None do not
                 # validate since cerberus dislikes empty document
                 if return_value is not None:
-                    return validate_value(v, return_value)
+                    return normalise(return_value)
                 else:
                     return None
 
@@ -141,6 +307,133 @@ def normalised_with(schema_name: str,
     return validator_decorator
 
 
+VOLUME_QUERY_CRITERIA = ['aggregate_name', 'state', 'name_prefix',
+                         'size_used_min', 'size_used_max',
+                         'size_total_min', 'size_total_max']
+
+
+def check_volume_query(criteria):
+    """
+    Raise a ValueError if criteria contains unknown volume query
+    criteria.
+    """
+    unknown = set(criteria.keys()) - set(VOLUME_QUERY_CRITERIA)
+    if unknown:
+        raise ValueError("Unknown volume query criteria: {}. Allowed"
+                         " criteria are: {}"
+                         .format(", ".join(sorted(unknown)),
+                                 ", ".join(VOLUME_QUERY_CRITERIA)))
+
+
+def volume_matches(volume, criteria):
+    """
+    Return True if the (formatted) volume matches all the query
+    criteria (see StorageBackend.query_volumes()). Criteria that are
+    None are ignored.
+    """
+    def value_is(key, expected):
+        return expected is None or volume.get(key, None) == expected
+
+    def value_within(key, lower, upper):
+        value = volume.get(key, None)
+        if lower is not None and (value is None or value < lower):
+            return False
+        if upper is not None and (value is None or value > upper):
+            return False
+        return True
+
+    name_prefix = criteria.get('name_prefix', None)
+
+    return (value_is('aggregate_name', criteria.get('aggregate_name', None))
+            and value_is('state', criteria.get('state', None))
+            and (name_prefix is None
+                 or volume['name'].startswith(name_prefix))
+            and value_within('size_used',
+                             criteria.get('size_used_min', None),
+                             criteria.get('size_used_max', None))
+            and value_within('size_total',
+                             criteria.get('size_total_min', None),
+                             criteria.get('size_total_max', None)))
+
+
+def sort_volumes(volumes, sort_by):
+    """
+    Sort a list of volumes on the field sort_by, descending if it is
+    prefixed with -. Volumes lacking the field always go last.
+
+    If sort_by is None, return the volumes as-is.
+    """
+    if sort_by is None:
+        return volumes
+
+    reverse = sort_by.startswith("-")
+    key = sort_by.lstrip("-")
+
+    present = [v for v in volumes if v.get(key, None) is not None]
+    absent = [v for v in volumes if v.get(key, None) is None]
+
+    return sorted(present, key=lambda v: v[key], reverse=reverse) + absent
+
+
+def encode_cursor(kind, position):
+    """
+    Make an opaque, URL-safe pagination cursor for a position of a
+    given kind (e.g. 'name' for "after this name", or 'tag' for a ZAPI
+    next-tag).
+    """
+    return (base64.urlsafe_b64encode(json.dumps([kind, position])
+                                     .encode('utf-8'))
+            .decode('ascii'))
+
+
+def decode_cursor(cursor, kind):
+    """
+    Return the position encoded in a cursor made by encode_cursor().
+
+    Raises:
+        ValueError: if the cursor is malformed or of the wrong kind
+    """
+    try:
+        cursor_kind, position = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii'))
+            .decode('utf-8'))
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("Invalid cursor: '{}'".format(cursor))
+
+    if cursor_kind != kind:
+        raise ValueError("Invalid cursor: '{}'".format(cursor))
+    return position
+
+
+def check_limit(limit):
+    """
+    Raise a ValueError if limit is not a valid page size.
+    """
+    if not isinstance(limit, int) or limit < 1:
+        raise ValueError("Page size must be a positive integer, not {}"
+                         .format(limit))
+
+
+def page_by_name(items, limit, cursor=None):
+    """
+    Return a tuple of (page, next cursor) of at most limit items, in
+    name order, starting after the position of cursor.
+
+    The next cursor is None on the last page.
+    """
+    check_limit(limit)
+    items = sorted(items, key=lambda item: item['name'])
+    start = 0
+    if cursor is not None:
+        after = decode_cursor(cursor, 'name')
+        start = bisect.bisect_right([item['name'] for item in items], after)
+
+    page = items[start:start + limit]
+    if start + limit < len(items):
+        return page, encode_cursor('name', page[-1]['name'])
+    return page, None
+
+
 def patch_and_diff(previous, new):
     """
     Replace all keys in previous with their values in new, returning a
@@ -178,6 +471,9 @@ def annotate_exception(exception, annotation):
 
 class StorageBackend(metaclass=ABCMeta):
 
+    # How return values are validated, see ValidationPolicy
+    validation = DEFAULT_VALIDATION
+
     def __repr__(self):
         return "{}({})".format(type(self).__name__, str(self.__dict__))
 
@@ -192,6 +488,136 @@ class StorageBackend(metaclass=ABCMeta):
         """
         return NotImplemented
 
+    @property
+    def volumes_age(self):
+        """
+        The age in seconds of the data served by `volumes`, or None if
+        it is fetched live on every access.
+
+        Read-only property.
+        """
+        return None
+
+    def query_volumes(self, sort_by=None, **criteria):
+        """
+        Return the volumes (see `volumes`) matching all of the given
+        criteria, optionally sorted.
+
+        Criteria are:
+
+        - aggregate_name, state: the value of the field
+        - name_prefix: a prefix of the name of the volume
+        - size_used_min, size_used_max, size_total_min, size_total_max:
+          inclusive bounds on sizes, in bytes
+
+        Criteria that are None are ignored. sort_by is the name of a
+        volume field to sort on, prefixed with - for descending order.
+
+        The default implementation filters `volumes`. Back-ends should
+        override it to push criteria down to the storage system or use
+        their indexes where possible.
+
+        Raises:
+            ValueError: on unknown criteria
+        """
+        check_volume_query(criteria)
+        return sort_volumes([v for v in self.volumes
+                             if volume_matches(v, criteria)],
+                            sort_by)
+
+    def volumes_page(self, limit, cursor=None, **criteria):
+        """
+        Return a tuple of (volumes, next cursor) with at most limit of
+        the volumes matching criteria (see `query_volumes`), starting
+        at cursor. A cursor of None means the first page, and the next
+        cursor is None on the last page.
+
+        Cursors are opaque strings, only meaningful to the back-end
+        that made them. Pages may be shorter than limit even if they
+        are not the last one.
+
+        The default implementation pages through `query_volumes` in
+        name order. Back-ends should override it to avoid listing every
+        volume for each page.
+
+        Raises:
+            ValueError: on unknown criteria, invalid limits or cursors
+        """
+        return page_by_name(self.query_volumes(**criteria), limit, cursor)
+
+    def snapshots_page(self, volume_name, limit, cursor=None):
+        """
+        Return a tuple of (snapshots, next cursor) with at most limit of
+        the snapshots of volume_name, starting at cursor. See
+        `volumes_page` for the semantics of cursors.
+
+        The default implementation pages through `get_snapshots` in
+        name order.
+
+        Raises:
+            KeyError: if no such volume exists
+            ValueError: on invalid limits or cursors
+        """
+        return page_by_name(self.get_snapshots(volume_name), limit, cursor)
+
+    def create_snapshots(self, volume_names, snapshot_name):
+        """
+        Make a snapshot named snapshot_name of every volume in
+        volume_names, as close in time to each other as possible, and
+        return a description of the group snapshot: its name, the
+        start time (UNIX time) and duration of each snapshot, and the
+        window_s between the start of the first and the end of the
+        last (see `storage_api.extensions.groups`).
+
+        Either every snapshot is made, or none is.
+
+        The default implementation calls `create_snapshot` on each
+        volume in turn, deleting the snapshots already made if one
+        fails. Back-ends should override it to snapshot the volumes
+        atomically, or at least concurrently.
+
+        Raises:
+            KeyError: if any of the volumes does not exist
+            ValueError: if volume_names is empty or has duplicates, or
+                as `create_snapshot`
+            TooManySnapshots: if any of the volumes has too many
+                snapshots
+        """
+        return take_group_snapshot(volume_names, snapshot_name,
+                                   create=self.create_snapshot,
+                                   delete=self.delete_snapshot)
+
+    def iter_volumes(self, **criteria):
+        """
+        Return an iterator over the volumes matching criteria (see
+        `query_volumes`), in no particular order.
+
+        The default implementation iterates over `query_volumes`.
+        Back-ends should override it to yield volumes as they are
+        fetched from the storage system.
+
+        Raises:
+            ValueError: on unknown criteria
+        """
+        return iter(self.query_volumes(**criteria))
+
+    def iter_snapshots(self, volume_name):
+        """
+        Return an iterator over the snapshots of volume_name. The
+        default implementation iterates over `get_snapshots`.
+
+        Raises:
+            KeyError: if no such volume exists
+        """
+        return iter(self.get_snapshots(volume_name))
+
+    def iter_policies(self):
+        """
+        Return an iterator over the export policies (see `policies`).
+        The default implementation iterates over `policies`.
+        """
+        return iter(self.policies)
+
     @abstractmethod
     def get_volume(self, volume_name):
         """
@@ -227,14 +653,20 @@ class StorageBackend(metaclass=ABCMeta):
         return NotImplemented
 
     @abstractmethod
-    def patch_volume(self, volume_name, **data):
+    def patch_volume(self, volume_name, expected_versions=None, **data):
         """
         Update a volume with data from **data.
 
+        If expected_versions is given, only update the volume if its
+        current version (see `storage_api.extensions.versions`) is one
+        of them.
+
         Raises:
             ValueError: on poorly formatted data, or invalid data
                 entries/attempts to write to read-only fields
             KeyError: if no volume named volume_name exists.
+            PreconditionFailed: if the volume is not in one of
+                expected_versions
         """
         return NotImplemented
 
@@ -374,14 +806,21 @@ class StorageBackend(metaclass=ABCMeta):
         return NotImplemented
 
     @abstractmethod
-    def create_snapshot(self, volume_name, snapshot_name):
+    def create_snapshot(self, volume_name, snapshot_name,
+                        purge_old_if_needed=False):
         """
         Make a snapshot from the current state of a volume.
 
+        If the volume already has as many snapshots as it may have,
+        and purge_old_if_needed is set, its oldest snapshot is deleted
+        to make room for the new one.
+
         Raises:
             KeyError: if no volume named volume_name exists
             ValueError: if there is already a snapshot named snapshot_name,
                 or if the name is invalid.
+            TooManySnapshots: if the volume has too many snapshots, and
+                purge_old_if_needed is not set
         """
         return NotImplemented
 
@@ -478,7 +917,12 @@ class StorageBackend(metaclass=ABCMeta):
         class_name = self.__class__.__name__
         instance_id = "{}_{}".format(class_name, endpoint)
         log.info("Initialising storage back-end {}".format(class_name))
-        app.extensions[instance_id] = self
+        metrics = app.extensions.get('metrics', None)
+        if metrics is None:
+            app.extensions[instance_id] = self
+        else:
+            app.extensions[instance_id] = InstrumentedBackend(
+                self, subsystem=endpoint, registry=metrics)
         app.config['SUBSYSTEM'][endpoint] = instance_id
 
 
@@ -487,8 +931,24 @@ class DummyStorage(StorageBackend):
     This is a dummy storage back-end meant for testing. It will persist
     data given to it in RAM and follow the standard API provided by the
     base class above, but that is about it.
+
+    Volumes and snapshots are kept in compact records (see
+    `storage_api.extensions.records`), so that fleets of realistic size
+    fit in memory. Stored volume records are never modified in place:
+    changes replace them by a modified copy. Snapshots share the record
+    of their volume as it was when they were taken.
+
+    The back-end is safe to use from several threads. Changes to a
+    volume or a policy hold one of a fixed number of striped locks,
+    chosen by its name, so operations on different volumes rarely
+    contend. Reading a volume record takes no lock at all, since
+    records are immutable. The name and attribute indexes have a lock
+    of their own, always taken last.
     """
 
+    # Number of striped locks, see _locked()
+    STRIPES = 64
+
     def raise_if_volume_absent(self, volume_name: str):
         """
         Raise a `KeyError` with an appropriate message if a volume is
@@ -510,166 +970,450 @@ class DummyStorage(StorageBackend):
             raise KeyError("No such snapshot exists for volume '{}': '{}'"
                            .format(volume_name, snapshot_name))
 
-    def __init__(self):
-        self.vols = {}  # type: Dict[str, Dict[str, Any]]
-        self.locks_store = {}  # type: Dict[str, str]
-        self.rules_store = {}  # type: Dict[str, str]
-        self.snapshots_store = {}  # Dict[str, Dict[str, List[str]]]
-        self.policies_store = {}  # Dict[str, List[str]]
+    def __init__(self, validation='strict',
+                 max_snapshots=DEFAULT_MAX_SNAPSHOTS, **fleet_options):
+        """
+        Initialise a dummy back-end, validating return values
+        according to the policy validation (see `ValidationPolicy`),
+        and allowing max_snapshots snapshots per volume.
+
+        The back-end is empty, unless fleet_ options describe a
+        synthetic fleet to load (see `FleetSpec.from_options`).
+        """
+        fleet = FleetSpec.from_options(fleet_options)
+        self.validation = ValidationPolicy.parse(validation)
+        self.max_snapshots = int(max_snapshots)
+        self.vols = {}  # type: Dict[Any, VolumeRecord]
+        self.locks_store = {}  # type: Dict[Any, str]
+        self.rules_store = {}  # type: Dict[str, RuleSet]
+        self.snapshots_store = {}  # type: Dict[Any, SnapshotIndex]
+        self._stripes = [threading.RLock() for _ in range(self.STRIPES)]
+
+        # Indexes for query_volumes(): (str(name), name) tuples sorted
+        # by name, and names by value, for each indexed attribute.
+        self.sorted_names = []  # type: List[Tuple[str, Any]]
+        self.attribute_index = {
+            key: {} for key in self.INDEXED_ATTRIBUTES
+        }  # type: Dict[str, Dict[Any, Set[Any]]]
+        self._index_lock = threading.Lock()
+
+        if fleet is not None:
+            self.load_fleet(fleet)
+
+    INDEXED_ATTRIBUTES = ['aggregate_name', 'state']
+
+    @contextmanager
+    def _locked(self, *names):
+        """
+        Hold the striped locks of the named volumes or policies.
+
+        Stripes are always acquired in the same order, so that
+        operations on several volumes cannot deadlock.
+        """
+        stripes = sorted({hash(name) % self.STRIPES for name in names})
+        with ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self._stripes[stripe])
+            yield
+
+    def load_fleet(self, spec):
+        """
+        Bulk-load the synthetic fleet described by spec (see
+        `storage_api.extensions.fleet`), replacing any volumes and
+        policies with the same names.
+
+        Indexes are rebuilt once at the end rather than maintained
+        volume by volume.
+        """
+        policies, volumes = generate_fleet(spec)
+        log.info("Loading synthetic fleet {}".format(spec))
+
+        # Volume names hash to themselves, so this holds every stripe
+        with self._locked(*range(self.STRIPES)):
+            for policy in policies:
+                self.rules_store[policy.name] = RuleSet(policy.rules)
+
+            for volume in volumes:
+                name = volume.fields['name']
+                record = VolumeRecord(volume.fields)
+                snapshots = SnapshotIndex()
+                for snapshot_name, size_kbytes, creation_time in (
+                        volume.snapshots):
+                    snapshots.add(SnapshotRecord(snapshot_name, size_kbytes,
+                                                 creation_time))
+                self.vols[name] = record
+                self.snapshots_store[name] = snapshots
+                if volume.lock is None:
+                    self.locks_store.pop(name, None)
+                else:
+                    self.locks_store[name] = volume.lock
+
+            with self._index_lock:
+                self.sorted_names = sorted((str(name), name)
+                                           for name in self.vols)
+                self.attribute_index = {key: {}
+                                        for key in self.INDEXED_ATTRIBUTES}
+                for name, record in self.vols.items():
+                    for key, index in self.attribute_index.items():
+                        index.setdefault(record.get(key, None),
+                                         set()).add(name)
+
+    def index_volume(self, volume_name, record):
+        with self._index_lock:
+            bisect.insort(self.sorted_names, (str(volume_name), volume_name))
+            for key, index in self.attribute_index.items():
+                index.setdefault(record.get(key, None),
+                                 set()).add(volume_name)
+
+    def unindex_volume(self, volume_name, record):
+        entry = (str(volume_name), volume_name)
+        with self._index_lock:
+            position = bisect.bisect_left(self.sorted_names, entry)
+            if self.sorted_names[position:position + 1] == [entry]:
+                self.sorted_names.pop(position)
+            for key, index in self.attribute_index.items():
+                index.get(record.get(key, None), set()).discard(volume_name)
+
+    def _replace_volume(self, volume_name, **changes):
+        """
+        Replace the record of volume_name by a copy with changes,
+        re-indexing it if needed. Must hold the lock of the volume.
+        """
+        previous = self.vols[volume_name]
+        record = previous.copy(**changes)
+        reindex = any(previous.get(key, None) != record.get(key, None)
+                      for key in self.INDEXED_ATTRIBUTES)
+        if reindex:
+            self.unindex_volume(volume_name, previous)
+        self.vols[volume_name] = record
+        if reindex:
+            self.index_volume(volume_name, record)
 
     @property
     def volumes(self):
-        return self._volumes()
+        return self._volume_records(list(self.vols))
 
     @normalised_with('volume', as_list=True)
-    def _volumes(self):
-        return list(self.vols.values())
+    def _normalised_volumes(self, volumes):
+        return volumes
+
+    def _volume_records(self, volume_names):
+        """
+        Return the normalised records of the named volumes, skipping
+        any that were removed in the meantime.
+
+        Each volume is only validated again after it has been modified
+        (see `trusted_records`).
+        """
+        records = (self.vols.get(name, None) for name in volume_names)
+        return trusted_records(self._normalised_volumes,
+                               [record for record in records
+                                if record is not None])
+
+    def _matching_names(self, criteria, after=None, limit=None):
+        """
+        Return the names of at most limit volumes matching criteria in
+        name order, starting after the name after, if given. Uses the
+        attribute and name indexes to only look at volumes matching
+        all indexed criteria.
+        """
+        names = []
+        with self._index_lock:
+            matching = None
+            for key, index in self.attribute_index.items():
+                if criteria.get(key, None) is not None:
+                    found = index.get(criteria[key], set())
+                    matching = (found if matching is None
+                                else matching & found)
+
+            name_prefix = criteria.get('name_prefix', None) or ""
+            start = bisect.bisect_left(self.sorted_names, (name_prefix,))
+            if after is not None:
+                start = max(start,
+                            bisect.bisect_left(self.sorted_names, (after,)))
+
+            for position in range(start, len(self.sorted_names)):
+                name_str, name = self.sorted_names[position]
+                if not name_str.startswith(name_prefix):
+                    break
+                if after is not None and name_str <= after:
+                    continue
+                if matching is not None and name not in matching:
+                    continue
+                if volume_matches(self.vols[name], criteria):
+                    names.append(name)
+                    if limit is not None and len(names) >= limit:
+                        break
+        return names
+
+    def query_volumes(self, sort_by=None, **criteria):
+        """
+        Answer the query from the attribute and name indexes.
+        Results are ordered by name unless sort_by is given.
+        """
+        check_volume_query(criteria)
+        return sort_volumes(
+            self._volume_records(self._matching_names(criteria)),
+            sort_by)
+
+    def volumes_page(self, limit, cursor=None, **criteria):
+        check_volume_query(criteria)
+        check_limit(limit)
+        after = None if cursor is None else decode_cursor(cursor, 'name')
+
+        names = self._matching_names(criteria, after, limit=limit + 1)
+        next_cursor = None
+        if len(names) > limit:
+            names = names[:limit]
+            next_cursor = encode_cursor('name', str(names[-1]))
+        return self._volume_records(names), next_cursor
+
+    def iter_volumes(self, **criteria):
+        check_volume_query(criteria)
+        return (record
+                for name in self._matching_names(criteria)
+                for record in self._volume_records([name]))
 
     @normalised_with('volume', allow_unknown=True)
     def get_volume(self, volume_name):
         log.info("Trying to get volume {}".format(volume_name))
         with annotate_exception(KeyError, vol_404(volume_name)):
-            return self.vols[volume_name]
+            return self.vols[volume_name].to_dict()
 
     @normalised_with('volume', ignore_none_values=True)
     def restrict_volume(self, volume_name):
         log.info("Restricting volume {}".format(volume_name))
-        with annotate_exception(KeyError, vol_404(volume_name)):
+        with self._locked(volume_name):
+            self.raise_if_volume_absent(volume_name)
+            self.unindex_volume(volume_name, self.vols[volume_name])
             self.vols.pop(volume_name)
-        self.locks_store.pop(volume_name, None)
-        self.rules_store.pop(volume_name, None)
-        self.snapshots_store.pop(volume_name, None)
+            self.locks_store.pop(volume_name, None)
+            self.rules_store.pop(volume_name, None)
+            self.snapshots_store.pop(volume_name, None)
 
-    def patch_volume(self, volume_name, **data):
+    def patch_volume(self, volume_name, expected_versions=None, **data):
         log.info("Updating volume {} with data {}"
                  .format(volume_name, data))
-        for key in data:
-            with annotate_exception(KeyError, vol_404(volume_name)):
-                self.vols[volume_name][key] = data[key]
+        with self._locked(volume_name):
+            self.raise_if_volume_absent(volume_name)
+            if expected_versions is not None:
+                check_version(self.get_volume(volume_name), expected_versions)
+            self._replace_volume(volume_name, **data)
+
+    def _add_volume(self, volume_name, record):
+        """
+        Add a volume. Must hold the lock of the volume.
+        """
+        self.snapshots_store[volume_name] = SnapshotIndex()
+        self.locks_store.pop(volume_name, None)
+        self.vols[volume_name] = record
+        self.index_volume(volume_name, record)
 
     def create_volume(self, volume_name, **kwargs):
         log.info("Adding new volume '{}': {}"
                  .format(volume_name, str(kwargs)))
 
-        if volume_name in self.vols:
-            raise KeyError("Volume {} already exists!".format(volume_name))
-
         size_total = kwargs.get('size_total', None)
         filer_address = kwargs.get('filer_address', None)
 
-        data = {'name': str(volume_name),
-                'size_used': 0,
-                'size_total': 0 if size_total is None else size_total,
-                'filer_address':
-                "dummy-filer" if filer_address is None else filer_address}
+        record = VolumeRecord()
+        record.name = str(volume_name)
+        record.size_used = 0
+        record.size_total = 0 if size_total is None else size_total
+        record.filer_address = ("dummy-filer" if filer_address is None
+                                else filer_address)
 
-        self.vols[volume_name] = data
-        self.locks_store.pop(volume_name, None)
-        self.snapshots_store[volume_name] = {}
-        return self.vols[volume_name]
+        with self._locked(volume_name):
+            if volume_name in self.vols:
+                raise KeyError("Volume {} already exists!"
+                               .format(volume_name))
+            self._add_volume(volume_name, record)
+        return record.to_dict()
 
     def locks(self, volume_name):
         self.raise_if_volume_absent(volume_name)
-
-        if volume_name not in self.locks_store:
-            return None
-        else:
-            return self.locks_store[volume_name]
+        return self.locks_store.get(volume_name, None)
 
     def create_lock(self, volume_name, host_owner):
-        self.raise_if_volume_absent(volume_name)
-
         log.info("Host_Owner {} is locking {}".format(host_owner, volume_name))
-        if volume_name in self.locks_store and\
-           self.locks_store[volume_name] != host_owner:
-            raise ValueError("{} is already locked by {}!"
-                             .format(volume_name,
-                                     self.locks_store[volume_name]))
+        with self._locked(volume_name):
+            self.raise_if_volume_absent(volume_name)
+            if volume_name in self.locks_store and\
+               self.locks_store[volume_name] != host_owner:
+                raise ValueError("{} is already locked by {}!"
+                                 .format(volume_name,
+                                         self.locks_store[volume_name]))
 
-        self.locks_store[volume_name] = host_owner
+            self.locks_store[volume_name] = host_owner
 
     def remove_lock(self, volume_name, host_owner):
-        self.raise_if_volume_absent(volume_name)
+        with self._locked(volume_name):
+            self.raise_if_volume_absent(volume_name)
 
-        with annotate_exception(KeyError, vol_404(volume_name)):
-            if host_owner == self.locks_store[volume_name]:
-                self.locks_store.pop(volume_name)
+            with annotate_exception(KeyError, vol_404(volume_name)):
+                if host_owner == self.locks_store[volume_name]:
+                    self.locks_store.pop(volume_name)
 
     @property
     def policies(self):
-        return [{'name': name, 'rules': rules}
-                for name, rules in self.rules_store.items()]
+        return [{'name': name, 'rules': self.get_policy(name)}
+                for name in list(self.rules_store)
+                if name in self.rules_store]
 
     def get_policy(self, policy_name):
-        return self.rules_store[policy_name]
+        with self._locked(policy_name):
+            return self.rules_store[policy_name].to_list()
 
     def set_policy(self, volume_name, policy_name):
-        self.raise_if_volume_absent(volume_name)
-        if policy_name not in self.rules_store:
-            raise ValueError("No such policy: {}".format(policy_name))
+        with self._locked(volume_name):
+            self.raise_if_volume_absent(volume_name)
+            if policy_name not in self.rules_store:
+                raise ValueError("No such policy: {}".format(policy_name))
 
-        self.vols[volume_name]['active_policy_name'] = policy_name
+            self._replace_volume(volume_name,
+                                 active_policy_name=policy_name)
 
     def create_policy(self, policy_name, rules):
         log.info("Adding policy {} with rules {}"
                  .format(policy_name, rules))
-        self.rules_store[policy_name] = list(OrderedSet(rules))
+        with self._locked(policy_name):
+            self.rules_store[policy_name] = RuleSet(rules)
 
     def remove_policy(self, policy_name):
         log.info("Removing policy {}"
                  .format(policy_name))
-        self.rules_store.pop(policy_name)
+        with self._locked(policy_name):
+            self.rules_store.pop(policy_name)
 
     def clone_volume(self, clone_volume_name,
                      from_volume_name, from_snapshot_name):
         log.info("Cloning volume {target} from {source}:{snapshot}"
                  .format(target=clone_volume_name, source=from_volume_name,
                          snapshot=from_snapshot_name))
-        self.raise_if_snapshot_absent(from_volume_name, from_snapshot_name)
+        with self._locked(clone_volume_name, from_volume_name):
+            self.raise_if_snapshot_absent(from_volume_name,
+                                          from_snapshot_name)
 
-        if clone_volume_name in self.vols:
-            raise ValueError("Name already in use!")
+            if clone_volume_name in self.vols:
+                raise ValueError("Name already in use!")
 
-        with annotate_exception(KeyError, vol_404(from_volume_name)):
-            self.vols[clone_volume_name] = self.vols[from_volume_name]
+            self._add_volume(clone_volume_name, self.vols[from_volume_name]
+                             .copy(name=str(clone_volume_name)))
 
-    def create_snapshot(self, volume_name, snapshot_name):
+    def _make_room_for_snapshot(self, volume_name, snapshot_name,
+                                purge_old_if_needed):
+        """
+        Ensure that a snapshot snapshot_name of volume_name can be made,
+        deleting the oldest snapshots if needed and purge_old_if_needed
+        is set. The volume must be locked.
+        """
+        snapshots = self.snapshots_store[volume_name]
+        if snapshot_name in snapshots:
+            return
+        while len(snapshots) >= self.max_snapshots:
+            if not purge_old_if_needed:
+                raise TooManySnapshots(
+                    "Volume {} already has {} snapshots"
+                    .format(volume_name, len(snapshots)))
+            oldest = snapshots.oldest()
+            log.info("Purging snapshot {} of {}".format(oldest, volume_name))
+            snapshots.remove(oldest)
+
+    def create_snapshot(self, volume_name, snapshot_name,
+                        purge_old_if_needed=False):
         log.info("Creating snapshot {}:{}".format(volume_name, snapshot_name))
-        with annotate_exception(KeyError, vol_404(volume_name)):
-            self.snapshots_store[volume_name][snapshot_name] = {
-                'name': snapshot_name,
-                'size_kbytes': 42,
-                'creation_time': datetime.now()}
+        with self._locked(volume_name):
+            self.raise_if_volume_absent(volume_name)
+            self._make_room_for_snapshot(volume_name, snapshot_name,
+                                         purge_old_if_needed)
+            self.snapshots_store[volume_name].add(SnapshotRecord(
+                name=snapshot_name, size_kbytes=42,
+                creation_time=datetime.now()))
+
+    def create_snapshots(self, volume_names, snapshot_name):
+        """
+        Make the snapshots atomically, holding the locks of all the
+        volumes.
+        """
+        log.info("Creating snapshot {} of {}".format(
+            snapshot_name, ", ".join(map(str, volume_names))))
+        check_group(volume_names)
+        with self._locked(*volume_names):
+            for volume_name in volume_names:
+                self.raise_if_volume_absent(volume_name)
+                self._make_room_for_snapshot(volume_name, snapshot_name,
+                                             purge_old_if_needed=False)
+            started = time.time()
+            creation_time = datetime.now()
+            for volume_name in volume_names:
+                self.snapshots_store[volume_name].add(SnapshotRecord(
+                    name=snapshot_name, size_kbytes=42,
+                    creation_time=creation_time))
+            duration_s = time.time() - started
+        return group_snapshot(snapshot_name, [
+            {'name': volume_name, 'started': started,
+             'duration_s': duration_s} for volume_name in volume_names])
 
     def get_snapshot(self, volume_name, snapshot_name):
         log.info("Fetching snapshot {}:{}".format(volume_name, snapshot_name))
-        self.raise_if_snapshot_absent(volume_name, snapshot_name)
-        return self.snapshots_store[volume_name][snapshot_name]
+        with self._locked(volume_name):
+            self.raise_if_snapshot_absent(volume_name, snapshot_name)
+            return self.snapshots_store[volume_name][snapshot_name].to_dict()
 
     def delete_snapshot(self, volume_name, snapshot_name):
         log.info("Deleting {} on {}".format(snapshot_name, volume_name))
-        self.raise_if_snapshot_absent(volume_name, snapshot_name)
-        self.snapshots_store[volume_name].pop(snapshot_name)
+        with self._locked(volume_name):
+            self.raise_if_snapshot_absent(volume_name, snapshot_name)
+            self.snapshots_store[volume_name].remove(snapshot_name)
 
     @normalised_with('snapshot', as_list=True)
+    def _normalised_snapshots(self, snapshots):
+        return snapshots
+
     def get_snapshots(self, volume_name):
         log.info("Getting snapshots for {}".format(volume_name))
-        self.raise_if_volume_absent(volume_name)
-        return list(self.snapshots_store[volume_name].values())
+        with self._locked(volume_name):
+            self.raise_if_volume_absent(volume_name)
+            snapshots = list(self.snapshots_store[volume_name].values())
+        return trusted_records(self._normalised_snapshots, snapshots)
+
+    def snapshots_page(self, volume_name, limit, cursor=None):
+        """
+        Page through the snapshots of volume_name using their name
+        index, only normalising the snapshots of the page.
+        """
+        check_limit(limit)
+        after = None if cursor is None else decode_cursor(cursor, 'name')
+
+        with self._locked(volume_name):
+            self.raise_if_volume_absent(volume_name)
+            snapshots = self.snapshots_store[volume_name]
+            names = snapshots.names_after(after, limit + 1)
+            next_cursor = None
+            if len(names) > limit:
+                names = names[:limit]
+                next_cursor = encode_cursor('name', str(names[-1]))
+            page = [snapshots[name] for name in names]
+        return (trusted_records(self._normalised_snapshots, page),
+                next_cursor)
 
     def rollback_volume(self, volume_name, restore_snapshot_name):
         log.info("Restoring '{}' to '{}'"
                  .format(volume_name, restore_snapshot_name))
-        self.raise_if_snapshot_absent(volume_name, restore_snapshot_name)
+        with self._locked(volume_name):
+            self.raise_if_snapshot_absent(volume_name, restore_snapshot_name)
 
     def ensure_policy_rule_present(self, policy_name, rule):
-        if rule not in self.rules_store[policy_name]:
-            self.rules_store[policy_name].append(rule)
+        with self._locked(policy_name):
+            self.rules_store[policy_name].add(rule)
 
     def ensure_policy_rule_absent(self, policy_name, rule):
-        stored_rules = self.rules_store[policy_name]
-        self.rules_store[policy_name] = list(filter(
-            lambda x: x != rule, stored_rules))
+        with self._locked(policy_name):
+            self.rules_store[policy_name].discard(rule)
+
+
+# The ZAPI error of snapshot-create on a volume with too many snapshots
+ERRNO_TOO_MANY_SNAPSHOTS = 13023
 
 
 class NetappStorage(StorageBackend):
@@ -677,21 +1421,115 @@ class NetappStorage(StorageBackend):
     A Back-end for a NetApp storage system.
     """
 
-    def __init__(self, hostname, username, password, vserver, timeout_s=4):
+    def __init__(self, hostname, username, password, vserver, timeout_s=4,
+                 inventory_refresh_s=None, inventory_max_staleness_s=None,
+                 validation='strict', port=443, transport_type="HTTPS",
+                 pool_size=10, keepalive=True, tls_resumption=True,
+                 warm_connections=0, patch_workers=4, recent_volumes_s=30,
+                 recent_volumes_dir=None, snapshot_workers=10,
+                 junction_index_ttl_s=junction_index.DEFAULT_TTL_S):
         """
-        Initialise a NetApp back-end
+        Initialise a NetApp back-end.
+
+        The filer is reached on port port using transport_type, HTTPS
+        or HTTP (e.g. for a simulated cluster, see
+        `storage_api.simulator`).
+
+        Calls go through a `PooledSession` keeping up to pool_size
+        connections open to the filer (unless keepalive is false), and
+        resuming TLS sessions (unless tls_resumption is false). If
+        warm_connections is set, that many connections are opened in
+        every worker right after it is forked.
+
+        The independent calls of a PATCH run concurrently, on up to
+        patch_workers threads shared by all requests (see `PatchPlan`).
+        If recent_volumes_dir is set, conditional PATCHes may skip
+        fetching volumes returned in the last recent_volumes_s seconds
+        (see `RecentVolumes`), provided no change to them was made
+        since, in this process or in any other one sharing the
+        directory. Group
+        snapshots are taken concurrently on up to snapshot_workers
+        threads, which should not exceed pool_size.
+
+        Return values are validated according to the policy validation
+        (see `ValidationPolicy`).
+
+        If inventory_refresh_s is set, `volumes` is served from an
+        in-memory inventory refreshed in the background every
+        inventory_refresh_s seconds, and never older than
+        inventory_max_staleness_s seconds (see `VolumeInventory`).
+
+        Junction paths are resolved to volume names through a
+        `JunctionPathIndex`, rebuilt on every full volume listing, whose
+        entries expire after junction_index_ttl_s seconds, or as soon as
+        a call to the filer fails for the volume.
         """
 
         self.server = netapp.api.Server(hostname=hostname,
                                         username=username,
                                         password=password,
                                         vserver=vserver,
+                                        port=int(port),
                                         timeout_s=int(timeout_s))
+        if transport_type.upper() not in ["HTTPS", "HTTP"]:
+            raise ValueError("Unknown transport type {}"
+                             .format(transport_type))
+        # netapp.api always uses HTTPS
+        self.server.ontap_api_url = "{}://{}:{}{}".format(
+            transport_type.lower(), hostname, int(port),
+            netapp.api.ONTAP_API_URL)
+        self.transport = PooledSession(
+            pool_size=int(pool_size),
+            keepalive=parse_flag(keepalive),
+            tls_resumption=parse_flag(tls_resumption))
+        self.server.session = self.transport
+        if int(warm_connections):
+            data, headers = self._warm_up_call()
+            self.transport.warm_up_after_fork(self.server.ontap_api_url,
+                                              int(warm_connections),
+                                              data=data, headers=headers,
+                                              timeout_s=int(timeout_s))
         import requests
 
         # FIXME: implement proper certificates, Miro!
         requests.packages.urllib3.disable_warnings()
 
+        self.junction_index = JunctionPathIndex(
+            ttl_s=float(junction_index_ttl_s))
+        self.validation = ValidationPolicy.parse(validation)
+        self.patch_executor = PatchExecutor(int(patch_workers))
+        self.recent_volumes = RecentVolumes(float(recent_volumes_s),
+                                            directory=recent_volumes_dir)
+        self.snapshot_workers = int(snapshot_workers)
+
+        if inventory_refresh_s:
+            self.inventory = VolumeInventory(
+                fetch=self._fetch_volumes,
+                refresh_interval_s=inventory_refresh_s,
+                max_staleness_s=inventory_max_staleness_s)
+        else:
+            self.inventory = None
+
+    def _warm_up_call(self):
+        """
+        Return the body and headers of a system-get-version call, the
+        cheapest ZAPI call there is, to warm connections up with.
+        """
+        root = netapp.api.X.netapp(netapp.api.X('system-get-version'),
+                                   xmlns=netapp.api.XMLNS,
+                                   version=netapp.api.XMLNS_VERSION,
+                                   nmsdk_app=self.server.app_name)
+        if self.server.vfiler:
+            root.attrib['vfiler'] = self.server.vfiler
+        credentials = base64.b64encode(
+            ":".join(self.server.auth_tuple).encode('utf-8'))
+        headers = {'Content-type': 'application/xml',
+                   'Authorization': "Basic {}".format(
+                       credentials.decode('ascii'))}
+        return (lxml.etree.tostring(root, xml_declaration=True,
+                                    encoding="UTF-8"),
+                headers)
+
     def format_volume(self, v):
         return merge_two_dicts(
             v.__dict__,
@@ -706,16 +1544,26 @@ class NetappStorage(StorageBackend):
 
     def name_from_path(self, junction_path):
         """
-        'Resolve' a junction path to a proper volume name.
+        'Resolve' a junction path to a proper volume name, using the
+        junction path index if possible.
 
         Raises KeyError if there was no such volume.
         """
+        entry = self.junction_index.lookup(None, junction_path)
+        if entry is not None:
+            return entry.name
+
         vols = self.server.volumes.filter(junction_path=junction_path)
         try:
             volume = next(vols)
         except StopIteration:
+            self.junction_index.discard_path(junction_path)
             raise KeyError(junction_path)
 
+        self.junction_index.add(name=volume.name,
+                                uuid=volume.uuid,
+                                node=volume.node_name,
+                                junction_path=volume.junction_path)
         return volume.name
 
     def node_junction_path(self, volume_name):
@@ -737,6 +1585,7 @@ class NetappStorage(StorageBackend):
                      .format(volume_name))
             return None, volume_name
 
+    @request_memoized
     def parse_volume_name(self, volume_name_or_node_path):
         """
         Parse a volume name on the format name, or node:junction_path,
@@ -749,20 +1598,189 @@ class NetappStorage(StorageBackend):
         else:
             return self.name_from_path(junction_path)
 
+    @contextmanager
+    def _evicting_on_error(self, volume_name):
+        """
+        Context manager discarding the junction path index entry of
+        volume_name if the calls made within fail, e.g. as it was
+        remounted or removed outside of the API.
+        """
+        try:
+            yield
+        except (KeyError, netapp.api.APIError):
+            self.junction_index.discard(volume_name)
+            raise
+
     @property
     def volumes(self):
         """
         Explicitly ignores volumes belonging to aggr0 and volumes that
         are restricted if not queried directly.
+
+        Served from the inventory, if enabled.
+        """
+        if self.inventory:
+            return self.inventory.volumes()
+        return self._fetch_volumes()
+
+    @property
+    def volumes_age(self):
+        if self.inventory:
+            return self.inventory.age
+        return None
+
+    @staticmethod
+    def _is_listed(volume):
+        return (not volume.state == 'restricted'
+                and volume.containing_aggregate_name
+                and not re.match("^aggr0.*",
+                                 volume.containing_aggregate_name))
+
+    def _fetch_volumes(self, **query):
+        """
+        List volumes from the filer, optionally matching a ZAPI query on
+        volume-id-attributes (see netapp.api.Server.VolumeList.filter).
+
+        A full listing also rebuilds the junction path index.
+        """
+        raw_volumes = (self.server.volumes.filter(**query) if query
+                       else self.server.volumes)
+        volumes = [self.format_volume(v) for v in raw_volumes
+                   if self._is_listed(v)]
+        if query:
+            for volume in volumes:
+                self.junction_index.add_volume(volume)
+        else:
+            self.junction_index.replace_all(volumes)
+        return volumes
+
+    @staticmethod
+    def _zapi_volume_query(criteria):
+        """
+        Translate the volume query criteria that can be pushed down to
+        volume-get-iter to a query on volume-id-attributes.
+        """
+        query = {}
+        if criteria.get('aggregate_name', None):
+            query['containing_aggregate_name'] = criteria['aggregate_name']
+        name_prefix = criteria.get('name_prefix', None)
+        if name_prefix and not ZAPI_QUERY_OPERATORS_RE.search(name_prefix):
+            query['name'] = "{}*".format(name_prefix)
+        return query
+
+    def query_volumes(self, sort_by=None, **criteria):
         """
+        Filter the inventory if enabled. Otherwise, push the aggregate
+        and name prefix criteria down into the volume-get-iter query and
+        apply the rest locally, as netapp.api only supports querying on
+        volume-id-attributes.
+        """
+        check_volume_query(criteria)
+
+        if self.inventory:
+            volumes = self.inventory.volumes()
+        else:
+            volumes = self._fetch_volumes(**self._zapi_volume_query(criteria))
+
+        return sort_volumes([v for v in volumes
+                             if volume_matches(v, criteria)],
+                            sort_by)
+
+    def _get_page(self, api_call, limit, cursor=None):
+        """
+        Perform a single call to a ZAPI *-get-iter api_call, fetching at
+        most limit records starting at the next-tag encoded in cursor.
+
+        Returns a tuple of (records, next cursor), where records are the
+        raw XML elements of the attributes-list.
+        """
+        check_limit(limit)
+        api_call.append(netapp.api.X('max-records', str(limit)))
+        if cursor is not None:
+            api_call.append(netapp.api.X('tag',
+                                         decode_cursor(cursor, 'tag')))
+
+        response = self.server.perform_call(api_call,
+                                            self.server.ontap_api_url)
+        namespaces = {'a': netapp.api.XMLNS}
+        records = response.xpath('/a:netapp/a:results/a:attributes-list/*',
+                                 namespaces=namespaces)
+        next_tag = response.xpath('/a:netapp/a:results/a:next-tag/text()',
+                                  namespaces=namespaces)
+
+        return records, (encode_cursor('tag', next_tag[0]) if next_tag
+                         else None)
+
+    def volumes_page(self, limit, cursor=None, **criteria):
+        """
+        Page through the inventory if enabled. Otherwise, map cursors
+        onto the next-tag of volume-get-iter, fetching one page of
+        volumes from the filer per call.
+
+        Volumes excluded from listings or not matching the criteria that
+        cannot be pushed down are filtered out of the page, so pages may
+        be shorter than limit.
+        """
+        check_volume_query(criteria)
+        if self.inventory:
+            return super().volumes_page(limit, cursor, **criteria)
+
+        X = netapp.api.X
+        api_call = X('volume-get-iter',
+                     X('desired-attributes',
+                       X('volume-attributes',
+                         *copy.deepcopy(netapp.api.VOL_FIELDS))))
+        query = self._zapi_volume_query(criteria)
+        if query:
+            api_call.append(
+                X('query',
+                  X('volume-attributes',
+                    X('volume-id-attributes',
+                      *[X(key.replace('_', '-'), value)
+                        for key, value in sorted(query.items())]))))
+
+        records, next_cursor = self._get_page(api_call, limit, cursor)
+
+        volumes = []
+        for record in records:
+            volume = self.server.volumes.make_volume(record)
+            if not self._is_listed(volume):
+                continue
+            formatted_volume = self.format_volume(volume)
+            self.junction_index.add_volume(formatted_volume)
+            if volume_matches(formatted_volume, criteria):
+                volumes.append(formatted_volume)
+
+        return volumes, next_cursor
+
+    def iter_volumes(self, **criteria):
+        """
+        Iterate over the inventory if enabled. Otherwise, yield volumes
+        as volume-get-iter returns them, one page at a time, pushing
+        criteria down like `query_volumes`.
+        """
+        check_volume_query(criteria)
+        if self.inventory:
+            return super().iter_volumes(**criteria)
+
+        query = self._zapi_volume_query(criteria)
+        raw_volumes = (self.server.volumes.filter(**query) if query
+                       else iter(self.server.volumes))
 
-        return [self.format_volume(v) for v in self.server.volumes
-                if not v.state == 'restricted'
-                and v.containing_aggregate_name
-                and not re.match("^aggr0.*", v.containing_aggregate_name)]
+        def matching_volumes():
+            for volume in raw_volumes:
+                if not self._is_listed(volume):
+                    continue
+                formatted_volume = self.format_volume(volume)
+                self.junction_index.add_volume(formatted_volume)
+                if volume_matches(formatted_volume, criteria):
+                    yield formatted_volume
+
+        return matching_volumes()
 
     # Volume parameters validation does not need to take place since we
     # also want to return offline and restricted volumes if asked
+    @request_memoized
     def get_volume(self, volume_name):
         node, junction_path = self.node_junction_path(volume_name)
         try:
@@ -778,32 +1796,94 @@ class NetappStorage(StorageBackend):
         except (StopIteration, IndexError):
             with annotate_exception(KeyError, vol_404(volume_name)):
                 raise KeyError
-        return self.format_volume(volume)
+        formatted_volume = self.format_volume(volume)
+        self.junction_index.add_volume(formatted_volume)
+        self.recent_volumes.add(formatted_volume['name'], formatted_volume)
+        return formatted_volume
 
+    @request_memoized
     def get_policy(self, policy_name):
         if policy_name not in [p.name for p in self.server.export_policies]:
             raise KeyError("No such policy exists: '{}'".format(policy_name))
         rules = [r[1] for r in self.server.export_rules_of(policy_name)]
         return rules
 
+    @invalidates_request_memo
     def set_policy(self, volume_name, policy_name):
         volume_name = self.parse_volume_name(volume_name)
 
-        self.server.set_volume_export_policy(volume_name=volume_name,
-                                             policy_name=policy_name)
+        self.recent_volumes.changed(volume_name)
+        with self._evicting_on_error(volume_name):
+            self.server.set_volume_export_policy(volume_name=volume_name,
+                                                 policy_name=policy_name)
+
+    def format_snapshot(self, s):
+        return {'name': s.name,
+                'size_kbytes': s.size_kbytes,
+                'creation_time': s.creation_time}
 
+    @request_memoized
     @normalised_with('snapshot', as_list=True)
     def get_snapshots(self, volume_name):
         volume_name = self.parse_volume_name(volume_name)
-        return [{'name': s.name,
-                 'size_kbytes': s.size_kbytes,
-                 'creation_time': s.creation_time}
+        return [self.format_snapshot(s)
                 for s in self.server.snapshots_of(volume_name)]
 
+    @normalised_with('snapshot')
+    def _normalised_snapshot(self, s):
+        return self.format_snapshot(s)
+
+    def iter_snapshots(self, volume_name):
+        """
+        Yield snapshots as snapshot-get-iter returns them, one page at a
+        time.
+        """
+        volume_name = self.parse_volume_name(volume_name)
+        return (self._normalised_snapshot(s)
+                for s in self.server.snapshots_of(volume_name))
+
+    @normalised_with('snapshot', as_list=True)
+    def _snapshot_records(self, snapshot_infos):
+        def value_of(snapshot_info, tag):
+            return snapshot_info.findtext('{{{}}}{}'
+                                          .format(netapp.api.XMLNS, tag))
+
+        return [{'name': value_of(s, 'name'),
+                 'size_kbytes': int(value_of(s, 'total')),
+                 'creation_time': datetime.fromtimestamp(
+                     int(value_of(s, 'access-time')),
+                     pytz.timezone(netapp.api.LOCAL_TIMEZONE))}
+                for s in snapshot_infos]
+
+    def snapshots_page(self, volume_name, limit, cursor=None):
+        """
+        Map cursors onto the next-tag of snapshot-get-iter, fetching one
+        page of snapshots from the filer per call.
+        """
+        volume_name = self.parse_volume_name(volume_name)
+
+        X = netapp.api.X
+        api_call = X('snapshot-get-iter',
+                     X('desired-attributes',
+                       X('snapshot-info',
+                         X('name'),
+                         X('access-time'),
+                         X('total'))),
+                     X('query',
+                       X('snapshot-info',
+                         X('volume', str(volume_name)))))
+
+        records, next_cursor = self._get_page(api_call, limit, cursor)
+        return self._snapshot_records(records), next_cursor
+
     @property
     def policies(self):
         return [self.format_policy(p) for p in self.server.export_policies]
 
+    def iter_policies(self):
+        return (self.format_policy(p) for p in self.server.export_policies)
+
+    @request_memoized
     def locks(self, volume_name):
         volume_name = self.parse_volume_name(volume_name)
         ls = [l.client_address for l in self.server.locks_on(volume_name)]
@@ -812,20 +1892,75 @@ class NetappStorage(StorageBackend):
         else:
             return ls
 
+    @invalidates_request_memo
     def clone_volume(self, clone_volume_name,
                      from_volume_name, from_snapshot_name):
 
         junction_path = self.get_volume(clone_volume_name)['junction_path']
 
+        self.recent_volumes.changed(clone_volume_name)
         self.server.clone_volume(from_volume_name, clone_volume_name,
                                  junction_path, from_snapshot_name)
+        self.junction_index.add(name=clone_volume_name,
+                                junction_path=junction_path)
 
-    def create_snapshot(self, volume_name, snapshot_name):
+    @invalidates_request_memo
+    def create_snapshot(self, volume_name, snapshot_name,
+                        purge_old_if_needed=False):
+        """
+        The filer enforces its limit on snapshots: the oldest one is
+        only looked for (in a single pass over the snapshots of the
+        volume) if it refuses a new snapshot.
+        """
         _node, junction_path = self.node_junction_path(volume_name)
         volume_name = self.name_from_path(junction_path)
 
-        self.server.create_snapshot(volume_name, snapshot_name)
+        try:
+            self._create_snapshot(volume_name, snapshot_name)
+        except TooManySnapshots:
+            if not purge_old_if_needed:
+                raise
+            oldest = min(self.server.snapshots_of(volume_name),
+                         key=lambda s: (s.creation_time, s.name))
+            log.info("Purging snapshot {} of {}"
+                     .format(oldest.name, volume_name))
+            self.server.delete_snapshot(volume_name, oldest.name)
+            self._create_snapshot(volume_name, snapshot_name)
+
+    def _create_snapshot(self, volume_name, snapshot_name):
+        try:
+            self.server.create_snapshot(volume_name, snapshot_name)
+        except netapp.api.APIError as e:
+            if e.errno == ERRNO_TOO_MANY_SNAPSHOTS:
+                raise TooManySnapshots(
+                    "Volume {} has too many snapshots: {}"
+                    .format(volume_name, e))
+            else:
+                raise e
 
+    @invalidates_request_memo
+    def create_snapshots(self, volume_names, snapshot_name):
+        """
+        Make the snapshots concurrently, after resolving every volume
+        name, so that only the snapshot calls fall within the window.
+        """
+        check_group(volume_names)
+        names = {self.name_from_path(self.node_junction_path(v)[1]): v
+                 for v in volume_names}
+        if len(names) != len(volume_names):
+            raise ValueError("Volumes appear more than once in {}"
+                             .format(", ".join(volume_names)))
+        group = take_group_snapshot(list(names), snapshot_name,
+                                    create=self._create_snapshot,
+                                    delete=self.server.delete_snapshot,
+                                    workers=self.snapshot_workers)
+        for timing in group['volumes']:
+            timing['name'] = names[timing['name']]
+        log.info("Took snapshot {} of {} volumes within {:.3f}s".format(
+            snapshot_name, len(names), group['window_s']))
+        return group
+
+    @request_memoized
     def get_snapshot(self, volume_name, snapshot_name):
         volume_name = self.parse_volume_name(volume_name)
         snapshots = self.get_snapshots(volume_name)
@@ -834,6 +1969,7 @@ class NetappStorage(StorageBackend):
                 return snapshot
         raise ValueError("No such snapshot {}".format(snapshot_name))
 
+    @invalidates_request_memo
     def remove_policy(self, policy_name):
         try:
             self.server.delete_export_policy(policy_name)
@@ -844,36 +1980,45 @@ class NetappStorage(StorageBackend):
             else:
                 raise e
 
+    @invalidates_request_memo
     def create_policy(self, policy_name, rules):
         self.server.create_export_policy(policy_name, rules=rules)
 
+    @invalidates_request_memo
     def delete_snapshot(self, volume_name, snapshot_name):
         volume_name = self.parse_volume_name(volume_name)
         try:
-            self.server.delete_snapshot(volume_name, snapshot_name)
+            with self._evicting_on_error(volume_name):
+                self.server.delete_snapshot(volume_name, snapshot_name)
         except netapp.api.APIError as e:
             if e.errno == 15661:
                 raise KeyError("No such snapshot {}".format(snapshot_name))
             else:
                 raise e
 
+    @invalidates_request_memo
     def rollback_volume(self, volume_name, restore_snapshot_name):
         volume_name = self.parse_volume_name(volume_name)
-        self.get_snapshot(volume_name, restore_snapshot_name)
-        self.server.rollback_volume_from_snapshot(volume_name,
-                                                  restore_snapshot_name)
+        with self._evicting_on_error(volume_name):
+            self.get_snapshot(volume_name, restore_snapshot_name)
+            self.recent_volumes.changed(volume_name)
+            self.server.rollback_volume_from_snapshot(volume_name,
+                                                      restore_snapshot_name)
 
+    @invalidates_request_memo
     def ensure_policy_rule_present(self, policy_name, rule):
         rules = [r for _i, r in self.server.export_rules_of(policy_name)]
         if rule not in rules:
             self.server.add_export_rule(policy_name, rule)
 
+    @invalidates_request_memo
     def ensure_policy_rule_absent(self, policy_name, rule):
         for index, stored_rule in self.server.export_rules_of(policy_name):
             if rule == stored_rule:
                 self.server.remove_export_rule(policy_name, index)
                 break
 
+    @invalidates_request_memo
     @normalised_with('volume', allow_unknown=True)
     def create_volume(self, volume_name, **fields):
         """
@@ -959,6 +2104,7 @@ class NetappStorage(StorageBackend):
 
         assert aggregate_name, "Could not find a suitable aggregate!"
 
+        self.recent_volumes.changed(volume_name)
         try:
             self.server.create_volume(
                 name=volume_name,
@@ -975,72 +2121,137 @@ class NetappStorage(StorageBackend):
                 autosize_enabled=autosize_enabled,
                 max_size_bytes=max_size_bytes)
 
-            return self.format_volume(
+            new_volume = self.format_volume(
                 self.server.volumes.single(volume_name=volume_name))
+            self.junction_index.add_volume(new_volume)
+            return new_volume
         except netapp.api.APIError as e:
             if e.errno == 17:
                 raise KeyError("Volume {} already exists!".format(volume_name))
             else:
                 raise e
 
+    @invalidates_request_memo
     def create_lock(self, volume_name, host_owner):
         # There doesn't seem to be any way of implementing this. :(
         return NotImplemented
 
+    @invalidates_request_memo
     def remove_lock(self, volume_name, host_owner):
         volume_name = self.parse_volume_name(volume_name)
-        self.server.break_lock(volume_name, host_owner)
+        with self._evicting_on_error(volume_name):
+            self.server.break_lock(volume_name, host_owner)
 
-    def patch_volume(self, volume_name, **data):
-        previous = self.get_volume(volume_name)
-        changed_keys, updated_volume = patch_and_diff(previous, data)
+    @invalidates_request_memo
+    def patch_volume(self, volume_name, expected_versions=None, **data):
+        """
+        Update a volume, running independent calls to the filer
+        concurrently (see `_patch_plan`).
 
-        # Autosize:
-        if 'max_autosize' in changed_keys:
-            log.info("Updating autosize...")
-            self.server.set_volume_autosize(
-                previous['name'],
-                max_size_bytes=updated_volume['max_autosize'],
-                autosize_enabled=updated_volume['autosize_enabled'])
-
-        # Snapshot reserve space
-        if 'percentage_snapshot_reserve' in changed_keys:
-            log.info("Updating snapshot reserve space...")
-            self.server.set_volume_snapshot_reserve(
-                previous['name'],
-                reserve_percent=updated_volume['percentage_snapshot_reserve'])
-
-        # Compression
-        if any(re.match('compression', k) for k in changed_keys):
-            log.info("Updating compression...")
-            self.server.set_compression(
-                volume_name=previous['name'],
-                enabled=updated_volume['compression_enabled'],
-                inline=updated_volume['inline_compression'])
-
-        # Active export policy
-        if 'active_policy_name' in changed_keys:
-            log.info("Updating policy name...")
-            self.server.set_volume_export_policy(
-                previous['name'],
-                policy_name=updated_volume['active_policy_name'])
-
-        # Resize volume
-        if 'size_total' in changed_keys:
-            log.info("Resizing volume...")
-            self.server.resize_volume(volume_name=previous['name'],
-                                      new_size=updated_volume['size_total'])
-
-        # Caching policy
-        if 'caching_policy' in changed_keys:
-            log.info("Setting caching policy...")
-            self.server.set_volume_caching_policy(
-                volume_name=previous['name'],
-                policy_name=updated_volume['caching_policy'])
+        If the client expects a version of the volume that was recently
+        returned by get_volume, and that no change made through the API
+        has superseded, the volume is not fetched again. As the filer
+        may still have changed it, all of data is then written, not
+        only what differs from the remembered volume.
 
+        Raises:
+            PartialPatchError: if only some of the attributes could be
+                updated
+        """
+        previous = None
+        if expected_versions is not None:
+            try:
+                name = self.parse_volume_name(volume_name)
+            except KeyError:
+                name = None
+            if name is not None:
+                previous = self.recent_volumes.get(name, expected_versions)
+            node, junction_path = self.node_junction_path(volume_name)
+            if (previous is not None and node is not None
+                    and previous.get('junction_path') != junction_path):
+                # The junction path index is out of date
+                previous = None
+        if previous is None:
+            previous = self.get_volume(volume_name)
+            check_version(previous, expected_versions)
+            changed_keys, updated_volume = patch_and_diff(previous, data)
+        else:
+            log.info("Updating {} from its cached state".format(volume_name))
+            updated_volume = dict(previous, **data)
+            changed_keys = sorted(data)
+
+        plan = self._patch_plan(previous['name'], updated_volume,
+                                changed_keys)
+        log.info("Updating {} of {} in {} call sequence(s)"
+                 .format(", ".join(changed_keys), previous['name'],
+                         len(plan.sequences)))
+        self.recent_volumes.changed(previous['name'])
+        plan.run(self.patch_executor)
+
+    def _patch_plan(self, name, volume, changed_keys):
+        """
+        Plan the calls setting the attributes changed_keys of the volume
+        name to their values in volume:
+
+        - the export policy, snapshot reserve and caching policy are
+          set in a single volume-modify-iter call
+        - compression is set through SIS
+        - autosize is set before resizing, as it used to be, since the
+          new size may depend on the new autosize bounds. As before, it
+          is only set when max_autosize changes.
+
+        The three are independent of each other.
+        """
+        X = netapp.api.X
+        changed = set(changed_keys)
+        plan = PatchPlan()
+
+        modified, elements = [], []
+        if 'active_policy_name' in changed:
+            modified.append('active_policy_name')
+            elements.append(X('volume-export-attributes',
+                              X('policy', volume['active_policy_name'])))
+        if 'percentage_snapshot_reserve' in changed:
+            modified.append('percentage_snapshot_reserve')
+            elements.append(X('volume-space-attributes',
+                              X('percentage-snapshot-reserve',
+                                str(volume['percentage_snapshot_reserve']))))
+        if 'caching_policy' in changed:
+            modified.append('caching_policy')
+            elements.append(X('volume-hybrid-cache-attributes',
+                              X('caching-policy', volume['caching_policy'])))
+        plan.add(Change(modified, functools.partial(
+            self.server.volume_modify_iter, name,
+            X('volume-attributes', *elements))))
+
+        plan.add(Change(
+            sorted(k for k in changed if re.match('compression', k)),
+            functools.partial(self.server.set_compression,
+                              volume_name=name,
+                              enabled=volume['compression_enabled'],
+                              inline=volume['inline_compression'])))
+
+        autosize = (sorted(changed & {'max_autosize', 'autosize_enabled'})
+                    if 'max_autosize' in changed else [])
+        plan.add(
+            Change(autosize,
+                   functools.partial(
+                       self.server.set_volume_autosize, name,
+                       max_size_bytes=volume['max_autosize'],
+                       autosize_enabled=volume['autosize_enabled'])),
+            Change(sorted(changed & {'size_total'}),
+                   functools.partial(self.server.resize_volume,
+                                     volume_name=name,
+                                     new_size=volume['size_total'])))
+        return plan
+
+    @invalidates_request_memo
     def restrict_volume(self, volume_name):
         name = self.parse_volume_name(volume_name)
-        self.server.restrict_volume(name)
+        self.recent_volumes.changed(name)
+        with self._evicting_on_error(name):
+            self.server.restrict_volume(name)
+        self.junction_index.discard(name)
 
         for volume in self.server.volumes.filter(name=name):
             return self.format_volume(volume)
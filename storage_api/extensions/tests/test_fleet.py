@@ -0,0 +1,127 @@
+from storage_api.extensions.fleet import (FleetSpec, generate_fleet,
+                                          parse_names, parse_range,
+                                          parse_sizes)
+from storage_api.extensions.storage import DummyStorage
+from storage_api.extensions.sqlite import SqliteDummyStorage
+from storage_api import conf
+from storage_api import extensions
+
+from unittest import mock
+import ipaddress
+import os
+
+import pytest
+
+FLEET_OPTIONS = {'fleet_volumes': "200", 'fleet_aggregates': "6",
+                 'fleet_filers': "filer-a,filer-b", 'fleet_sizes': "10:3,100",
+                 'fleet_snapshots': "1-3", 'fleet_policies': "5",
+                 'fleet_rules': "20-40", 'fleet_locked': "0.25",
+                 'fleet_seed': "7"}
+
+
+def fleet_of(spec):
+    policies, volumes = generate_fleet(spec)
+    return policies, list(volumes)
+
+
+def test_parse_options():
+    assert parse_names("2", "aggr{}") == ["aggr1", "aggr2"]
+    assert parse_names("a, b", "aggr{}") == ["a", "b"]
+    assert parse_range("3") == (3, 3)
+    assert parse_range("0-20") == (0, 20)
+    assert parse_sizes("10:3,0.5") == [(10 * 2**30, 3.0), (2**29, 1.0)]
+
+    for parse, value in [(parse_range, "5-1"), (parse_range, "some"),
+                         (parse_sizes, "10:0"), (parse_sizes, "big")]:
+        with pytest.raises(ValueError):
+            parse(value)
+
+
+def test_spec_from_options():
+    assert FleetSpec.from_options({}) is None
+
+    spec = FleetSpec.from_options(FLEET_OPTIONS)
+    assert spec.volumes == 200
+    assert spec.aggregates[-1] == "aggr6_node1"
+    assert spec.filers == ["filer-a", "filer-b"]
+    assert spec.rules == (20, 40)
+    assert spec.locked == 0.25
+
+    for options in [{'fleet_colour': "blue"}, {'volumes': "10"},
+                    {'fleet_volumes': "many"}, {'fleet_locked': "2"}]:
+        with pytest.raises(ValueError):
+            FleetSpec.from_options(options)
+
+
+def test_fleets_are_seeded():
+    spec = FleetSpec.from_options(FLEET_OPTIONS)
+    assert fleet_of(spec) == fleet_of(spec)
+    spec.seed = 8
+    assert fleet_of(spec) != fleet_of(FleetSpec.from_options(FLEET_OPTIONS))
+
+
+def test_fleet_shape():
+    spec = FleetSpec.from_options(FLEET_OPTIONS)
+    policies, volumes = fleet_of(spec)
+
+    assert [p.name for p in policies] == ["policy_{:04d}".format(n)
+                                          for n in range(5)]
+    for policy in policies:
+        assert len(policy.rules) <= 40
+        assert len(set(policy.rules)) == len(policy.rules)
+        for rule in policy.rules:
+            ipaddress.ip_network(rule)
+
+    assert [v.fields['name'] for v in volumes] == [
+        "vol_{:06d}".format(n) for n in range(200)]
+    for volume in volumes:
+        fields = volume.fields
+        assert fields['size_total'] in [10 * 2**30, 100 * 2**30]
+        assert 0 <= fields['size_used'] <= fields['size_total']
+        assert fields['aggregate_name'] in spec.aggregates
+        assert fields['filer_address'] == spec.filers[
+            spec.aggregates.index(fields['aggregate_name']) % 2]
+        assert fields['active_policy_name'] in [p.name for p in policies]
+        assert 1 <= len(volume.snapshots) <= 3
+    assert 20 < sum(v.lock is not None for v in volumes) < 80
+
+
+def test_dummy_loads_fleet():
+    storage = DummyStorage(**FLEET_OPTIONS)
+    _, volumes = fleet_of(FleetSpec.from_options(FLEET_OPTIONS))
+
+    assert storage.volumes == [v.fields for v in volumes]
+    assert len(storage.policies) == 5
+    volume = volumes[42]
+    name = volume.fields['name']
+    assert [s['name'] for s in storage.get_snapshots(name)] == [
+        s[0] for s in volume.snapshots]
+    assert storage.locks(name) == volume.lock
+    assert storage.query_volumes(aggregate_name="aggr1_node1") == [
+        v.fields for v in volumes
+        if v.fields['aggregate_name'] == "aggr1_node1"]
+
+    storage.clone_volume("clone", name, volume.snapshots[0][0])
+    storage.patch_volume(name, size_total=1)
+    assert storage.get_volume("clone")['size_total'] == (
+        volume.fields['size_total'])
+
+
+def test_sqlite_loads_fleet_once(tmpdir):
+    path = str(tmpdir.join("dummy.db"))
+    storage = SqliteDummyStorage(path, **FLEET_OPTIONS)
+    assert storage.volumes == DummyStorage(**FLEET_OPTIONS).volumes
+
+    storage.restrict_volume("vol_000000")
+    reopened = SqliteDummyStorage(path, **FLEET_OPTIONS)
+    assert len(reopened.volumes) == 199
+    assert not reopened.load_fleet(FleetSpec(volumes=10))
+
+
+def test_fleet_from_backend_conf(temp_app):
+    backends = "fleet🌈DummyStorage🌈fleet_volumes🌈10🌈fleet_seed🌈3"
+    with mock.patch.dict(os.environ, {'SAPI_BACKENDS': backends}):
+        conf.load_backend_conf(temp_app, backends_module=extensions)
+
+    backend = temp_app.extensions[temp_app.config['SUBSYSTEM']['fleet']]
+    assert len(backend.volumes) == 10
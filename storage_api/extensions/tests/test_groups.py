@@ -0,0 +1,58 @@
+from storage_api.extensions.groups import (check_group, group_snapshot,
+                                           take_group_snapshot)
+
+import threading
+import time
+
+import pytest
+
+
+def test_check_group():
+    check_group(["a", "b"])
+    with pytest.raises(ValueError):
+        check_group([])
+    with pytest.raises(ValueError):
+        check_group(["a", "b", "a"])
+
+
+def test_window():
+    group = group_snapshot("snap", [
+        {'name': "a", 'started': 10.0, 'duration_s': 0.5},
+        {'name': "b", 'started': 10.2, 'duration_s': 1.0}])
+    assert group['window_s'] == pytest.approx(1.2)
+
+
+def test_snapshots_are_taken_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+    created = []
+
+    def create(volume_name, snapshot_name):
+        # Deadlocks (and times out) unless all three run at once
+        barrier.wait()
+        created.append(volume_name)
+
+    group = take_group_snapshot(["a", "b", "c"], "snap", create=create,
+                                delete=None, workers=3)
+    assert sorted(created) == ["a", "b", "c"]
+    assert [t['name'] for t in group['volumes']] == ["a", "b", "c"]
+
+
+def test_failure_deletes_taken_snapshots():
+    deleted = []
+
+    def create(volume_name, snapshot_name):
+        if volume_name == "b":
+            raise KeyError(volume_name)
+        time.sleep(0.01)
+
+    def delete(volume_name, snapshot_name):
+        deleted.append((volume_name, snapshot_name))
+
+    for workers in [1, 3]:
+        deleted.clear()
+        with pytest.raises(KeyError):
+            take_group_snapshot(["a", "b", "c"], "snap", create=create,
+                                delete=delete, workers=workers)
+        expected = ([("a", "snap")] if workers == 1
+                    else [("a", "snap"), ("c", "snap")])
+        assert deleted == expected
@@ -0,0 +1,163 @@
+from storage_api.extensions.index import JunctionPathIndex
+from storage_api.extensions.storage import NetappStorage
+
+from unittest import mock
+
+import netapp.api as netapp_api
+import pytest
+
+
+def volume(name, junction_path, uuid=None, node="node-1"):
+    return {'name': name, 'junction_path': junction_path,
+            'uuid': uuid or "uuid-{}".format(name), 'filer_address': node}
+
+
+def test_lookup_both_directions():
+    index = JunctionPathIndex()
+    index.add_volume(volume("vol1", "/vol1"))
+
+    assert index.lookup("node-1", "/vol1").name == "vol1"
+    assert index.lookup(None, "/vol1").uuid == "uuid-vol1"
+    assert index.lookup("", "/vol1").name == "vol1"
+    assert index.lookup("filer-alias", "/vol1").name == "vol1"
+    assert index.entry_of("vol1").junction_path == "/vol1"
+    assert index.entry_of("vol1").node == "node-1"
+    assert index.lookup(None, "/nowhere") is None
+    assert index.entry_of("nothing") is None
+
+
+def test_remount_replaces_old_path():
+    index = JunctionPathIndex()
+    index.add_volume(volume("vol1", "/old"))
+    index.add_volume(volume("vol1", "/new"))
+
+    assert index.lookup(None, "/old") is None
+    assert index.lookup(None, "/new").name == "vol1"
+    assert len(index) == 1
+
+
+def test_path_taken_over_drops_previous_owner():
+    index = JunctionPathIndex()
+    index.add_volume(volume("vol1", "/path"))
+    index.add_volume(volume("vol2", "/path"))
+
+    assert index.lookup(None, "/path").name == "vol2"
+    assert index.entry_of("vol1") is None
+
+
+def test_discard():
+    index = JunctionPathIndex()
+    index.add_volume(volume("vol1", "/vol1"))
+    index.discard("vol1")
+    index.discard("never-there")
+
+    assert index.lookup(None, "/vol1") is None
+    assert len(index) == 0
+
+
+def test_entries_expire():
+    now = [0]
+    index = JunctionPathIndex(ttl_s=60, clock=lambda: now[0])
+    index.add_volume(volume("vol1", "/vol1"))
+    now[0] = 60
+    assert index.lookup("node-1", "/vol1").name == "vol1"
+
+    now[0] = 61
+    assert index.lookup("node-1", "/vol1") is None
+    assert index.entry_of("vol1") is None
+
+    index.replace_all([volume("vol1", "/vol1")])
+    assert index.lookup("node-1", "/vol1").name == "vol1"
+
+
+def test_discard_path():
+    index = JunctionPathIndex()
+    index.add_volume(volume("vol1", "/vol1"))
+    index.discard_path("/vol1")
+    index.discard_path("/nowhere")
+
+    assert index.entry_of("vol1") is None
+    assert len(index) == 0
+
+
+def test_replace_all():
+    index = JunctionPathIndex()
+    index.add_volume(volume("gone", "/gone"))
+    index.replace_all([volume("vol{}".format(i), "/vol{}".format(i))
+                       for i in range(100)])
+
+    assert len(index) == 100
+    assert index.entry_of("gone") is None
+    assert index.lookup(None, "/vol42").name == "vol42"
+
+
+@pytest.fixture
+def netapp():
+    with mock.patch('netapp.api.Server') as server:
+        storage = NetappStorage(hostname="h", username="u", password="p",
+                                vserver="vs")
+    storage.server = server.return_value
+    return storage
+
+
+def raw_volume(name, junction_path):
+    vol = mock.MagicMock(junction_path=junction_path,
+                         uuid="uuid-{}".format(name), node_name="node-1",
+                         state="online", containing_aggregate_name="aggr1")
+    # name is reserved in the MagicMock constructor
+    vol.name = name
+    return vol
+
+
+def test_netapp_name_resolution_is_cached(netapp):
+    vol = raw_volume("vol1", "/vol1")
+    netapp.server.volumes.filter.side_effect = lambda **kw: iter([vol])
+
+    for volume_name in ["node-1:/vol1", ":/vol1", "filer-alias:/vol1"]:
+        assert netapp.parse_volume_name(volume_name) == "vol1"
+
+    assert netapp.server.volumes.filter.call_count == 1
+
+
+def test_netapp_listing_fills_index(netapp):
+    vols = [raw_volume("vol{}".format(i), "/vol{}".format(i))
+            for i in range(5)]
+    netapp.server.volumes.__iter__.return_value = iter(vols)
+    netapp.format_volume = lambda v: volume(v.name, v.junction_path)
+
+    netapp.volumes
+
+    assert netapp.parse_volume_name("node-1:/vol3") == "vol3"
+    assert netapp.server.volumes.filter.call_count == 0
+
+
+def test_netapp_restrict_drops_from_index(netapp):
+    netapp.junction_index.add_volume(volume("vol1", "/vol1"))
+    vol = raw_volume("vol1", "/vol1")
+    netapp.server.volumes.filter.side_effect = (
+        lambda **kw: iter([vol] if 'junction_path' in kw else []))
+
+    netapp.restrict_volume("node-1:/vol1")
+    netapp.server.volumes.filter.side_effect = lambda **kw: iter([])
+
+    netapp.server.restrict_volume.assert_called_once_with("vol1")
+    with pytest.raises(KeyError):
+        netapp.parse_volume_name("node-1:/vol1")
+
+
+def test_netapp_failed_calls_evict_from_index(netapp):
+    # vol1 was remounted at /vol2 behind the API's back
+    netapp.junction_index.add_volume(volume("vol1", "/vol2"))
+    netapp.server.volumes.filter.side_effect = (
+        lambda **kw: iter([raw_volume("vol2", "/vol2")]))
+    netapp.server.break_lock.side_effect = netapp_api.APIError(
+        "No such volume", errno=13040)
+
+    with pytest.raises(netapp_api.APIError):
+        netapp.remove_lock(":/vol2", "db1")
+    netapp.server.break_lock.assert_called_once_with("vol1", "db1")
+    assert netapp.junction_index.entry_of("vol1") is None
+
+    netapp.delete_snapshot(":/vol2", "snap")
+    netapp.server.delete_snapshot.assert_called_once_with("vol2", "snap")
+    assert netapp.server.volumes.filter.call_count == 1
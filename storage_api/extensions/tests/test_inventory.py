@@ -0,0 +1,118 @@
+from storage_api.extensions.inventory import VolumeInventory
+from storage_api.extensions.storage import NetappStorage
+
+import time
+from unittest import mock
+
+import pytest
+
+
+class CountingFetch(object):
+    def __init__(self, volumes=None):
+        self.calls = 0
+        self.volumes = volumes or [{'name': 'a'}, {'name': 'b'}]
+
+    def __call__(self):
+        self.calls += 1
+        return list(self.volumes)
+
+
+@pytest.fixture
+def inventory():
+    inventory = VolumeInventory(CountingFetch(), refresh_interval_s=60)
+    yield inventory
+    inventory.stop()
+
+
+def test_first_read_fetches(inventory):
+    assert inventory.age is None
+    assert inventory.volumes() == [{'name': 'a'}, {'name': 'b'}]
+    assert inventory.age is not None
+    assert inventory.age < 60
+
+
+def test_reads_are_served_from_snapshot(inventory):
+    inventory.volumes()
+    calls_after_first_read = inventory.fetch.calls
+
+    for _ in range(10):
+        inventory.volumes()
+
+    assert inventory.fetch.calls == calls_after_first_read
+    assert calls_after_first_read == 1
+
+
+def test_stale_snapshot_is_refreshed_synchronously(inventory):
+    inventory.volumes()
+    inventory.fetch.volumes = [{'name': 'c'}]
+
+    with mock.patch('time.monotonic',
+                    return_value=time.monotonic() + 1000):
+        assert inventory.volumes() == [{'name': 'c'}]
+
+
+def test_refresh_listeners_are_notified(inventory):
+    seen = []
+    inventory.refresh_listeners.append(seen.append)
+    inventory.refresh()
+    assert seen == [[{'name': 'a'}, {'name': 'b'}]]
+
+
+def test_background_refresh():
+    fetch = CountingFetch()
+    inventory = VolumeInventory(fetch, refresh_interval_s=0.01)
+    try:
+        inventory.start()
+        deadline = time.monotonic() + 5
+        while fetch.calls < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert fetch.calls >= 3
+    finally:
+        inventory.stop()
+
+
+def test_failing_refresh_keeps_snapshot(inventory):
+    inventory.volumes()
+    inventory.fetch = mock.Mock(side_effect=IOError("filer went away"))
+
+    with pytest.raises(IOError):
+        inventory.refresh()
+
+    assert inventory.volumes() == [{'name': 'a'}, {'name': 'b'}]
+
+
+def test_staleness_shorter_than_interval_is_invalid():
+    with pytest.raises(ValueError):
+        VolumeInventory(CountingFetch(), refresh_interval_s=10,
+                        max_staleness_s=1)
+
+
+@mock.patch('netapp.api.Server')
+def test_netapp_serves_volumes_from_inventory(server):
+    storage = NetappStorage(hostname="h", username="u", password="p",
+                            vserver="vs", inventory_refresh_s="60")
+    try:
+        raw_volume = mock.MagicMock(state='online',
+                                    containing_aggregate_name='aggr1')
+        raw_volume.name = 'vol1'
+        server.return_value.volumes = [raw_volume]
+
+        assert storage.volumes_age is None
+        assert len(storage.volumes) == 1
+        assert storage.volumes_age is not None
+
+        server.return_value.volumes = []
+        assert len(storage.volumes) == 1
+    finally:
+        storage.inventory.stop()
+
+
+@mock.patch('netapp.api.Server')
+def test_netapp_without_inventory_is_live(server):
+    storage = NetappStorage(hostname="h", username="u", password="p",
+                            vserver="vs")
+    server.return_value.volumes = []
+
+    assert storage.inventory is None
+    assert storage.volumes == []
+    assert storage.volumes_age is None
@@ -0,0 +1,124 @@
+from storage_api.extensions.memo import (request_memoized,
+                                         invalidates_request_memo,
+                                         request_memo_stats)
+from storage_api.extensions.storage import NetappStorage
+from storage_api import metrics
+
+from datetime import datetime
+from unittest import mock
+
+import flask
+import pytest
+
+
+class FakeBackend(object):
+    def __init__(self):
+        self.calls = 0
+        self.value = {'name': 'vol1', 'size_total': 1}
+
+    @request_memoized
+    def get_volume(self, volume_name):
+        self.calls += 1
+        if volume_name == 'missing':
+            raise KeyError(volume_name)
+        return self.value
+
+    @invalidates_request_memo
+    def patch_volume(self, volume_name, **data):
+        self.value = dict(self.value, **data)
+
+
+@pytest.fixture
+def app():
+    return flask.Flask(__name__)
+
+
+def test_no_memo_outside_requests():
+    backend = FakeBackend()
+    backend.get_volume('vol1')
+    backend.get_volume('vol1')
+    assert backend.calls == 2
+    assert request_memo_stats() == {'hits': 0, 'misses': 0}
+
+
+def test_memo_within_request(app):
+    backend = FakeBackend()
+    with app.test_request_context():
+        for _ in range(3):
+            assert backend.get_volume('vol1')['name'] == 'vol1'
+        backend.get_volume('vol2')
+
+        assert backend.calls == 2
+        assert request_memo_stats() == {'hits': 2, 'misses': 2}
+
+    with app.test_request_context():
+        backend.get_volume('vol1')
+        assert backend.calls == 3
+
+
+def test_memo_hits_are_counted_in_metrics(app):
+    registry = metrics.init_app(app)
+    backend = FakeBackend()
+    with app.test_request_context():
+        for _ in range(3):
+            backend.get_volume('vol1')
+
+    _, counters = registry.collect()
+    assert counters['sapi_memo_hits_total'] == {
+        (('method', 'get_volume'), ): 2}
+    assert counters['sapi_memo_misses_total'] == {
+        (('method', 'get_volume'), ): 1}
+    assert 'sapi_memo_hits_total{method="get_volume"} 2' in (
+        registry.render())
+
+
+def test_memoised_values_are_copies(app):
+    backend = FakeBackend()
+    with app.test_request_context():
+        backend.get_volume('vol1')['name'] = 'changed'
+        assert backend.get_volume('vol1')['name'] == 'vol1'
+
+
+def test_exceptions_are_not_memoised(app):
+    backend = FakeBackend()
+    with app.test_request_context():
+        for _ in range(2):
+            with pytest.raises(KeyError):
+                backend.get_volume('missing')
+        assert backend.calls == 2
+
+
+def test_mutation_invalidates(app):
+    backend = FakeBackend()
+    other_backend = FakeBackend()
+    with app.test_request_context():
+        backend.get_volume('vol1')
+        other_backend.get_volume('vol1')
+        backend.patch_volume('vol1', size_total=2)
+
+        assert backend.get_volume('vol1')['size_total'] == 2
+        assert backend.calls == 2
+        other_backend.get_volume('vol1')
+        assert other_backend.calls == 1
+
+
+def test_netapp_rollback_fetches_once(app):
+    with mock.patch('netapp.api.Server') as server:
+        storage = NetappStorage(hostname="h", username="u", password="p",
+                                vserver="vs")
+    volume = mock.MagicMock()
+    volume.name = "vol1"
+    server = server.return_value
+    server.volumes.filter.side_effect = lambda **kw: iter([volume])
+    server.snapshots_of.return_value = [
+        mock.MagicMock(size_kbytes=1, creation_time=datetime.now())]
+    server.snapshots_of.return_value[0].name = "snap"
+
+    with app.test_request_context():
+        storage.rollback_volume("node:/vol1", "snap")
+        assert request_memo_stats()['hits'] >= 1
+
+    server.volumes.filter.assert_called_once_with(junction_path="/vol1")
+    server.snapshots_of.assert_called_once_with("vol1")
+    server.rollback_volume_from_snapshot.assert_called_once_with("vol1",
+                                                                 "snap")
@@ -0,0 +1,67 @@
+from storage_api.extensions.patch import (Change, PatchPlan, PatchExecutor,
+                                          PartialPatchError)
+
+import os
+import threading
+from unittest import mock
+
+import pytest
+
+
+def fail(message):
+    def apply():
+        raise ValueError(message)
+    return apply
+
+
+def test_plan_ignores_empty_changes():
+    plan = PatchPlan()
+    plan.add(Change([], fail("never")))
+    plan.add(Change([], fail("never")), Change(['a'], lambda: None))
+    assert len(plan.sequences) == 1
+    assert len(plan) == 1
+    plan.run()
+
+
+def test_partial_failure_skips_dependent_changes():
+    applied = []
+    plan = PatchPlan()
+    plan.add(Change(['a'], lambda: applied.append('a')))
+    plan.add(Change(['b', 'c'], fail("no b")), Change(['d'], fail("never")))
+
+    with pytest.raises(PartialPatchError) as excinfo:
+        plan.run()
+    assert applied == ['a']
+    assert excinfo.value.summary() == {'applied': ['a'],
+                                       'failed': {'b': "no b", 'c': "no b"},
+                                       'skipped': ['d']}
+    assert "b (no b)" in str(excinfo.value)
+
+
+def test_total_failure_raises_the_first_error():
+    plan = PatchPlan()
+    plan.add(Change(['a'], fail("no a")))
+    plan.add(Change(['b'], fail("no b")))
+    with pytest.raises(ValueError, match="no a"):
+        plan.run(PatchExecutor(2))
+
+
+def test_sequences_run_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+    plan = PatchPlan()
+    for attribute in ['a', 'b', 'c']:
+        plan.add(Change([attribute], barrier.wait))
+    plan.run(PatchExecutor(3))
+
+
+def test_executor_is_recreated_after_fork():
+    executor = PatchExecutor(1)
+    assert executor.submit(os.getpid).result() == os.getpid()
+    pool = executor._executor
+
+    with mock.patch('os.getpid', return_value=os.getpid() + 1):
+        executor.submit(lambda: None).result()
+    assert executor._executor is not pool
+
+    with pytest.raises(ValueError):
+        PatchExecutor(0)
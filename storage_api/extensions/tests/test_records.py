@@ -0,0 +1,82 @@
+from storage_api.extensions.records import (VolumeRecord, SnapshotRecord,
+                                            SnapshotIndex, RuleSet)
+
+import pytest
+
+
+def test_volume_record_behaves_like_a_dict():
+    record = VolumeRecord({'name': "vol", 'size_total': 10})
+    record['colour'] = "blue"
+
+    assert record['name'] == "vol"
+    assert record.get('state') is None
+    assert 'state' not in record and 'colour' in record
+    assert record.to_dict() == {'name': "vol", 'size_total': 10,
+                                'colour': "blue"}
+    assert record == {'name': "vol", 'size_total': 10, 'colour': "blue"}
+    with pytest.raises(KeyError):
+        record['state']
+    with pytest.raises(AttributeError):
+        record.__dict__
+
+
+def test_volume_record_copies():
+    record = VolumeRecord({'name': "vol", 'size_total': 10})
+    record.validated_with = ('volume', False, False)
+
+    copy = record.copy()
+    assert copy == record
+    assert copy.validated_with == record.validated_with
+
+    clone = record.copy(name="clone")
+    assert clone['name'] == "clone" and record['name'] == "vol"
+    assert clone.validated_with is None
+
+    copy['size_total'] = 20
+    assert record['size_total'] == 10
+    assert copy.validated_with is None
+
+
+def test_snapshot_index():
+    index = SnapshotIndex()
+    for name in ["c", "a", "b"]:
+        index.add(SnapshotRecord(name, size_kbytes=1, creation_time=None))
+
+    assert [s.name for s in index.values()] == ["c", "a", "b"]
+    assert index.names_after(None, 2) == ["a", "b"]
+    assert index.names_after("a", 5) == ["b", "c"]
+    assert index.names_after("aa", 5) == ["b", "c"]
+
+    assert index.remove("b").name == "b"
+    assert "b" not in index and len(index) == 2
+    assert index.names_after(None, 5) == ["a", "c"]
+    with pytest.raises(KeyError):
+        index.remove("b")
+
+
+def test_snapshot_index_oldest():
+    index = SnapshotIndex()
+    assert index.oldest() is None
+    for name, time in [("b", 3), ("c", 1), ("a", 2)]:
+        index.add(SnapshotRecord(name, size_kbytes=1, creation_time=time))
+
+    assert index.oldest() == "c"
+    index.remove("c")
+    assert index.oldest() == "a"
+    index.add(SnapshotRecord("a", size_kbytes=1, creation_time=4))
+    assert index.oldest() == "b"
+    index.add(SnapshotRecord("d", size_kbytes=1, creation_time=0))
+    assert index.oldest() == "d"
+    assert index.by_age == [(0, "d"), (3, "b"), (4, "a")]
+
+
+def test_rule_set():
+    rules = RuleSet(["a", "b", "a"])
+    assert rules.to_list() == ["a", "b"]
+
+    rules.add("c")
+    rules.add("a")
+    rules.discard("b")
+    rules.discard("nothing")
+    assert "a" in rules and "b" not in rules
+    assert rules.to_list() == ["a", "c"]
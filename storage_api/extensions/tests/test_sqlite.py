@@ -0,0 +1,113 @@
+from storage_api.extensions.sqlite import (SqliteDummyStorage,
+                                           prefix_upper_bound)
+
+import multiprocessing
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join("dummy.db"))
+
+
+def test_data_persists(path):
+    storage = SqliteDummyStorage(path)
+    storage.create_volume("vol", size_total=10)
+    storage.create_snapshot("vol", "snap")
+    storage.create_lock("vol", "host")
+    storage.create_policy("policy", ["a", "b"])
+
+    reopened = SqliteDummyStorage(path)
+    assert reopened.get_volume("vol")['size_total'] == 10
+    assert reopened.get_snapshots("vol") == storage.get_snapshots("vol")
+    assert reopened.locks("vol") == "host"
+    assert reopened.policies == [{'name': "policy", 'rules': ["a", "b"]}]
+
+
+def test_uses_wal(path):
+    storage = SqliteDummyStorage(path)
+    assert storage._query("PRAGMA journal_mode") == [("wal", )]
+
+
+def test_prefix_upper_bound():
+    assert prefix_upper_bound("vol") == "vom"
+    assert prefix_upper_bound("a\U0010ffff") == "b"
+    assert prefix_upper_bound("\U0010ffff") is None
+    assert prefix_upper_bound("\ud7ff") == "\ue000"
+
+
+def test_query_volumes_by_prefix(path):
+    storage = SqliteDummyStorage(path)
+    for name in ["vol", "vol_1", "vol\U0010ffff", "vom", "vo"]:
+        storage.create_volume(name)
+
+    assert [v['name'] for v in storage.query_volumes(name_prefix="vol")] == [
+        "vol", "vol_1", "vol\U0010ffff"]
+
+
+def test_iter_volumes_in_chunks(path):
+    storage = SqliteDummyStorage(path)
+    for number in range(5):
+        storage.create_volume("vol_{}".format(number))
+
+    with mock.patch('storage_api.extensions.sqlite.ITERATION_CHUNK', 2):
+        assert ([v['name'] for v in storage.iter_volumes()]
+                == ["vol_{}".format(number) for number in range(5)])
+
+
+def test_listings_are_not_revalidated(path):
+    storage = SqliteDummyStorage(path)
+    storage.create_volume("vol")
+    storage.create_snapshot("vol", "snap")
+
+    with mock.patch('cerberus.Validator.validate') as validate:
+        assert [v['name'] for v in SqliteDummyStorage(path).volumes] == [
+            "vol"]
+        assert len(storage.get_snapshots("vol")) == 1
+        assert validate.call_count == 0
+
+
+def contend(path, number, results):
+    storage = SqliteDummyStorage(path)
+    for round in range(10):
+        name = "vol_{}".format(round)
+        try:
+            storage.create_volume(name)
+            results.put(('created', name, number))
+        except KeyError:
+            pass
+        try:
+            storage.create_lock(name, "host_{}".format(number))
+            results.put(('locked', name, number))
+        except ValueError:
+            pass
+        storage.create_snapshot(name, "snap_{}".format(number))
+
+
+def test_processes_share_the_store(path):
+    storage = SqliteDummyStorage(path)
+    storage.volumes
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=contend,
+                                         args=(path, number, results))
+                 for number in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    outcomes = {}
+    while not results.empty():
+        outcome, name, number = results.get()
+        outcomes.setdefault((outcome, name), []).append(number)
+
+    for round in range(10):
+        name = "vol_{}".format(round)
+        assert len(outcomes[('created', name)]) == 1
+        owner, = outcomes[('locked', name)]
+        assert storage.locks(name) == "host_{}".format(owner)
+        assert len(storage.get_snapshots(name)) == 4
+    assert len(storage.volumes) == 10
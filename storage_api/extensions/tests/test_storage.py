@@ -1,9 +1,21 @@
 from storage_api.extensions.storage import (DummyStorage,
-                                            NetappStorage) # noqa
+                                            NetappStorage,
+                                            NormalisedRecord,
+                                            ValidationError,
+                                            TooManySnapshots,
+                                            normalised_with,
+                                            validator_for) # noqa
+from storage_api.extensions.sqlite import SqliteDummyStorage
+from storage_api.extensions.versions import (PreconditionFailed,
+                                             volume_version)
 
 import uuid
+import copy
 import functools
+import threading
 import os
+import sys
+import tempfile
 from unittest import mock
 from contextlib import contextmanager
 
@@ -62,8 +74,10 @@ def on_all_backends(func):
     """
 
     @functools.wraps(func)
-    @pytest.mark.parametrize("storage,recorder", [(DummyStorage(),
-                                                   mock.MagicMock())])
+    @pytest.mark.parametrize("storage,recorder", [
+        (DummyStorage(), mock.MagicMock()),
+        (SqliteDummyStorage(os.path.join(tempfile.mkdtemp(), "dummy.db")),
+         mock.MagicMock())])
     def backend_wrapper(*args, **kwargs):
         func(*args, **kwargs)
     return backend_wrapper
@@ -129,6 +143,20 @@ def test_patch_volume(storage, recorder):
             assert v['max_autosize'] <= 3*DEFAULT_VOLUME_SIZE
 
 
+@on_all_backends
+def test_conditional_patch(storage, recorder):
+    storage.create_volume("conditional", size_total=1)
+    version = volume_version(storage.get_volume("conditional"))
+
+    storage.patch_volume("conditional", expected_versions={version},
+                         size_total=2)
+    with pytest.raises(PreconditionFailed):
+        storage.patch_volume("conditional", expected_versions={version},
+                             size_total=3)
+    assert storage.get_volume("conditional")['size_total'] == 2
+    assert volume_version(storage.get_volume("conditional")) != version
+
+
 @on_all_backends
 def test_get_no_locks(storage, recorder):
     with recorder.use_cassette('get_no_locks'):
@@ -204,6 +232,51 @@ def test_get_snapshots(storage, recorder):
             assert snapshots[0]['name'] == "snapshot-new"
 
 
+@on_all_backends
+def test_create_snapshots(storage, recorder):
+    storage.create_volume("group_a", size_total=1)
+    storage.create_volume("group_b", size_total=1)
+
+    group = storage.create_snapshots(["group_a", "group_b"], "consistent")
+    assert group['name'] == "consistent"
+    assert [t['name'] for t in group['volumes']] == ["group_a", "group_b"]
+    assert group['window_s'] >= 0
+    times = {storage.get_snapshot(v, "consistent")['creation_time']
+             for v in ["group_a", "group_b"]}
+    assert len(times) == 1
+
+    with pytest.raises(KeyError):
+        storage.create_snapshots(["group_a", "group_missing"], "partial")
+    assert [s['name'] for s in storage.get_snapshots("group_a")] == [
+        "consistent"]
+    with pytest.raises(ValueError):
+        storage.create_snapshots(["group_a", "group_a"], "twice")
+    with pytest.raises(ValueError):
+        storage.create_snapshots([], "empty")
+
+
+@on_all_backends
+def test_purge_old_snapshots(storage, recorder):
+    storage.max_snapshots = 2
+    storage.create_volume("rotated", size_total=1)
+    storage.create_snapshot("rotated", "first")
+    storage.create_snapshot("rotated", "second")
+
+    with pytest.raises(TooManySnapshots):
+        storage.create_snapshot("rotated", "third")
+    # Replacing a snapshot needs no room
+    storage.create_snapshot("rotated", "second")
+    storage.create_snapshot("rotated", "third", purge_old_if_needed=True)
+    assert sorted(s['name'] for s in storage.get_snapshots("rotated")) == [
+        "second", "third"]
+
+    storage.create_snapshot("rotated", "fourth", purge_old_if_needed=True)
+    assert sorted(s['name'] for s in storage.get_snapshots("rotated")) == [
+        "fourth", "third"]
+    with pytest.raises(TooManySnapshots):
+        storage.create_snapshots(["rotated"], "fifth")
+
+
 @on_all_backends
 def test_set_policy(storage, recorder):
     rules = ["host1.db.cern.ch", "db.cern.ch", "foo.cern.ch"]
@@ -276,7 +349,11 @@ def test_clone_volume(storage, recorder):
                              from_volume_name=volume_name,
                              from_snapshot_name="mysnap")
 
-    assert vol == clone
+    assert clone['name'] == "vol2-clone"
+    assert ({k: v for k, v in vol.items() if k != 'name'}
+            == {k: v for k, v in clone.items() if k != 'name'})
+    assert [v['name'] for v in storage.query_volumes(
+        name_prefix="vol2-cl")] == ["vol2-clone"]
 
 
 @on_all_backends
@@ -617,3 +694,377 @@ def test_has_caching_policy(storage, recorder):
     with recorder.use_cassette('has_caching_policy'):
         with ephermeral_volume(storage) as vol:
             assert 'caching_policy' in vol
+
+
+@on_all_backends
+def test_query_volumes(storage, recorder):
+    if isinstance(storage, NetappStorage):
+        return
+
+    for name, aggregate, size in [("vol-b", "aggr1", 3), ("vol-a", "aggr1", 1),
+                                  ("other", "aggr2", 2)]:
+        storage.create_volume(name, size_total=size)
+        storage.patch_volume(name, aggregate_name=aggregate, state="online")
+    storage.patch_volume("vol-a", state="offline")
+
+    def names(**query):
+        return [v['name'] for v in storage.query_volumes(**query)]
+
+    assert names() == ["other", "vol-a", "vol-b"]
+    assert names(name_prefix="vol") == ["vol-a", "vol-b"]
+    assert names(aggregate_name="aggr1", state="online") == ["vol-b"]
+    assert names(state="offline") == ["vol-a"]
+    assert names(size_total_min=2, size_total_max=2) == ["other"]
+    assert names(sort_by="-size_total") == ["vol-b", "other", "vol-a"]
+    assert names(name_prefix="nothing") == []
+
+    storage.restrict_volume("vol-b")
+    assert names(aggregate_name="aggr1") == ["vol-a"]
+
+    with pytest.raises(ValueError):
+        storage.query_volumes(colour="blue")
+
+
+def test_netapp_query_pushes_down_id_attributes():
+    with mock.patch('netapp.api.Server') as server:
+        storage = NetappStorage(hostname="h", username="u", password="p",
+                                vserver="vs")
+    server = server.return_value
+    server.volumes.filter.return_value = []
+
+    storage.query_volumes(aggregate_name="aggr1", name_prefix="vol",
+                          state="online")
+    server.volumes.filter.assert_called_once_with(
+        containing_aggregate_name="aggr1", name="vol*")
+
+    server.volumes.filter.reset_mock()
+    storage.query_volumes(name_prefix="vol*")
+    server.volumes.__iter__.assert_called_once_with()
+    assert server.volumes.filter.call_count == 0
+
+
+def all_pages(page_function, limit, **kwargs):
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = page_function(limit=limit, cursor=cursor, **kwargs)
+        pages.append([item['name'] for item in page])
+        if cursor is None:
+            return pages
+
+
+@on_all_backends
+def test_volumes_page(storage, recorder):
+    if isinstance(storage, NetappStorage):
+        return
+
+    for i in range(7):
+        storage.create_volume("vol{}".format(i))
+    storage.create_volume("other")
+
+    assert all_pages(storage.volumes_page, limit=3) == [
+        ["other", "vol0", "vol1"], ["vol2", "vol3", "vol4"],
+        ["vol5", "vol6"]]
+    assert all_pages(storage.volumes_page, limit=4, name_prefix="vol") == [
+        ["vol0", "vol1", "vol2", "vol3"], ["vol4", "vol5", "vol6"]]
+    assert all_pages(storage.volumes_page, limit=8) == [
+        ["other"] + ["vol{}".format(i) for i in range(7)]]
+
+    with pytest.raises(ValueError):
+        storage.volumes_page(limit=0)
+    with pytest.raises(ValueError):
+        storage.volumes_page(limit=1, cursor="garbage")
+
+
+@on_all_backends
+def test_snapshots_page(storage, recorder):
+    if isinstance(storage, NetappStorage):
+        return
+
+    storage.create_volume("vol")
+    for name in ["c", "a", "b"]:
+        storage.create_snapshot("vol", name)
+
+    assert all_pages(storage.snapshots_page, limit=2,
+                     volume_name="vol") == [["a", "b"], ["c"]]
+    with pytest.raises(KeyError):
+        storage.snapshots_page("no-such-volume", limit=2)
+
+
+def zapi_response(records, next_tag=None):
+    X = netapp.api.X
+    results = X('results', X('num-records', str(len(records))),
+                X('attributes-list', *records), status="passed")
+    if next_tag is not None:
+        results.append(X('next-tag', next_tag))
+    root = X('netapp', results)
+    # Responses from the filer are in the NetApp namespace
+    for element in root.iter():
+        element.tag = "{{{}}}{}".format(netapp.api.XMLNS, element.tag)
+    return root
+
+
+def test_netapp_snapshots_page_maps_cursor_to_next_tag():
+    with mock.patch('netapp.api.Server') as server:
+        storage = NetappStorage(hostname="h", username="u", password="p",
+                                vserver="vs")
+    server = server.return_value
+    X = netapp.api.X
+
+    def snapshot(name):
+        return X('snapshot-info', X('name', name), X('total', "4"),
+                 X('access-time', "1500000000"))
+
+    server.perform_call.side_effect = [
+        zapi_response([snapshot("a"), snapshot("b")], next_tag="<tag>"),
+        zapi_response([snapshot("c")])]
+
+    assert all_pages(storage.snapshots_page, limit=2,
+                     volume_name="vol") == [["a", "b"], ["c"]]
+
+    first_call, second_call = [c[0][0]
+                               for c in server.perform_call.call_args_list]
+    assert first_call.findtext('max-records') == "2"
+    assert first_call.find('tag') is None
+    assert second_call.findtext('tag') == "<tag>"
+    assert second_call.findtext('query/snapshot-info/volume') == "vol"
+
+
+def test_netapp_volumes_page_pushes_down_query():
+    with mock.patch('netapp.api.Server') as server:
+        storage = NetappStorage(hostname="h", username="u", password="p",
+                                vserver="vs")
+    server = server.return_value
+    X = netapp.api.X
+
+    def make_volume(record):
+        volume = mock.MagicMock(state="online",
+                                containing_aggregate_name="aggr1",
+                                junction_path="/" + record.text)
+        volume.name = record.text
+        return volume
+
+    server.volumes.make_volume.side_effect = make_volume
+    storage.format_volume = lambda v: {'name': v.name,
+                                       'junction_path': v.junction_path,
+                                       'aggregate_name': "aggr1"}
+    server.perform_call.return_value = zapi_response(
+        [X('volume-attributes', "vol1")], next_tag="tag")
+
+    volumes, cursor = storage.volumes_page(limit=1, aggregate_name="aggr1")
+
+    assert [v['name'] for v in volumes] == ["vol1"]
+    assert cursor is not None
+    api_call = server.perform_call.call_args[0][0]
+    assert api_call.findtext('query/volume-attributes/volume-id-attributes/'
+                             'containing-aggregate-name') == "aggr1"
+    assert storage.parse_volume_name("node:/vol1") == "vol1"
+
+
+@on_all_backends
+def test_iterators_match_listings(storage, recorder):
+    if isinstance(storage, NetappStorage):
+        return
+
+    storage.create_volume("vol")
+    storage.create_snapshot("vol", "snap")
+    storage.create_policy("policy", ["10.0.0.1"])
+
+    assert list(storage.iter_volumes()) == storage.volumes
+    assert list(storage.iter_volumes(name_prefix="x")) == []
+    assert list(storage.iter_snapshots("vol")) == storage.get_snapshots("vol")
+    assert list(storage.iter_policies()) == storage.policies
+
+
+def test_netapp_iter_volumes_is_lazy():
+    with mock.patch('netapp.api.Server') as server:
+        storage = NetappStorage(hostname="h", username="u", password="p",
+                                vserver="vs")
+    server = server.return_value
+    fetched = []
+
+    def filter_volumes(**query):
+        for i in range(3):
+            volume = mock.MagicMock(state="online",
+                                    containing_aggregate_name="aggr1")
+            volume.name = "vol{}".format(i)
+            fetched.append(volume.name)
+            yield volume
+
+    server.volumes.filter.side_effect = filter_volumes
+    storage.format_volume = lambda v: {'name': v.name}
+
+    volumes = storage.iter_volumes(name_prefix="vol")
+    assert next(volumes)['name'] == "vol0"
+    assert fetched == ["vol0"]
+
+
+def test_validators_are_cached_per_thread():
+    v = validator_for('volume', allow_unknown=True)
+    assert validator_for('volume', allow_unknown=True) is v
+    assert validator_for('volume') is not v
+
+    other_threads = []
+    thread = threading.Thread(
+        target=lambda: other_threads.append(validator_for('volume',
+                                                          allow_unknown=True)))
+    thread.start()
+    thread.join()
+    assert other_threads[0] is not v
+
+
+def test_normalised_records_skip_revalidation():
+    @normalised_with('snapshot', as_list=True)
+    def snapshots(records):
+        return records
+
+    records = snapshots([{'name': "snap", 'size_kbytes': 1}])
+    assert isinstance(records[0], NormalisedRecord)
+
+    trusted = copy.deepcopy(records)
+    with mock.patch('cerberus.Validator.validate') as validate:
+        assert snapshots(trusted) == records
+        assert validate.call_count == 0
+
+    trusted[0]['size_kbytes'] = -1
+    with pytest.raises(ValidationError):
+        snapshots(trusted)
+
+
+def test_trust_depends_on_options():
+    @normalised_with('volume', allow_unknown=True)
+    def lenient(record):
+        return record
+
+    @normalised_with('volume')
+    def strict(record):
+        return record
+
+    record = lenient({'name': "vol", 'size_used': 0, 'size_total': 1,
+                      'filer_address': "filer", 'colour': "blue"})
+    with pytest.raises(ValidationError):
+        strict(record)
+
+
+@on_all_backends
+def test_listings_revalidate_modified_volumes(storage, recorder):
+    if isinstance(storage, NetappStorage):
+        return
+
+    storage.create_volume("vol")
+    storage.volumes
+    with mock.patch('cerberus.Validator.validate',
+                    side_effect=lambda *args, **kwargs: True) as validate:
+        storage.volumes
+        assert validate.call_count == 0
+        storage.patch_volume("vol", size_total=10)
+    assert storage.volumes[0]['size_total'] == 10
+
+
+def test_dummy_snapshots_are_validated_once():
+    storage = DummyStorage()
+    storage.create_volume("vol")
+    storage.create_snapshot("vol", "snap")
+    storage.get_snapshots("vol")
+    with mock.patch('cerberus.Validator.validate') as validate:
+        assert [s['name'] for s in storage.get_snapshots("vol")] == ["snap"]
+        assert validate.call_count == 0
+
+
+@contextmanager
+def frequent_thread_switches():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        yield
+    finally:
+        sys.setswitchinterval(interval)
+
+
+def run_threads(target, count):
+    """
+    Run target(number) in count threads started together, and return
+    the unexpected exceptions they raised.
+    """
+    barrier = threading.Barrier(count)
+    failures = []
+
+    def run(number):
+        barrier.wait()
+        try:
+            target(number)
+        except Exception as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=run, args=(n, ))
+               for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return failures
+
+
+def test_dummy_is_thread_safe():
+    storage = DummyStorage()
+    thread_count = 16
+    rounds = 20
+    created = {}
+    owners = {}
+    storage.create_policy("policy", [])
+
+    def contend(number):
+        for round in range(rounds):
+            # Everyone races for the same volume, then for its lock
+            name = "vol_{}".format(round)
+            try:
+                storage.create_volume(name)
+                created.setdefault(name, []).append(number)
+            except KeyError:
+                pass
+            try:
+                storage.create_lock(name, "host_{}".format(number))
+                owners.setdefault(name, []).append(number)
+            except ValueError:
+                pass
+
+            # Work on a volume of our own while others list and page
+            own = "own_{}_{}".format(number, round)
+            storage.create_volume(own)
+            storage.create_snapshot(own, "snap")
+            storage.patch_volume(own, size_total=round)
+            storage.set_policy(own, "policy")
+            storage.ensure_policy_rule_present("policy", own)
+            storage.clone_volume(own + "_clone", own, "snap")
+            storage.get_snapshots(own)
+            storage.snapshots_page(own, limit=1)
+            storage.delete_snapshot(own, "snap")
+            storage.volumes_page(limit=5, name_prefix="own_")
+            storage.query_volumes(name_prefix="vol_")
+            list(storage.iter_volumes())
+            storage.ensure_policy_rule_absent("policy", own)
+            if round % 2:
+                storage.restrict_volume(own + "_clone")
+
+    with frequent_thread_switches():
+        assert run_threads(contend, thread_count) == []
+
+    for round in range(rounds):
+        name = "vol_{}".format(round)
+        assert len(created[name]) == 1
+        assert len(owners[name]) == 1
+        assert storage.locks(name) == "host_{}".format(owners[name][0])
+
+    assert len(storage.vols) == rounds + thread_count * (rounds + rounds // 2)
+    assert [name for _, name in storage.sorted_names] == sorted(storage.vols)
+    for key, index in storage.attribute_index.items():
+        assert set().union(*index.values()) == set(storage.vols)
+        for value, names in index.items():
+            assert all(storage.vols[name].get(key) == value
+                       for name in names)
+    assert storage.get_policy("policy") == []
+    for number in range(thread_count):
+        own = "own_{}_{}".format(number, rounds - 1)
+        assert storage.get_volume(own)['size_total'] == rounds - 1
+        assert storage.get_volume(own)['active_policy_name'] == "policy"
+        assert storage.get_snapshots(own) == []
@@ -0,0 +1,131 @@
+from storage_api.extensions.transport import (PooledSession, parse_flag,
+                                              after_fork)
+from storage_api.extensions.storage import NetappStorage
+from storage_api.simulator import SimulatedCluster, start_server
+
+import os
+import shutil
+import ssl
+import subprocess
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def cluster():
+    return SimulatedCluster.synthetic(volumes=5, aggregates=1)
+
+
+@pytest.fixture
+def server(cluster):
+    server = start_server(cluster)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def tls_server(cluster, tmpdir):
+    openssl = shutil.which("openssl")
+    if openssl is None:
+        pytest.skip("openssl is not installed")
+    cert, key = str(tmpdir.join("cert.pem")), str(tmpdir.join("key.pem"))
+    subprocess.check_call([openssl, "req", "-x509", "-newkey", "rsa:2048",
+                           "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                           "-keyout", key, "-out", cert],
+                          stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS)
+    context.load_cert_chain(cert, key)
+    server = start_server(cluster, ssl_context=context)
+    yield server
+    server.shutdown()
+
+
+def netapp(server, cluster, **options):
+    host, port = server.server_address
+    transport_type = "HTTP" if server.ssl_context is None else "HTTPS"
+    return NetappStorage(hostname=host, port=port, username="u",
+                         password="p", vserver=cluster.vserver,
+                         transport_type=transport_type, **options)
+
+
+def warm_up(storage, connections):
+    data, headers = storage._warm_up_call()
+    return storage.transport.warm_up(storage.server.ontap_api_url,
+                                     connections, data=data,
+                                     headers=headers)
+
+
+def test_parse_flag():
+    assert parse_flag(True) is True
+    assert parse_flag("Yes") is True
+    assert parse_flag("0") is False
+    with pytest.raises(ValueError):
+        parse_flag("maybe")
+
+
+def test_connections_are_reused(server, cluster):
+    storage = netapp(server, cluster)
+    for _ in range(10):
+        storage.volumes
+    assert storage.transport.stats()['connections_opened'] == 1
+
+
+def test_pool_is_rebuilt_after_fork(server, cluster):
+    storage = netapp(server, cluster)
+    storage.volumes
+    adapter = storage.transport.get_adapter(storage.server.ontap_api_url)
+
+    with mock.patch('os.getpid', return_value=os.getpid() + 1):
+        storage.volumes
+        assert storage.transport.get_adapter(
+            storage.server.ontap_api_url) is not adapter
+        assert storage.transport.stats()['connections_opened'] == 1
+
+
+def test_warm_up(server, cluster):
+    storage = netapp(server, cluster, pool_size=4)
+    assert warm_up(storage, 8) == 4
+    assert cluster.calls['system-get-version'] == 4
+    for _ in range(3):
+        storage.volumes
+    assert storage.transport.stats()['connections_opened'] == 4
+
+    url = storage.server.ontap_api_url
+    assert storage.transport.warm_up(url, 2) == 2
+    assert storage.transport.stats()['connections_opened'] == 4
+
+
+def test_warm_up_on_first_call_without_uwsgi(server, cluster):
+    assert not after_fork(lambda: None)
+    storage = netapp(server, cluster, warm_connections="3")
+    storage.volumes
+    assert cluster.calls['system-get-version'] == 3
+    assert storage.transport.stats()['connections_opened'] == 3
+
+
+def test_tls_sessions_are_resumed(tls_server, cluster):
+    storage = netapp(tls_server, cluster, pool_size="2")
+    storage.volumes
+    assert warm_up(storage, 2) == 2
+    for _ in range(3):
+        storage.volumes
+    stats = storage.transport.stats()
+    assert stats['tls_handshakes'] == 2
+    assert stats['tls_resumptions'] == 1
+
+
+def test_without_keepalive(tls_server, cluster):
+    storage = netapp(tls_server, cluster, keepalive="false",
+                     tls_resumption="false")
+    for _ in range(3):
+        storage.volumes
+    stats = storage.transport.stats()
+    assert stats['tls_handshakes'] == sum(cluster.calls.values())
+    assert stats['tls_resumptions'] == 0
+
+
+def test_pool_size_must_be_positive():
+    with pytest.raises(ValueError):
+        PooledSession(pool_size=0)
@@ -0,0 +1,80 @@
+from storage_api.extensions.validation import ValidationPolicy
+from storage_api.extensions.storage import (DummyStorage, ValidationError,
+                                            normalised_with)
+
+import pytest
+
+
+class Backend(object):
+    def __init__(self, validation, records):
+        self.validation = ValidationPolicy.parse(validation)
+        self.records = records
+
+    @normalised_with('snapshot', as_list=True)
+    def snapshots(self):
+        return self.records
+
+
+def snapshot(size_kbytes=1):
+    return {'name': "snap", 'size_kbytes': size_kbytes}
+
+
+@pytest.mark.parametrize('spec,mode,sample_every', [
+    ("strict", "strict", 1),
+    ("off", "off", 1),
+    ("sampled", "sampled", 100),
+    ("sampled:7", "sampled", 7)])
+def test_parse(spec, mode, sample_every):
+    policy = ValidationPolicy.parse(spec)
+    assert policy.mode == mode
+    assert policy.sample_every == sample_every
+    assert ValidationPolicy.parse(str(policy)).sample_every == sample_every
+
+
+@pytest.mark.parametrize('spec', ["sloppy", "sampled:0", "sampled:x",
+                                  "strict:3"])
+def test_parse_invalid(spec):
+    with pytest.raises(ValueError):
+        ValidationPolicy.parse(spec)
+
+
+def test_strict_validates_everything():
+    backend = Backend("strict", [snapshot(), snapshot(-1)])
+    with pytest.raises(ValidationError):
+        backend.snapshots()
+
+    stats = backend.validation.stats()
+    assert stats['validated'] == 1
+    assert stats['failed'] == 1
+    assert stats['seconds'] > 0
+
+
+def test_off_validates_nothing():
+    records = [snapshot(-1)]
+    backend = Backend("off", records)
+    assert backend.snapshots() == records
+    assert backend.validation.stats()['skipped'] == 1
+
+
+def test_sampled_reports_failures():
+    backend = Backend("sampled:3", [snapshot(-1)] * 9)
+    assert backend.snapshots() == [snapshot(-1)] * 9
+
+    stats = backend.validation.stats()
+    assert stats['failed'] == 3
+    assert stats['skipped'] == 6
+    assert stats['mode'] == "sampled:3"
+
+
+def test_trusted_records_are_counted():
+    backend = Backend("strict", [snapshot()])
+    backend.records = backend.snapshots()
+    backend.snapshots()
+    assert backend.validation.stats()['trusted'] == 1
+
+
+def test_backend_option():
+    storage = DummyStorage(validation="off")
+    storage.create_volume("vol")
+    storage.vols["vol"]['size_total'] = -1
+    assert storage.volumes[0]['size_total'] == -1
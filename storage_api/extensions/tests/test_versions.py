@@ -0,0 +1,69 @@
+from storage_api.extensions.versions import (RecentVolumes, check_version,
+                                             volume_version,
+                                             PreconditionFailed)
+
+from datetime import datetime
+import time
+from unittest import mock
+
+import pytest
+
+
+def test_versions_follow_the_record():
+    volume = {'name': "vol", 'size_total': 1,
+              'creation_time': datetime(2017, 1, 1)}
+    version = volume_version(volume)
+    assert version == volume_version(dict(reversed(list(volume.items()))))
+    assert version != volume_version(dict(volume, size_total=2))
+    assert version == volume_version(dict(volume, size_used=1))
+
+    check_version(volume, None)
+    check_version(volume, {version, "other"})
+    with pytest.raises(PreconditionFailed):
+        check_version(volume, {"other"})
+
+
+def test_recent_volumes(tmpdir):
+    recent = RecentVolumes(max_age_s=10, max_entries=2,
+                           directory=str(tmpdir))
+    volume = {'name': "vol", 'size_total': 1}
+    version = volume_version(volume)
+    recent.add("vol", volume)
+    volume['size_total'] = 2
+
+    assert recent.get("vol", {version}) == {'name': "vol", 'size_total': 1}
+    assert recent.get("vol", {"other"}) is None
+    assert recent.get("other", {version}) is None
+
+    with mock.patch('time.time', return_value=time.time() + 3600):
+        assert recent.get("vol", {version}) is None
+
+    recent.add("vol2", volume)
+    recent.add("vol3", volume)
+    assert len(recent) == 2
+    assert recent.get("vol", {version}) is None
+
+    recent.discard("vol2")
+    assert len(recent) == 1
+
+    for disabled in [RecentVolumes(max_age_s=0, directory=str(tmpdir)),
+                     RecentVolumes(max_age_s=10)]:
+        disabled.add("vol", volume)
+        assert len(disabled) == 0
+
+
+def test_recent_volumes_share_changes(tmpdir):
+    workers = [RecentVolumes(max_age_s=10, directory=str(tmpdir))
+               for _ in range(2)]
+    volume = {'name': "vol", 'size_total': 1}
+    version = volume_version(volume)
+    workers[0].add("vol", volume)
+    workers[0].add("vol2", volume)
+
+    workers[1].changed("vol")
+    assert workers[0].get("vol", {version}) is None
+    assert workers[0].get("vol2", {version}) == volume
+
+    workers[0].add("vol", volume)
+    with mock.patch('time.time', return_value=time.time() + 1):
+        assert workers[0].get("vol", {version}) == volume
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+A pooled HTTP(S) transport for ZAPI calls.
+
+`netapp.api.Server` posts every call through a `requests.Session`,
+which we replace with a `PooledSession`: a fixed-size pool of
+keep-alive connections per filer, shared by the threads of a worker,
+whose TLS handshakes resume earlier sessions instead of negotiating new
+ones. Connections do not survive forking (a parent and its uWSGI
+workers must never share a socket), so the pool is rebuilt in every new
+process, and optionally warmed up right after the fork (see
+`after_fork`) so that no request pays for the handshakes.
+"""
+from storage_api.utils import init_logger
+
+import os
+import socket
+import ssl
+import threading
+import urllib.parse
+import weakref
+
+import requests
+import requests.adapters
+from requests.packages.urllib3.connectionpool import (HTTPConnectionPool,
+                                                      HTTPSConnectionPool)
+
+log = init_logger()
+
+
+def parse_flag(value):
+    """
+    Parse a boolean back-end option, given as a bool or as a string like
+    "true" or "no".
+
+    Raises:
+        ValueError: if value is not a recognisable boolean
+    """
+    if isinstance(value, bool):
+        return value
+    flag = str(value).strip().lower()
+    if flag in ["1", "true", "yes", "on"]:
+        return True
+    if flag in ["0", "false", "no", "off"]:
+        return False
+    raise ValueError("Invalid boolean: '{}'. Expected true or false"
+                     .format(value))
+
+
+def after_fork(callback):
+    """
+    Run callback in every uWSGI worker right after it has been forked.
+
+    Returns False if we are not running under uWSGI, in which case the
+    callback is not registered.
+    """
+    try:
+        import uwsgidecorators
+    except ImportError:
+        return False
+    uwsgidecorators.postfork(callback)
+    return True
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """
+    A client SSL context offering the last TLS session it saw to every
+    new connection, so that re-connecting to the same filer resumes it
+    (an abbreviated handshake) instead of negotiating a new one.
+
+    Certificates are not verified (see `netapp.api`), so hostnames are
+    not checked either.
+    """
+
+    def __init__(self, *, resumption=True):
+        super().__init__()
+        self.check_hostname = False
+        self.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+        self.options |= ssl.OP_NO_COMPRESSION
+        self.resumption = resumption
+        self.handshakes = 0
+        self.resumptions = 0
+        self._session = None
+        self._sockets = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._default_certs_loaded = False
+
+    def load_default_certs(self, *args, **kwargs):
+        # urllib3 calls this on every connection
+        if not self._default_certs_loaded:
+            super().load_default_certs(*args, **kwargs)
+            self._default_certs_loaded = True
+
+    def _resumable_session(self):
+        # TLS 1.3 tickets arrive after the handshake, so the sessions of
+        # connections are collected when the next one is made, not when
+        # they are opened
+        with self._lock:
+            for sock in list(self._sockets):
+                try:
+                    session = sock.session
+                except (OSError, ValueError):
+                    session = None
+                if session is not None:
+                    self._session = session
+            return self._session
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        if self.resumption and kwargs.get('session') is None:
+            kwargs['session'] = self._resumable_session()
+        ssl_sock = super().wrap_socket(sock, *args, **kwargs)
+        with self._lock:
+            self.handshakes += 1
+            if ssl_sock.session_reused:
+                self.resumptions += 1
+            if self.resumption:
+                self._sockets.add(ssl_sock)
+        return ssl_sock
+
+
+class ClosingPoolMixin(object):
+    """
+    Close connections as soon as they are returned to the pool, so that
+    every call opens a connection of its own.
+    """
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.close()
+        super()._put_conn(conn)
+
+
+class ClosingHTTPConnectionPool(ClosingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class ClosingHTTPSConnectionPool(ClosingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledAdapter(requests.adapters.HTTPAdapter):
+    """
+    An adapter keeping up to pool_size connections open per host,
+    negotiating TLS through ssl_context and, with keepalive, sending TCP
+    keep-alive probes on idle connections so that firewalls do not drop
+    them.
+
+    Calls made while every pooled connection is busy open an extra
+    connection rather than waiting, which is closed after use. Without
+    keepalive, every connection is closed after use.
+    """
+
+    def __init__(self, pool_size, ssl_context, keepalive=True):
+        self.ssl_context = ssl_context
+        self.keepalive = keepalive
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        if self.keepalive:
+            kwargs['socket_options'] = [
+                (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        super().init_poolmanager(*args, **kwargs)
+        if not self.keepalive:
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': ClosingHTTPConnectionPool,
+                'https': ClosingHTTPSConnectionPool}
+
+
+class PooledSession(requests.Session):
+    """
+    A `requests.Session` sending every request through a
+    `PooledAdapter`, rebuilt in every process.
+
+    Args:
+        pool_size (int): the number of connections kept open per host
+        keepalive (bool): reuse connections between calls. Otherwise,
+            every call opens (and closes) a connection of its own.
+        tls_resumption (bool): resume TLS sessions when re-connecting
+    """
+
+    def __init__(self, pool_size=10, keepalive=True, tls_resumption=True):
+        super().__init__()
+        if pool_size < 1:
+            raise ValueError("Connection pool size must be positive, not {}"
+                             .format(pool_size))
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.tls_resumption = tls_resumption
+        if not keepalive:
+            self.headers['Connection'] = "close"
+        self._pid = None
+        self._mount_lock = threading.Lock()
+        self._warm_up = None
+
+    def __repr__(self):
+        return ("PooledSession(pool_size={}, keepalive={}, tls_resumption={})"
+                .format(self.pool_size, self.keepalive, self.tls_resumption))
+
+    def _check_pid(self):
+        """
+        Mount fresh adapters if this is a new process. The pools of the
+        parent are dropped without being closed, as their sockets are
+        still in use there.
+        """
+        if self._pid == os.getpid():
+            return False
+
+        with self._mount_lock:
+            if self._pid == os.getpid():
+                return False
+            self.ssl_context = ResumingSSLContext(
+                resumption=self.tls_resumption)
+            for prefix in ['https://', 'http://']:
+                self.mount(prefix, PooledAdapter(self.pool_size,
+                                                 self.ssl_context,
+                                                 keepalive=self.keepalive))
+            self._pid = os.getpid()
+            return True
+
+    def request(self, *args, **kwargs):
+        if self._check_pid() and self._warm_up is not None:
+            self.warm_up(**self._warm_up)
+        return super().request(*args, **kwargs)
+
+    def warm_up(self, url, connections, data=None, headers=None,
+                timeout_s=None):
+        """
+        Open up to connections connections to the host of url
+        concurrently, and return them to the pool.
+
+        If data is given, it is POSTed to url with headers on every
+        connection, which should be a cheap call: TLS 1.3 session
+        tickets only arrive after the handshake, and a connection with
+        unread tickets looks dropped to urllib3, which would re-open it.
+
+        Failures are logged, not raised: the call that needs the
+        connection will open it again. Returns the number of
+        connections opened.
+        """
+        self._check_pid()
+        if not self.keepalive:
+            return 0
+
+        adapter = self.get_adapter(url)
+        pool = adapter.get_connection(url)
+        # netapp.api never verifies certificates
+        adapter.cert_verify(pool, url, verify=False, cert=None)
+        path = urllib.parse.urlsplit(url).path
+
+        # These are urllib3 internals, but its public API can only open
+        # connections one request at a time, and may reuse them
+        opened = []
+
+        def connect():
+            connection = pool._get_conn()
+            if timeout_s is not None:
+                connection.timeout = timeout_s
+            try:
+                if data is not None:
+                    connection.request("POST", path, body=data,
+                                       headers=headers or {})
+                    connection.getresponse().read()
+                elif connection.sock is None:
+                    connection.connect()
+            except Exception as e:
+                log.warning("Failed to warm up a connection to {}: {}"
+                            .format(url, e))
+                connection.close()
+            opened.append(connection)
+
+        threads = [threading.Thread(target=connect, name="pool-warm-up")
+                   for _ in range(min(connections, self.pool_size))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for connection in opened:
+            pool._put_conn(connection)
+
+        warmed = sum(connection.sock is not None for connection in opened)
+        log.info("Warmed up {} connection(s) to {}".format(warmed, url))
+        return warmed
+
+    def warm_up_after_fork(self, url, connections, **options):
+        """
+        Warm up connections to url (see `warm_up`) in the background in
+        every uWSGI worker after it has been forked or, when not running
+        under uWSGI, on the first call of every process.
+        """
+        def warm_up_in_background():
+            self._check_pid()
+            threading.Thread(target=self.warm_up, args=(url, connections),
+                             kwargs=options, name="pool-warm-up",
+                             daemon=True).start()
+
+        if not after_fork(warm_up_in_background):
+            self._warm_up = dict(options, url=url, connections=connections)
+
+    def stats(self):
+        """
+        Return the transport settings, the number of connections opened
+        by the current pools, and the number of TLS handshakes made and
+        of those that resumed an earlier session, in this process.
+        """
+        self._check_pid()
+        opened = 0
+        for adapter in self.adapters.values():
+            for key in adapter.poolmanager.pools.keys():
+                opened += adapter.poolmanager.pools[key].num_connections
+        return {'pool_size': self.pool_size,
+                'keepalive': self.keepalive,
+                'tls_resumption': self.tls_resumption,
+                'connections_opened': opened,
+                'tls_handshakes': self.ssl_context.handshakes,
+                'tls_resumptions': self.ssl_context.resumptions}
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Policies for how much back-end return values are validated.
+
+Back-end methods decorated with `normalised_with` validate their return
+values against a schema. Since most of that data comes straight from
+our own storage systems, each back-end can choose how much of it to
+check:
+
+- strict: validate every record, raising a ValidationError on invalid
+  ones. This is the default.
+- sampled:N: validate one in every N records (N defaults to 100).
+  Invalid records are logged and counted, but returned as-is.
+- off: never validate, returning records as-is.
+
+Policies also count records and time spent validating, so the cost of
+validation can be measured.
+"""
+from storage_api.utils import init_logger
+from storage_api.metrics import record_timing
+
+import itertools
+import threading
+import time
+
+log = init_logger()
+
+VALIDATION_MODES = ['strict', 'sampled', 'off']
+DEFAULT_SAMPLE_EVERY = 100
+
+
+class ValidationPolicy(object):
+    """
+    How, and how often, the return values of a back-end are validated.
+    """
+
+    def __init__(self, mode='strict', sample_every=DEFAULT_SAMPLE_EVERY):
+        if mode not in VALIDATION_MODES:
+            raise ValueError("Unknown validation mode '{}'. Valid modes"
+                             " are: {}"
+                             .format(mode, ", ".join(VALIDATION_MODES)))
+        if sample_every < 1:
+            raise ValueError("Cannot sample one in every {} records"
+                             .format(sample_every))
+
+        self.mode = mode
+        self.sample_every = sample_every if mode == 'sampled' else 1
+        self._records = itertools.count()
+        self._lock = threading.Lock()
+        self._counts = {'validated': 0, 'skipped': 0, 'trusted': 0,
+                        'failed': 0}
+        self._seconds = 0.0
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Make a ValidationPolicy from a string like `strict`, `off`,
+        `sampled` or `sampled:N`, as given in back-end configuration.
+
+        Raises:
+            ValueError: on invalid specifications
+        """
+        if isinstance(spec, cls):
+            return spec
+
+        mode, _, sample_every = str(spec).strip().partition(":")
+        if sample_every and mode != 'sampled':
+            raise ValueError("Only sampled validation takes a rate, not {}"
+                             .format(spec))
+        try:
+            sample_every = (int(sample_every) if sample_every
+                            else DEFAULT_SAMPLE_EVERY)
+        except ValueError:
+            raise ValueError("Invalid sampling rate in '{}'".format(spec))
+
+        return cls(mode=mode, sample_every=sample_every)
+
+    def __str__(self):
+        if self.mode == 'sampled':
+            return "sampled:{}".format(self.sample_every)
+        return self.mode
+
+    def __repr__(self):
+        return "ValidationPolicy({})".format(self)
+
+    def _count(self, outcome, seconds=0.0):
+        with self._lock:
+            self._counts[outcome] += 1
+            self._seconds += seconds
+
+    def count_trusted(self):
+        """
+        Record that a record was passed through without validation
+        because it had already been validated.
+        """
+        self._count('trusted')
+
+    def check(self, validate, record):
+        """
+        Apply the policy to a record, returning either the result of
+        calling validate(record) or the record as-is.
+
+        Raises whatever validate raises on invalid records, but only in
+        strict mode.
+        """
+        if self.mode == 'off' or (self.mode == 'sampled'
+                                  and next(self._records)
+                                  % self.sample_every):
+            self._count('skipped')
+            return record
+
+        start = time.perf_counter()
+        try:
+            validated = validate(record)
+        except Exception as e:
+            self._record('failed', time.perf_counter() - start)
+            if self.mode == 'strict':
+                raise
+            log.warning("Sampled validation failed for {}: {}"
+                        .format(record, e))
+            return record
+
+        self._record('validated', time.perf_counter() - start)
+        return validated
+
+    def _record(self, outcome, seconds):
+        self._count(outcome, seconds)
+        record_timing('validation', seconds)
+
+    def stats(self):
+        """
+        Return a dictionary with the policy and the number of records
+        that were validated, skipped, trusted (already validated) and
+        failed validation, and the total time spent validating.
+        """
+        with self._lock:
+            return dict(self._counts, mode=str(self),
+                        seconds=self._seconds)
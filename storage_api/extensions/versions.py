@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Volume versions, for conditional updates.
+
+The version of a volume is a digest of the fields of its record (as
+returned by `get_volume`) that clients can set, served as its ETag.
+Fields that change on their own, like size_used, are left out. A
+client sending the version back with a PATCH (in If-Match) states
+which version it is modifying: the update fails with a
+`PreconditionFailed` if the volume has changed since.
+
+Back-ends for which fetching a volume is expensive may remember the
+volumes they recently returned in a `RecentVolumes` cache, and skip
+fetching the volume again when the client's version matches it. Every
+change made through the back-end must be reported to the cache, which
+shares them with other worker processes through a directory. Without
+one, nothing is remembered.
+"""
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+
+# The fields of a volume that clients can set, and that make its version
+VERSIONED_FIELDS = ['active_policy_name', 'autosize_enabled',
+                    'caching_policy', 'compression_enabled',
+                    'inline_compression', 'max_autosize',
+                    'percentage_snapshot_reserve', 'size_total']
+
+
+class PreconditionFailed(Exception):
+    """
+    An Exception raised when a conditional update finds a different
+    version of its target than the one it expected.
+    """
+    pass
+
+
+def volume_version(volume):
+    """
+    Return the version of the volume record volume, as a hex digest of
+    its VERSIONED_FIELDS.
+    """
+    serialised = json.dumps({k: volume.get(k, None)
+                             for k in VERSIONED_FIELDS},
+                            sort_keys=True, default=str)
+    return hashlib.sha1(serialised.encode('utf-8')).hexdigest()
+
+
+def check_version(volume, expected_versions):
+    """
+    Raise PreconditionFailed unless expected_versions is None (no
+    condition) or contains the version of volume.
+    """
+    if expected_versions is None:
+        return
+    version = volume_version(volume)
+    if version not in expected_versions:
+        raise PreconditionFailed(
+            "Volume {} has changed: its current version is {}"
+            .format(volume.get('name'), version))
+
+
+class RecentVolumes(object):
+    """
+    The volume records a back-end recently returned, by volume name,
+    for up to max_age_s seconds, and at most max_entries of them (the
+    least recently seen are evicted first).
+
+    Records are forgotten when their volume is reported as changed.
+    Changes are also recorded in directory, as one stamp file per
+    volume, so that records are not used after a change made by any
+    process sharing it. If directory is not set, nothing is
+    remembered, as the changes made by other processes could not be
+    seen. Changes made outside of the API are not seen either.
+    """
+
+    def __init__(self, max_age_s, max_entries=10000, directory=None):
+        self.max_age_s = float(max_age_s)
+        self.max_entries = max_entries
+        self.directory = directory
+        # name -> (version, record, seen at)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_age_s > 0 and bool(self.directory)
+
+    def _stamp_path(self, name):
+        digest = hashlib.sha1(str(name).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, "changed-{}".format(digest))
+
+    def _changed_at(self, name):
+        try:
+            return os.stat(self._stamp_path(name)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, name, volume):
+        if not self.enabled:
+            return
+        entry = (volume_version(volume), copy.deepcopy(volume),
+                 time.time())
+        with self._lock:
+            self._entries.pop(name, None)
+            self._entries[name] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def changed(self, name):
+        """
+        Forget the record of the volume name, in every process sharing
+        the directory.
+        """
+        with self._lock:
+            self._entries.pop(name, None)
+        if self.enabled:
+            with open(self._stamp_path(name), "a"):
+                pass
+            os.utime(self._stamp_path(name))
+
+    def get(self, name, expected_versions):
+        """
+        Return a copy of the record of the volume name if it was seen
+        recently enough, in one of expected_versions, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(name, None)
+        if entry is None:
+            return None
+        version, volume, seen_at = entry
+        if (time.time() - seen_at > self.max_age_s
+                or version not in expected_versions):
+            return None
+        changed_at = self._changed_at(name)
+        if changed_at is not None and changed_at >= seen_at:
+            self.discard(name)
+            return None
+        return copy.deepcopy(volume)
+
+    def discard(self, name):
+        with self._lock:
+            self._entries.pop(name, None)
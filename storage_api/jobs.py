@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Background jobs for long-running operations.
+
+Clients may ask for a slow operation (e.g. cloning a volume) to be run
+asynchronously: the request then returns at once with the id of a job,
+run by a bounded pool of threads in the same process, whose status and
+result are served at `/jobs/<id>`.
+
+When running with several worker processes (e.g. under uWSGI), jobs
+are kept as files in a shared directory, so that any worker can report
+on any job. Otherwise, they are kept in memory.
+"""
+from storage_api.utils import init_logger
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+import time
+import uuid
+
+import flask
+from werkzeug.exceptions import HTTPException
+
+log = init_logger()
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 100
+# How long finished jobs are kept, in seconds
+DEFAULT_RETENTION_S = 3600
+PRUNE_INTERVAL_S = 60
+
+FINISHED_STATES = ['succeeded', 'failed']
+
+
+class TooManyJobs(Exception):
+    """
+    An Exception raised when a job is submitted while the maximum number
+    of jobs are already queued or running in this process.
+    """
+    pass
+
+
+def _now():
+    return time.time()
+
+
+class JobStore(object):
+    """
+    A thread-safe store of job documents (dictionaries) by id, in memory
+    or, if directory is set, as one JSON file per job in it.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, "job-{}.json".format(job_id))
+
+    def put(self, job):
+        if not self.directory:
+            with self._lock:
+                self._jobs[job['id']] = dict(job)
+            return
+
+        path = self._path(job['id'])
+        temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(temp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(temp_path, path)
+
+    def get(self, job_id):
+        """
+        Return the job job_id.
+
+        Raises:
+            KeyError: if there is no such job
+        """
+        if not self.directory:
+            with self._lock:
+                return dict(self._jobs[job_id])
+
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise KeyError("No such job: {}".format(job_id))
+
+    def _ids(self):
+        if not self.directory:
+            with self._lock:
+                return list(self._jobs)
+        return [name[len("job-"):-len(".json")]
+                for name in os.listdir(self.directory)
+                if name.startswith("job-") and name.endswith(".json")]
+
+    def remove(self, job_id):
+        if not self.directory:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            return
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, older_than_s):
+        """
+        Remove the jobs that finished more than older_than_s seconds ago.
+        """
+        for job_id in self._ids():
+            try:
+                job = self.get(job_id)
+            except KeyError:
+                continue
+            if (job['status'] in FINISHED_STATES
+                    and _now() - job['finished'] > older_than_s):
+                self.remove(job_id)
+
+
+def error_response(exception):
+    """
+    Return the HTTP status code and the body the request would have
+    failed with if exception had been raised while handling it
+    synchronously.
+    """
+    if isinstance(exception, HTTPException):
+        body = getattr(exception, 'data', None) or {
+            'message': exception.description}
+        return exception.code, body
+    summary = getattr(exception, 'summary', None)
+    if summary is not None:
+        return 500, dict(summary(), message=str(exception))
+    return 500, {'message': str(exception)}
+
+
+class JobRunner(object):
+    """
+    Runs jobs on up to workers threads per process, refusing new jobs
+    while max_pending are queued or running, and keeps their documents
+    in a `JobStore` for retention_s seconds after they finished.
+    """
+
+    def __init__(self, store, workers=DEFAULT_WORKERS,
+                 max_pending=DEFAULT_MAX_PENDING,
+                 retention_s=DEFAULT_RETENTION_S):
+        if workers < 1:
+            raise ValueError("Job workers must be positive, not {}"
+                             .format(workers))
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention_s = retention_s
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._last_prune = _now()
+        self._lock = threading.Lock()
+
+    def _check_pid(self):
+        # Threads, and the jobs they run, do not survive forking
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.workers,
+                                                thread_name_prefix="job")
+            self._pending = 0
+            self._pid = os.getpid()
+
+    def submit(self, operation, subsystem, target, run, app=None):
+        """
+        Run run() in the background, in an app context of app (the
+        current app by default), and return the document of its job.
+
+        run returns the (body, status code) of the response it would
+        have given synchronously, and may raise any exception the
+        request handler would have raised, e.g. through api.abort().
+
+        Raises:
+            TooManyJobs: if max_pending jobs are pending in this process
+        """
+        app = app or flask.current_app._get_current_object()
+        job = {'id': uuid.uuid4().hex, 'operation': operation,
+               'subsystem': subsystem, 'target': target,
+               'status': 'queued', 'pid': os.getpid(),
+               'submitted': _now(), 'started': None, 'finished': None,
+               'code': None, 'result': None}
+
+        with self._lock:
+            self._check_pid()
+            if self._pending >= self.max_pending:
+                raise TooManyJobs("{} jobs are already pending"
+                                  .format(self._pending))
+            self._pending += 1
+            self.store.put(job)
+            self._executor.submit(self._run, app, dict(job), run)
+
+        self._maybe_prune()
+        log.info("Queued job {} ({} of {} on {})".format(
+            job['id'], operation, target, subsystem))
+        return job
+
+    def _run(self, app, job, run):
+        job.update(status='running', started=_now())
+        try:
+            self.store.put(job)
+            with app.app_context():
+                result, code = run()
+            job.update(status='succeeded', code=code, result=result)
+        except Exception as e:
+            log.warning("Job {} failed: {}".format(job['id'], e))
+            code, body = error_response(e)
+            job.update(status='failed', code=code, result=body)
+        finally:
+            job['finished'] = _now()
+            with self._lock:
+                self._pending -= 1
+            try:
+                self.store.put(job)
+            except Exception:
+                log.exception("Could not record the outcome of job {}"
+                              .format(job['id']))
+
+    def get(self, job_id):
+        """
+        Return the job job_id. Jobs whose worker process exited before
+        they finished are reported as failed.
+
+        Raises:
+            KeyError: if there is no such job
+        """
+        job = self.store.get(job_id)
+        if job['status'] not in FINISHED_STATES and not _alive(job['pid']):
+            job.update(status='failed', code=500, result={
+                'message': "The worker running the job exited"})
+        return job
+
+    def _maybe_prune(self):
+        if _now() - self._last_prune < PRUNE_INTERVAL_S:
+            return
+        self._last_prune = _now()
+        try:
+            self.store.prune(self.retention_s)
+        except OSError as e:
+            log.warning("Could not prune old jobs: {}".format(e))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def init_app(app: flask.Flask, directory=None, workers=DEFAULT_WORKERS,
+             max_pending=DEFAULT_MAX_PENDING):
+    """
+    Install a JobRunner into app, sharing jobs between worker processes
+    through directory, if set. It must exist and be writable.
+    """
+    if not hasattr(app, 'extensions'):   # pragma: no coverage
+        app.extensions = {}
+
+    runner = JobRunner(JobStore(directory), workers=workers,
+                       max_pending=max_pending)
+    app.extensions['jobs'] = runner
+    return runner
@@ -0,0 +1,724 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Concurrent load tests of the WSGI app, giving throughput and latency as
+a function of server processes, threads and client concurrency.
+
+The app is served either by a local uWSGI with the options of
+uwsgi.ini (`--target uwsgi`), or by a built-in pre-forking server with
+a fixed pool of threads per process, mimicking it when uWSGI is not
+installed (`--target inprocess`, the default). It serves a `NetappStorage`
+talking to a simulated cluster (see `storage_api.simulator`) running in
+its own process, with latency injected into every ZAPI call, or a
+populated `DummyStorage` (in-process target only; every worker then has
+its own copy).
+
+For every combination of processes and threads, closed-loop clients
+replay a weighted mix of reads and mutations for --duration seconds at
+every level of concurrency, e.g.:
+
+    python -m storage_api.loadtest --processes 1,2,4 --threads 1,2 \\
+        --concurrency 1,2,4,8,16,32 --latency default=0.02 \\
+        --mix get_volume=6,get_snapshots=2,create_snapshot=1
+
+The saturation point of a configuration is the lowest concurrency whose
+throughput is within --tolerance of the best throughput reached; more
+clients beyond it only queue, increasing latency.
+"""
+from storage_api import benchmark
+from storage_api import simulator
+from storage_api.apis import SAPI_MOUNTPOINT
+from storage_api.utils import init_logger
+
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import argparse
+import base64
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import werkzeug.serving
+
+log = init_logger()
+
+TARGETS = ['inprocess', 'uwsgi']
+BACKEND_KINDS = ['netapp', 'dummy']
+ENDPOINT = benchmark.ENDPOINT
+USERNAME = "loadtest"
+PASSWORD = "loadtest"
+UWSGI_INI = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "uwsgi.ini")
+START_TIMEOUT_S = 60.0
+REQUEST_TIMEOUT_S = 120.0  # uwsgi.ini's harakiri
+
+OPERATIONS = OrderedDict()
+
+DEFAULT_MIX = OrderedDict([('get_volume', 48),
+                           ('page_volumes', 2),
+                           ('get_snapshots', 20),
+                           ('get_locks', 10),
+                           ('get_policy', 5),
+                           ('create_snapshot', 5),
+                           ('delete_snapshot', 5),
+                           ('patch_volume', 3),
+                           ('put_rule', 2)])
+
+
+def operation(name):
+    """
+    Decorator: register a load-test operation.
+
+    The decorated function is called with the client state and returns
+    the method, path (relative to the API mount point) and body of the
+    request to make.
+    """
+    def register(func):
+        OPERATIONS[name] = func
+        return func
+    return register
+
+
+def parse_mix(spec):
+    """
+    Parse a mix of operations like "get_volume=3,create_snapshot=1" into
+    an ordered dictionary of operation name to weight.
+
+    Raises ValueError on unknown operations or invalid weights.
+    """
+    mix = OrderedDict()
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in OPERATIONS:
+            raise ValueError("Unknown operation {}, expected one of {}"
+                             .format(name, ", ".join(OPERATIONS)))
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError("Invalid weight in {}".format(item))
+        if mix[name] < 0:
+            raise ValueError("Negative weight in {}".format(item))
+    if not any(mix.values()):
+        raise ValueError("The mix {} has no operations".format(spec))
+    return mix
+
+
+def parse_counts(spec):
+    """
+    Parse a comma-separated list of positive integers.
+    """
+    counts = [int(count) for count in spec.split(",")]
+    if any(count < 1 for count in counts):
+        raise ValueError("Counts must be positive: {}".format(spec))
+    return counts
+
+
+def saturation_point(points, tolerance=0.05):
+    """
+    The first of points (in order of increasing concurrency) whose
+    throughput is within tolerance of the best one, or None if no point
+    completed any request.
+    """
+    best = max((p['ops_per_s'] or 0 for p in points), default=0)
+    if not best:
+        return None
+    return next(p for p in points
+                if (p['ops_per_s'] or 0) >= (1 - tolerance) * best)
+
+
+class ClientState(object):
+    """
+    What a single load-generating client knows about the fleet, and the
+    snapshots it has created (and may delete).
+    """
+
+    def __init__(self, kind, number, volume_count, policy_count,
+                 snapshot_count, seed, prefix="load"):
+        self.kind = kind
+        self.number = number
+        self.prefix = prefix
+        self.volume_count = volume_count
+        self.policy_count = policy_count
+        self.snapshot_count = snapshot_count
+        self.random = random.Random("{}-{}".format(seed, number))
+        self.counter = itertools.count()
+        self.snapshots = []
+
+    def volume_id(self):
+        name = benchmark.Fleet.volume_name(
+            self.random.randrange(self.volume_count))
+        return ":/{}".format(name) if self.kind == 'netapp' else name
+
+    def policy(self):
+        return benchmark.Fleet.policy_name(
+            self.random.randrange(max(self.policy_count, 1)))
+
+    def unique(self):
+        return "{}_{}_{}".format(self.prefix, self.number,
+                                 next(self.counter))
+
+
+def volume_path(volume_id):
+    return "/{}/volumes/{}".format(ENDPOINT, volume_id)
+
+
+@operation('get_volume')
+def op_get_volume(state):
+    return 'GET', volume_path(state.volume_id()), None
+
+
+@operation('page_volumes')
+def op_page_volumes(state):
+    return 'GET', "/{}/volumes?limit=100".format(ENDPOINT), None
+
+
+@operation('get_snapshots')
+def op_get_snapshots(state):
+    return 'GET', "{}/snapshots".format(volume_path(state.volume_id())), None
+
+
+@operation('get_locks')
+def op_get_locks(state):
+    return 'GET', "{}/locks".format(volume_path(state.volume_id())), None
+
+
+@operation('get_policy')
+def op_get_policy(state):
+    return 'GET', "/{}/export/{}".format(ENDPOINT, state.policy()), None
+
+
+@operation('create_snapshot')
+def op_create_snapshot(state):
+    volume_id, snapshot = state.volume_id(), state.unique()
+    state.snapshots.append((volume_id, snapshot))
+    return 'POST', "{}/snapshots/{}".format(volume_path(volume_id),
+                                            snapshot), {}
+
+
+@operation('delete_snapshot')
+def op_delete_snapshot(state):
+    """
+    Delete a snapshot this client created, creating one first if there
+    are none left.
+    """
+    if not state.snapshots:
+        return op_create_snapshot(state)
+    volume_id, snapshot = state.snapshots.pop(
+        state.random.randrange(len(state.snapshots)))
+    return 'DELETE', "{}/snapshots/{}".format(volume_path(volume_id),
+                                              snapshot), None
+
+
+@operation('patch_volume')
+def op_patch_volume(state):
+    return 'PATCH', volume_path(state.volume_id()), {
+        'size_total': (100 + state.random.randrange(100)) * 2**30}
+
+
+@operation('put_rule')
+def op_put_rule(state):
+    return 'PUT', "/{}/export/{}/rule/{}.cern.ch".format(
+        ENDPOINT, state.policy(), state.unique()), None
+
+
+def free_port(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(host, port, process=None, timeout_s=START_TIMEOUT_S):
+    """
+    Wait until something accepts connections on host:port, raising
+    RuntimeError if process exits first or after timeout_s.
+    """
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("{} exited with status {}"
+                               .format(process.args[0], process.returncode))
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Nothing listening on {}:{} after {}s"
+                       .format(host, port, timeout_s))
+
+
+class SimulatorProcess(object):
+    """
+    A simulated cluster served by `python -m storage_api.simulator` in a
+    separate process, so that it doesn't compete with the clients for
+    the interpreter lock.
+    """
+
+    def __init__(self, volume_count, snapshot_count, policy_count,
+                 latency_specs, host='127.0.0.1'):
+        self.host = host
+        self.port = free_port(host)
+        args = [sys.executable, "-m", "storage_api.simulator",
+                "--host", host, "--port", str(self.port),
+                "--volumes", str(volume_count),
+                "--snapshots", str(snapshot_count),
+                "--policies", str(policy_count),
+                "--locks", str(volume_count // benchmark.LOCKED_FRACTION)]
+        for spec in latency_specs:
+            args += ["--latency", spec]
+        self.process = subprocess.Popen(args, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(host, self.port, self.process)
+        except Exception:
+            self.close()
+            raise
+
+    def backend_conf(self):
+        """
+        The $SAPI_BACKENDS configuration of a back-end using the
+        simulated cluster.
+        """
+        return "🌈".join([
+            ENDPOINT, "NetappStorage",
+            "hostname", self.host, "port", str(self.port),
+            "transport_type", "HTTP",
+            "username", USERNAME, "password", PASSWORD,
+            "vserver", "vs1"])
+
+    def backend(self):
+        from storage_api.extensions import NetappStorage
+        return NetappStorage(hostname=self.host, port=self.port,
+                             transport_type="HTTP", username=USERNAME,
+                             password=PASSWORD, vserver="vs1")
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class QuietRequestHandler(werkzeug.serving.WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class PooledWSGIServer(werkzeug.serving.BaseWSGIServer):
+    """
+    A WSGI server handling requests with a fixed pool of threads, like
+    a uWSGI worker with --threads.
+    """
+    multithread = True
+    request_queue_size = 1024
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app, handler=QuietRequestHandler)
+        self.threads = threads
+        self.pool = None
+
+    def process_request(self, request, client_address):
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(self.threads)
+        self.pool.submit(self.process_request_thread, request,
+                         client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class InProcessTarget(object):
+    """
+    Serve app from processes forked from this one, sharing one listening
+    socket, each with a pool of threads.
+    """
+
+    def __init__(self, app, processes, threads, host='127.0.0.1'):
+        self.server = PooledWSGIServer(host, 0, app, threads)
+        self.server.multiprocess = processes > 1
+        self.host, self.port = self.server.server_address
+        self.children = []
+        for _ in range(processes):
+            pid = os.fork()
+            if pid == 0:
+                self._serve()
+            self.children.append(pid)
+
+    def _serve(self):
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self.server.serve_forever()
+        except BaseException:
+            status = 1
+        finally:
+            os._exit(status)
+
+    def close(self):
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in self.children:
+            os.waitpid(pid, 0)
+        self.server.server_close()
+
+
+class UwsgiTarget(object):
+    """
+    Serve storage-api.wsgi from a local uWSGI with the options of
+    uwsgi.ini, except for the socket, processes and threads.
+    """
+
+    def __init__(self, env, processes, threads, host='127.0.0.1'):
+        binary = shutil.which("uwsgi")
+        if binary is None:
+            raise RuntimeError("uwsgi is not installed, use --target "
+                               "inprocess")
+        self.host, self.port = host, free_port(host)
+        root = os.path.dirname(UWSGI_INI)
+        args = [binary, "--ini", UWSGI_INI,
+                "--http-socket", "{}:{}".format(self.host, self.port),
+                "--processes", str(processes), "--threads", str(threads),
+                "--virtualenv", sys.prefix,
+                "--chdir", root, "--die-on-term", "--disable-logging"]
+        self.process = subprocess.Popen(
+            args, env=env, cwd=root, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(self.host, self.port, self.process)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def login(host, port):
+    """
+    Log in through HTTP basic authentication, returning the session
+    cookie.
+    """
+    connection = http.client.HTTPConnection(host, port,
+                                            timeout=REQUEST_TIMEOUT_S)
+    try:
+        credentials = base64.b64encode("{}:{}".format(
+            USERNAME, PASSWORD).encode()).decode()
+        connection.request('GET', "/login_basic", headers={
+            'Authorization': "Basic {}".format(credentials)})
+        response = connection.getresponse()
+        response.read()
+        cookie = response.getheader('Set-Cookie')
+        if response.status >= 400 or not cookie:
+            raise RuntimeError("Logging in failed: {} {}".format(
+                response.status, response.reason))
+        return cookie.split(";", 1)[0]
+    finally:
+        connection.close()
+
+
+def client_loop(host, port, state, cookie, operations, weights, warmup_end,
+                end, samples):
+    """
+    Make requests back-to-back until end, on a new connection each (as
+    uWSGI's http-socket closes them), recording (operation, latency,
+    status) in samples for requests started after warmup_end.
+    """
+    headers = {'Cookie': cookie, 'Accept': 'application/json',
+               'Content-Type': 'application/json'}
+    while True:
+        started = time.monotonic()
+        if started >= end:
+            return
+        name = state.random.choices(operations, weights)[0]
+        method, path, body = OPERATIONS[name](state)
+        try:
+            connection = http.client.HTTPConnection(
+                host, port, timeout=REQUEST_TIMEOUT_S)
+            try:
+                connection.request(method, SAPI_MOUNTPOINT + path,
+                                   body=json.dumps(body or {}),
+                                   headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            finally:
+                connection.close()
+        except Exception as e:
+            log.debug("{} {} failed: {}".format(method, path, e))
+            status = None
+        if started >= warmup_end:
+            samples.append((name, time.monotonic() - started, status))
+
+
+def drive(host, port, concurrency, mix, duration_s, warmup_s, kind,
+          volume_count, snapshot_count, policy_count, seed=0):
+    """
+    Run concurrency closed-loop clients against host:port for warmup_s
+    plus duration_s seconds, returning a summary of the requests
+    started after the warm-up.
+
+    Requests failing or answering with a status of 500 or more are
+    errors; 4xx answers (e.g. deleting a snapshot another client's
+    patch made vanish) are counted separately as rejected.
+    """
+    operations, weights = list(mix), list(mix.values())
+    samples = []
+    # Names must not clash with those created by earlier runs
+    prefix = "load_{}".format(uuid.uuid4().hex[:8])
+    states = [ClientState(kind, number, volume_count, policy_count,
+                          snapshot_count, seed, prefix)
+              for number in range(concurrency)]
+    cookies = [login(host, port) for _ in states]
+
+    start = time.monotonic()
+    warmup_end = start + warmup_s
+    end = warmup_end + duration_s
+    threads = [threading.Thread(target=client_loop,
+                                args=(host, port, state, cookie, operations,
+                                      weights, warmup_end, end, samples))
+               for state, cookie in zip(states, cookies)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Requests still running at the end were started before it
+    elapsed_s = max(time.monotonic(), end) - warmup_end
+
+    def summary_of(samples):
+        errors = sum(1 for _name, _duration, status in samples
+                     if status is None or status >= 500)
+        summary = benchmark.summarise(
+            [duration for _name, duration, _status in samples],
+            errors, elapsed_s)
+        summary['rejected'] = sum(1 for _name, _duration, status in samples
+                                  if status and 400 <= status < 500)
+        return summary
+
+    result = OrderedDict([('concurrency', concurrency)])
+    result.update(summary_of(samples))
+    by_operation = defaultdict(list)
+    for sample in samples:
+        by_operation[sample[0]].append(sample)
+    result['operations'] = OrderedDict(
+        (name, summary_of(by_operation[name]))
+        for name in operations if by_operation[name])
+    return result
+
+
+def target_env(backend_conf):
+    env = dict(os.environ,
+               SAPI_BACKENDS=backend_conf,
+               BASIC_AUTH_USERNAME=USERNAME,
+               BASIC_AUTH_PASSWORD=PASSWORD)
+    env.setdefault('SAPI_OAUTH_CLIENT_ID', "loadtest")
+    env.setdefault('SAPI_OAUTH_SECRET_KEY', "loadtest")
+    return env
+
+
+def run(target='inprocess', backend='netapp', processes=(1,),
+        threads=(1,), concurrency=(1, 2, 4, 8), mix=None, duration_s=10.0,
+        warmup_s=1.0, volume_count=1000, snapshot_count=5, policy_count=10,
+        latency_specs=(), tolerance=0.05, seed=0):
+    """
+    Load test target for every combination of processes and threads at
+    every level of concurrency, returning a JSON-serialisable report.
+    """
+    from storage_api.apis import __version__
+
+    if target == 'uwsgi' and backend != 'netapp':
+        raise ValueError("uWSGI workers need a shared back-end, use "
+                         "--backend netapp")
+    mix = mix or DEFAULT_MIX
+    simulator.parse_latency(latency_specs)  # Fail early on invalid specs
+
+    report = OrderedDict([
+        ('created', datetime.utcnow().isoformat() + "Z"),
+        ('version', __version__),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('cpus', os.cpu_count()),
+        ('parameters', OrderedDict([
+            ('target', target),
+            ('backend', backend),
+            ('volumes', volume_count),
+            ('snapshots_per_volume', snapshot_count),
+            ('policies', policy_count),
+            ('zapi_latency', list(latency_specs)),
+            ('mix', mix),
+            ('duration_s', duration_s),
+            ('warmup_s', warmup_s),
+            ('tolerance', tolerance)])),
+        ('configurations', [])])
+
+    cluster = fleet = None
+    try:
+        if backend == 'netapp':
+            cluster = SimulatorProcess(volume_count, snapshot_count,
+                                       policy_count, latency_specs)
+        if target == 'inprocess':
+            app = benchmark.make_app()
+            app.config['BASIC_AUTH_USERNAME'] = USERNAME
+            app.config['BASIC_AUTH_PASSWORD'] = PASSWORD
+            if cluster is not None:
+                cluster.backend().init_app(app, endpoint=ENDPOINT)
+            else:
+                fleet = benchmark.Fleet('dummy', volume_count,
+                                        snapshot_count, policy_count)
+                fleet.backend.init_app(app, endpoint=ENDPOINT)
+
+        for process_count, thread_count in itertools.product(processes,
+                                                             threads):
+            log.info("Load testing {} processes x {} threads"
+                     .format(process_count, thread_count))
+            if target == 'inprocess':
+                server = InProcessTarget(app, process_count, thread_count)
+            else:
+                server = UwsgiTarget(target_env(cluster.backend_conf()),
+                                     process_count, thread_count)
+            try:
+                points = []
+                for clients in concurrency:
+                    point = drive(server.host, server.port, clients, mix,
+                                  duration_s, warmup_s, backend,
+                                  volume_count, snapshot_count,
+                                  policy_count, seed)
+                    log.info("{} clients: {:.1f}/s, {} errors".format(
+                        clients, point['ops_per_s'] or 0, point['errors']))
+                    points.append(point)
+            finally:
+                server.close()
+
+            saturation = saturation_point(points, tolerance)
+            report['configurations'].append(OrderedDict([
+                ('processes', process_count),
+                ('threads', thread_count),
+                ('points', points),
+                ('saturation', OrderedDict([
+                    ('concurrency', saturation['concurrency']),
+                    ('ops_per_s', saturation['ops_per_s']),
+                    ('latency_s', saturation.get('latency_s'))])
+                 if saturation else None)]))
+    finally:
+        if cluster is not None:
+            cluster.close()
+
+    return report
+
+
+def format_table(report):
+    """
+    A human-readable summary of report, one line per data point.
+    """
+    lines = ["{:>5} {:>7} {:>7} {:>9} {:>9} {:>9} {:>6}".format(
+        "procs", "threads", "clients", "ops/s", "p50 ms", "p99 ms",
+        "errors")]
+    for configuration in report['configurations']:
+        saturation = configuration['saturation'] or {}
+        for point in configuration['points']:
+            latency = point.get('latency_s', {})
+            lines.append("{:>5} {:>7} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>6}"
+                         "{}".format(
+                             configuration['processes'],
+                             configuration['threads'],
+                             point['concurrency'], point['ops_per_s'] or 0,
+                             latency.get('p50', 0) * 1000,
+                             latency.get('p99', 0) * 1000,
+                             point['errors'],
+                             " <- saturation" if point['concurrency'] ==
+                             saturation.get('concurrency') else ""))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=("Load test the WSGI app across server processes,"
+                     " threads and client concurrency"))
+    parser.add_argument('--target', choices=TARGETS, default='inprocess')
+    parser.add_argument('--backend', choices=BACKEND_KINDS,
+                        default='netapp')
+    parser.add_argument('--processes', type=parse_counts, default=[1, 2, 4],
+                        help="comma-separated server process counts")
+    parser.add_argument('--threads', type=parse_counts, default=[1, 2],
+                        help="comma-separated thread counts per process")
+    parser.add_argument('--concurrency', type=parse_counts,
+                        default=[1, 2, 4, 8, 16, 32],
+                        help="comma-separated numbers of concurrent clients")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help=("weighted operations, e.g. get_volume=3,"
+                              "create_snapshot=1, among: {}"
+                              .format(", ".join(OPERATIONS))))
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="seconds measured at each concurrency level")
+    parser.add_argument('--warmup', type=float, default=1.0,
+                        help="seconds of unmeasured load before each level")
+    parser.add_argument('--volumes', type=int, default=1000)
+    parser.add_argument('--snapshots', type=int, default=5,
+                        help="snapshots per volume")
+    parser.add_argument('--policies', type=int, default=10)
+    parser.add_argument('--latency', action='append', default=None,
+                        metavar="API=SECONDS",
+                        help=("ZAPI latency of the simulated cluster, as for"
+                              " storage_api.simulator (default:"
+                              " default=0.02)"))
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help=("fraction of the best throughput within which"
+                              " a configuration is saturated"))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help="file to write results to (default: stdout)")
+    args = parser.parse_args(argv)
+
+    # Logging every request would dominate the timings
+    loggers = [log, logging.getLogger('werkzeug')]
+    levels = [logger.level for logger in loggers]
+    for logger in loggers:
+        logger.setLevel(logging.WARNING)
+    try:
+        report = run(target=args.target, backend=args.backend,
+                     processes=args.processes, threads=args.threads,
+                     concurrency=args.concurrency, mix=args.mix,
+                     duration_s=args.duration, warmup_s=args.warmup,
+                     volume_count=args.volumes,
+                     snapshot_count=args.snapshots,
+                     policy_count=args.policies,
+                     latency_specs=(args.latency
+                                    if args.latency is not None
+                                    else ["default=0.02"]),
+                     tolerance=args.tolerance, seed=args.seed)
+    finally:
+        for logger, level in zip(loggers, levels):
+            logger.setLevel(level)
+
+    sys.stderr.write(format_table(report) + "\n")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Operation metrics, exposed in the Prometheus text format.
+
+Metrics are collected for every HTTP route, and for every call to a
+back-end registered with `StorageBackend.init_app` after `init_app` has
+been called on the app (back-ends are wrapped in an
+`InstrumentedBackend`).
+
+When running with several worker processes (e.g. under uWSGI), each
+process periodically writes its metrics to its own file in a shared
+directory. Rendering the metrics adds up the files of all processes.
+
+Optionally, the time spent on each request is also broken down into
+phases (see TIMING_PHASES), reported in a Server-Timing header and/or
+logged for slow requests.
+"""
+from storage_api.utils import init_logger
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Tuple  # noqa
+
+import flask
+
+log = init_logger()
+
+# Upper bounds of latency histogram buckets, in seconds. Requests are
+# killed by uWSGI after 120 seconds.
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 120.0]
+
+METRICS = OrderedDict([
+    ('sapi_backend_call_duration_seconds',
+     ('histogram', "Latency of calls to storage back-end operations")),
+    ('sapi_backend_call_errors_total',
+     ('counter', "Calls to storage back-end operations that raised")),
+    ('sapi_http_request_duration_seconds',
+     ('histogram', "Latency of HTTP requests, until the first byte")),
+    ('sapi_memo_hits_total',
+     ('counter', "Back-end calls served from the per-request memo")),
+    ('sapi_memo_misses_total',
+     ('counter', "Memoised back-end calls passed through to the back-end")),
+    ('sapi_retention_snapshots_total',
+     ('counter', "Retention snapshots made (and pruned), by outcome")),
+])
+
+# Back-end properties that are timed like operations
+TIMED_PROPERTIES = ['volumes', 'policies']
+
+DEFAULT_FLUSH_INTERVAL_S = 5
+
+# Phases of request handling broken down in Server-Timing headers.
+# Phases may overlap: back-end calls include validation.
+TIMING_PHASES = ['auth', 'backend', 'validation', 'serialisation']
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key):
+    def escape(value):
+        return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+                .replace('"', '\\"'))
+
+    if not label_key:
+        return ""
+    return "{{{}}}".format(",".join('{}="{}"'.format(name, escape(value))
+                                    for name, value in label_key))
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsRegistry(object):
+    """
+    A thread-safe store of histograms and counters, identified by metric
+    name and labels.
+
+    If directory is set, the metrics of this process are written to a
+    file in it at most every flush_interval_s seconds, and rendering
+    includes the metrics of every process that wrote to it.
+    """
+
+    def __init__(self, directory=None,
+                 flush_interval_s=DEFAULT_FLUSH_INTERVAL_S):
+        self.directory = directory
+        self.flush_interval_s = flush_interval_s
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Histograms are lists of bucket counts, with the +Inf bucket
+        # last, followed by the sum of the observations.
+        self._histograms = {}  # type: Dict[str, Dict[Tuple, List]]
+        self._counters = {}  # type: Dict[str, Dict[Tuple, float]]
+        self._pid = os.getpid()
+        self._last_flush = time.monotonic()
+
+    def _check_pid(self):
+        # Metrics recorded before a fork belong to the parent process
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def observe(self, name, labels, value):
+        """
+        Add an observation of value to the histogram name.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            self._check_pid()
+            buckets = self._histograms.setdefault(name, {}).setdefault(
+                key, [0] * (len(LATENCY_BUCKETS) + 2))
+            for position, upper_bound in enumerate(LATENCY_BUCKETS):
+                if value <= upper_bound:
+                    break
+            else:
+                position = len(LATENCY_BUCKETS)
+            buckets[position] += 1
+            buckets[-1] += value
+        self._maybe_flush()
+
+    def increment(self, name, labels, amount=1):
+        """
+        Increment the counter name by amount.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            self._check_pid()
+            counters = self._counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + amount
+        self._maybe_flush()
+
+    @contextmanager
+    def timer(self, name, labels):
+        """
+        Context manager: observe the time spent in it in the histogram
+        name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, labels, time.perf_counter() - start)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, "metrics-{}.json".format(pid))
+
+    def _snapshot(self):
+        with self._lock:
+            self._check_pid()
+            return {
+                'histograms': {name: [[list(key), list(buckets)]
+                                      for key, buckets in values.items()]
+                               for name, values in self._histograms.items()},
+                'counters': {name: [[list(key), value]
+                                    for key, value in values.items()]
+                             for name, values in self._counters.items()},
+            }
+
+    def flush(self):
+        """
+        Write the metrics of this process to its file, if there is a
+        metrics directory.
+        """
+        if not self.directory:
+            return
+
+        self._last_flush = time.monotonic()
+        path = self._path(os.getpid())
+        temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(temp_path, "w") as f:
+            json.dump(self._snapshot(), f)
+        os.replace(temp_path, path)
+
+    def _maybe_flush(self):
+        if (self.directory and time.monotonic() - self._last_flush
+                >= self.flush_interval_s):
+            try:
+                self.flush()
+            except OSError as e:
+                log.warning("Could not write metrics: {}".format(e))
+
+    def _snapshots(self):
+        """
+        Return the snapshots of all processes: the current one from
+        memory, and the others from their files.
+        """
+        snapshots = [self._snapshot()]
+        if not self.directory:
+            return snapshots
+
+        own_file = os.path.basename(self._path(os.getpid()))
+        for file_name in sorted(os.listdir(self.directory)):
+            if (file_name == own_file or not file_name.startswith("metrics-")
+                    or not file_name.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(self.directory, file_name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                log.warning("Skipping unreadable metrics file {}: {}"
+                            .format(file_name, e))
+        return snapshots
+
+    def collect(self):
+        """
+        Return a tuple of dictionaries (histograms, counters), mapping
+        metric names to label keys to values, summed over all processes.
+        """
+        histograms = {}
+        counters = {}
+        for snapshot in self._snapshots():
+            for name, values in snapshot['histograms'].items():
+                for key, buckets in values:
+                    key = tuple(tuple(label) for label in key)
+                    total = histograms.setdefault(name, {}).setdefault(
+                        key, [0] * len(buckets))
+                    for position, count in enumerate(buckets):
+                        total[position] += count
+            for name, values in snapshot['counters'].items():
+                for key, value in values:
+                    key = tuple(tuple(label) for label in key)
+                    named_counters = counters.setdefault(name, {})
+                    named_counters[key] = named_counters.get(key, 0) + value
+        return histograms, counters
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+        """
+        self._maybe_flush()
+        histograms, counters = self.collect()
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            if metric_type == 'histogram':
+                for key, buckets in sorted(histograms.get(name, {}).items()):
+                    cumulative = 0
+                    bounds = [str(b) for b in LATENCY_BUCKETS] + ["+Inf"]
+                    for bound, count in zip(bounds, buckets):
+                        cumulative += count
+                        lines.append("{}_bucket{} {}".format(
+                            name, _format_labels(key + (('le', bound),)),
+                            cumulative))
+                    lines.append("{}_sum{} {}".format(
+                        name, _format_labels(key),
+                        _format_value(buckets[-1])))
+                    lines.append("{}_count{} {}".format(
+                        name, _format_labels(key), cumulative))
+            else:
+                for key, value in sorted(counters.get(name, {}).items()):
+                    lines.append("{}{} {}".format(name, _format_labels(key),
+                                                  _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedBackend(object):
+    """
+    A proxy for a storage back-end, recording the latency of every call
+    to its public methods (and the properties in TIMED_PROPERTIES), and
+    the exceptions they raise, labelled with the subsystem.
+
+    Calls that return generators (e.g. iter_volumes) are timed until
+    the generator is returned, not until it is exhausted. Calls made by
+    the back-end to itself are not recorded.
+    """
+
+    def __init__(self, backend, subsystem, registry):
+        self.__dict__['_backend'] = backend
+        self.__dict__['_subsystem'] = subsystem
+        self.__dict__['_registry'] = registry
+
+    def __repr__(self):
+        return "InstrumentedBackend({!r})".format(self._backend)
+
+    def _timed(self, method_name, func, *args, **kwargs):
+        labels = {'subsystem': self._subsystem, 'method': method_name}
+        try:
+            with self._registry.timer('sapi_backend_call_duration_seconds',
+                                      labels), \
+                    timed_phase('backend', detail=method_name):
+                return func(*args, **kwargs)
+        except Exception as e:
+            self._registry.increment('sapi_backend_call_errors_total',
+                                     dict(labels,
+                                          exception=type(e).__name__))
+            raise
+
+    def __getattr__(self, name):
+        if name in TIMED_PROPERTIES:
+            return self._timed(name, getattr, self._backend, name)
+
+        value = getattr(self._backend, name)
+        if name.startswith("_") or not inspect.ismethod(value):
+            return value
+
+        return functools.wraps(value)(
+            functools.partial(self._timed, name, value))
+
+    def __setattr__(self, name, value):
+        setattr(self._backend, name, value)
+
+
+def init_app(app: flask.Flask, directory=None):
+    """
+    Install a MetricsRegistry into app, timing every HTTP request and
+    every back-end registered afterwards.
+
+    If directory is set, metrics are shared through it between worker
+    processes. It must exist and be writable.
+    """
+    if not hasattr(app, 'extensions'):   # pragma: no coverage
+        app.extensions = {}
+
+    registry = MetricsRegistry(directory=directory)
+    app.extensions['metrics'] = registry
+
+    @app.before_request
+    def start_request_timer():
+        flask.g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_time(response):
+        start = getattr(flask.g, 'request_start', None)
+        if start is not None:
+            rule = flask.request.url_rule
+            registry.observe('sapi_http_request_duration_seconds',
+                             {'method': flask.request.method,
+                              'route': rule.rule if rule else "unmatched",
+                              'status': str(response.status_code)},
+                             time.perf_counter() - start)
+        return response
+
+    return registry
+
+
+def record_timing(phase, seconds, detail=None):
+    """
+    Add seconds to the time spent in phase during the current request,
+    and to the time spent on detail (e.g. a back-end method) within it,
+    if request timing is enabled.
+    """
+    if not flask.has_request_context():
+        return
+    timings = getattr(flask.g, 'request_timings', None)
+    if timings is None:
+        return
+
+    for key in [phase] if detail is None else [phase, (phase, detail)]:
+        count, total = timings.get(key, (0, 0.0))
+        timings[key] = (count + 1, total + seconds)
+
+
+@contextmanager
+def timed_phase(phase, detail=None):
+    """
+    Context manager: record the time spent in it as phase (see
+    record_timing()).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(phase, time.perf_counter() - start, detail)
+
+
+def format_server_timing(timings, total_s):
+    """
+    Format request timings as the value of a Server-Timing header, with
+    durations in milliseconds.
+    """
+    metrics = []
+    for phase in TIMING_PHASES:
+        if phase not in timings:
+            continue
+        count, seconds = timings[phase]
+        metrics.append('{};desc="{} call{}";dur={:.1f}'
+                       .format(phase, count, "" if count == 1 else "s",
+                               seconds * 1000))
+    metrics.append("total;dur={:.1f}".format(total_s * 1000))
+    return ", ".join(metrics)
+
+
+def format_breakdown(timings):
+    """
+    Format request timings for logging, including the time spent on
+    each back-end method.
+    """
+    parts = []
+    for phase in TIMING_PHASES:
+        if phase not in timings:
+            continue
+        count, seconds = timings[phase]
+        details = sorted((key[1], value) for key, value in timings.items()
+                         if isinstance(key, tuple) and key[0] == phase)
+        parts.append("{}: {} calls, {:.3f}s{}".format(
+            phase, count, seconds,
+            " ({})".format(", ".join(
+                "{} x{} {:.3f}s".format(detail, detail_count, detail_s)
+                for detail, (detail_count, detail_s) in details))
+            if details else ""))
+    return "; ".join(parts) if parts else "no breakdown"
+
+
+def init_request_timing(app: flask.Flask, server_timing=False,
+                        slow_request_s=None):
+    """
+    Break down the time spent on each request of app into phases (see
+    TIMING_PHASES), adding it as a Server-Timing header to every
+    response if server_timing is True, and logging it for requests
+    slower than slow_request_s seconds, if set.
+    """
+    if not server_timing and slow_request_s is None:
+        return
+
+    @app.before_request
+    def start_request_timing():
+        flask.g.request_timings = {}
+        flask.g.request_timing_start = time.perf_counter()
+
+    @app.after_request
+    def report_request_timing(response):
+        timings = getattr(flask.g, 'request_timings', None)
+        if timings is None:
+            return response
+
+        total_s = time.perf_counter() - flask.g.request_timing_start
+        if server_timing:
+            response.headers['Server-Timing'] = format_server_timing(
+                timings, total_s)
+        if slow_request_s is not None and total_s >= slow_request_s:
+            log.warning("Slow request: {} {} took {:.3f}s ({})"
+                        .format(flask.request.method,
+                                flask.request.full_path.rstrip("?"),
+                                total_s, format_breakdown(timings)))
+        return response
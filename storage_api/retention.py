@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+Snapshot retention, run by the service itself.
+
+Volumes are given retention policies (keep the last N hourly and/or
+daily snapshots) in a JSON file of the form::
+
+    {"<subsystem>": {"<volume name>": {"hourly": 24, "daily": 7}}}
+
+For every period (hour or day), each volume gets a snapshot named after
+the period (e.g. `retention_hourly_20171018T0800Z`), made through the
+back-end's `create_snapshot`, after which its retention snapshots of
+that kind beyond the last N are deleted through `delete_snapshot`.
+Snapshots not made by the engine are never touched.
+
+Rather than all at the start of the period, the snapshot of each volume
+is due at an offset of up to jitter_s seconds into it, fixed per volume
+so that volumes stay evenly spread. At most per_filer snapshots are
+handled at a time on each subsystem. Failed snapshots are retried after
+retry_s seconds, doubling up to max_retry_s, until the period ends.
+
+Only one process runs the engine: when running with several worker
+processes (e.g. under uWSGI), they share a directory in which the one
+holding the lock file is the leader. The leader also writes its status
+(queue depth and lag) there, for any worker to report. Unless given
+one, workers share a directory in the system's temporary directory.
+"""
+from storage_api.utils import init_logger
+from storage_api.extensions.transport import after_fork
+
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+import flask
+
+log = init_logger()
+
+# Retention kinds, and the length of their periods in seconds
+PERIODS_S = OrderedDict([('hourly', 3600), ('daily', 86400)])
+
+SNAPSHOT_PREFIX = "retention_"
+
+DEFAULT_INTERVAL_S = 30
+DEFAULT_JITTER_S = 3000
+DEFAULT_PER_FILER = 2
+DEFAULT_WORKERS = 8
+DEFAULT_RETRY_S = 60
+DEFAULT_MAX_RETRY_S = 3600
+
+# A snapshot to make of a volume: when it is due, and for which period
+Task = namedtuple('Task', ['due', 'subsystem', 'volume', 'kind', 'period'])
+
+
+def load_policies(path):
+    """
+    Return the retention policies in the JSON file path, as a
+    dictionary of (subsystem, volume name) to a dictionary of kind to
+    the number of snapshots to keep.
+
+    Raises:
+        ValueError: if the policies are malformed
+    """
+    with open(path) as f:
+        document = json.load(f)
+
+    policies = {}
+    for subsystem, volumes in document.items():
+        for volume, policy in volumes.items():
+            unknown = set(policy) - set(PERIODS_S)
+            if unknown:
+                raise ValueError("Unknown retention kinds for {}: {}".format(
+                    volume, ", ".join(sorted(unknown))))
+            for kind, keep in policy.items():
+                if not isinstance(keep, int) or keep < 0:
+                    raise ValueError("Invalid retention {} of {}: {!r}"
+                                     .format(kind, volume, keep))
+            policies[(subsystem, volume)] = {
+                kind: keep for kind, keep in policy.items() if keep}
+    return policies
+
+
+def snapshot_name(kind, period):
+    """
+    Return the name of the retention snapshot of kind for the period
+    starting at UNIX time period. Names sort in time order.
+    """
+    return "{}{}_{}".format(SNAPSHOT_PREFIX, kind,
+                            time.strftime("%Y%m%dT%H%MZ", time.gmtime(period)))
+
+
+def offset_s(subsystem, volume, kind, jitter_s):
+    """
+    Return how long after the start of each period the snapshot of kind
+    of volume is due: a fixed, evenly distributed offset below jitter_s
+    (and the period).
+    """
+    spread = min(jitter_s, PERIODS_S[kind])
+    if spread < 1:
+        return 0
+    key = "{}/{}/{}".format(subsystem, volume, kind).encode('utf-8')
+    return zlib.crc32(key) % int(spread)
+
+
+class LeaderLock(object):
+    """
+    An exclusive, non-blocking lock on a file, held until the process
+    exits. Without a file, the lock is always acquired.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        if self._file is not None or self.path is None:
+            return True
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+
+class RetentionEngine(object):
+    """
+    Schedules and runs the retention snapshots of the volumes of app
+    with policies in policies_path (reloaded when it changes), on up to
+    workers threads. Failed snapshots are retried with an exponential
+    backoff from retry_s to max_retry_s seconds, within their period.
+
+    If directory is set, the engine only runs in the process holding
+    the lock in it, and reports its status there.
+    """
+
+    def __init__(self, app, policies_path, directory=None,
+                 interval_s=DEFAULT_INTERVAL_S, jitter_s=DEFAULT_JITTER_S,
+                 per_filer=DEFAULT_PER_FILER, workers=DEFAULT_WORKERS,
+                 retry_s=DEFAULT_RETRY_S, max_retry_s=DEFAULT_MAX_RETRY_S,
+                 clock=time.time):
+        if per_filer < 1:
+            raise ValueError("Retention snapshots per filer must be"
+                             " positive, not {}".format(per_filer))
+        self.app = app
+        self.policies_path = policies_path
+        self.directory = directory
+        self.interval_s = interval_s
+        self.jitter_s = jitter_s
+        self.per_filer = per_filer
+        self.workers = workers
+        self.retry_s = retry_s
+        self.max_retry_s = max_retry_s
+        self.clock = clock
+        self.lock = LeaderLock(os.path.join(directory, "leader.lock")
+                               if directory else None)
+
+        self.policies = {}
+        self._policies_mtime = None
+        self._queue = []  # A heap of Tasks
+        self._queued = set()  # (subsystem, volume, kind, period)
+        # (subsystem, volume, kind) -> last period done or given up on
+        self._done = {}
+        self._attempts = {}  # (subsystem, volume, kind, period) -> failures
+        self._running = {}  # subsystem -> number of running tasks
+        self._futures = set()
+        self._completed = 0
+        self._failed = 0
+        self._last_lag_s = 0.0
+        self._status = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _check_pid(self):
+        # Threads do not survive forking
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="retention")
+            self._running = {}
+            self._futures = set()
+            self._pid = os.getpid()
+
+    def start(self):
+        """
+        Run the engine in a background thread of this process.
+        """
+        thread = threading.Thread(target=self._loop, name="retention",
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("Retention run failed")
+            self._stop.wait(self.interval_s)
+
+    def _reload_policies(self):
+        try:
+            mtime = os.stat(self.policies_path).st_mtime
+            if mtime != self._policies_mtime:
+                self.policies = load_policies(self.policies_path)
+                self._policies_mtime = mtime
+                log.info("Loaded {} retention policies from {}".format(
+                    len(self.policies), self.policies_path))
+        except (OSError, ValueError) as e:
+            log.error("Could not load retention policies, keeping the"
+                      " previous ones: {}".format(e))
+
+    def run_once(self):
+        """
+        If this process is the leader, queue the snapshots due in the
+        current periods, start the ones that are due, as far as the
+        per-filer limit allows, and report the status. Queued snapshots
+        are also started as soon as others finish.
+
+        Returns False if this process is not the leader.
+        """
+        if not self.lock.acquire():
+            return False
+
+        now = self.clock()
+        self._reload_policies()
+        with self._lock:
+            self._check_pid()
+            self._schedule(now)
+            self._dispatch(now)
+            self._status = self._current_status(now)
+        self._write_status()
+        return True
+
+    def _schedule(self, now):
+        for (subsystem, volume), policy in self.policies.items():
+            for kind in policy:
+                length = PERIODS_S[kind]
+                period = now - now % length
+                key = (subsystem, volume, kind)
+                if (self._done.get(key, -1) >= period
+                        or key + (period, ) in self._queued):
+                    continue
+                due = period + offset_s(subsystem, volume, kind,
+                                        self.jitter_s)
+                heapq.heappush(self._queue, Task(due, subsystem, volume,
+                                                 kind, period))
+                self._queued.add(key + (period, ))
+
+    def _dispatch(self, now):
+        waiting = []
+        while self._queue and self._queue[0].due <= now:
+            task = heapq.heappop(self._queue)
+            if self._running.get(task.subsystem, 0) >= self.per_filer:
+                waiting.append(task)
+                continue
+            self._running[task.subsystem] = (
+                self._running.get(task.subsystem, 0) + 1)
+            self._last_lag_s = now - task.due
+            future = self._executor.submit(self._run, task)
+            self._futures.add(future)
+            future.add_done_callback(self._futures.discard)
+        for task in waiting:
+            heapq.heappush(self._queue, task)
+
+    def _backend(self, subsystem):
+        instance_id = self.app.config['SUBSYSTEM'][subsystem]
+        return self.app.extensions[instance_id]
+
+    def _run(self, task):
+        name = snapshot_name(task.kind, task.period)
+        # The policy may have changed since the snapshot was queued
+        keep = self.policies.get((task.subsystem, task.volume),
+                                 {}).get(task.kind, 0)
+        try:
+            with self.app.app_context():
+                storage = self._backend(task.subsystem)
+                existing = sorted(
+                    s['name'] for s in storage.get_snapshots(task.volume)
+                    if s['name'].startswith(
+                        "{}{}_".format(SNAPSHOT_PREFIX, task.kind)))
+                if keep and name not in existing:
+                    storage.create_snapshot(task.volume, name)
+                    existing.append(name)
+                # Without a policy any more, snapshots are left alone
+                for old_name in (existing[:len(existing) - keep] if keep
+                                 else []):
+                    log.info("Deleting retention snapshot {} of {}"
+                             .format(old_name, task.volume))
+                    storage.delete_snapshot(task.volume, old_name)
+            outcome = 'completed'
+        except Exception as e:
+            log.warning("Retention snapshot {} of {} on {} failed: {}"
+                        .format(name, task.volume, task.subsystem, e))
+            outcome = 'failed'
+
+        with self._lock:
+            now = self.clock()
+            key = (task.subsystem, task.volume, task.kind)
+            self._running[task.subsystem] -= 1
+            if outcome == 'completed':
+                self._completed += 1
+                self._done[key] = task.period
+                self._forget(task)
+            else:
+                self._failed += 1
+                self._retry_later(task, now)
+            self._dispatch(now)
+
+        metrics = self.app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.increment('sapi_retention_snapshots_total',
+                              {'subsystem': task.subsystem,
+                               'outcome': outcome})
+
+    def _forget(self, task):
+        queued_key = (task.subsystem, task.volume, task.kind, task.period)
+        self._queued.discard(queued_key)
+        self._attempts.pop(queued_key, None)
+
+    def _retry_later(self, task, now):
+        queued_key = (task.subsystem, task.volume, task.kind, task.period)
+        attempts = self._attempts.get(queued_key, 0) + 1
+        due = now + min(self.retry_s * 2 ** (attempts - 1), self.max_retry_s)
+        if due >= task.period + PERIODS_S[task.kind]:
+            log.warning("Giving up on retention snapshot of {} on {} for"
+                        " this period after {} attempts".format(
+                            task.volume, task.subsystem, attempts))
+            self._done[(task.subsystem, task.volume, task.kind)] = (
+                task.period)
+            self._forget(task)
+            return
+        # Still queued, so it is not scheduled again meanwhile
+        self._attempts[queued_key] = attempts
+        heapq.heappush(self._queue, task._replace(due=due))
+
+    def wait(self, timeout_s=None):
+        """
+        Wait for the running snapshots to finish.
+        """
+        # Finishing snapshots may start queued ones
+        while self._futures:
+            for future in list(self._futures):
+                future.result(timeout_s)
+
+    def _current_status(self, now):
+        due = [task for task in self._queue if task.due <= now]
+        return {'leader': os.getpid(),
+                'updated': now,
+                'policies': len(self.policies),
+                'queue_depth': len(due),
+                'scheduled': len(self._queue) - len(due),
+                'running': sum(self._running.values()),
+                'lag_s': max([now - task.due for task in due],
+                             default=0.0),
+                'last_start_lag_s': self._last_lag_s,
+                'completed': self._completed,
+                'failed': self._failed}
+
+    def _status_path(self):
+        return os.path.join(self.directory, "status.json")
+
+    def _write_status(self):
+        if not self.directory:
+            return
+        temp_path = "{}.{}.tmp".format(self._status_path(), os.getpid())
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(self._status, f)
+            os.replace(temp_path, self._status_path())
+        except OSError as e:
+            log.warning("Could not write the retention status: {}"
+                        .format(e))
+
+    def status(self):
+        """
+        Return the status of the engine, as last reported by the
+        leader, or None if it has not run yet.
+
+        queue_depth is the number of snapshots that are due but not
+        started, and lag_s how long the oldest of them has been due.
+        """
+        if not self.directory:
+            return self._status
+        try:
+            with open(self._status_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def default_directory(policies_path):
+    """
+    Return (creating it if needed) a directory in the system's
+    temporary directory, shared by all processes running retention on
+    the policies in policies_path.
+    """
+    digest = hashlib.sha1(os.path.abspath(policies_path)
+                          .encode('utf-8')).hexdigest()
+    directory = os.path.join(tempfile.gettempdir(),
+                             "sapi-retention-{}".format(digest[:12]))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def init_app(app: flask.Flask, policies_path, directory=None, **options):
+    """
+    Install a RetentionEngine into app and start it, right after
+    forking in every worker if running under uWSGI. options are passed
+    to the engine.
+
+    Workers elect a leader in directory, or, if it is not set, in the
+    `default_directory` of policies_path, so that only one of them
+    runs the engine.
+    """
+    if not hasattr(app, 'extensions'):   # pragma: no coverage
+        app.extensions = {}
+
+    if directory is None:
+        directory = default_directory(policies_path)
+
+    engine = RetentionEngine(app, policies_path, directory=directory,
+                             **options)
+    app.extensions['retention'] = engine
+    if not after_fork(engine.start):
+        engine.start()
+    return engine
@@ -0,0 +1,905 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2016, CERN
+# This software is distributed under the terms of the GNU General Public
+# Licence version 3 (GPL Version 3), copied verbatim in the file "LICENSE".
+# In applying this license, CERN does not waive the privileges and immunities
+# granted to it by virtue of its status as Intergovernmental Organization
+# or submit itself to any jurisdiction.
+
+"""
+A local stand-in for a NetApp cluster, speaking (just enough) ZAPI over
+HTTP for `NetappStorage` to run against it unmodified.
+
+The simulated cluster keeps its volumes, snapshots, export policies,
+locks and aggregates in memory, and can be populated with a synthetic
+fleet of any size (see `SimulatedCluster.synthetic`). Each ZAPI call can
+be given an artificial latency, so that the real code path can be
+measured offline under realistic conditions.
+
+Only the calls made by netapp.api on behalf of `NetappStorage` are
+implemented (see `SimulatedCluster.supported_apis`). Queries support
+exact values, `*` and `?` wildcards and `|` for alternatives.
+
+Run a simulator with e.g.:
+
+    python -m storage_api.simulator --volumes 20000 --port 8080 \\
+        --latency default=0.005 --latency volume-get-iter=0.05
+
+and point a NetApp back-end at it with the options `hostname localhost`,
+`port 8080` and `transport_type HTTP`.
+"""
+from storage_api.utils import init_logger
+
+from collections import Counter, OrderedDict
+import argparse
+import bisect
+import fnmatch
+import itertools
+import random
+import socket
+import threading
+import time
+import uuid
+
+import lxml.builder
+import lxml.etree
+import netapp.api
+import werkzeug.serving
+from werkzeug.wrappers import Request, Response
+
+log = init_logger()
+
+E = lxml.builder.ElementMaker(namespace=netapp.api.XMLNS,
+                              nsmap={None: netapp.api.XMLNS})
+
+"Records per page of *-get-iter calls without max-records, as in ONTAP"
+DEFAULT_MAX_RECORDS = 20
+
+ERRNO_EXISTS = 17
+ERRNO_SIS_ALREADY_ENABLED = 13001
+ERRNO_API_NOT_FOUND = 13005
+ERRNO_VOLUME_NOT_FOUND = 13040
+ERRNO_INVALID_INPUT = 13115
+ERRNO_TOO_MANY_SNAPSHOTS = 13023
+ERRNO_NOT_FOUND = 15661
+
+
+class ZapiError(Exception):
+    """
+    A failed ZAPI call, reported to the client as a failed result with
+    the given errno and reason.
+    """
+
+    def __init__(self, errno, reason):
+        super().__init__(reason)
+        self.errno = errno
+        self.reason = reason
+
+
+def _strip_namespaces(root):
+    for element in root.iter(lxml.etree.Element):
+        element.tag = lxml.etree.QName(element).localname
+    return root
+
+
+def _text(element, path, default=None):
+    value = element.findtext(path)
+    return default if value is None else value
+
+
+def _required(element, path):
+    value = element.findtext(path)
+    if value is None:
+        raise ZapiError(ERRNO_INVALID_INPUT,
+                        "Missing input: {}".format(path))
+    return value
+
+
+def _bool(value):
+    return str(value).lower() == 'true'
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ZapiError(ERRNO_INVALID_INPUT,
+                        "Invalid integer for {}: {}".format(name, value))
+
+
+def _matches(pattern, value):
+    """
+    Match a ZAPI query value against a stored value, supporting
+    wildcards and alternatives separated by `|`.
+    """
+    if value is None:
+        return False
+    return any(fnmatch.fnmatchcase(str(value), alternative)
+               for alternative in pattern.split('|'))
+
+
+def _is_exact(pattern):
+    return not any(c in pattern for c in '*?|[')
+
+
+def _children(tag, **values):
+    """
+    Make child elements of tag from keyword arguments (underscores
+    become hyphens), skipping None values.
+    """
+    return E(tag, *[E(key.replace('_', '-'), str(value).lower()
+                      if isinstance(value, bool) else str(value))
+                    for key, value in values.items()
+                    if value is not None])
+
+
+class SimulatedVolume(object):
+    __slots__ = ('name', 'uuid', 'junction_path', 'aggregate_name',
+                 'node', 'vserver', 'creation_time', 'size_total',
+                 'size_used', 'percentage_snapshot_reserve',
+                 'autosize_enabled', 'max_autosize', 'state', 'policy',
+                 'caching_policy', 'sis_enabled', 'compression',
+                 'inline_compression', 'snapshots')
+
+    def __init__(self, name, aggregate_name, node, vserver, size_total,
+                 junction_path=None, size_used=0,
+                 percentage_snapshot_reserve=0, policy='default',
+                 caching_policy=None, creation_time=None):
+        self.name = name
+        self.uuid = str(uuid.uuid4())
+        self.junction_path = junction_path
+        self.aggregate_name = aggregate_name
+        self.node = node
+        self.vserver = vserver
+        self.creation_time = int(creation_time or time.time())
+        self.size_total = size_total
+        self.size_used = size_used
+        self.percentage_snapshot_reserve = percentage_snapshot_reserve
+        self.autosize_enabled = False
+        self.max_autosize = size_total
+        self.state = 'online'
+        self.policy = policy
+        self.caching_policy = caching_policy
+        self.sis_enabled = False
+        self.compression = False
+        self.inline_compression = False
+        self.snapshots = OrderedDict()  # name -> (access time, kbytes)
+
+    def id_attribute(self, name):
+        return {'name': self.name,
+                'uuid': self.uuid,
+                'junction-path': self.junction_path,
+                'containing-aggregate-name': self.aggregate_name,
+                'node': self.node,
+                'owning-vserver-name': self.vserver}.get(name)
+
+    def to_xml(self):
+        return E('volume-attributes',
+                 _children('volume-id-attributes',
+                           name=self.name,
+                           uuid=self.uuid,
+                           junction_path=self.junction_path,
+                           containing_aggregate_name=self.aggregate_name,
+                           node=self.node,
+                           owning_vserver_name=self.vserver,
+                           creation_time=self.creation_time),
+                 _children('volume-space-attributes',
+                           size_total=self.size_total,
+                           size_used=self.size_used,
+                           percentage_snapshot_reserve=(
+                               self.percentage_snapshot_reserve),
+                           percentage_snapshot_reserve_used=0),
+                 _children('volume-autosize-attributes',
+                           is_enabled=self.autosize_enabled,
+                           maximum_size=self.max_autosize),
+                 _children('volume-state-attributes', state=self.state),
+                 _children('volume-export-attributes', policy=self.policy),
+                 _children('volume-hybrid-cache-attributes',
+                           caching_policy=self.caching_policy))
+
+
+class SimulatedCluster(object):
+    """
+    An in-memory NetApp cluster with a single vserver, answering ZAPI
+    calls given as (namespace-less) XML elements.
+
+    Latencies are given in seconds per API name in latency_s, falling
+    back to default_latency_s. Both can be changed at any time, as can
+    the maximum number of snapshots of a volume, max_snapshots.
+    """
+
+    def __init__(self, vserver='vs1', aggregates=None, latency_s=None,
+                 default_latency_s=0.0, max_snapshots=255):
+        """
+        aggregates is a dictionary of aggregate name to (node name,
+        size in bytes). By default, the cluster has one root aggregate
+        and one data aggregate of 100 TB on a single node.
+        """
+        self.vserver = vserver
+        self.aggregates = OrderedDict(
+            sorted((aggregates or {
+                'aggr0_node1': ('node1', 10**12),
+                'aggr1_node1': ('node1', 100 * 10**12)}).items()))
+        self.latency_s = dict(latency_s or {})
+        self.default_latency_s = default_latency_s
+        self.calls = Counter()
+        self.max_snapshots = max_snapshots
+
+        self.volumes = {}
+        self.volume_names = []
+        self.junction_paths = {}
+        self.policies = OrderedDict([('default', [])])
+        self.policy_ids = {'default': 1}
+        self.locks = []  # (volume name, client address, state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def synthetic(cls, volumes=1000, aggregates=4, nodes=2,
+                  snapshots=0, policies=10, locks=0, seed=0, **kwargs):
+        """
+        Make a cluster with a synthetic fleet of volumes spread evenly
+        over aggregates on nodes, each volume with snapshots snapshots
+        and exported through one of policies export policies. locks
+        volumes are locked by a client each.
+
+        The same seed always produces the same fleet (except for UUIDs).
+        """
+        rng = random.Random(seed)
+        aggregate_names = OrderedDict()
+        for node_number in range(1, nodes + 1):
+            node = "node{}".format(node_number)
+            aggregate_names["aggr0_{}".format(node)] = (node, 10**12)
+        for aggregate_number in range(1, aggregates + 1):
+            node = "node{}".format((aggregate_number - 1) % nodes + 1)
+            aggregate_names["aggr{}_{}".format(aggregate_number, node)] = (
+                node, 500 * 10**12)
+
+        cluster = cls(aggregates=aggregate_names, **kwargs)
+        data_aggregates = [name for name in cluster.aggregates
+                           if not name.startswith('aggr0')]
+
+        policy_names = ['policy_{:04d}'.format(i) for i in range(policies)]
+        for policy_id, policy_name in enumerate(policy_names, start=2):
+            cluster.policies[policy_name] = [
+                "db-{:04d}-{}.cern.ch".format(policy_id, i)
+                for i in range(rng.randint(1, 4))]
+            cluster.policy_ids[policy_name] = policy_id
+
+        created_at = int(time.time()) - 365 * 24 * 3600
+        for number in range(volumes):
+            aggregate_name = data_aggregates[number % len(data_aggregates)]
+            size_total = rng.choice([10, 50, 100, 500, 1000]) * 2**30
+            volume = SimulatedVolume(
+                name="vol_{:06d}".format(number),
+                junction_path="/vol_{:06d}".format(number),
+                aggregate_name=aggregate_name,
+                node=cluster.aggregates[aggregate_name][0],
+                vserver=cluster.vserver,
+                size_total=size_total,
+                size_used=int(size_total * rng.random()),
+                percentage_snapshot_reserve=rng.choice([0, 5, 10, 20]),
+                policy=(rng.choice(policy_names) if policy_names
+                        else 'default'),
+                creation_time=created_at + number)
+            volume.autosize_enabled = rng.random() < 0.5
+            volume.max_autosize = int(size_total * 1.2)
+            volume.sis_enabled = rng.random() < 0.8
+            volume.compression = volume.sis_enabled and rng.random() < 0.5
+            volume.inline_compression = volume.compression
+            for snapshot_number in range(snapshots):
+                volume.snapshots["snap_{:04d}".format(snapshot_number)] = (
+                    volume.creation_time + 3600 * snapshot_number,
+                    rng.randint(0, size_total // 2**10 // 100))
+            cluster._add_volume(volume)
+
+        for volume_name in cluster.volume_names[:locks]:
+            cluster.locks.append((volume_name, "db-client.cern.ch",
+                                  'granted'))
+
+        return cluster
+
+    @property
+    def supported_apis(self):
+        return sorted(name[len('zapi_'):].replace('_', '-')
+                      for name in dir(self) if name.startswith('zapi_'))
+
+    def add_lock(self, volume_name, client_address):
+        """
+        Make client_address lock the volume volume_name, as clients
+        would through NFS.
+        """
+        with self._lock:
+            self._volume(volume_name)
+            self.locks.append((volume_name, client_address, 'granted'))
+
+    def latency_of(self, api_name):
+        return self.latency_s.get(api_name, self.default_latency_s)
+
+    def perform(self, api_call):
+        """
+        Perform the ZAPI call api_call (an XML element), returning the
+        contents of its results element as a tuple of attributes and a
+        list of child elements.
+
+        Raises ZapiError on failed calls.
+        """
+        api_name = api_call.tag
+        handler = getattr(self, "zapi_{}".format(api_name.replace('-', '_')),
+                          None)
+        self.calls[api_name] += 1
+
+        latency_s = self.latency_of(api_name)
+        if latency_s:
+            time.sleep(latency_s)
+
+        if handler is None:
+            raise ZapiError(ERRNO_API_NOT_FOUND,
+                            "Unable to find API: {}".format(api_name))
+
+        with self._lock:
+            results = handler(api_call)
+        return results if results is not None else []
+
+    def _add_volume(self, volume):
+        self.volumes[volume.name] = volume
+        bisect.insort(self.volume_names, volume.name)
+        if volume.junction_path:
+            self.junction_paths[volume.junction_path] = volume.name
+
+    def _remove_volume(self, volume):
+        del self.volumes[volume.name]
+        self.volume_names.pop(bisect.bisect_left(self.volume_names,
+                                                 volume.name))
+        self._unmount(volume)
+        self.locks = [lock for lock in self.locks
+                      if lock[0] != volume.name]
+
+    def _unmount(self, volume):
+        self.junction_paths.pop(volume.junction_path, None)
+        volume.junction_path = None
+
+    def _mount(self, volume, junction_path):
+        if junction_path in self.junction_paths:
+            raise ZapiError(ERRNO_INVALID_INPUT,
+                            "Junction path {} is already in use"
+                            .format(junction_path))
+        volume.junction_path = junction_path
+        self.junction_paths[junction_path] = volume.name
+
+    def _volume(self, volume_name):
+        try:
+            return self.volumes[volume_name]
+        except KeyError:
+            raise ZapiError(ERRNO_VOLUME_NOT_FOUND,
+                            "Volume {} does not exist".format(volume_name))
+
+    def _policy(self, policy_name):
+        try:
+            return self.policies[policy_name]
+        except KeyError:
+            raise ZapiError(ERRNO_NOT_FOUND,
+                            "Entry doesn't exist: policy {}"
+                            .format(policy_name))
+
+    def _volume_from_sis_path(self, path):
+        if not path.startswith('/vol/'):
+            raise ZapiError(ERRNO_INVALID_INPUT,
+                            "Invalid SIS path {}".format(path))
+        return self._volume(path[len('/vol/'):])
+
+    @staticmethod
+    def _page(api_call, records):
+        """
+        Return the results of a *-get-iter call as a page of at most
+        max-records records from the iterable records of (key,
+        element), starting after the key in tag. Keys must be strings
+        sorted in ascending order.
+        """
+        max_records = _int(_text(api_call, 'max-records',
+                                 DEFAULT_MAX_RECORDS), 'max-records')
+        tag = api_call.findtext('tag')
+
+        page = []
+        next_tag = None
+        for key, element in records:
+            if tag is not None and key <= tag:
+                continue
+            if len(page) == max_records:
+                next_tag = page[-1][0]
+                break
+            page.append((key, element))
+
+        results = [E('num-records', str(len(page))),
+                   E('attributes-list', *[e for _key, e in page])]
+        if next_tag is not None:
+            results.append(E('next-tag', next_tag))
+        return results
+
+    @staticmethod
+    def _indexed(records):
+        """
+        Key records by their position, as zero-padded strings.
+        """
+        return (("{:012d}".format(i), record)
+                for i, record in enumerate(records))
+
+    def _volume_query(self, api_call):
+        query = api_call.find('query/volume-attributes/volume-id-attributes')
+        return [] if query is None else [(e.tag, e.text or '')
+                                         for e in query]
+
+    def _matching_volumes(self, query, after=None):
+        name = dict(query).get('name')
+        junction_path = dict(query).get('junction-path')
+
+        if name is not None and _is_exact(name):
+            candidates = [name] if name in self.volumes else []
+        elif junction_path is not None and _is_exact(junction_path):
+            candidates = ([self.junction_paths[junction_path]]
+                          if junction_path in self.junction_paths else [])
+        else:
+            start = (0 if after is None
+                     else bisect.bisect_right(self.volume_names, after))
+            candidates = itertools.islice(self.volume_names, start, None)
+
+        for candidate in candidates:
+            volume = self.volumes[candidate]
+            if all(_matches(pattern, volume.id_attribute(attribute))
+                   for attribute, pattern in query):
+                yield volume
+
+    def zapi_system_get_version(self, api_call):
+        return [E('version', "NetApp Release 8.3.2 (storage-api simulator)")]
+
+    def zapi_volume_get_iter(self, api_call):
+        volumes = self._matching_volumes(self._volume_query(api_call),
+                                         after=api_call.findtext('tag'))
+        return self._page(api_call,
+                          ((v.name, v.to_xml()) for v in volumes))
+
+    def zapi_sis_get_iter(self, api_call):
+        path = _required(api_call, 'query/sis-status-info/path')
+        volume = self._volume_from_sis_path(path)
+        infos = []
+        if volume.sis_enabled:
+            infos.append(_children(
+                'sis-status-info', path=path, vserver=volume.vserver,
+                is_compression_enabled=volume.compression,
+                is_inline_compression_enabled=volume.inline_compression))
+        return self._page(api_call, self._indexed(infos))
+
+    def zapi_sis_enable(self, api_call):
+        volume = self._volume_from_sis_path(_required(api_call, 'path'))
+        if volume.sis_enabled:
+            raise ZapiError(ERRNO_SIS_ALREADY_ENABLED,
+                            "SIS is already enabled for {}"
+                            .format(volume.name))
+        volume.sis_enabled = True
+
+    def zapi_sis_set_config(self, api_call):
+        volume = self._volume_from_sis_path(_required(api_call, 'path'))
+        if not volume.sis_enabled:
+            raise ZapiError(ERRNO_INVALID_INPUT,
+                            "SIS is not enabled for {}".format(volume.name))
+        compression = _bool(_text(api_call, 'enable-compression',
+                                  volume.compression))
+        inline = _bool(_text(api_call, 'enable-inline-compression',
+                             volume.inline_compression))
+        if inline and not compression:
+            raise ZapiError(ERRNO_INVALID_INPUT,
+                            "Inline compression requires compression")
+        volume.compression = compression
+        volume.inline_compression = inline
+
+    def zapi_volume_create(self, api_call):
+        name = _required(api_call, 'volume')
+        aggregate_name = _required(api_call, 'containing-aggr-name')
+        if name in self.volumes:
+            raise ZapiError(ERRNO_EXISTS,
+                            "Volume {} already exists".format(name))
+        if aggregate_name not in self.aggregates:
+            raise ZapiError(ERRNO_NOT_FOUND,
+                            "Aggregate {} does not exist"
+                            .format(aggregate_name))
+
+        policy = _text(api_call, 'export-policy', 'default')
+        self._policy(policy)
+
+        volume = SimulatedVolume(
+            name=name,
+            aggregate_name=aggregate_name,
+            node=self.aggregates[aggregate_name][0],
+            vserver=self.vserver,
+            size_total=_int(_required(api_call, 'size'), 'size'),
+            percentage_snapshot_reserve=_int(
+                _text(api_call, 'percentage-snapshot-reserve', 0),
+                'percentage-snapshot-reserve'),
+            policy=policy,
+            caching_policy=_text(api_call, 'caching-policy'))
+
+        junction_path = api_call.findtext('junction-path')
+        if junction_path:
+            self._mount(volume, junction_path)
+        self._add_volume(volume)
+
+    def zapi_volume_clone_create(self, api_call):
+        name = _required(api_call, 'volume')
+        parent = self._volume(_required(api_call, 'parent-volume'))
+        snapshot_name = api_call.findtext('parent-snapshot')
+        if name in self.volumes:
+            raise ZapiError(ERRNO_EXISTS,
+                            "Volume {} already exists".format(name))
+        if snapshot_name and snapshot_name not in parent.snapshots:
+            raise ZapiError(ERRNO_NOT_FOUND,
+                            "Snapshot {} does not exist"
+                            .format(snapshot_name))
+
+        clone = SimulatedVolume(
+            name=name,
+            aggregate_name=parent.aggregate_name,
+            node=parent.node,
+            vserver=parent.vserver,
+            size_total=parent.size_total,
+            size_used=parent.size_used,
+            percentage_snapshot_reserve=parent.percentage_snapshot_reserve,
+            policy=parent.policy,
+            caching_policy=parent.caching_policy)
+
+        junction_path = api_call.findtext('junction-path')
+        if junction_path:
+            self._mount(clone, junction_path)
+        self._add_volume(clone)
+
+    def zapi_volume_size(self, api_call):
+        volume = self._volume(_required(api_call, 'volume'))
+        volume.size_total = _int(_required(api_call, 'new-size'),
+                                 'new-size')
+        return [E('volume-size', str(volume.size_total))]
+
+    def zapi_volume_autosize_set(self, api_call):
+        volume = self._volume(_required(api_call, 'volume'))
+        volume.autosize_enabled = _bool(_required(api_call, 'is-enabled'))
+        max_size = api_call.findtext('maximum-size')
+        if max_size is not None:
+            # Sizes may be given as floats, e.g. size * 1.2
+            try:
+                volume.max_autosize = int(float(max_size))
+            except ValueError:
+                raise ZapiError(ERRNO_INVALID_INPUT,
+                                "Invalid maximum-size: {}".format(max_size))
+
+    def zapi_volume_modify_iter(self, api_call):
+        attributes = api_call.find('attributes/volume-attributes')
+        if attributes is None:
+            raise ZapiError(ERRNO_INVALID_INPUT, "Missing input: attributes")
+
+        policy = attributes.findtext('volume-export-attributes/policy')
+        if policy is not None:
+            self._policy(policy)
+        reserve = attributes.findtext(
+            'volume-space-attributes/percentage-snapshot-reserve')
+        if reserve is not None:
+            reserve = _int(reserve, 'percentage-snapshot-reserve')
+        caching_policy = attributes.findtext(
+            'volume-hybrid-cache-attributes/caching-policy')
+        state = attributes.findtext('volume-state-attributes/state')
+
+        volumes = list(self._matching_volumes(self._volume_query(api_call)))
+        for volume in volumes:
+            if policy is not None:
+                volume.policy = policy
+            if reserve is not None:
+                volume.percentage_snapshot_reserve = reserve
+            if caching_policy is not None:
+                volume.caching_policy = caching_policy
+            if state is not None:
+                volume.state = state
+
+        return [E('num-succeeded', str(len(volumes))),
+                E('num-failed', '0'),
+                E('success-list',
+                  *[E('volume-modify-iter-info',
+                      E('volume-key', v.name)) for v in volumes])]
+
+    def zapi_volume_unmount(self, api_call):
+        self._unmount(self._volume(_required(api_call, 'volume-name')))
+
+    def zapi_volume_restrict(self, api_call):
+        self._volume(_required(api_call, 'name')).state = 'restricted'
+
+    def zapi_volume_destroy(self, api_call):
+        volume = self._volume(_required(api_call, 'name'))
+        if volume.state == 'online':
+            raise ZapiError(ERRNO_INVALID_INPUT,
+                            "Volume {} must be offline to be destroyed"
+                            .format(volume.name))
+        self._remove_volume(volume)
+
+    def zapi_snapshot_get_iter(self, api_call):
+        volume_name = api_call.findtext('query/snapshot-info/volume')
+        volumes = ([self._volume(volume_name)] if volume_name is not None
+                   else [self.volumes[n] for n in self.volume_names])
+
+        snapshots = (_children('snapshot-info', name=name, volume=v.name,
+                               access_time=access_time, total=kbytes)
+                     for v in volumes
+                     for name, (access_time, kbytes) in v.snapshots.items())
+        return self._page(api_call, self._indexed(snapshots))
+
+    def zapi_snapshot_create(self, api_call):
+        volume = self._volume(_required(api_call, 'volume'))
+        snapshot_name = _required(api_call, 'snapshot')
+        if snapshot_name in volume.snapshots:
+            raise ZapiError(ERRNO_EXISTS,
+                            "Snapshot {} already exists"
+                            .format(snapshot_name))
+        if len(volume.snapshots) >= self.max_snapshots:
+            raise ZapiError(ERRNO_TOO_MANY_SNAPSHOTS,
+                            "Volume {} has the maximum number of snapshots"
+                            .format(volume.name))
+        volume.snapshots[snapshot_name] = (int(time.time()),
+                                           volume.size_used // 2**10)
+
+    def _snapshot_of(self, api_call):
+        volume = self._volume(_required(api_call, 'volume'))
+        snapshot_name = _required(api_call, 'snapshot')
+        if snapshot_name not in volume.snapshots:
+            raise ZapiError(ERRNO_NOT_FOUND,
+                            "Entry doesn't exist: snapshot {}"
+                            .format(snapshot_name))
+        return volume, snapshot_name
+
+    def zapi_snapshot_delete(self, api_call):
+        volume, snapshot_name = self._snapshot_of(api_call)
+        del volume.snapshots[snapshot_name]
+
+    def zapi_snapshot_restore_volume(self, api_call):
+        volume, snapshot_name = self._snapshot_of(api_call)
+        # Restoring discards every snapshot newer than the restored one
+        names = list(volume.snapshots)
+        for newer in names[names.index(snapshot_name) + 1:]:
+            del volume.snapshots[newer]
+
+    def zapi_export_policy_get_iter(self, api_call):
+        return self._page(api_call, self._indexed(
+            _children('export-policy-info', policy_name=name,
+                      vserver=self.vserver)
+            for name in self.policies))
+
+    def zapi_export_policy_create(self, api_call):
+        policy_name = _required(api_call, 'policy-name')
+        if policy_name in self.policies:
+            raise ZapiError(ERRNO_EXISTS,
+                            "Policy {} already exists".format(policy_name))
+        self.policies[policy_name] = []
+        self.policy_ids[policy_name] = max(self.policy_ids.values()) + 1
+        return [E('result',
+                  _children('export-policy-info', policy_name=policy_name,
+                            policy_id=self.policy_ids[policy_name],
+                            vserver=self.vserver))]
+
+    def zapi_export_policy_destroy(self, api_call):
+        policy_name = _required(api_call, 'policy-name')
+        self._policy(policy_name)
+        del self.policies[policy_name]
+        del self.policy_ids[policy_name]
+
+    def zapi_export_rule_get_iter(self, api_call):
+        policy_name = api_call.findtext('query/export-rule-info/policy-name')
+        names = [policy_name] if policy_name is not None else self.policies
+        return self._page(api_call, self._indexed(
+            _children('export-rule-info', policy_name=name,
+                      rule_index=index, client_match=rule)
+            for name in names
+            for index, rule in enumerate(self.policies.get(name, []),
+                                         start=1)))
+
+    def _rule_index(self, api_call, tag, rules):
+        index = _int(_required(api_call, tag), tag)
+        if not 1 <= index <= len(rules):
+            raise ZapiError(ERRNO_NOT_FOUND,
+                            "Entry doesn't exist: rule index {}"
+                            .format(index))
+        return index
+
+    def zapi_export_rule_create(self, api_call):
+        rules = self._policy(_required(api_call, 'policy-name'))
+        client_match = _required(api_call, 'client-match')
+        index = _int(_text(api_call, 'rule-index', len(rules) + 1),
+                     'rule-index')
+        rules.insert(max(index, 1) - 1, client_match)
+
+    def zapi_export_rule_destroy(self, api_call):
+        rules = self._policy(_required(api_call, 'policy-name'))
+        index = self._rule_index(api_call, 'rule-index', rules)
+        del rules[index - 1]
+
+    def zapi_export_rule_set_index(self, api_call):
+        rules = self._policy(_required(api_call, 'policy-name'))
+        index = self._rule_index(api_call, 'rule-index', rules)
+        new_index = _int(_required(api_call, 'new-rule-index'),
+                         'new-rule-index')
+        rules.insert(max(new_index, 1) - 1, rules.pop(index - 1))
+
+    def zapi_lock_get_iter(self, api_call):
+        volume_name = api_call.findtext('query/lock-info/volume')
+        return self._page(api_call, self._indexed(
+            _children('lock-info', volume=volume, lock_state=state,
+                      client_address=client)
+            for volume, client, state in self.locks
+            if volume_name is None or _matches(volume_name, volume)))
+
+    def zapi_lock_break_iter(self, api_call):
+        volume_name = _required(api_call, 'query/lock-info/volume')
+        client = api_call.findtext('query/lock-info/client-address')
+
+        broken = [lock for lock in self.locks
+                  if _matches(volume_name, lock[0])
+                  and (client is None or _matches(client, lock[1]))]
+        self.locks = [lock for lock in self.locks if lock not in broken]
+        return [E('num-succeeded', str(len(broken))),
+                E('num-failed', '0')]
+
+    def _aggregate_usage(self):
+        used = Counter()
+        for volume in self.volumes.values():
+            used[volume.aggregate_name] += volume.size_total
+        return used
+
+    def zapi_aggr_get_iter(self, api_call):
+        used = self._aggregate_usage()
+        return self._page(api_call, (
+            (name, E('aggr-attributes',
+                     E('aggregate-name', name),
+                     _children('aggr-space-attributes',
+                               size_used=used[name],
+                               size_available=max(size - used[name], 0)),
+                     E('nodes', E('node-name', node))))
+            for name, (node, size) in self.aggregates.items()))
+
+    def zapi_vserver_show_aggr_get_iter(self, api_call):
+        used = self._aggregate_usage()
+        return self._page(api_call, (
+            (name, _children('show-aggregates', aggregate_name=name,
+                             vserver_name=self.vserver,
+                             available_size=max(size - used[name], 0)))
+            for name, (_node, size) in self.aggregates.items()
+            if not name.startswith('aggr0')))
+
+
+class ZapiSimulator(object):
+    """
+    A WSGI application serving the ZAPI of a `SimulatedCluster` at the
+    same URL as a filer.
+    """
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    @staticmethod
+    def _response(results, status='passed', reason=None, errno=None):
+        attributes = {'status': status}
+        if status != 'passed':
+            attributes.update(reason=reason, errno=str(errno))
+        root = E('netapp', E('results', *results, **attributes),
+                 version=netapp.api.XMLNS_VERSION)
+        return Response(lxml.etree.tostring(root, xml_declaration=True,
+                                            encoding="UTF-8"),
+                        content_type='text/xml')
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        if request.path != netapp.api.ONTAP_API_URL:
+            response = Response("Not found", status=404)
+        elif request.method != 'POST':
+            response = Response("Method not allowed", status=405)
+        else:
+            try:
+                root = _strip_namespaces(
+                    lxml.etree.fromstring(request.get_data()))
+                api_call = root[0]
+            except (lxml.etree.XMLSyntaxError, IndexError) as e:
+                response = Response("Invalid ZAPI request: {}".format(e),
+                                    status=400)
+            else:
+                try:
+                    response = self._response(self.cluster.perform(api_call))
+                except ZapiError as e:
+                    log.debug("Simulated {} failed: {}"
+                              .format(api_call.tag, e.reason))
+                    response = self._response([], status='failed',
+                                              reason=e.reason,
+                                              errno=e.errno)
+
+        return response(environ, start_response)
+
+
+class KeepAliveHandler(werkzeug.serving.WSGIRequestHandler):
+    """
+    Keep connections open between requests, like a filer does. Without
+    it, every call pays for a new connection.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                   1)
+
+
+def start_server(cluster, host='127.0.0.1', port=0, ssl_context=None):
+    """
+    Serve the cluster from a background thread, on a random free port
+    unless port is given, over HTTPS if an ssl_context is given. Returns
+    the server; its address is in server_address and it is stopped with
+    shutdown().
+    """
+    server = werkzeug.serving.make_server(host, port, ZapiSimulator(cluster),
+                                          threaded=True,
+                                          request_handler=KeepAliveHandler,
+                                          ssl_context=ssl_context)
+    thread = threading.Thread(target=server.serve_forever,
+                              name="zapi-simulator", daemon=True)
+    thread.start()
+    return server
+
+
+def parse_latency(specs):
+    """
+    Parse latency specifications like `volume-get-iter=0.05` into a
+    tuple of (latencies by API name, default latency), where the default
+    is given as `default=0.01`.
+    """
+    latency_s = {}
+    for spec in specs:
+        api_name, separator, seconds = spec.partition('=')
+        try:
+            latency_s[api_name.strip()] = float(seconds)
+        except ValueError:
+            raise ValueError("Invalid latency specification '{}'"
+                             .format(spec))
+        if not separator:
+            raise ValueError("Invalid latency specification '{}'"
+                             .format(spec))
+    default_latency_s = latency_s.pop('default', 0.0)
+    return latency_s, default_latency_s
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve a simulated NetApp cluster over ZAPI")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--vserver', default='vs1')
+    parser.add_argument('--volumes', type=int, default=1000)
+    parser.add_argument('--aggregates', type=int, default=4)
+    parser.add_argument('--nodes', type=int, default=2)
+    parser.add_argument('--snapshots', type=int, default=0,
+                        help="snapshots per volume")
+    parser.add_argument('--policies', type=int, default=10)
+    parser.add_argument('--locks', type=int, default=0,
+                        help="number of locked volumes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', action='append', default=[],
+                        metavar="API=SECONDS",
+                        help=("latency of an API call, e.g. "
+                              "volume-get-iter=0.05, or default=SECONDS "
+                              "for every other call. May be repeated."))
+    args = parser.parse_args(argv)
+
+    latency_s, default_latency_s = parse_latency(args.latency)
+    cluster = SimulatedCluster.synthetic(
+        volumes=args.volumes, aggregates=args.aggregates, nodes=args.nodes,
+        snapshots=args.snapshots, policies=args.policies, locks=args.locks,
+        seed=args.seed, vserver=args.vserver, latency_s=latency_s,
+        default_latency_s=default_latency_s)
+    log.info("Serving a simulated cluster with {} volumes on {}:{}"
+             .format(len(cluster.volumes), args.host, args.port))
+    werkzeug.serving.run_simple(args.host, args.port, ZapiSimulator(cluster),
+                                threaded=True,
+                                request_handler=KeepAliveHandler)
+
+
+if __name__ == '__main__':
+    main()
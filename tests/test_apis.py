@@ -1,13 +1,18 @@
+from storage_api import extensions
 from storage_api.apis import common
 from storage_api.apis import SAPI_MOUNTPOINT
+from storage_api.apis import storage as storage_apis
 from storage_api.utils import compose_decorators
+from storage_api.extensions.patch import PartialPatchError
 
 import json
+import threading
 from urllib.parse import urlencode
 from contextlib import contextmanager
 import uuid
 from storage_api.utils import init_logger
 from functools import partial
+from unittest import mock
 
 import pytest
 import hypothesis
@@ -331,7 +336,11 @@ def test_clone_from_snapshot(client, namespace):
                                              'from_volume': master_name})
 
     assert post_code == 201
-    assert _get(client, clone_volume) == _get(client, volume)
+    clone_code, clone = _get(client, clone_volume)
+    master_code, master = _get(client, volume)
+    assert (clone_code, clone['name']) == (master_code, "clone")
+    assert ({k: v for k, v in clone.items() if k != 'name'}
+            == {k: v for k, v in master.items() if k != 'name'})
 
 
 @params_namespaces
@@ -762,3 +771,344 @@ def test_put_to_export_rule_with_slash(client, namespace):
         for rule in rules:
             put_code, _ = _put(client, ("{}/rule/{}".format(policy, rule)))
             assert put_code == 201
+
+
+def test_volume_listing_reports_inventory_age(temp_app, client):
+    with mock.patch('netapp.api.Server') as server:
+        server.return_value.volumes = []
+        storage = extensions.NetappStorage(hostname="h", username="u",
+                                           password="p", vserver="vs",
+                                           inventory_refresh_s=60)
+    storage.init_app(temp_app, endpoint="inventoried")
+
+    try:
+        result = client.get("{}/inventoried/volumes".format(ROOT_URL),
+                            headers=_DEFAULT_HEADERS)
+        assert result.status_code == 200
+        assert int(result.headers['Age']) >= 0
+
+        result = client.get("{}/dummy/volumes".format(ROOT_URL),
+                            headers=_DEFAULT_HEADERS)
+        assert 'Age' not in result.headers
+    finally:
+        storage.inventory.stop()
+
+
+def test_volume_listing_query(client):
+    namespace = ROOT_URL + "/dummy"
+    with user_set(client):
+        for name, size in [("vol-b", 3), ("vol-a", 1), ("other", 2)]:
+            code, _ = _post(client, "{}/volumes/{}".format(namespace, name),
+                            data={'size_total': size})
+            assert code == 201
+
+    volumes = "{}/volumes".format(namespace)
+
+    code, response = _get(client, volumes, name_prefix="vol")
+    assert code == 200
+    assert [v['name'] for v in response] == ["vol-a", "vol-b"]
+
+    code, response = _get(client, volumes, sort="-size_total",
+                          fields="name,size_total")
+    assert code == 200
+    assert response == [{'name': "vol-b", 'size_total': 3},
+                        {'name': "other", 'size_total': 2},
+                        {'name': "vol-a", 'size_total': 1}]
+
+    code, response = _get(client, volumes, size_total_min=2,
+                          size_total_max=2)
+    assert [v['name'] for v in response] == ["other"]
+
+    assert _get(client, volumes, fields="name,colour")[0] == 400
+    assert _get(client, volumes, sort="colour")[0] == 400
+    assert _get(client, volumes, size_total_min=-1)[0] == 400
+
+
+def test_volume_and_snapshot_pagination(client):
+    namespace = ROOT_URL + "/dummy"
+    with user_set(client):
+        for i in range(5):
+            code, _ = _post(client, "{}/volumes/vol{}".format(namespace, i))
+            assert code == 201
+        for i in range(3):
+            code, _ = _post(client, "{}/volumes/vol0/snapshots/snap{}"
+                            .format(namespace, i))
+            assert code == 201
+
+    def pages(url, limit):
+        names = []
+        result = client.get("{}?limit={}".format(url, limit),
+                            headers=_DEFAULT_HEADERS)
+        while True:
+            assert result.status_code == 200
+            names.append([v['name'] for v in json.loads(
+                result.get_data(as_text=True))])
+            if 'Link' not in result.headers:
+                assert 'X-Next-Cursor' not in result.headers
+                return names
+            assert result.headers['Link'].endswith('; rel="next"')
+            cursor = result.headers['X-Next-Cursor']
+            result = client.get("{}?{}".format(url, urlencode(
+                {'limit': limit, 'cursor': cursor})),
+                headers=_DEFAULT_HEADERS)
+
+    volumes = "{}/volumes".format(namespace)
+    assert pages(volumes, 2) == [["vol0", "vol1"], ["vol2", "vol3"],
+                                 ["vol4"]]
+    assert pages(volumes + "/vol0/snapshots", 2) == [["snap0", "snap1"],
+                                                     ["snap2"]]
+
+    assert _get(client, volumes, limit=0)[0] == 400
+    assert _get(client, volumes, limit=2, cursor="garbage")[0] == 400
+    assert _get(client, volumes, cursor="garbage")[0] == 400
+    assert _get(client, volumes, limit=2, sort="name")[0] == 400
+    assert _get(client, volumes + "/nothing/snapshots", limit=2)[0] == 404
+
+
+def test_streamed_listings(client):
+    namespace = ROOT_URL + "/dummy"
+    with user_set(client):
+        for i in range(3):
+            code, _ = _post(client, "{}/volumes/vol{}".format(namespace, i))
+            assert code == 201
+        code, _ = _post(client, "{}/volumes/vol0/snapshots/snap"
+                        .format(namespace))
+        assert code == 201
+        code, _ = _post(client, "{}/export/policy".format(namespace),
+                        data={'rules': ["10.0.0.1"]})
+        assert code == 201
+
+        def stream(url, **headers):
+            result = client.get(url, headers=dict(_DEFAULT_HEADERS,
+                                                  **headers))
+            assert result.status_code == 200
+            assert result.mimetype == "application/x-ndjson"
+            return [json.loads(line) for line in
+                    result.get_data(as_text=True).splitlines()]
+
+        volumes = "{}/volumes".format(namespace)
+        assert ([v['name'] for v in stream(volumes + "?stream=1")]
+                == ["vol0", "vol1", "vol2"])
+        assert (stream(volumes + "?fields=name&name_prefix=vol2",
+                       Accept="application/x-ndjson")
+                == [{'name': "vol2"}])
+        assert ([v['name'] for v in stream(volumes + "?stream=1&limit=2")]
+                == ["vol0", "vol1"])
+        assert ([s['name'] for s in
+                 stream(volumes + "/vol0/snapshots?stream=1")] == ["snap"])
+        assert (stream("{}/export?stream=1".format(namespace))
+                == [{'name': "policy", 'rules': ["10.0.0.1"]}])
+
+        result = client.get(volumes + "?stream=0",
+                            headers={'Accept': "application/x-ndjson"})
+        assert result.mimetype == "application/json"
+        assert _get(client, volumes + "/nothing/snapshots",
+                    stream=1)[0] == 404
+
+
+def test_validation_stats(client):
+    with user_set(client):
+        _get(client, ROOT_URL + "/dummy/volumes")
+        code, stats = _get(client, "/conf/subsystems/dummy/validation")
+    assert code == 200
+    assert stats['mode'] == "strict"
+    assert set(stats) >= {'validated', 'skipped', 'trusted', 'failed',
+                          'seconds'}
+
+    assert _get(client, "/conf/subsystems/dummy/validation")[0] == 403
+    with user_set(client):
+        assert _get(client, "/conf/subsystems/nothing/validation")[0] == 404
+
+
+def test_transport_stats_need_a_pool(client):
+    with user_set(client):
+        assert _get(client, "/conf/subsystems/dummy/transport")[0] == 404
+
+
+def test_partial_patch_failure(client):
+    volume = ROOT_URL + "/dummy/volumes/partial"
+    error = PartialPatchError(applied=['size_total'],
+                              failed={'caching_policy': ValueError("bad")},
+                              skipped=['max_autosize'])
+    with user_set(client):
+        _post(client, volume, data={'size_total': 1})
+        with mock.patch.object(extensions.DummyStorage, 'patch_volume',
+                               side_effect=error):
+            code, result = _patch(client, volume,
+                                  data={'size_total': 2,
+                                        'caching_policy': "bad"})
+    assert code == 500
+    assert result['applied'] == ['size_total']
+    assert result['failed'] == {'caching_policy': "bad"}
+    assert result['skipped'] == ['max_autosize']
+
+
+def test_conditional_patch(client):
+    volume = ROOT_URL + "/dummy/volumes/conditional"
+    with user_set(client):
+        _post(client, volume, data={'size_total': 1})
+        etag = client.get(volume, headers=_DEFAULT_HEADERS).headers['ETag']
+        assert etag.startswith('"')
+
+        def patch(if_match, size):
+            headers = dict(_DEFAULT_HEADERS, **{'If-Match': if_match})
+            return client.patch(volume, headers=headers,
+                                data=json.dumps({'size_total': size}))
+
+        assert patch(etag, 2).status_code == 200
+        assert patch(etag, 3).status_code == 412
+        assert patch('W/' + etag, 3).status_code == 412
+        assert patch('*', 4).status_code == 200
+        assert _get(client, volume)[1]['size_total'] == 4
+
+
+def test_batch(client):
+    volumes = ROOT_URL + "/dummy/volumes/"
+    with user_set(client):
+        _post(client, volumes + "batched", data={'size_total': 1})
+        _post(client, ROOT_URL + "/dummy/export/batch-policy",
+              data={'rules': []})
+        code, result = _post(client, ROOT_URL + "/dummy/batch", data={
+            'operations': [
+                {'operation': 'create_snapshot', 'volume_name': "batched",
+                 'snapshot_name': "s1"},
+                {'operation': 'delete_snapshot', 'volume_name': "batched",
+                 'snapshot_name': "s1"},
+                {'operation': 'create_snapshot', 'volume_name': "missing",
+                 'snapshot_name': "s1"},
+                {'operation': 'patch_volume', 'volume_name': "batched",
+                 'data': {'size_total': 2}},
+                {'operation': 'patch_volume', 'volume_name': "batched"},
+                {'operation': 'ensure_policy_rule_present',
+                 'policy': "batch-policy", 'rule': "10.0.0.1"},
+                {'operation': 'create_lock', 'volume_name': "batched"}]})
+
+        assert code == 200
+        assert [r['code'] for r in result['results']] == [
+            201, 204, 404, 200, 400, 201, 400]
+        assert "host" in result['results'][-1]['result']['message']
+        assert _get(client, volumes + "batched")[1]['size_total'] == 2
+        assert _get(client, volumes + "batched/snapshots")[1] == []
+        assert _get(client, ROOT_URL + "/dummy/export/batch-policy")[1][
+            'rules'] == ["10.0.0.1"]
+
+
+def test_batch_authorises_each_operation(client):
+    with user_set(client):
+        _post(client, ROOT_URL + "/dummy/volumes/batched",
+              data={'size_total': 1})
+    with user_set(client, user={'roles': [common.ADMIN_ROLE]}):
+        code, result = _post(client, ROOT_URL + "/dummy/batch", data={
+            'operations': [
+                {'operation': 'patch_volume', 'volume_name': "batched",
+                 'data': {'size_total': 2}},
+                {'operation': 'create_lock', 'volume_name': "batched",
+                 'host': "db1"},
+                {'operation': 'create_snapshot', 'volume_name': "batched",
+                 'snapshot_name': "s1"}]})
+    assert code == 200
+    assert [r['code'] for r in result['results']] == [403, 201, 403]
+
+
+def test_batch_size_is_limited(client, temp_app):
+    operations = [{'operation': 'create_snapshot', 'volume_name': "v",
+                   'snapshot_name': "s{}".format(i)} for i in range(3)]
+    with mock.patch.dict(temp_app.config, {'MAX_BATCH_SIZE': 2}):
+        code, _ = _post(client, ROOT_URL + "/dummy/batch",
+                        data={'operations': operations})
+    assert code == 400
+    code, _ = _post(client, ROOT_URL + "/dummy/batch",
+                    data={'operations': [{'operation': 'format_disk'}]})
+    assert code == 400
+
+
+def test_batch_orders_operations_on_the_same_volume():
+    netapp = mock.Mock()
+    netapp.parse_volume_name.side_effect = (
+        lambda name: {'node1:/vol1': "vol1"}.get(name, name))
+    dummy = mock.Mock(spec=[])
+
+    def target(storage, volume_name):
+        return storage_apis._batch_target(storage,
+                                          {'volume_name': volume_name})
+
+    assert target(netapp, "node1:/vol1") == target(netapp, "vol1")
+    assert target(netapp, "vol2") != target(netapp, "vol1")
+    assert target(dummy, "vol1") == ('volume', "vol1")
+
+    netapp.parse_volume_name.side_effect = KeyError("node1:/missing")
+    assert target(netapp, "node1:/missing") == ('volume', "node1:/missing")
+
+
+def test_batch_resolves_names_in_its_workers(client):
+    threads = []
+
+    def parse_volume_name(volume_name):
+        threads.append(threading.current_thread().name)
+        return volume_name
+
+    with mock.patch.object(extensions.DummyStorage, 'parse_volume_name',
+                           create=True, side_effect=parse_volume_name), \
+            user_set(client):
+        code, _ = _post(client, ROOT_URL + "/dummy/batch", data={
+            'operations': [{'operation': 'create_snapshot',
+                            'volume_name': "vol{}".format(i),
+                            'snapshot_name': "s1"} for i in range(4)]})
+    assert code == 200
+    assert len(threads) == 4
+    assert all(name.startswith("batch") for name in threads)
+
+
+def test_batch_without_configuration(client, temp_app):
+    with mock.patch.dict(temp_app.config), user_set(client):
+        del temp_app.config['MAX_BATCH_SIZE']
+        del temp_app.config['BATCH_WORKERS']
+        code, result = _post(client, ROOT_URL + "/dummy/batch", data={
+            'operations': [{'operation': 'create_snapshot',
+                            'volume_name': "missing",
+                            'snapshot_name': "s1"}]})
+    assert code == 200
+    assert result['results'][0]['code'] == 404
+
+
+def test_snapshot_group(client):
+    volumes = ROOT_URL + "/dummy/volumes/"
+    with user_set(client):
+        for name in ["db_data", "db_logs"]:
+            _post(client, volumes + name, data={'size_total': 1})
+
+    with user_set(client, user={'roles': []}):
+        assert _post(client, ROOT_URL + "/dummy/snapshots/backup",
+                     data={'volumes': ["db_data", "db_logs"]})[0] == 403
+    assert _get(client, volumes + "db_logs/snapshots/backup")[0] == 404
+
+    with user_set(client, user={'roles': [common.USER_ROLE]}):
+        code, group = _post(client, ROOT_URL + "/dummy/snapshots/backup",
+                            data={'volumes': ["db_data", "db_logs"]})
+        assert code == 201
+        assert group['name'] == "backup"
+        assert [t['name'] for t in group['volumes']] == ["db_data",
+                                                         "db_logs"]
+        assert _get(client, volumes + "db_logs/snapshots/backup")[0] == 200
+
+        code, _ = _post(client, ROOT_URL + "/dummy/snapshots/partial",
+                        data={'volumes': ["db_data", "no_such_volume"]})
+        assert code == 404
+        assert _get(client, volumes + "db_data/snapshots/partial")[0] == 404
+        assert _post(client, ROOT_URL + "/dummy/snapshots/none",
+                     data={'volumes': []})[0] == 400
+
+
+def test_purge_old_snapshots(client, temp_app):
+    volume = ROOT_URL + "/dummy/volumes/rotated"
+    with user_set(client):
+        _post(client, volume, data={'size_total': 1})
+    storage = temp_app.extensions[temp_app.config['SUBSYSTEM']['dummy']]
+    storage.max_snapshots = 1
+
+    assert _post(client, volume + "/snapshots/first", data={})[0] == 201
+    assert _post(client, volume + "/snapshots/second", data={})[0] == 409
+    assert _post(client, volume + "/snapshots/second",
+                 data={'purge_old_if_needed': True})[0] == 201
+    code, snapshots = _get(client, volume + "/snapshots")
+    assert [s['name'] for s in snapshots] == ["second"]
@@ -0,0 +1,66 @@
+from storage_api import benchmark
+
+import json
+
+import pytest
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 0.5) == 50
+    assert benchmark.percentile(values, 0.99) == 99
+    assert benchmark.percentile([3], 0.99) == 3
+
+
+def test_summarise():
+    summary = benchmark.summarise([0.3, 0.1, 0.2], errors=1, elapsed_s=0.6)
+    assert summary['count'] == 3
+    assert summary['errors'] == 1
+    assert summary['ops_per_s'] == pytest.approx(5)
+    assert summary['latency_s']['min'] == 0.1
+    assert summary['latency_s']['p50'] == 0.2
+    assert summary['latency_s']['max'] == 0.3
+
+
+def test_run_benchmark_stops_after_max_seconds():
+    def prepare(i):
+        if i == 1:
+            raise ValueError("preparation failed")
+        return lambda: 1 / 0 if i == 2 else None
+
+    summary = benchmark.run_benchmark(prepare, repeat=10, max_seconds=60)
+    assert summary['count'] == 9
+    assert summary['errors'] == 2
+
+    summary = benchmark.run_benchmark(lambda i: lambda: None, repeat=10,
+                                      max_seconds=0)
+    assert summary['count'] == 1
+
+
+@pytest.mark.parametrize('kind', benchmark.BACKEND_KINDS)
+def test_every_benchmark_runs(kind):
+    report = benchmark.run([kind], [20], snapshot_count=2, policy_count=3,
+                           repeat=2, max_seconds=5)
+    json.dumps(report)
+
+    assert report['fleets'][0]['volumes'] == 20
+    results = {(r['kind'], r['name']): r for r in report['results']}
+    assert len(results) == (len(benchmark.BACKEND_BENCHMARKS)
+                            + len(benchmark.ROUTE_BENCHMARKS))
+
+    failing = {name for (_kind, name), r in results.items() if r['errors']}
+    if kind == 'netapp':
+        # NetappStorage cannot clone into a volume that doesn't exist yet
+        assert failing == {'clone_volume'}
+    else:
+        assert failing == set()
+
+
+def test_main_writes_json(tmpdir):
+    output = tmpdir.join("benchmark.json")
+    benchmark.main(["--backend", "dummy", "--volumes", "10", "--repeat", "1",
+                    "--filter", "^get_volume$", "--output", str(output)])
+
+    report = json.loads(output.read())
+    assert report['parameters']['volumes'] == [10]
+    assert [r['name'] for r in report['results']] == ['get_volume']
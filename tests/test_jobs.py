@@ -0,0 +1,156 @@
+from storage_api import jobs
+from storage_api.apis import SAPI_MOUNTPOINT
+from storage_api.apis import common
+from storage_api.extensions.patch import PartialPatchError
+
+import json
+import threading
+import time
+from unittest import mock
+
+import flask
+import pytest
+
+_ASYNC_HEADERS = {'Content-Type': 'application/json',
+                  'Accept': 'application/json',
+                  'Prefer': "respond-async"}
+
+
+def wait_for(runner, job_id, timeout_s=10):
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        job = runner.get(job_id)
+        if job['status'] in jobs.FINISHED_STATES:
+            return job
+        time.sleep(0.01)
+    raise AssertionError("Job {} did not finish".format(job_id))
+
+
+@pytest.fixture
+def runner():
+    return jobs.JobRunner(jobs.JobStore(), workers=2, max_pending=2)
+
+
+def test_job_success(runner):
+    job = runner.submit('op', 'dummy', 'vol', lambda: ({'a': 1}, 201),
+                        app=flask.Flask(__name__))
+    assert job['status'] == 'queued'
+    job = wait_for(runner, job['id'])
+    assert job['status'] == 'succeeded'
+    assert (job['code'], job['result']) == (201, {'a': 1})
+    assert job['finished'] >= job['started'] >= job['submitted']
+
+
+def test_job_failure(runner):
+    app = flask.Flask(__name__)
+
+    def fail():
+        flask.abort(404)
+
+    def fail_partially():
+        raise PartialPatchError(applied=['a'], failed={'b': ValueError()},
+                                skipped=[])
+
+    job = wait_for(runner, runner.submit('op', 'dummy', 'vol', fail,
+                                         app=app)['id'])
+    assert (job['status'], job['code']) == ('failed', 404)
+
+    job = wait_for(runner, runner.submit('op', 'dummy', 'vol',
+                                         fail_partially, app=app)['id'])
+    assert (job['status'], job['code']) == ('failed', 500)
+    assert job['result']['applied'] == ['a']
+
+
+def test_too_many_jobs(runner):
+    release = threading.Event()
+    app = flask.Flask(__name__)
+
+    def block():
+        release.wait(10)
+        return None, 200
+
+    submitted = [runner.submit('op', 'dummy', 'vol', block, app=app)
+                 for _ in range(2)]
+    with pytest.raises(jobs.TooManyJobs):
+        runner.submit('op', 'dummy', 'vol', block, app=app)
+    release.set()
+    for job in submitted:
+        wait_for(runner, job['id'])
+    runner.submit('op', 'dummy', 'vol', block, app=app)
+
+
+def test_jobs_are_shared_through_directory(tmpdir):
+    store = jobs.JobStore(str(tmpdir))
+    runner = jobs.JobRunner(store)
+    job = runner.submit('op', 'dummy', 'vol', lambda: ('', 201),
+                        app=flask.Flask(__name__))
+    wait_for(runner, job['id'])
+
+    other_worker = jobs.JobRunner(jobs.JobStore(str(tmpdir)))
+    assert other_worker.get(job['id'])['status'] == 'succeeded'
+    with pytest.raises(KeyError):
+        other_worker.get("no-such-job")
+
+    with mock.patch.object(jobs, '_now', return_value=time.time() + 7200):
+        store.prune(older_than_s=3600)
+    with pytest.raises(KeyError):
+        other_worker.get(job['id'])
+
+
+def test_job_of_dead_worker_fails(tmpdir):
+    store = jobs.JobStore(str(tmpdir))
+    store.put({'id': "orphan", 'status': 'running', 'pid': 2**22 + 1,
+               'finished': None})
+    job = jobs.JobRunner(store).get("orphan")
+    assert (job['status'], job['code']) == ('failed', 500)
+
+
+def test_async_api(client):
+    volume = SAPI_MOUNTPOINT + "/dummy/volumes/async"
+    runner = client.application.extensions['jobs']
+    with client.session_transaction() as sess:
+        sess['user'] = {'roles': [common.ADMIN_ROLE, common.UBER_ADMIN_ROLE,
+                                  common.USER_ROLE]}
+
+    r = client.post(volume, headers=_ASYNC_HEADERS,
+                    data=json.dumps({'size_total': 1}))
+    assert r.status_code == 202
+    assert r.headers['Preference-Applied'] == "respond-async"
+    job = json.loads(r.get_data(as_text=True))
+    assert job['operation'] == 'create_volume'
+    assert r.headers['Location'].endswith(
+        SAPI_MOUNTPOINT + "/jobs/" + job['id'])
+
+    wait_for(runner, job['id'])
+    r = client.get(r.headers['Location'], headers=_ASYNC_HEADERS)
+    job = json.loads(r.get_data(as_text=True))
+    assert (job['status'], job['code']) == ('succeeded', 201)
+    assert job['result']['name'] == "async"
+
+    r = client.patch(volume + "-missing", headers=_ASYNC_HEADERS,
+                     data=json.dumps({'size_total': 2}))
+    assert r.status_code == 202
+    job = wait_for(runner, json.loads(r.get_data(as_text=True))['id'])
+    assert (job['status'], job['code']) == ('failed', 404)
+    assert "async-missing" in job['result']['message']
+
+    r = client.post(volume + "/snapshots/snap", headers=_ASYNC_HEADERS,
+                    data=json.dumps({}))
+    assert r.status_code == 202
+    job = wait_for(runner, json.loads(r.get_data(as_text=True))['id'])
+    assert (job['status'], job['code']) == ('succeeded', 201)
+
+    assert client.get(SAPI_MOUNTPOINT + "/jobs/nope",
+                      headers=_ASYNC_HEADERS).status_code == 404
+
+
+def test_sync_api_unchanged(client):
+    volume = SAPI_MOUNTPOINT + "/dummy/volumes/sync"
+    headers = dict(_ASYNC_HEADERS)
+    del headers['Prefer']
+    with client.session_transaction() as sess:
+        sess['user'] = {'roles': [common.ADMIN_ROLE]}
+    r = client.post(volume, headers=headers,
+                    data=json.dumps({'size_total': 1}))
+    assert r.status_code == 201
+    assert json.loads(r.get_data(as_text=True))['name'] == "sync"
@@ -0,0 +1,91 @@
+from storage_api import loadtest
+
+import json
+import shutil
+
+import pytest
+
+
+def test_parse_mix():
+    assert loadtest.parse_mix("get_volume=3,put_rule") == {
+        'get_volume': 3.0, 'put_rule': 1.0}
+    with pytest.raises(ValueError):
+        loadtest.parse_mix("get_volume=3,format_everything=1")
+    with pytest.raises(ValueError):
+        loadtest.parse_mix("get_volume=lots")
+    with pytest.raises(ValueError):
+        loadtest.parse_mix("get_volume=0")
+
+
+def test_parse_counts():
+    assert loadtest.parse_counts("1,2,8") == [1, 2, 8]
+    with pytest.raises(ValueError):
+        loadtest.parse_counts("1,0")
+
+
+def test_saturation_point():
+    points = [{'concurrency': 1, 'ops_per_s': 10.0},
+              {'concurrency': 2, 'ops_per_s': 19.5},
+              {'concurrency': 4, 'ops_per_s': 20.0},
+              {'concurrency': 8, 'ops_per_s': 19.0}]
+    assert loadtest.saturation_point(points)['concurrency'] == 2
+    assert loadtest.saturation_point(points, tolerance=0)['concurrency'] == 4
+    assert loadtest.saturation_point(
+        [{'concurrency': 1, 'ops_per_s': 0.0}]) is None
+
+
+def test_delete_snapshot_only_deletes_own_snapshots():
+    state = loadtest.ClientState('netapp', 3, volume_count=10,
+                                 policy_count=1, snapshot_count=0, seed=0)
+    method, path, _body = loadtest.OPERATIONS['delete_snapshot'](state)
+    assert method == 'POST'
+    assert path.endswith("/snapshots/load_3_0")
+    assert path.startswith("/bench/volumes/:/vol_0000")
+
+    method, deleted, _body = loadtest.OPERATIONS['delete_snapshot'](state)
+    assert (method, deleted) == ('DELETE', path)
+    assert state.snapshots == []
+
+
+def test_inprocess_dummy_sweep():
+    report = loadtest.run(target='inprocess', backend='dummy',
+                          processes=[1, 2], threads=[2], concurrency=[1, 2],
+                          duration_s=0.3, warmup_s=0.1, volume_count=20,
+                          snapshot_count=2, policy_count=2)
+    json.dumps(report)
+
+    assert [(c['processes'], c['threads'])
+            for c in report['configurations']] == [(1, 2), (2, 2)]
+    for configuration in report['configurations']:
+        assert [p['concurrency'] for p in configuration['points']] == [1, 2]
+        for point in configuration['points']:
+            assert point['count'] > 0
+            assert point['errors'] == 0
+        assert configuration['saturation']['concurrency'] in [1, 2]
+
+
+def test_main_netapp(tmpdir, capsys):
+    output = tmpdir.join("loadtest.json")
+    loadtest.main(["--processes", "1", "--threads", "2",
+                   "--concurrency", "2", "--duration", "0.3",
+                   "--warmup", "0", "--volumes", "20",
+                   "--latency", "default=0.001",
+                   "--mix", "get_volume=2,create_snapshot,delete_snapshot",
+                   "--output", str(output)])
+
+    report = json.loads(output.read())
+    point = report['configurations'][0]['points'][0]
+    assert point['count'] > 0
+    assert point['errors'] == 0
+    assert set(point['operations']) <= {'get_volume', 'create_snapshot',
+                                        'delete_snapshot'}
+    assert "saturation" in capsys.readouterr().err
+
+
+@pytest.mark.skipif(shutil.which("uwsgi") is None,
+                    reason="uwsgi is not installed")
+def test_uwsgi_sweep():
+    report = loadtest.run(target='uwsgi', processes=[2], threads=[2],
+                          concurrency=[2], duration_s=0.5, volume_count=20,
+                          latency_specs=["default=0.001"])
+    assert report['configurations'][0]['points'][0]['errors'] == 0
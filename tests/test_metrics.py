@@ -0,0 +1,170 @@
+from storage_api import metrics
+from storage_api.apis import SAPI_MOUNTPOINT
+from storage_api.extensions import DummyStorage
+
+import json
+import os
+from unittest import mock
+
+import flask
+import pytest
+
+
+def sample(rendered, line_start):
+    matching = [line for line in rendered.splitlines()
+                if line.startswith(line_start)]
+    assert len(matching) == 1, matching
+    return float(matching[0].rsplit(" ", 1)[1])
+
+
+def test_histogram_rendering():
+    registry = metrics.MetricsRegistry()
+    labels = {'subsystem': "dummy", 'method': "get_volume"}
+    for value in [0.001, 0.2, 500]:
+        registry.observe('sapi_backend_call_duration_seconds', labels, value)
+
+    rendered = registry.render()
+    name = 'sapi_backend_call_duration_seconds'
+    labels = 'method="get_volume",subsystem="dummy"'
+    assert "# TYPE {} histogram".format(name) in rendered
+    assert sample(rendered, '{}_bucket{{{},le="0.005"}}'
+                  .format(name, labels)) == 1
+    assert sample(rendered, '{}_bucket{{{},le="0.25"}}'
+                  .format(name, labels)) == 2
+    assert sample(rendered, '{}_bucket{{{},le="120.0"}}'
+                  .format(name, labels)) == 2
+    assert sample(rendered, '{}_bucket{{{},le="+Inf"}}'
+                  .format(name, labels)) == 3
+    assert sample(rendered, '{}_count{{{}}}'.format(name, labels)) == 3
+    assert sample(rendered, '{}_sum{{{}}}'
+                  .format(name, labels)) == pytest.approx(500.201)
+
+
+def test_label_escaping():
+    registry = metrics.MetricsRegistry()
+    registry.increment('sapi_backend_call_errors_total',
+                       {'method': 'a"b\\c\nd'})
+    assert ('sapi_backend_call_errors_total{method="a\\"b\\\\c\\nd"} 1'
+            in registry.render())
+
+
+def test_metrics_are_shared_between_processes(tmpdir):
+    other_process = metrics.MetricsRegistry(directory=str(tmpdir))
+    other_process.increment('sapi_backend_call_errors_total',
+                            {'method': "get_volume"}, 2)
+    other_process.flush()
+    # Pretend the file was written by another process
+    own_file = tmpdir.join("metrics-{}.json".format(os.getpid()))
+    own_file.rename(tmpdir.join("metrics-1.json"))
+
+    registry = metrics.MetricsRegistry(directory=str(tmpdir))
+    registry.increment('sapi_backend_call_errors_total',
+                       {'method': "get_volume"})
+
+    assert sample(registry.render(),
+                  'sapi_backend_call_errors_total{method="get_volume"}') == 3
+
+
+def test_flush_writes_own_file(tmpdir):
+    registry = metrics.MetricsRegistry(directory=str(tmpdir),
+                                       flush_interval_s=0)
+    registry.observe('sapi_http_request_duration_seconds', {}, 0.1)
+
+    with open(str(tmpdir.join("metrics-{}.json".format(os.getpid())))) as f:
+        assert json.load(f)['histograms']
+
+
+def test_instrumented_backend():
+    registry = metrics.MetricsRegistry()
+    backend = metrics.InstrumentedBackend(DummyStorage(), "dummy", registry)
+
+    backend.create_volume("vol")
+    backend.get_volume("vol")
+    backend.volumes
+    with pytest.raises(KeyError):
+        backend.get_volume("no-such-volume")
+
+    rendered = registry.render()
+    for method, calls in [('create_volume', 1), ('get_volume', 2),
+                          ('volumes', 1)]:
+        assert sample(rendered,
+                      'sapi_backend_call_duration_seconds_count{{'
+                      'method="{}",subsystem="dummy"}}'
+                      .format(method)) == calls
+    assert sample(rendered,
+                  'sapi_backend_call_errors_total{exception="KeyError",'
+                  'method="get_volume",subsystem="dummy"}') == 1
+
+
+def test_metrics_endpoint(client):
+    client.get("{}/dummy/volumes".format(SAPI_MOUNTPOINT))
+
+    result = client.get("/conf/metrics")
+    assert result.status_code == 200
+    assert result.mimetype == "text/plain"
+    rendered = result.get_data(as_text=True)
+    assert sample(rendered,
+                  'sapi_http_request_duration_seconds_count{method="GET",'
+                  'route="/v3/<string:subsystem>/volumes",status="200"}') >= 1
+    assert sample(rendered,
+                  'sapi_backend_call_duration_seconds_count{'
+                  'method="query_volumes",subsystem="dummy"}') >= 1
+
+
+@pytest.fixture
+def timed_app():
+    app = flask.Flask(__name__)
+    metrics.init_request_timing(app, server_timing=True, slow_request_s=0)
+
+    @app.route('/slow')
+    def slow():
+        with metrics.timed_phase('auth'):
+            pass
+        for method in ["get_volume", "get_volume", "get_snapshots"]:
+            with metrics.timed_phase('backend', detail=method):
+                metrics.record_timing('validation', 0.001)
+        return "ok"
+
+    return app
+
+
+def test_server_timing_header(timed_app):
+    response = timed_app.test_client().get('/slow')
+    entries = response.headers['Server-Timing'].split(", ")
+
+    assert [entry.split(";")[0] for entry in entries] == [
+        "auth", "backend", "validation", "total"]
+    assert entries[1].startswith('backend;desc="3 calls";dur=')
+    assert entries[2] == 'validation;desc="3 calls";dur=3.0'
+
+
+def test_slow_request_log(timed_app):
+    with mock.patch.object(metrics.log, 'warning') as warning:
+        timed_app.test_client().get('/slow?x=1')
+
+    message = warning.call_args[0][0]
+    assert message.startswith("Slow request: GET /slow?x=1 took")
+    assert "backend: 3 calls" in message
+    assert "get_snapshots x1" in message
+    assert "get_volume x2" in message
+
+
+def test_request_timing_disabled_by_default():
+    app = flask.Flask(__name__)
+    metrics.init_request_timing(app)
+    app.route('/')(lambda: "ok")
+
+    assert 'Server-Timing' not in app.test_client().get('/').headers
+
+
+def test_instrumented_backend_reports_request_timing():
+    app = flask.Flask(__name__)
+    backend = metrics.InstrumentedBackend(DummyStorage(), "dummy",
+                                          metrics.MetricsRegistry())
+    with app.test_request_context():
+        flask.g.request_timings = {}
+        backend.create_volume("vol")
+        backend.volumes
+        assert flask.g.request_timings[('backend', 'volumes')][0] == 1
+        assert flask.g.request_timings['backend'][0] == 2
+        assert flask.g.request_timings['validation'][0] == 1
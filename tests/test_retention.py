@@ -0,0 +1,228 @@
+from storage_api import extensions
+from storage_api import retention
+from storage_api.apis import INTROSPECTION_MOUNTPOINT
+from storage_api.apis import common
+
+import json
+import tempfile
+import threading
+from unittest import mock
+
+import flask
+import pytest
+
+HOUR = 3600
+DAY = 86400
+_HEADERS = {'Accept': 'application/json'}
+
+
+class Clock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def write_policies(tmpdir, policies):
+    path = tmpdir.join("policies.json")
+    path.write(json.dumps(policies))
+    return str(path)
+
+
+@pytest.fixture
+def app():
+    app = flask.Flask(__name__)
+    app.config['SUBSYSTEM'] = {}
+    storage = extensions.DummyStorage()
+    storage.init_app(app, endpoint="dummy")
+    for name in ["vol1", "vol2", "vol3"]:
+        storage.create_volume(name)
+    return app
+
+
+def retention_snapshots(app, volume_name):
+    storage = app.extensions[app.config['SUBSYSTEM']['dummy']]
+    return sorted(s['name'] for s in storage.get_snapshots(volume_name)
+                  if s['name'].startswith(retention.SNAPSHOT_PREFIX))
+
+
+def test_load_policies(tmpdir):
+    path = write_policies(tmpdir, {'dummy': {'vol1': {'hourly': 2,
+                                                      'daily': 0}}})
+    assert retention.load_policies(path) == {('dummy', 'vol1'):
+                                             {'hourly': 2}}
+
+    for policy in [{'weekly': 1}, {'hourly': -1}, {'daily': "7"}]:
+        path = write_policies(tmpdir, {'dummy': {'vol1': policy}})
+        with pytest.raises(ValueError):
+            retention.load_policies(path)
+
+
+def test_snapshot_names_and_offsets():
+    names = [retention.snapshot_name('hourly', period)
+             for period in range(0, 3 * DAY, HOUR)]
+    assert names == sorted(names)
+    assert names[1] == "retention_hourly_19700101T0100Z"
+
+    offsets = {retention.offset_s('dummy', "vol{}".format(i), 'hourly',
+                                  jitter_s=600)
+               for i in range(100)}
+    assert all(0 <= offset < 600 for offset in offsets)
+    assert len(offsets) > 50
+    assert retention.offset_s('dummy', 'vol1', 'daily', 600) == (
+        retention.offset_s('dummy', 'vol1', 'daily', 600))
+    assert retention.offset_s('dummy', 'vol1', 'hourly', 0) == 0
+
+
+def test_retention_rotates_snapshots(app, tmpdir):
+    path = write_policies(tmpdir, {'dummy': {'vol1': {'hourly': 2},
+                                             'vol2': {'hourly': 1,
+                                                      'daily': 1}}})
+    storage = app.extensions[app.config['SUBSYSTEM']['dummy']]
+    storage.create_snapshot("vol1", "manual")
+    clock = Clock(10 * DAY)
+    engine = retention.RetentionEngine(app, path, jitter_s=0, clock=clock)
+
+    for hour in range(4):
+        clock.now = 10 * DAY + hour * HOUR
+        assert engine.run_once()
+        engine.wait(10)
+        # Nothing more to do until the next hour
+        engine.run_once()
+        engine.wait(10)
+
+    assert retention_snapshots(app, "vol1") == [
+        retention.snapshot_name('hourly', 10 * DAY + 2 * HOUR),
+        retention.snapshot_name('hourly', 10 * DAY + 3 * HOUR)]
+    assert retention_snapshots(app, "vol2") == [
+        retention.snapshot_name('daily', 10 * DAY),
+        retention.snapshot_name('hourly', 10 * DAY + 3 * HOUR)]
+    assert "manual" in [s['name'] for s in storage.get_snapshots("vol1")]
+    assert retention_snapshots(app, "vol3") == []
+    assert engine.status()['completed'] == 4 * 2 + 1
+    assert engine.status()['failed'] == 0
+
+
+def test_retention_spreads_and_limits_snapshots(app, tmpdir):
+    path = write_policies(tmpdir, {'dummy': {name: {'hourly': 1}
+                                             for name in ["vol1", "vol2",
+                                                          "vol3"]}})
+    storage = app.extensions[app.config['SUBSYSTEM']['dummy']]
+    started, release = threading.Event(), threading.Event()
+    running = []
+    create_snapshot = storage.create_snapshot
+
+    def blocking_create(volume_name, snapshot_name, **kwargs):
+        running.append(volume_name)
+        started.set()
+        release.wait(10)
+        return create_snapshot(volume_name, snapshot_name, **kwargs)
+
+    storage.create_snapshot = blocking_create
+    clock = Clock(10 * DAY)
+    engine = retention.RetentionEngine(app, path, jitter_s=HOUR - 1,
+                                       per_filer=1, clock=clock)
+    assert engine.run_once()
+    assert engine.status()['scheduled'] == 3
+
+    # All due, but only one at a time
+    clock.now = 10 * DAY + HOUR - 1
+    engine.run_once()
+    status = engine.status()
+    assert (status['running'], status['queue_depth']) == (1, 2)
+    assert 0 < status['lag_s'] < HOUR
+    assert started.wait(10)
+    assert len(running) == 1
+
+    release.set()
+    engine.wait(10)
+    assert sorted(running) == ["vol1", "vol2", "vol3"]
+    engine.run_once()
+    status = engine.status()
+    assert (status['queue_depth'], status['completed']) == (0, 3)
+    assert status['lag_s'] == 0
+
+
+def test_retention_backs_off_failed_snapshots(app, tmpdir):
+    path = write_policies(tmpdir, {'dummy': {'missing': {'hourly': 1}}})
+    storage = app.extensions[app.config['SUBSYSTEM']['dummy']]
+    get_snapshots = storage.get_snapshots
+    attempts = []
+
+    def counted_get_snapshots(volume_name):
+        attempts.append(clock.now)
+        return get_snapshots(volume_name)
+
+    storage.get_snapshots = counted_get_snapshots
+    clock = Clock(10 * DAY)
+    engine = retention.RetentionEngine(app, path, jitter_s=0, retry_s=60,
+                                       max_retry_s=600, clock=clock)
+
+    for offset_s in range(0, 2 * HOUR, 30):
+        clock.now = 10 * DAY + offset_s
+        engine.run_once()
+        engine.wait(10)
+
+    # Given up before the end of the hour, tried again in the next one
+    backoff = [0, 60, 180, 420, 900, 1500, 2100, 2700, 3300]
+    assert [t - 10 * DAY for t in attempts] == (
+        backoff + [HOUR + t for t in backoff])
+    assert engine.status()['failed'] == len(attempts)
+    assert engine.status()['completed'] == 0
+
+
+def test_retention_has_one_leader(app, tmpdir):
+    path = write_policies(tmpdir, {'dummy': {'vol1': {'hourly': 1}}})
+    directory = tmpdir.mkdir("retention")
+    leader = retention.RetentionEngine(app, path, directory=str(directory),
+                                       jitter_s=0, clock=Clock(10 * DAY))
+    follower = retention.RetentionEngine(app, path, directory=str(directory),
+                                         jitter_s=0, clock=Clock(10 * DAY))
+
+    assert follower.status() is None
+    assert leader.run_once()
+    assert not follower.run_once()
+    leader.wait(10)
+    leader.run_once()
+    assert follower.status()['completed'] == 1
+    assert follower.status()['leader'] == leader.status()['leader']
+
+
+def test_retention_api(client):
+    with client.session_transaction() as sess:
+        sess['user'] = {'roles': [common.ADMIN_ROLE]}
+    url = INTROSPECTION_MOUNTPOINT + "/retention"
+    extensions = client.application.extensions
+    assert 'retention' not in extensions
+    assert client.get(url, headers=_HEADERS).status_code == 404
+
+    engine = retention.RetentionEngine(client.application, "/nonexistent")
+    extensions['retention'] = engine
+    try:
+        assert client.get(url, headers=_HEADERS).status_code == 404
+        engine.run_once()
+        r = client.get(url, headers=_HEADERS)
+        assert r.status_code == 200
+        status = json.loads(r.get_data(as_text=True))
+        assert (status['policies'], status['queue_depth']) == (0, 0)
+    finally:
+        del extensions['retention']
+
+
+def test_retention_workers_elect_a_leader_by_default(app, tmpdir,
+                                                     monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir.mkdir("tmp")))
+    path = write_policies(tmpdir, {'dummy': {'vol1': {'hourly': 1}}})
+    engines = []
+    try:
+        for _ in range(2):
+            with mock.patch.object(retention.RetentionEngine, 'start'):
+                engines.append(retention.init_app(app, path, jitter_s=0))
+        assert engines[0].directory == engines[1].directory
+        assert engines[0].directory.startswith(tempfile.tempdir)
+        assert [engine.run_once() for engine in engines] == [True, False]
+    finally:
+        del app.extensions['retention']
+        for engine in engines:
+            engine.wait(10)
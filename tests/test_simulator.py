@@ -0,0 +1,297 @@
+from storage_api.simulator import (SimulatedCluster, start_server,
+                                   parse_latency)
+from storage_api.extensions.storage import NetappStorage, TooManySnapshots
+from storage_api.extensions.patch import PartialPatchError
+from storage_api.extensions.versions import (PreconditionFailed,
+                                             volume_version)
+
+import functools
+import time
+
+import netapp.api
+import pytest
+
+VOLUME_SIZE = 30000000
+
+
+@pytest.fixture
+def cluster():
+    return SimulatedCluster.synthetic(volumes=45, aggregates=2, snapshots=3,
+                                      policies=2, locks=1)
+
+
+@pytest.fixture
+def connect(cluster):
+    server = start_server(cluster)
+    host, port = server.server_address
+    try:
+        yield functools.partial(NetappStorage, hostname=host, port=port,
+                                transport_type="HTTP", username="u",
+                                password="p", vserver=cluster.vserver)
+    finally:
+        server.shutdown()
+
+
+@pytest.fixture
+def storage(connect):
+    return connect()
+
+
+def test_list_volumes(storage, cluster):
+    volumes = storage.volumes
+    assert len(volumes) == 45
+    assert volumes[0]['name'] == "vol_000000"
+    assert volumes[0]['junction_path'] == "/vol_000000"
+    assert volumes[0]['aggregate_name'] == "aggr1_node1"
+    assert cluster.calls['volume-get-iter'] == 3  # 20 records per page
+
+    assert [v['name'] for v in storage.query_volumes(
+        name_prefix="vol_00001")] == ["vol_{:06d}".format(i)
+                                      for i in range(10, 20)]
+
+
+def test_volume_pages_and_snapshots(storage):
+    volumes, cursor = storage.volumes_page(limit=30)
+    assert len(volumes) == 30
+    volumes, cursor = storage.volumes_page(limit=30, cursor=cursor)
+    assert len(volumes) == 15
+    assert volumes[-1]['name'] == "vol_000044"
+    assert cursor is None
+
+    snapshots = storage.get_snapshots("vol_000001")
+    assert [s['name'] for s in snapshots] == ["snap_0000", "snap_0001",
+                                              "snap_0002"]
+    page, cursor = storage.snapshots_page("vol_000001", limit=2)
+    assert len(page) == 2 and cursor
+
+
+def test_volume_lifecycle(storage):
+    volume = storage.create_volume("new_volume", junction_path="/new",
+                                   size_total=VOLUME_SIZE)
+    assert volume['aggregate_name'] in ["aggr1_node1", "aggr2_node2"]
+    assert volume['compression_enabled'] is True
+    assert storage.get_volume(":/new") == volume
+
+    with pytest.raises(KeyError):
+        storage.create_volume("new_volume", junction_path="/new2",
+                              size_total=VOLUME_SIZE)
+
+    storage.create_policy("new_policy", ["db.cern.ch", "db2.cern.ch"])
+    storage.patch_volume("new_volume", size_total=2 * VOLUME_SIZE,
+                         percentage_snapshot_reserve=10,
+                         compression_enabled=False,
+                         inline_compression=False,
+                         active_policy_name="new_policy")
+    volume = storage.get_volume("new_volume")
+    assert volume['size_total'] == 2 * VOLUME_SIZE
+    assert volume['percentage_snapshot_reserve'] == 10
+    assert volume['compression_enabled'] is False
+    assert volume['active_policy_name'] == "new_policy"
+    assert storage.get_policy("new_policy") == ["db.cern.ch", "db2.cern.ch"]
+
+    storage.create_snapshot(":/new", "snap")
+    assert storage.get_snapshot("new_volume", "snap")['name'] == "snap"
+    storage.rollback_volume("new_volume", "snap")
+    storage.delete_snapshot("new_volume", "snap")
+    with pytest.raises(KeyError):
+        storage.delete_snapshot("new_volume", "snap")
+
+    storage.restrict_volume("new_volume")
+    assert "new_volume" not in [v['name'] for v in storage.volumes]
+
+
+def test_policy_rules(storage):
+    storage.create_policy("rules", ["a.cern.ch", "b.cern.ch"])
+    storage.ensure_policy_rule_present("rules", "c.cern.ch")
+    storage.ensure_policy_rule_absent("rules", "a.cern.ch")
+    # netapp.api adds new rules first
+    assert storage.get_policy("rules") == ["c.cern.ch", "b.cern.ch"]
+
+    storage.remove_policy("rules")
+    with pytest.raises(KeyError):
+        storage.remove_policy("rules")
+
+
+def test_locks(storage):
+    assert storage.locks("vol_000000") == ["db-client.cern.ch"]
+    assert storage.locks("vol_000001") is None
+
+    with pytest.raises(netapp.api.APIError):
+        storage.remove_lock("vol_000000", "other.cern.ch")
+    storage.remove_lock("vol_000000", "db-client.cern.ch")
+    assert storage.locks("vol_000000") is None
+
+
+def test_clone_volume(storage, cluster):
+    storage.server.clone_volume("vol_000001", "clone", "/clone",
+                                parent_snapshot="snap_0001")
+    clone = storage.get_volume(":/clone")
+    assert clone['name'] == "clone"
+    assert clone['size_total'] == cluster.volumes["vol_000001"].size_total
+
+
+def test_latency_injection(storage, cluster):
+    cluster.latency_s['system-get-version'] = 0.2
+    start = time.perf_counter()
+    assert "simulator" in storage.server.ontap_system_version
+    assert time.perf_counter() - start >= 0.2
+    assert cluster.calls['system-get-version'] == 1
+
+
+def test_unsupported_api(storage):
+    with pytest.raises(netapp.api.APIError) as e:
+        storage.server.perform_call(netapp.api.X('vserver-get-iter'),
+                                    storage.server.ontap_api_url)
+    assert e.value.errno == 13005
+
+
+def test_parse_latency():
+    assert parse_latency([]) == ({}, 0.0)
+    assert parse_latency(["default=0.1", "volume-get-iter=1"]) == (
+        {'volume-get-iter': 1.0}, 0.1)
+    with pytest.raises(ValueError):
+        parse_latency(["volume-get-iter"])
+
+
+def test_synthetic_fleet_scales():
+    cluster = SimulatedCluster.synthetic(volumes=20000)
+    assert len(cluster.volume_names) == 20000
+    page = cluster.zapi_volume_get_iter(netapp.api.X(
+        'volume-get-iter',
+        netapp.api.X('max-records', '100'),
+        netapp.api.X('tag', 'vol_019950')))
+    assert page[0].text == "49"
+
+
+def test_patch_merges_and_parallelises_calls(storage, cluster):
+    storage.create_policy("other_policy", ["db.cern.ch"])
+    calls = dict(cluster.calls)
+    cluster.latency_s.update({'volume-modify-iter': 1.0,
+                              'sis-set-config': 1.0, 'volume-size': 1.0})
+
+    started = time.monotonic()
+    storage.patch_volume("vol_000002", active_policy_name="other_policy",
+                         percentage_snapshot_reserve=15,
+                         caching_policy="auto", compression_enabled=False,
+                         inline_compression=False, size_total=VOLUME_SIZE)
+    assert time.monotonic() - started < 2.5
+
+    assert cluster.calls['volume-modify-iter'] == (
+        calls.get('volume-modify-iter', 0) + 1)
+    volume = storage.get_volume("vol_000002")
+    assert volume['active_policy_name'] == "other_policy"
+    assert volume['percentage_snapshot_reserve'] == 15
+    assert volume['caching_policy'] == "auto"
+    assert volume['compression_enabled'] is False
+    assert volume['size_total'] == VOLUME_SIZE
+
+
+def test_patch_sets_autosize_with_max_autosize(storage, cluster):
+    volume = storage.get_volume("vol_000005")
+    calls = cluster.calls.get('volume-autosize-set', 0)
+
+    storage.patch_volume("vol_000005",
+                         autosize_enabled=not volume['autosize_enabled'])
+    assert cluster.calls.get('volume-autosize-set', 0) == calls
+
+    storage.patch_volume("vol_000005", autosize_enabled=True,
+                         max_autosize=volume['max_autosize'] + 1)
+    assert cluster.calls['volume-autosize-set'] == calls + 1
+    volume = storage.get_volume("vol_000005")
+    assert volume['autosize_enabled'] is True
+
+
+def test_patch_reports_partial_failures(storage):
+    with pytest.raises(PartialPatchError) as excinfo:
+        storage.patch_volume("vol_000003", active_policy_name="no_policy",
+                             percentage_snapshot_reserve=15,
+                             size_total=VOLUME_SIZE)
+    error = excinfo.value
+    assert error.applied == ['size_total']
+    assert set(error.failed) == {'active_policy_name',
+                                 'percentage_snapshot_reserve'}
+    assert storage.get_volume("vol_000003")['size_total'] == VOLUME_SIZE
+
+    with pytest.raises(netapp.api.APIError):
+        storage.patch_volume("vol_000003", active_policy_name="no_policy")
+
+
+def test_group_snapshot_is_concurrent(storage, cluster):
+    volumes = ["/vol_00001{}".format(i) for i in range(5)]
+    for volume in volumes:
+        storage.name_from_path(volume)
+    cluster.latency_s['snapshot-create'] = 0.5
+
+    started = time.monotonic()
+    group = storage.create_snapshots(volumes, "group")
+    assert time.monotonic() - started < 2.0
+    assert group['window_s'] < 1.5
+    assert [t['name'] for t in group['volumes']] == volumes
+    assert cluster.calls['snapshot-create'] == 5
+    assert "group" in [s['name'] for s in storage.get_snapshots("vol_000010")]
+
+
+def test_group_snapshot_failure_deletes_snapshots(storage):
+    storage.create_snapshot("/vol_000021", "taken")
+    with pytest.raises(netapp.api.APIError):
+        storage.create_snapshots(["/vol_000020", "/vol_000021"], "taken")
+    assert "taken" not in [s['name']
+                           for s in storage.get_snapshots("vol_000020")]
+    with pytest.raises(KeyError):
+        storage.create_snapshots(["/vol_000020", "/no_such_volume"], "x")
+
+
+def test_purge_old_snapshots(storage, cluster):
+    cluster.max_snapshots = 3
+    with pytest.raises(TooManySnapshots):
+        storage.create_snapshot("/vol_000030", "snap_new")
+    listings = cluster.calls['snapshot-get-iter']
+
+    storage.create_snapshot("/vol_000030", "snap_new",
+                            purge_old_if_needed=True)
+    assert cluster.calls['snapshot-get-iter'] == listings + 1
+    assert [s['name'] for s in storage.get_snapshots("vol_000030")] == [
+        "snap_0001", "snap_0002", "snap_new"]
+
+
+def test_conditional_patch_skips_the_fetch(connect, cluster, tmpdir):
+    storage = connect(recent_volumes_dir=str(tmpdir))
+    version = volume_version(storage.get_volume("vol_000004"))
+    fetches = cluster.calls['volume-get-iter']
+
+    storage.patch_volume("vol_000004", expected_versions={version},
+                         size_total=VOLUME_SIZE)
+    assert cluster.calls['volume-get-iter'] == fetches
+    assert storage.get_volume("vol_000004")['size_total'] == VOLUME_SIZE
+
+    with pytest.raises(PreconditionFailed):
+        storage.patch_volume("vol_000004", expected_versions={version},
+                             size_total=2 * VOLUME_SIZE)
+    assert storage.get_volume("vol_000004")['size_total'] == VOLUME_SIZE
+
+
+def test_conditional_patch_after_a_change(connect, cluster, tmpdir):
+    shared = [connect(recent_volumes_dir=str(tmpdir)) for _ in range(2)]
+    separate = [connect() for _ in range(2)]
+
+    for workers in [shared, separate]:
+        volume = workers[1].get_volume(":/vol_000005")
+        version = volume_version(volume)
+        policy = next(p for p in ['policy_0000', 'policy_0001']
+                      if p != volume['active_policy_name'])
+
+        workers[0].patch_volume("vol_000005", expected_versions={version},
+                                active_policy_name=policy)
+        with pytest.raises(PreconditionFailed):
+            workers[1].patch_volume(
+                ":/vol_000005", expected_versions={version},
+                active_policy_name=volume['active_policy_name'])
+        assert workers[1].get_volume("vol_000005")['active_policy_name'] == (
+            policy)
+
+    # Without a shared directory, volumes are always fetched
+    fetches = cluster.calls['volume-get-iter']
+    version = volume_version(separate[0].get_volume("vol_000005"))
+    separate[0].patch_volume("vol_000005", expected_versions={version},
+                             size_total=VOLUME_SIZE)
+    assert cluster.calls['volume-get-iter'] == fetches + 2